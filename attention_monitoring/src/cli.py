@@ -0,0 +1,284 @@
+import logging
+import os
+import sys
+
+import click
+
+_log = logging.getLogger(__name__)
+
+@click.group()
+def cli() -> None:
+    """Tools for managing attention monitoring studies."""
+
+@cli.command("rebuild-catalog")
+@click.option(
+    "--data-sub-dir", default=None,
+    help="Subdirectory of 'src/data' containing the studies to catalog."
+    )
+@click.option(
+    "--workers", type=int, default=None,
+    help="Number of threads used to scan session directories."
+    )
+@click.option(
+    "--scan-data-files/--no-scan-data-files", default=True, show_default=True,
+    help="Read data files to get hashes and durations missing from sessions' "
+    + "info files."
+    )
+def rebuildCatalog(
+        data_sub_dir: [str | None],
+        workers: [int | None],
+        scan_data_files: bool
+        ) -> None:
+    """Rebuild the session catalog from the session directories."""
+    from src.gradcpt import GradCPTSession
+    from src.study import SessionCatalog
+
+    catalog = SessionCatalog(data_sub_dir)
+    numSessions = catalog.rebuild(
+        [GradCPTSession], numWorkers=workers, scanDataFiles=scan_data_files
+        )
+    click.echo(f"Cataloged {numSessions} sessions in {catalog.path}")
+
+@cli.command("analyze-study")
+@click.option(
+    "--data-sub-dir", default=None,
+    help="Subdirectory of 'src/data' containing the study to analyze."
+    )
+@click.option(
+    "--output", default=None,
+    help="Parquet file to write the summary to. Defaults to "
+    + "'summary.parquet' in the study's data directory."
+    )
+@click.option(
+    "--workers", type=int, default=None,
+    help="Number of worker processes used to analyze blocks (0 to analyze "
+    + "them in this process)."
+    )
+@click.option(
+    "--force", is_flag=True,
+    help="Analyze every block, even those whose inputs have not changed."
+    )
+def analyzeStudy(
+        data_sub_dir: [str | None],
+        output: [str | None],
+        workers: [int | None],
+        force: bool
+        ) -> None:
+    """Summarize the behaviour and EEG of every gradCPT block.
+
+    Blocks whose data files, stimulus sequences and analysis settings have
+    not changed since the summary was last written are not analyzed again.
+    """
+    from src.config import CONFIG
+    from src.data_analysis.summary import summarizeStudy
+    from src.gradcpt import GradCPTSession
+
+    dataDir = os.path.join(CONFIG.projectRoot, "src", "data")
+    if data_sub_dir is not None:
+        dataDir = os.path.join(dataDir, data_sub_dir)
+    studyDir = os.path.join(dataDir, GradCPTSession.getStudyType())
+
+    def progress(numDone, numTotal):
+        click.echo(f"Checked {numDone} of {numTotal} blocks", err=True)
+
+    table, stats = summarizeStudy(
+        studyDir, outputFile=output, numWorkers=workers, force=force,
+        progress=progress
+        )
+    for source, message in stats["errors"].items():
+        if isinstance(source, tuple):
+            source = f"block {source[1]} of session {source[0]}"
+        click.echo(f"Failed to analyze {source}: {message}", err=True)
+    click.echo(
+        f"Summarized {len(table)} blocks ({stats['analyzed']} analyzed, "
+        + f"{stats['unchanged']} unchanged, {stats['failed']} failed) in "
+        + (output if output is not None else
+            os.path.join(studyDir, "summary.parquet"))
+        )
+
+@cli.command("update-features")
+@click.option(
+    "--data-sub-dir", default=None,
+    help="Subdirectory of 'src/data' containing the study to analyze."
+    )
+@click.option(
+    "--store-dir", default=None,
+    help="Directory of the feature store. Defaults to 'features' in the "
+    + "study's data directory."
+    )
+@click.option(
+    "--workers", type=int, default=None,
+    help="Number of worker processes used to analyze blocks (0 to analyze "
+    + "them in this process)."
+    )
+@click.option(
+    "--force", is_flag=True,
+    help="Analyze every block, even those whose inputs have not changed."
+    )
+def updateFeatures(
+        data_sub_dir: [str | None],
+        store_dir: [str | None],
+        workers: [int | None],
+        force: bool
+        ) -> None:
+    """Update the per-trial features of every gradCPT block.
+
+    Only blocks that are new, or whose data files, stimulus sequences or
+    analysis settings have changed, are analyzed.
+    """
+    from src.config import CONFIG
+    from src.data_analysis.feature_store import FeatureStore
+    from src.gradcpt import GradCPTSession
+
+    dataDir = os.path.join(CONFIG.projectRoot, "src", "data")
+    if data_sub_dir is not None:
+        dataDir = os.path.join(dataDir, data_sub_dir)
+    studyDir = os.path.join(dataDir, GradCPTSession.getStudyType())
+    store_dir = (
+        os.path.join(studyDir, "features") if store_dir is None else store_dir
+        )
+
+    def progress(numDone, numTotal):
+        click.echo(f"Checked {numDone} of {numTotal} blocks", err=True)
+
+    stats = FeatureStore(store_dir).update(
+        studyDir, numWorkers=workers, force=force, progress=progress
+        )
+    for source, message in stats["errors"].items():
+        if isinstance(source, tuple):
+            source = f"block {source[1]} of session {source[0]}"
+        click.echo(f"Failed to analyze {source}: {message}", err=True)
+    click.echo(
+        f"Updated {store_dir} ({stats['computed']} blocks analyzed, "
+        + f"{stats['unchanged']} unchanged, {stats['removed']} removed, "
+        + f"{stats['failed']} failed)"
+        )
+
+@cli.command("train-attention-model")
+@click.option(
+    "--data-sub-dir", default=None,
+    help="Subdirectory of 'src/data' containing the study to train on."
+    )
+@click.option(
+    "--store-dir", default=None,
+    help="Directory of the feature store. Defaults to 'features' in the "
+    + "study's data directory."
+    )
+@click.option(
+    "--output", default=None,
+    help="JSON file to write the model to. Defaults to "
+    + "'attention_model.json' in the study's data directory."
+    )
+@click.option(
+    "--regularization", type=float, default=1.0, show_default=True,
+    help="Strength of the L2 penalty on the model's coefficients."
+    )
+def trainAttentionModel(
+        data_sub_dir: [str | None],
+        store_dir: [str | None],
+        output: [str | None],
+        regularization: float
+        ) -> None:
+    """Train a model predicting whether gradCPT trials are in the zone.
+
+    The model is evaluated on each session when trained on the others, then
+    trained on every session in the feature store (see 'update-features').
+    """
+    from src.config import CONFIG
+    from src.data_analysis.attention_model import crossValidate, trainModel
+    from src.data_analysis.feature_store import FeatureStore
+    from src.gradcpt import GradCPTSession
+
+    dataDir = os.path.join(CONFIG.projectRoot, "src", "data")
+    if data_sub_dir is not None:
+        dataDir = os.path.join(dataDir, data_sub_dir)
+    studyDir = os.path.join(dataDir, GradCPTSession.getStudyType())
+    store = FeatureStore(
+        os.path.join(studyDir, "features") if store_dir is None else store_dir
+        )
+    output = (
+        os.path.join(studyDir, "attention_model.json") if output is None
+        else output
+        )
+
+    trials = store.query()
+    if trials["session_name"].n_unique() > 1:
+        scores = crossValidate(trials, regularization=regularization)
+        for row in scores.iter_rows(named=True):
+            click.echo(
+                f"Session {row['session_name']}: AUC {row['auc']:.3f}, "
+                + f"accuracy {row['accuracy']:.3f} ({row['num_trials']} "
+                + "trials)"
+                )
+    model = trainModel(store, regularization=regularization)
+    model.save(output)
+    click.echo(f"Saved model with {len(model.features)} features to {output}")
+
+@cli.command("start-session")
+@click.option(
+    "--participant-id", type=int, default=None,
+    help="Numeric ID of the participant."
+    )
+@click.option(
+    "--resume", "session_name", default=None,
+    help="Name of an interrupted session to resume instead of starting a new "
+    + "one."
+    )
+@click.option(
+    "--presentation", type=click.Choice(["matlab", "simulated"]),
+    default="matlab", show_default=True,
+    help="Backend used to present the stimuli."
+    )
+@click.option(
+    "--time-scale", type=float, default=1.0, show_default=True,
+    help="(Simulated presentation only) Factor by which to compress time."
+    )
+@click.option(
+    "--eeg", type=click.Choice(["muse", "simulated"]), default=None,
+    help="Source of the EEG: a Muse headset or synthetic signals. Defaults to "
+    + "'simulated' with simulated presentation and 'muse' otherwise."
+    )
+def startSession(
+        participant_id: [int | None],
+        session_name: [str | None],
+        presentation: str,
+        time_scale: float,
+        eeg: [str | None]
+        ) -> None:
+    """Run a gradCPT session with a Muse headset."""
+    from src.gradcpt.muse_gradcpt import MuseGradCPTSession
+
+    if eeg is None:
+        eeg = "simulated" if presentation == "simulated" else "muse"
+    simulateEEG = eeg == "simulated"
+    if session_name is not None:
+        session = MuseGradCPTSession(
+            sessionName=session_name, simulateEEG=simulateEEG
+            )
+    else:
+        session = MuseGradCPTSession(
+            participantID=participant_id, simulateEEG=simulateEEG
+            )
+    session.run(
+        presentation=presentation, timeScale=time_scale,
+        resume=session_name is not None
+        )
+
+def _addProjectRoot() -> None:
+    # Modules of this project import each other relative to the project root
+    # (eg. `src.config`), which is not on the path when the CLI is run as an
+    # installed script
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    if root not in sys.path:
+        sys.path.insert(0, root)
+
+def main() -> None:
+    _addProjectRoot()
+    cli()
+
+def startSessionMain() -> None:
+    _addProjectRoot()
+    startSession()
+
+if __name__ == "__main__":
+    main()
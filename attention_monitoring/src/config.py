@@ -220,7 +220,10 @@ class _Config:
 
     @property
     def path_to_LabRecorder(self):
-        val = _getConfig()['constants']['path_to_LabRecorder']
+        constants = _getConfig()['constants'] or {}
+        val = constants.get('path_to_LabRecorder')
+        if val is None:
+            return None
         if not os.path.isabs(val):
             val = os.path.join(_getRoot(), val)
         return os.path.normpath(val)
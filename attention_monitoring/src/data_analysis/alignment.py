@@ -0,0 +1,442 @@
+"""Alignment of Muse streams onto a common timebase.
+
+The streams of a Muse headset (EEG, PPG, accelerometer and gyroscope) have
+different nominal sample rates (eg. 256, 64, 52 and 52 Hz) and their time
+stamps are irregular, as samples are time stamped when they arrive in
+chunks rather than when they are recorded. To combine them (eg. to compute
+multimodal features), each stream is:
+
+1. Dejittered (`dejitter`): the time stamps of each segment of the stream
+   (separated by gaps or clock resets, see `segmentBoundaries`) are replaced
+   by a line fitted to them, robust to outliers.
+2. Resampled (`resampleStream`) onto a common, regular timebase, by linear
+   interpolation or (when downsampling) with a polyphase anti-aliasing
+   filter. Times that fall in a gap of a stream are NaN.
+
+`alignStreams` does both for several streams and returns a single array with
+a column per channel. Streams are resampled one chunk of the timebase at a
+time, so that only a chunk of each stream needs to be in memory, and the
+result can be written to a `numpy.memmap`.
+
+Note that `pyxdf.load_xdf` dejitters time stamps itself by default, with an
+ordinary least squares fit; load data with `dejitter_timestamps=False` (see
+`GradCPTBlock.loadData`) to use the robust fit instead.
+"""
+from fractions import Fraction
+
+import numpy as np
+from scipy import signal as spsignal
+
+from .epochs import estimateSampleRate
+
+# Consecutive samples further apart than this (in seconds) are separated by
+# a gap
+GAP_THRESHOLD = 0.5
+
+def nominalRate(stream):
+    """Get the nominal sample rate of a stream loaded by `pyxdf`.
+
+    Falls back to the effective sample rate, or an estimate from the time
+    stamps, for streams without a nominal rate.
+    """
+    info = stream['info']
+    nominal = info.get('nominal_srate')
+    if nominal is not None:
+        nominal = float(np.ravel(nominal)[0])
+        if nominal > 0:
+            return nominal
+    return info.get('effective_srate') or estimateSampleRate(
+        stream['time_stamps']
+        )
+
+def channelNames(stream):
+    """Get the name of each channel of a stream loaded by `pyxdf`.
+
+    Channels without a label in the stream's description are named by their
+    index.
+    """
+    numChannels = np.shape(stream['time_series'])[1]
+    try:
+        channels = stream['info']['desc'][0]['channels'][0]['channel']
+        names = [c['label'][0] for c in channels]
+    except (KeyError, IndexError, TypeError):
+        names = []
+    return names if len(names) == numChannels else [
+        str(k) for k in range(numChannels)
+        ]
+
+def segmentBoundaries(timestamps, gapThreshold=GAP_THRESHOLD):
+    """Split a stream into segments separated by gaps or clock resets.
+
+    Parameters
+    ----------
+    timestamps : numpy.ndarray
+        The time stamp of each sample.
+    gapThreshold : float, default=GAP_THRESHOLD
+        Consecutive samples further apart than this (in seconds), or whose
+        time stamps decrease by more than this (eg. when a clock is reset),
+        are in different segments.
+
+    Returns
+    -------
+    numpy.ndarray of int
+        The index of the first sample of each segment, followed by the
+        number of samples.
+    """
+    timestamps = np.asarray(timestamps, dtype=float)
+    dt = np.diff(timestamps)
+    breaks = np.flatnonzero(np.abs(dt) > gapThreshold) + 1
+    return np.concatenate(([0], breaks, [len(timestamps)])).astype(np.intp)
+
+def dejitter(
+        timestamps, srate=None, gapThreshold=GAP_THRESHOLD, numIterations=3,
+        outlierThreshold=3.0
+        ):
+    """Replace the time stamps of a stream by lines fitted to each segment.
+
+    The time stamps of each segment (see `segmentBoundaries`) are fitted
+    with a line (against the index of each sample), by least squares
+    repeated `numIterations` times, each time without the time stamps whose
+    residual is more than `outlierThreshold` robust standard deviations
+    (1.4826 times the median absolute residual) from the line, so that
+    samples that arrived late do not skew the fit. All segments are fitted
+    at once.
+
+    Parameters
+    ----------
+    timestamps : numpy.ndarray
+        The time stamp of each sample.
+    srate : float, optional
+        The nominal sample rate, used as the slope of segments with a single
+        sample. Defaults to an estimate from the time stamps.
+    gapThreshold : float, default=GAP_THRESHOLD
+        See `segmentBoundaries`.
+    numIterations : int, default=3
+        The number of fits, including the first one with every time stamp.
+    outlierThreshold : float, default=3.0
+        See above.
+
+    Returns
+    -------
+    timestamps : numpy.ndarray
+        The dejittered time stamps.
+    segments : numpy.ndarray
+        One row per segment, with the index of its first sample and of the
+        sample after its last, the time of its first sample and its sample
+        period (seconds per sample).
+    """
+    t = np.asarray(timestamps, dtype=float)
+    n = len(t)
+    if n == 0:
+        return t.copy(), np.empty((0, 4))
+    bounds = segmentBoundaries(t, gapThreshold=gapThreshold)
+    starts, lengths = bounds[:-1], np.diff(bounds)
+    segment = np.repeat(np.arange(len(starts)), lengths)
+    index = np.arange(n) - starts[segment]
+    # Times relative to the start of each segment, for numerical precision
+    t0 = t[starts]
+    y = t - t0[segment]
+    if srate is None:
+        srate = estimateSampleRate(t) if n > 1 else 1.0
+    period = np.full(len(starts), 1 / srate)
+    intercept = np.zeros(len(starts))
+
+    weights = np.ones(n)
+    for k in range(numIterations):
+        # Weighted least squares of every segment at once
+        sw = np.add.reduceat(weights, starts)
+        safe = np.maximum(sw, 1)
+        meanX = np.add.reduceat(weights * index, starts) / safe
+        meanY = np.add.reduceat(weights * y, starts) / safe
+        dx = index - meanX[segment]
+        sxx = np.add.reduceat(weights * dx * dx, starts)
+        sxy = np.add.reduceat(weights * dx * (y - meanY[segment]), starts)
+        fitted = sxx > 0
+        period[fitted] = sxy[fitted] / sxx[fitted]
+        intercept = meanY - period * meanX
+        if k == numIterations - 1:
+            break
+
+        # Exclude outliers from the next fit, with the median absolute
+        # residual of each segment (the middle of each segment's sorted
+        # residuals)
+        residual = np.abs(y - (intercept[segment] + period[segment] * index))
+        order = np.lexsort((residual, segment))
+        mad = residual[order][starts + (lengths - 1) // 2]
+        scale = np.maximum(1.4826 * mad, 1e-12)
+        weights = (residual <= outlierThreshold * scale[segment]).astype(float)
+
+    dejittered = t0[segment] + intercept[segment] + period[segment] * index
+    segments = np.column_stack(
+        (starts, starts + lengths, t0 + intercept, period)
+        )
+    return dejittered, segments
+
+def detectGaps(timestamps, gapThreshold=GAP_THRESHOLD):
+    """Find the gaps in a stream.
+
+    Parameters
+    ----------
+    timestamps : numpy.ndarray
+        The (dejittered) time stamp of each sample.
+    gapThreshold : float, default=GAP_THRESHOLD
+        See `segmentBoundaries`.
+
+    Returns
+    -------
+    numpy.ndarray
+        One row per gap, with the time of the last sample before the gap and
+        of the first sample after it.
+    """
+    timestamps = np.asarray(timestamps, dtype=float)
+    bounds = segmentBoundaries(timestamps, gapThreshold=gapThreshold)[1:-1]
+    return np.column_stack((timestamps[bounds - 1], timestamps[bounds]))
+
+def commonTimebase(start, stop, srate):
+    """Get regularly spaced times from `start` (inclusive) to `stop`."""
+    numSamples = max(int(np.floor((stop - start) * srate)) + 1, 0)
+    return start + np.arange(numSamples) / srate
+
+def _interpolate(t, x, times, gapThreshold):
+    # Linearly interpolate all channels at once. Times outside the signal or
+    # between samples separated by a gap are NaN.
+    out = np.full((len(times), x.shape[1]), np.nan)
+    if len(t) == 0:
+        return out
+    right = np.searchsorted(t, times, side="right")
+    left = right - 1
+    exact = (left >= 0) & (t[np.maximum(left, 0)] == times)
+    inside = (left >= 0) & (right < len(t))
+    inside[inside] &= (t[right[inside]] - t[left[inside]]) <= gapThreshold
+    l, r = left[inside], right[inside]
+    w = ((times[inside] - t[l]) / (t[r] - t[l]))[:, np.newaxis]
+    out[inside] = x[l] * (1 - w) + x[r] * w
+    # The last sample is only at its exact time
+    out[exact] = x[left[exact]]
+    return out
+
+def polyphaseFactors(srate, streamSrate):
+    """Get the factors to resample a stream to `srate` by polyphase filtering.
+
+    Returns
+    -------
+    up, down : int
+        The stream is upsampled by `up` then downsampled by `down` (see
+        `scipy.signal.resample_poly`), eg. 13 and 64 from 256 to 52 Hz.
+    """
+    ratio = Fraction(srate / streamSrate).limit_denominator(100)
+    return ratio.numerator, ratio.denominator
+
+def resampleStream(
+        t, x, times, method="linear", segments=None, srate=None,
+        streamSrate=None, gapThreshold=GAP_THRESHOLD
+        ):
+    """Resample a stream at given times.
+
+    Parameters
+    ----------
+    t : numpy.ndarray
+        The (dejittered, sorted) time stamp of each sample.
+    x : numpy.ndarray
+        The samples, with shape `(samples, channels)`.
+    times : numpy.ndarray
+        The (regularly spaced) times at which to resample the stream.
+    method : {'linear', 'polyphase'}, default='linear'
+        'linear' interpolates linearly between samples. 'polyphase' first
+        resamples each segment of the stream to the rate of `times` with a
+        polyphase anti-aliasing filter (see `scipy.signal.resample_poly`),
+        then interpolates linearly (to align the samples with `times`), and
+        should be used to downsample.
+    segments : numpy.ndarray, optional
+        The segments of the stream (see `dejitter`), with indices into `t`.
+        Required for 'polyphase'.
+    srate : float, optional
+        The rate of `times`. Defaults to an estimate from `times`. Only used
+        for 'polyphase'.
+    streamSrate : float, optional
+        The nominal rate of the stream, used to choose the polyphase factors
+        (see `polyphaseFactors`). Defaults to an estimate from `t`.
+    gapThreshold : float, default=GAP_THRESHOLD
+        Times between samples further apart than this are NaN.
+
+    Returns
+    -------
+    numpy.ndarray
+        The resampled stream, with shape `(len(times), channels)`.
+    """
+    t = np.asarray(t, dtype=float)
+    x = np.asarray(x, dtype=float)
+    x = x[:, np.newaxis] if x.ndim == 1 else x
+    times = np.asarray(times, dtype=float)
+    if method == "linear":
+        return _interpolate(t, x, times, gapThreshold)
+    if method != "polyphase":
+        raise ValueError(f"Invalid method: {method}")
+    if segments is None:
+        raise ValueError("segments are required for polyphase resampling.")
+    srate = estimateSampleRate(times) if srate is None else srate
+    streamSrate = estimateSampleRate(t) if streamSrate is None else streamSrate
+    up, down = polyphaseFactors(srate, streamSrate)
+
+    out = np.full((len(times), x.shape[1]), np.nan)
+    for start, stop, _, period in segments:
+        start, stop = int(start), int(stop)
+        if stop - start < 2:
+            continue
+        # Only the times within the segment
+        first = np.searchsorted(times, t[start], side="left")
+        last = np.searchsorted(times, t[stop - 1], side="right")
+        if first >= last:
+            continue
+        y = spsignal.resample_poly(x[start:stop], up, down, axis=0)
+        ty = t[start] + np.arange(len(y)) * (period * down / up)
+        out[first:last] = _interpolate(ty, y, times[first:last], np.inf)
+    return out
+
+def _overlap(streams, key):
+    starts = [s[key][0] for s in streams if len(s[key]) > 0]
+    stops = [s[key][-1] for s in streams if len(s[key]) > 0]
+    return max(starts), min(stops)
+
+def alignStreams(
+        data, signalTypes=None, srate=None, method="auto", start=None,
+        stop=None, chunkDuration=None, out=None, gapThreshold=GAP_THRESHOLD,
+        dejitterTimestamps=True
+        ):
+    """Resample several streams of a block onto a common timebase.
+
+    Parameters
+    ----------
+    data : dict
+        The streams of a block (eg. `GradCPTBlock.data`).
+    signalTypes : list of str, optional
+        The streams to align (eg. `['eeg', 'ppg']`). Defaults to every Muse
+        signal in `data` ('eeg', 'ppg', 'acc' and 'gyr').
+    srate : float, optional
+        The rate of the common timebase. Defaults to the lowest nominal rate
+        of the streams (see `nominalRate`).
+    method : {'auto', 'linear', 'polyphase'}, default='auto'
+        How to resample the streams (see `resampleStream`). 'auto' uses
+        'polyphase' for streams with a higher nominal rate than `srate` and
+        'linear' for the others.
+    start, stop : float, optional
+        The first and last time of the timebase. Default to the times that
+        every stream covers.
+    chunkDuration : float, optional
+        If specified, the timebase is resampled this many seconds at a time,
+        so that only a chunk of each stream (and of `out`) is held in memory
+        at once.
+    out : numpy.ndarray, optional
+        Array (eg. a `numpy.memmap`) to write the aligned streams to, with
+        shape `(len(times), channels)`.
+    gapThreshold : float, default=GAP_THRESHOLD
+        See `segmentBoundaries`. Times in a gap of a stream are NaN for its
+        channels.
+    dejitterTimestamps : bool, default=True
+        Whether to dejitter the time stamps of each stream first (see
+        `dejitter`).
+
+    Returns
+    -------
+    times : numpy.ndarray
+        The common timebase.
+    values : numpy.ndarray
+        The aligned streams, with shape `(len(times), channels)` and the
+        channels of each stream in order.
+    names : list of str
+        The name of each channel, as "[signal type]_[channel name]".
+    """
+    if signalTypes is None:
+        signalTypes = [s for s in ('eeg', 'ppg', 'acc', 'gyr') if s in data]
+    missing = [s for s in signalTypes if s not in data]
+    if len(signalTypes) == 0 or len(missing) > 0:
+        raise ValueError(f"Invalid signalTypes: {signalTypes}")
+    if method not in ("auto", "linear", "polyphase"):
+        raise ValueError(f"Invalid method: {method}")
+
+    streams = []
+    for signalType in signalTypes:
+        stream = data[signalType]
+        rate = nominalRate(stream)
+        t = np.asarray(stream['time_stamps'], dtype=float)
+        x = stream['time_series']
+        if len(t) == 0:
+            raise ValueError(f"The {signalType} stream has no samples.")
+        if dejitterTimestamps:
+            t, segments = dejitter(t, srate=rate, gapThreshold=gapThreshold)
+        else:
+            # Interpolation requires sorted time stamps
+            if np.any(np.diff(t) < 0):
+                order = np.argsort(t, kind="stable")
+                t, x = t[order], np.asarray(x)[order]
+            bounds = segmentBoundaries(t, gapThreshold=gapThreshold)
+            segments = np.column_stack((
+                bounds[:-1], bounds[1:], t[bounds[:-1]],
+                np.full(len(bounds) - 1, 1 / rate)
+                ))
+        streams.append({
+            'name' : signalType,
+            't' : t,
+            'x' : x,
+            'srate' : rate,
+            'segments' : segments,
+            'channels' : channelNames(stream)
+            })
+
+    srate = min(s['srate'] for s in streams) if srate is None else srate
+    if start is None or stop is None:
+        overlapStart, overlapStop = _overlap(streams, 't')
+        start = overlapStart if start is None else start
+        stop = overlapStop if stop is None else stop
+    times = commonTimebase(start, stop, srate)
+    names = [f"{s['name']}_{c}" for s in streams for c in s['channels']]
+    if out is None:
+        out = np.empty((len(times), len(names)))
+    elif out.shape != (len(times), len(names)):
+        raise ValueError(
+            f"out must have shape {(len(times), len(names))}: {out.shape}"
+            )
+
+    chunkSize = (
+        len(times) if chunkDuration is None
+        else max(int(chunkDuration * srate), 1)
+        )
+    column = 0
+    for s in streams:
+        numChannels = len(s['channels'])
+        streamMethod = (
+            method if method != "auto"
+            else "polyphase" if s['srate'] > srate
+            else "linear"
+            )
+        segmentStarts = s['segments'][:, 0].astype(np.intp)
+        segmentStops = s['segments'][:, 1].astype(np.intp)
+        # The samples outside a chunk that affect it: the neighbours to
+        # interpolate between, and the length of the polyphase filter
+        up, down = polyphaseFactors(srate, s['srate'])
+        pad = 2 if streamMethod == "linear" else (
+            2 + down + int(np.ceil(10 * max(up, down) / up))
+            )
+        for first in range(0, len(times), chunkSize):
+            chunkTimes = times[first:first + chunkSize]
+            a, b = np.searchsorted(s['t'], [chunkTimes[0], chunkTimes[-1]])
+            a, b = max(a - pad, 0), min(b + pad, len(s['t']))
+            if streamMethod == "polyphase" and a < b:
+                # Start a whole number of `down` samples into the segment, so
+                # that every chunk is resampled onto the same times
+                segmentStart = segmentStarts[
+                    np.searchsorted(segmentStarts, a, side="right") - 1
+                    ]
+                a = segmentStart + (a - segmentStart) // down * down
+            inChunk = (segmentStops > a) & (segmentStarts < b)
+            segments = s['segments'][inChunk].copy()
+            segments[:, :2] = np.clip(segments[:, :2], a, b) - a
+            out[first:first + chunkSize, column:column + numChannels] = (
+                resampleStream(
+                    s['t'][a:b], s['x'][a:b], chunkTimes,
+                    method=streamMethod, segments=segments, srate=srate,
+                    streamSrate=s['srate'], gapThreshold=gapThreshold
+                    )
+                )
+        column += numChannels
+    return times, out, names
@@ -0,0 +1,527 @@
+"""Detection of artifacts in Muse EEG.
+
+Artifacts are detected on the raw signal with statistics over rolling
+windows, computed from cumulative sums so that every window of every channel
+costs the same, whatever its length:
+
+- Amplitude: samples further than a threshold from the rolling mean (the
+  slow baseline) of their channel.
+- Flatline: windows in which a channel barely varies (eg. a disconnected
+  electrode).
+- Railing: windows in which a channel repeatedly sits at the limits of its
+  range (eg. a saturated amplifier).
+- Blinks: large deflections of the same sign on the frontal channels (AF7
+  and AF8), lasting at most about half a second.
+- Head motion: windows in which the magnitude of the accelerometer varies,
+  or that of the gyroscope is large, mapped onto the EEG's time stamps.
+
+`detectArtifacts` runs every detector and returns an `Artifacts` object
+holding a mask per kind of artifact, which gives the flagged samples of the
+signal (`Artifacts.sampleMask`) and the trials that contain any of them
+(`Artifacts.trialMask`). `GradCPTBlock.epochs` and the "artifacts" action of
+`pipeline.DataPipe` use these to mark epochs for rejection.
+"""
+import numpy as np
+
+from .epochs import estimateSampleRate, sampleMaskToTrialMask
+
+ARTIFACT_KINDS = ("amplitude", "flatline", "railing", "blink", "motion")
+
+def _windowBounds(n, window):
+    # The first and last (exclusive) sample of the window centred on each
+    # sample, truncated at the edges of the signal
+    lo = np.arange(n) - window // 2
+    return np.clip(lo, 0, n), np.clip(lo + window, 0, n)
+
+def rollingSum(x, window):
+    """Get the sum of a signal over a window centred on each sample.
+
+    Parameters
+    ----------
+    x : numpy.ndarray
+        The signal, with samples along the first axis.
+    window : int
+        The number of samples in each window. Windows are truncated at the
+        edges of the signal.
+
+    Returns
+    -------
+    sums : numpy.ndarray
+        The sum of each window, with the same shape as `x`.
+    counts : numpy.ndarray of int
+        The number of samples in each window.
+    """
+    x = np.asarray(x)
+    window = max(int(window), 1)
+    cumsum = np.zeros((len(x) + 1,) + x.shape[1:], dtype=np.result_type(
+        x.dtype, np.int64
+        ))
+    np.cumsum(x, axis=0, out=cumsum[1:])
+    lo, hi = _windowBounds(len(x), window)
+    return cumsum[hi] - cumsum[lo], hi - lo
+
+def rollingMean(x, window):
+    """Get the mean of a signal over a window centred on each sample.
+
+    See `rollingSum`.
+    """
+    x = np.asarray(x, dtype=float)
+    # Centre the signal so that the cumulative sum does not lose precision
+    offset = x.mean(axis=0) if len(x) > 0 else 0
+    sums, counts = rollingSum(x - offset, window)
+    return sums / counts.reshape((-1,) + (1,) * (x.ndim - 1)) + offset
+
+def rollingStd(x, window):
+    """Get the standard deviation of a signal over a window centred on each
+    sample.
+
+    See `rollingSum`.
+    """
+    x = np.asarray(x, dtype=float)
+    x = x - (x.mean(axis=0) if len(x) > 0 else 0)
+    sums, counts = rollingSum(x, window)
+    squares, _ = rollingSum(x * x, window)
+    counts = counts.reshape((-1,) + (1,) * (x.ndim - 1))
+    mean = sums / counts
+    return np.sqrt(np.maximum(squares / counts - mean * mean, 0))
+
+def dilateMask(mask, before, after=None):
+    """Extend every flagged sample of a mask to its neighbours.
+
+    Parameters
+    ----------
+    mask : numpy.ndarray of bool
+        The mask, with samples along the first axis.
+    before, after : int
+        The number of samples before and after each flagged sample to flag.
+        `after` defaults to `before`.
+
+    Returns
+    -------
+    numpy.ndarray of bool
+        The dilated mask.
+    """
+    mask = np.asarray(mask, dtype=bool)
+    after = before if after is None else after
+    n = len(mask)
+    counts = np.zeros((n + 1,) + mask.shape[1:], dtype=np.int64)
+    np.cumsum(mask, axis=0, out=counts[1:])
+    # Sample k is flagged if any of samples k - after to k + before are
+    lo = np.clip(np.arange(n) - after, 0, n)
+    hi = np.clip(np.arange(n) + before + 1, 0, n)
+    return counts[hi] - counts[lo] > 0
+
+def maskEvents(mask):
+    """Get the runs of consecutive flagged samples of a 1D mask.
+
+    Returns
+    -------
+    numpy.ndarray of int
+        One row per run, with the index of its first sample and of the
+        sample after its last.
+    """
+    mask = np.asarray(mask, dtype=np.int8)
+    edges = np.diff(np.concatenate(([0], mask, [0])))
+    return np.column_stack((
+        np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+        ))
+
+def eventsMask(events, n):
+    """Get a 1D mask of `n` samples flagging runs (see `maskEvents`)."""
+    changes = np.zeros(n + 1, dtype=np.int64)
+    np.add.at(changes, events[:, 0], 1)
+    np.add.at(changes, events[:, 1], -1)
+    return np.cumsum(changes[:-1]) > 0
+
+def amplitudeMask(x, srate, threshold=150.0, baselineWindow=1.0):
+    """Flag samples far from the baseline of their channel.
+
+    Parameters
+    ----------
+    x : numpy.ndarray
+        The signal, with shape `(samples, channels)`.
+    srate : float
+        The sample rate of the signal.
+    threshold : float or numpy.ndarray, default=150.0
+        Samples further than this from the baseline are flagged (eg. in
+        microvolts for EEG). May be given per channel.
+    baselineWindow : float, default=1.0
+        The length in seconds of the rolling mean used as the baseline.
+
+    Returns
+    -------
+    numpy.ndarray of bool
+        Whether each sample of each channel is flagged.
+    """
+    x = np.asarray(x, dtype=float)
+    baseline = rollingMean(x, baselineWindow * srate)
+    return np.abs(x - baseline) > threshold
+
+def flatlineMask(x, srate, minStd=0.5, window=1.0):
+    """Flag windows in which a channel barely varies.
+
+    Parameters
+    ----------
+    x : numpy.ndarray
+        The signal, with shape `(samples, channels)`.
+    srate : float
+        The sample rate of the signal.
+    minStd : float or numpy.ndarray, default=0.5
+        Samples whose window has a standard deviation below this are flagged
+        (eg. in microvolts for EEG). May be given per channel.
+    window : float, default=1.0
+        The length of the windows in seconds.
+
+    Returns
+    -------
+    numpy.ndarray of bool
+        Whether each sample of each channel is flagged, ie. is in a flat
+        window.
+    """
+    window = max(int(window * srate), 1)
+    flat = rollingStd(x, window) < minStd
+    return dilateMask(flat, window // 2, window - window // 2 - 1)
+
+def railingMask(x, srate, rails=None, tolerance=0.5, window=0.1, minCount=3):
+    """Flag windows in which a channel repeatedly reaches its limits.
+
+    Parameters
+    ----------
+    x : numpy.ndarray
+        The signal, with shape `(samples, channels)`.
+    srate : float
+        The sample rate of the signal.
+    rails : tuple of (float, float), optional
+        The lower and upper limits of the signal's range (eg. of the
+        amplifier). Default to the minimum and maximum of each channel.
+    tolerance : float, default=0.5
+        Samples within this of a limit are at the limit.
+    window : float, default=0.1
+        The length of the windows in seconds.
+    minCount : int, default=3
+        Samples whose window has at least this many samples at a limit are
+        flagged.
+
+    Returns
+    -------
+    numpy.ndarray of bool
+        Whether each sample of each channel is flagged.
+    """
+    x = np.asarray(x, dtype=float)
+    if len(x) == 0:
+        return np.zeros(x.shape, dtype=bool)
+    low, high = (x.min(axis=0), x.max(axis=0)) if rails is None else rails
+    atRail = (x <= np.asarray(low) + tolerance) | (
+        x >= np.asarray(high) - tolerance
+        )
+    counts, _ = rollingSum(atRail, window * srate)
+    return counts >= minCount
+
+def blinkEvents(
+        x, srate, threshold=80.0, smoothing=0.05, baselineWindow=1.0,
+        maxDuration=0.5, padding=0.1
+        ):
+    """Find blinks on frontal channels.
+
+    A blink is a deflection from the baseline larger than `threshold` on
+    every frontal channel, with the same sign on all of them, that lasts at
+    most `maxDuration`. Longer deflections are left to the other detectors.
+
+    Parameters
+    ----------
+    x : numpy.ndarray
+        The frontal channels (eg. AF7 and AF8), with shape
+        `(samples, channels)`.
+    srate : float
+        The sample rate of the signal.
+    threshold : float, default=80.0
+        The minimum deflection (eg. in microvolts).
+    smoothing : float, default=0.05
+        The length in seconds of the rolling mean applied before detection,
+        to ignore high frequency noise (eg. muscle activity).
+    baselineWindow : float, default=1.0
+        The length in seconds of the rolling mean used as the baseline.
+    maxDuration : float, default=0.5
+        The maximum duration of a blink in seconds (before padding).
+    padding : float, default=0.1
+        The time in seconds added before and after each blink.
+
+    Returns
+    -------
+    numpy.ndarray of int
+        One row per blink, with the index of its first sample and of the
+        sample after its last (see `maskEvents`).
+    """
+    x = np.asarray(x, dtype=float)
+    x = x[:, np.newaxis] if x.ndim == 1 else x
+    deflection = (
+        rollingMean(x, smoothing * srate)
+        - rollingMean(x, baselineWindow * srate)
+        )
+    positive = (deflection > threshold).all(axis=1)
+    negative = (deflection < -threshold).all(axis=1)
+    events = maskEvents(positive | negative)
+    events = events[np.diff(events, axis=1)[:, 0] <= maxDuration * srate]
+    pad = int(round(padding * srate))
+    return np.column_stack((
+        np.maximum(events[:, 0] - pad, 0),
+        np.minimum(events[:, 1] + pad, len(x))
+        )).astype(np.intp)
+
+def motionMask(
+        timestamps, acc=None, gyr=None, accThreshold=0.05, gyrThreshold=10.0,
+        window=0.5
+        ):
+    """Flag samples recorded while the head was moving.
+
+    Parameters
+    ----------
+    timestamps : numpy.ndarray
+        The time stamps of the samples to flag (eg. of the EEG).
+    acc, gyr : dict, optional
+        The accelerometer and gyroscope streams (as in `GradCPTBlock.data`).
+        Streams that are not specified are not used.
+    accThreshold : float, default=0.05
+        Samples at which the magnitude of the accelerometer has a rolling
+        standard deviation above this (in g) are flagged.
+    gyrThreshold : float, default=10.0
+        Samples at which the magnitude of the gyroscope (without its median,
+        the sensor's offset) has a rolling mean above this (in degrees per
+        second) are flagged.
+    window : float, default=0.5
+        The length of the rolling windows in seconds.
+
+    Returns
+    -------
+    numpy.ndarray of bool
+        Whether each sample is flagged. A sample is flagged if the IMU
+        samples on either side of it are.
+    """
+    timestamps = np.asarray(timestamps, dtype=float)
+    mask = np.zeros(len(timestamps), dtype=bool)
+    for stream, threshold, isAcc in ((acc, accThreshold, True), (
+            gyr, gyrThreshold, False
+            )):
+        if stream is None or threshold is None:
+            continue
+        t = np.asarray(stream['time_stamps'], dtype=float)
+        x = np.asarray(stream['time_series'], dtype=float)
+        if len(t) == 0:
+            continue
+        srate = estimateSampleRate(t) if len(t) > 1 else 1.0
+        if isAcc:
+            moving = rollingStd(np.linalg.norm(x, axis=1), window * srate)
+        else:
+            moving = rollingMean(
+                np.linalg.norm(x - np.median(x, axis=0), axis=1),
+                window * srate
+                )
+        moving = moving > threshold
+        # The IMU samples before and after each time stamp
+        after = np.searchsorted(t, timestamps)
+        mask |= moving[np.clip(after - 1, 0, len(t) - 1)]
+        mask |= moving[np.clip(after, 0, len(t) - 1)]
+    return mask
+
+class Artifacts:
+    """Artifacts detected in a signal.
+
+    Attributes
+    ----------
+    masks : dict of str to numpy.ndarray of bool
+        Whether each sample is flagged, per kind of artifact (see
+        `ARTIFACT_KINDS`). Masks of kinds detected per channel have shape
+        `(samples, channels)`, the others `(samples,)`.
+    timestamps : numpy.ndarray
+        The time stamp of each sample.
+    srate : float
+        The sample rate of the signal.
+    channelNames : list of str
+        The name of each channel.
+    blinks : numpy.ndarray of int
+        The first and last (exclusive) sample of each blink.
+    """
+    def __init__(self, masks, timestamps, srate, channelNames, blinks=None):
+        self.masks = masks
+        self.timestamps = np.asarray(timestamps)
+        self.srate = srate
+        self.channelNames = list(channelNames)
+        self.blinks = (
+            np.empty((0, 2), dtype=np.intp) if blinks is None else blinks
+            )
+
+    @property
+    def numSamples(self):
+        return len(self.timestamps)
+
+    def sampleMask(self, kinds=None, excludeChannels=None):
+        """Get whether each sample is flagged.
+
+        Parameters
+        ----------
+        kinds : list of str, optional
+            The kinds of artifact to include. Defaults to every kind that
+            was detected.
+        excludeChannels : list of str, optional
+            Channels whose artifacts are ignored (eg. bad channels, see
+            `badChannels`, that will be dropped or interpolated).
+
+        Returns
+        -------
+        numpy.ndarray of bool
+            Whether each sample is flagged, on any channel.
+        """
+        kinds = list(self.masks) if kinds is None else kinds
+        invalid = [k for k in kinds if k not in self.masks]
+        if len(invalid) > 0:
+            raise ValueError(f"Invalid kinds: {invalid}")
+        keep = np.array([
+            c not in (excludeChannels or []) for c in self.channelNames
+            ], dtype=bool)
+        mask = np.zeros(self.numSamples, dtype=bool)
+        for kind in kinds:
+            m = self.masks[kind]
+            mask |= m[:, keep].any(axis=1) if m.ndim == 2 else m
+        return mask
+
+    def trialMask(self, starts, numSamples, **kwargs):
+        """Get whether each trial contains a flagged sample.
+
+        Parameters
+        ----------
+        starts : numpy.ndarray of int
+            The index of the first sample of each trial (eg.
+            `Epochs.starts`).
+        numSamples : int
+            The number of samples in each trial.
+        **kwargs
+            Passed to `sampleMask`.
+
+        Returns
+        -------
+        numpy.ndarray of bool
+            Whether each trial should be rejected.
+        """
+        return sampleMaskToTrialMask(
+            self.sampleMask(**kwargs), starts, numSamples
+            )
+
+    def fractions(self):
+        """Get the fraction of flagged samples per kind of artifact.
+
+        Returns
+        -------
+        dict of str to float or numpy.ndarray
+            The fraction of samples flagged, per channel for kinds detected
+            per channel.
+        """
+        return {
+            kind : mask.mean(axis=0) if self.numSamples > 0 else 0.0
+            for kind, mask in self.masks.items()
+            }
+
+    def badChannels(self, maxFraction=0.5, kinds=("flatline", "railing")):
+        """Get the channels flagged for most of the signal.
+
+        Parameters
+        ----------
+        maxFraction : float, default=0.5
+            Channels with more than this fraction of their samples flagged
+            are bad.
+        kinds : tuple of str, default=("flatline", "railing")
+            The kinds of artifact that count (those detected per channel).
+
+        Returns
+        -------
+        list of str
+            The names of the bad channels.
+        """
+        flagged = np.zeros(
+            (self.numSamples, len(self.channelNames)), dtype=bool
+            )
+        for kind in kinds:
+            if kind in self.masks and self.masks[kind].ndim == 2:
+                flagged |= self.masks[kind]
+        if self.numSamples == 0:
+            return []
+        fraction = flagged.mean(axis=0)
+        return [
+            c for c, f in zip(self.channelNames, fraction) if f > maxFraction
+            ]
+
+def detectArtifacts(
+        data, signalType='eeg', amplitude=150.0, minStd=0.5, rails=None,
+        blinkChannels=("AF7", "AF8"), blinkThreshold=80.0, accThreshold=0.05,
+        gyrThreshold=10.0, padding=0.2
+        ):
+    """Detect artifacts in a signal of a block.
+
+    Every threshold can be set to None to skip its detector. Thresholds are
+    in the units of the signals (microvolts for EEG, g for the accelerometer
+    and degrees per second for the gyroscope).
+
+    Parameters
+    ----------
+    data : dict
+        The streams of a block (eg. `GradCPTBlock.data`). The 'acc' and 'gyr'
+        streams are used to detect head motion if they are present.
+    signalType : str, default='eeg'
+        The signal to detect artifacts in.
+    amplitude : float or numpy.ndarray, optional, default=150.0
+        See `amplitudeMask`.
+    minStd : float or numpy.ndarray, optional, default=0.5
+        See `flatlineMask`.
+    rails : tuple of (float, float), optional
+        See `railingMask`. Railing is only detected if specified.
+    blinkChannels : tuple of str, default=("AF7", "AF8")
+        The frontal channels used to detect blinks. Blinks are not detected
+        if any of them is missing.
+    blinkThreshold : float, optional, default=80.0
+        See `blinkEvents`.
+    accThreshold, gyrThreshold : float, optional
+        See `motionMask`.
+    padding : float, default=0.2
+        The time in seconds flagged before and after every flagged sample
+        (except blinks, which are padded by `blinkEvents`).
+
+    Returns
+    -------
+    Artifacts
+        The artifacts of each kind.
+    """
+    if signalType not in data:
+        raise ValueError(f"No data for signal type: {signalType}")
+    stream = data[signalType]
+    x = np.asarray(stream['time_series'], dtype=float)
+    timestamps = np.asarray(stream['time_stamps'], dtype=float)
+    srate = (
+        stream['info'].get('effective_srate')
+        or estimateSampleRate(timestamps)
+        )
+    channels = stream['info']['desc'][0]['channels'][0]['channel']
+    channelNames = [c['label'][0] for c in channels]
+    pad = int(round(padding * srate))
+
+    masks = {}
+    if amplitude is not None:
+        masks["amplitude"] = dilateMask(
+            amplitudeMask(x, srate, amplitude), pad
+            )
+    if minStd is not None:
+        masks["flatline"] = flatlineMask(x, srate, minStd)
+    if rails is not None:
+        masks["railing"] = dilateMask(railingMask(x, srate, rails), pad)
+    blinks = None
+    if (
+            blinkThreshold is not None
+            and all(c in channelNames for c in blinkChannels)
+            ):
+        index = [channelNames.index(c) for c in blinkChannels]
+        blinks = blinkEvents(x[:, index], srate, blinkThreshold)
+        masks["blink"] = eventsMask(blinks, len(x))
+    if 'acc' in data or 'gyr' in data:
+        masks["motion"] = dilateMask(motionMask(
+            timestamps, data.get('acc'), data.get('gyr'),
+            accThreshold=accThreshold, gyrThreshold=gyrThreshold
+            ), pad)
+    return Artifacts(masks, timestamps, srate, channelNames, blinks=blinks)
@@ -0,0 +1,923 @@
+"""Prediction of the attentional state (in or out of the zone) of trials.
+
+`AttentionModel` is an L2 regularized logistic regression of whether each
+trial is in the zone (see `vtc.varianceTimeCourse`) on its EEG and PPG
+features, trained on the trials of past sessions in a `FeatureStore` (see
+`trainModel` and `crossValidate`). It is fitted with Newton's method on
+standardized features and applied as a single dot product.
+
+`AttentionPredictor` applies a model to a live gradCPT run. EEG samples are
+kept in a ring buffer (`RingBuffer`) as they arrive, and heart beats are
+detected in the PPG as it arrives. Once the EEG of a trial's epoch has been
+received, the trial's features are computed from a window of the buffer
+around the epoch and the beats before it, exactly as the feature store
+computes them from recordings (see `feature_store.trialFeatures`), so that
+live features match those the model was trained on.
+`AttentionMonitor` reads the streams from the lab streaming layer and
+publishes each prediction as an LSL stream.
+
+The latency of each prediction is the time from the arrival of the last
+sample (or marker) it needed to its publication. Predictions are computed
+in trial order, and when several trials are ready at once (eg. after a stall
+of the streams), trials that could no longer be predicted within the
+latency budget are dropped in favour of the most recent one, so that a
+backlog does not delay every following prediction.
+"""
+import json
+import threading
+from collections import deque
+
+import numpy as np
+import polars as pl
+from pylsl import (
+    IRREGULAR_RATE, StreamInfo, StreamInlet, StreamOutlet, local_clock,
+    resolve_byprop
+    )
+from scipy import linalg
+from scipy.special import expit
+
+from .feature_store import epochParameters, windowFeatures
+from .pipeline import DataPipe
+from .ppg import PPG_CHANNEL, StreamingHRV, windowMetrics
+from .summary import defaultPipeline
+
+# Columns of a feature store that are not features of a trial, or that
+# depend on the trial's behaviour
+_EXCLUDED_FEATURES = ("eeg_reject", "ppg_num_beats")
+_PPG_METRICS = ("hr_bpm", "sdnn_ms", "rmssd_ms")
+
+OUTPUT_CHANNELS = ["p_in_zone", "in_zone", "reject", "onset"]
+
+def featureColumns(columns):
+    """Get the names of the features among the columns of a feature store.
+
+    Parameters
+    ----------
+    columns : list of str
+        The columns (eg. `FeatureStore.scan().columns`).
+
+    Returns
+    -------
+    list of str
+        The EEG ("eeg_...") and PPG ("ppg_...") features, in order.
+    """
+    return [
+        c for c in columns
+        if c.startswith(("eeg_", "ppg_")) and c not in _EXCLUDED_FEATURES
+        ]
+
+def trainingData(trials, features=None):
+    """Get the features and labels of trials to train a model on.
+
+    Trials whose epoch was rejected (see the "artifacts" action) or whose
+    state is unknown (blocks without reaction times) are left out.
+
+    Parameters
+    ----------
+    trials : polars.DataFrame
+        Trials from a `FeatureStore`.
+    features : list of str, optional
+        The features to use. Defaults to every EEG and PPG feature (see
+        `featureColumns`).
+
+    Returns
+    -------
+    X : numpy.ndarray
+        The features of each trial, with shape `(trials, features)`. Missing
+        values are NaN.
+    y : numpy.ndarray of bool
+        Whether each trial is in the zone.
+    trials : polars.DataFrame
+        The trials that were kept.
+    features : list of str
+        The name of each feature.
+    """
+    features = (
+        featureColumns(trials.columns) if features is None
+        else list(features)
+        )
+    missing = [f for f in features if f not in trials.columns]
+    if len(missing) > 0:
+        raise ValueError(f"Invalid features: {missing}")
+    keep = pl.col("in_zone").is_not_null()
+    if "eeg_reject" in trials.columns:
+        keep = keep & ~pl.col("eeg_reject").fill_null(False)
+    trials = trials.filter(keep)
+    X = (
+        trials.select([pl.col(f).cast(pl.Float64) for f in features])
+        .to_numpy().astype(float).reshape(len(trials), len(features))
+        )
+    return X, trials["in_zone"].to_numpy().astype(bool), trials, features
+
+def rocAUC(y, scores):
+    """Get the area under the ROC curve of scores of binary labels.
+
+    Parameters
+    ----------
+    y : numpy.ndarray of bool
+        The labels.
+    scores : numpy.ndarray
+        The scores, higher for positive labels.
+
+    Returns
+    -------
+    float
+        The probability that a random positive is scored higher than a random
+        negative (ties count half), or NaN if there is a single class.
+    """
+    y = np.asarray(y, dtype=bool)
+    numPositive = np.count_nonzero(y)
+    numNegative = len(y) - numPositive
+    if numPositive == 0 or numNegative == 0:
+        return np.nan
+    # Mean ranks of tied scores
+    order = np.argsort(scores, kind="stable")
+    sortedScores = np.asarray(scores)[order]
+    _, first, counts = np.unique(
+        sortedScores, return_index=True, return_counts=True
+        )
+    ranks = np.empty(len(y))
+    ranks[order] = np.repeat(first + (counts + 1) / 2, counts)
+    return float(
+        (ranks[y].sum() - numPositive * (numPositive + 1) / 2)
+        / (numPositive * numNegative)
+        )
+
+class AttentionModel:
+    """Logistic regression of the attentional state on trial features.
+
+    Minimizes the mean log loss over the training trials plus
+    `regularization / 2` times the squared norm of the coefficients of the
+    standardized features (the intercept is not penalized), with Newton's
+    method. Missing feature values are replaced by the feature's mean over
+    the training trials, both when fitting and predicting.
+
+    Parameters
+    ----------
+    features : list of str, optional
+        The name of each feature. Defaults to the columns selected by
+        `fit`'s caller (see `trainModel`).
+    regularization : float, default=1.0
+        The strength of the L2 penalty.
+    balanced : bool, default=True
+        Whether to weight the trials of each state by the inverse of their
+        frequency, so that both states count equally.
+    maxIterations : int, default=100
+        The maximum number of Newton steps.
+    tol : float, default=1e-8
+        Fitting stops once no coefficient changes by more than `tol`.
+
+    Attributes
+    ----------
+    coef : numpy.ndarray
+        The coefficient of each (unstandardized) feature.
+    intercept : float
+        The intercept.
+    mean : numpy.ndarray
+        The mean of each feature over the training trials.
+    numIterations : int
+        The number of Newton steps taken by `fit`.
+    metadata : dict
+        How the features were computed (the feature store's "pipeline",
+        "ppg_window", "padding" and "lookahead", see `trainModel`).
+    """
+    def __init__(
+            self, features=None, regularization=1.0, balanced=True,
+            maxIterations=100, tol=1e-8
+            ):
+        self.features = None if features is None else list(features)
+        self.regularization = regularization
+        self.balanced = balanced
+        self.maxIterations = maxIterations
+        self.tol = tol
+        self.coef = None
+        self.intercept = None
+        self.mean = None
+        self.numIterations = 0
+        self.metadata = {}
+
+    def __impute(self, X):
+        X = np.array(X, dtype=float, ndmin=2)
+        return np.where(np.isnan(X), self.mean, X)
+
+    def fit(self, X, y):
+        """Fit the model.
+
+        Parameters
+        ----------
+        X : numpy.ndarray
+            The features of each trial, with shape `(trials, features)`.
+        y : numpy.ndarray of bool
+            Whether each trial is in the zone.
+
+        Returns
+        -------
+        self
+        """
+        X = np.array(X, dtype=float, ndmin=2)
+        y = np.asarray(y, dtype=float)
+        numTrials, numFeatures = X.shape
+        if numTrials == 0 or len(y) != numTrials:
+            raise ValueError("X and y must have the same, non-zero length.")
+        if self.features is not None and len(self.features) != numFeatures:
+            raise ValueError(
+                f"Expected {len(self.features)} features, got {numFeatures}"
+                )
+
+        with np.errstate(invalid="ignore"):
+            self.mean = np.nan_to_num(np.nanmean(X, axis=0))
+        X = self.__impute(X)
+        scale = X.std(axis=0)
+        scale[scale == 0] = 1.0
+        Z = np.column_stack((np.ones(numTrials), (X - self.mean) / scale))
+
+        weights = np.full(numTrials, 1 / numTrials)
+        if self.balanced:
+            numPositive = y.sum()
+            counts = {1.0 : numPositive, 0.0 : numTrials - numPositive}
+            for label, count in counts.items():
+                if count > 0:
+                    weights[y == label] = 1 / (2 * count)
+        penalty = np.full(numFeatures + 1, self.regularization)
+        penalty[0] = 0.0
+
+        beta = np.zeros(numFeatures + 1)
+        for k in range(1, self.maxIterations + 1):
+            p = expit(Z @ beta)
+            gradient = Z.T @ (weights * (p - y)) + penalty * beta
+            hessian = (Z * (weights * p * (1 - p))[:, np.newaxis]).T @ Z
+            hessian[np.diag_indices_from(hessian)] += penalty + 1e-12
+            step = linalg.solve(hessian, gradient, assume_a="pos")
+            beta -= step
+            if np.max(np.abs(step)) < self.tol:
+                break
+        self.numIterations = k
+
+        # Coefficients of the unstandardized features
+        self.coef = beta[1:] / scale
+        self.intercept = float(beta[0] - self.coef @ self.mean)
+        return self
+
+    def decisionFunction(self, X):
+        """Get the log odds of each trial being in the zone."""
+        if self.coef is None:
+            raise ValueError("The model has not been fitted.")
+        return self.__impute(X) @ self.coef + self.intercept
+
+    def predictProba(self, X):
+        """Get the probability of each trial being in the zone."""
+        return expit(self.decisionFunction(X))
+
+    def predict(self, X):
+        """Get whether each trial is predicted to be in the zone."""
+        return self.decisionFunction(X) > 0
+
+    def save(self, filePath):
+        """Save the fitted model to a JSON file."""
+        if self.coef is None:
+            raise ValueError("The model has not been fitted.")
+        with open(filePath, "w") as f:
+            json.dump({
+                "features" : self.features,
+                "regularization" : self.regularization,
+                "balanced" : self.balanced,
+                "coef" : self.coef.tolist(),
+                "intercept" : self.intercept,
+                "mean" : self.mean.tolist(),
+                "num_iterations" : self.numIterations,
+                "metadata" : self.metadata
+                }, f, indent=4)
+
+    @classmethod
+    def load(cls, filePath):
+        """Load a model saved with `save`."""
+        with open(filePath, "r") as f:
+            params = json.load(f)
+        model = cls(
+            params["features"], regularization=params["regularization"],
+            balanced=params["balanced"]
+            )
+        model.coef = np.asarray(params["coef"], dtype=float)
+        model.intercept = float(params["intercept"])
+        model.mean = np.asarray(params["mean"], dtype=float)
+        model.numIterations = params["num_iterations"]
+        model.metadata = params["metadata"]
+        return model
+
+def _storeSettings(store, study=None):
+    # The settings the features of a store were computed with, which must be
+    # the same for every partition
+    keys = ("pipeline", "ppg_window", "padding", "lookahead")
+    settings = {
+        json.dumps([p.get(k) for k in keys])
+        for p in store.provenance(study=study)
+        }
+    if len(settings) > 1:
+        raise ValueError(
+            "The partitions of the store were computed with different "
+            + "settings. Update the store first."
+            )
+    if len(settings) == 0:
+        return {}
+    return {
+        k : v for k, v in zip(keys, json.loads(settings.pop()))
+        if v is not None
+        }
+
+def trainModel(
+        store, features=None, study=None, predicate=None, **kwargs
+        ):
+    """Train a model on the trials of a feature store.
+
+    Parameters
+    ----------
+    store : FeatureStore
+        The store.
+    features : list of str, optional
+        See `trainingData`.
+    study : str, optional
+        Only train on trials of this study.
+    predicate : polars.Expr, optional
+        Only train on the trials that match it (eg. some sessions).
+    **kwargs
+        Passed to `AttentionModel`.
+
+    Returns
+    -------
+    AttentionModel
+        The fitted model. Its metadata holds the settings the store's
+        features were computed with (pipeline, PPG window, padding and
+        lookahead), which `AttentionPredictor` uses to compute the same
+        features live.
+    """
+    trials = store.query(predicate=predicate, study=study)
+    X, y, _, features = trainingData(trials, features=features)
+    model = AttentionModel(features, **kwargs).fit(X, y)
+    model.metadata = _storeSettings(store, study=study)
+    return model
+
+def crossValidate(
+        trials, features=None, groupBy="session_name", **kwargs
+        ):
+    """Evaluate the model on each group of trials, trained on the others.
+
+    Parameters
+    ----------
+    trials : polars.DataFrame
+        Trials from a `FeatureStore` (eg. `FeatureStore.query()`).
+    features : list of str, optional
+        See `trainingData`.
+    groupBy : str, default="session_name"
+        The column whose groups are left out in turn (eg. "participant_id"
+        to evaluate on unseen participants).
+    **kwargs
+        Passed to `AttentionModel`.
+
+    Returns
+    -------
+    polars.DataFrame
+        One row per group, with its number of trials ("num_trials"), the
+        area under the ROC curve ("auc") and the accuracy ("accuracy") of
+        the model's predictions.
+    """
+    X, y, trials, features = trainingData(trials, features=features)
+    groups = trials[groupBy].to_numpy()
+    rows = []
+    for group in np.unique(groups):
+        test = groups == group
+        if np.all(test):
+            raise ValueError("At least two groups are needed.")
+        model = AttentionModel(features, **kwargs).fit(X[~test], y[~test])
+        scores = model.decisionFunction(X[test])
+        rows.append({
+            groupBy : group,
+            "num_trials" : int(np.count_nonzero(test)),
+            "auc" : rocAUC(y[test], scores),
+            "accuracy" : float(np.mean((scores > 0) == y[test]))
+            })
+    return pl.DataFrame(rows)
+
+class RingBuffer:
+    """A fixed size buffer of the most recent samples of a stream.
+
+    Samples are written twice, `capacity` samples apart, so that the
+    buffered samples are always contiguous in memory and can be read without
+    copying, in time order.
+
+    Parameters
+    ----------
+    capacity : int
+        The number of samples kept.
+    numChannels : int
+        The number of channels of the stream.
+    """
+    def __init__(self, capacity, numChannels):
+        self.capacity = int(capacity)
+        self.numChannels = numChannels
+        self.__data = np.zeros((2 * self.capacity, numChannels))
+        self.__times = np.zeros(2 * self.capacity)
+        self.clear()
+
+    def __len__(self):
+        return self.__size
+
+    def clear(self):
+        """Remove every sample."""
+        self.__end = 0
+        self.__size = 0
+
+    def extend(self, samples, timestamps):
+        """Add samples, overwriting the oldest ones if the buffer is full.
+
+        Parameters
+        ----------
+        samples : numpy.ndarray
+            The samples, with shape `(samples, channels)`.
+        timestamps : numpy.ndarray
+            The time stamp of each sample, in order.
+        """
+        timestamps = np.asarray(timestamps, dtype=float)
+        samples = np.asarray(samples, dtype=float).reshape(
+            len(timestamps), self.numChannels
+            )
+        n = len(timestamps)
+        if n >= self.capacity:
+            samples = samples[n - self.capacity:]
+            timestamps = timestamps[n - self.capacity:]
+            n = self.capacity
+        index = (self.__end + np.arange(n)) % self.capacity
+        for offset in (0, self.capacity):
+            self.__data[index + offset] = samples
+            self.__times[index + offset] = timestamps
+        self.__end = (self.__end + n) % self.capacity
+        self.__size = min(self.__size + n, self.capacity)
+
+    def arrays(self):
+        """Get the buffered samples, oldest first.
+
+        Returns
+        -------
+        timestamps, samples : numpy.ndarray
+            Views of the time stamps and samples, valid until the next call
+            to `extend`.
+        """
+        stop = self.__end + self.capacity
+        start = stop - self.__size
+        return self.__times[start:stop], self.__data[start:stop]
+
+    def window(self, start, stop):
+        """Get the buffered samples with time stamps in `[start, stop)`.
+
+        Returns
+        -------
+        timestamps, samples : numpy.ndarray
+            Views (see `arrays`).
+        """
+        times, data = self.arrays()
+        first, last = np.searchsorted(times, [start, stop])
+        return times[first:last], data[first:last]
+
+    @property
+    def lastTime(self):
+        """The time stamp of the most recent sample, or None if empty."""
+        return self.arrays()[0][-1] if self.__size > 0 else None
+
+    @property
+    def firstTime(self):
+        """The time stamp of the oldest sample, or None if empty."""
+        return self.arrays()[0][0] if self.__size > 0 else None
+
+class AttentionPredictor:
+    """Predict the attentional state of each trial of a live run.
+
+    Feed the samples of the EEG (and optionally PPG) stream and the onsets of
+    trials as they arrive (`addEEG`, `addPPG`, `addOnset`), then call
+    `predict` to get the predictions of the trials whose epoch has been
+    received.
+
+    The features of a trial are computed as the feature store computes them
+    (see `feature_store.trialFeatures`), with the settings of the model's
+    metadata (see `trainModel`). The EEG features are computed with its
+    pipeline (defaults to `summary.defaultPipeline`), applied to the
+    buffered EEG from `padding` seconds before the trial's epoch to
+    `lookahead` seconds after it (see `feature_store.windowFeatures`). Only
+    the artifacts in the EEG itself are detected (not those in the motion
+    streams). The PPG features are computed over the beats detected by
+    `StreamingHRV` in the model's PPG window around the onset, which must
+    end before the end of the epoch.
+
+    Parameters
+    ----------
+    model : AttentionModel
+        A fitted model.
+    srate : float
+        The sample rate of the EEG.
+    channelNames : list of str
+        The names of the EEG channels.
+    ppgSrate : float, optional
+        The sample rate of the PPG, if it is used.
+    ppgChannel : int, default=PPG_CHANNEL
+        The PPG channel to use.
+    padding, lookahead : float, optional
+        The EEG before and after each epoch that is filtered with it, in
+        seconds. Every prediction waits for `lookahead` seconds of EEG after
+        the epoch. Default to those of the model's metadata (or 1.0 and
+        0.25), which the features must be computed with to match those the
+        model was trained on.
+    bufferDuration : float, default=10.0
+        The length of the EEG ring buffer, in seconds.
+    budgetMs : float, default=50.0
+        The latency budget of each prediction, in milliseconds.
+    numLatencies : int, default=1000
+        The number of recent predictions the latency statistics are computed
+        over.
+    """
+    def __init__(
+            self, model, srate, channelNames, ppgSrate=None,
+            ppgChannel=PPG_CHANNEL, padding=None, lookahead=None,
+            bufferDuration=10.0, budgetMs=50.0, numLatencies=1000
+            ):
+        self.model = model
+        self.srate = srate
+        self.channelNames = list(channelNames)
+        self.ppgChannel = ppgChannel
+        self.padding = (
+            model.metadata.get("padding", 1.0) if padding is None else padding
+            )
+        self.lookahead = (
+            model.metadata.get("lookahead", 0.25) if lookahead is None
+            else lookahead
+            )
+        self.budgetMs = budgetMs
+
+        actions = model.metadata.get("pipeline")
+        if actions is None:
+            self.pipe = defaultPipeline()
+        else:
+            self.pipe = DataPipe(cache=False)
+            for action, params in actions:
+                self.pipe.add(action, **params)
+        epoch = epochParameters(self.pipe)
+        self.marker = epoch["marker"]
+        self.tmin = epoch["tmin"]
+        self.tmax = epoch["tmax"]
+        self.ppgWindow = model.metadata.get("ppg_window", [-10.0, 0.0])
+        if self.marker == "response":
+            raise ValueError("Epochs must be cut around stimulus markers.")
+        # The end of the EEG needed by a trial, relative to its onset
+        self.__end = self.tmax + self.lookahead
+
+        self.__info = {
+            'nominal_srate' : srate,
+            'desc' : [{'channels' : [{'channel' : [
+                {'label' : [name]} for name in self.channelNames
+                ]}]}]
+            }
+        self.__eeg = RingBuffer(
+            int(np.ceil(bufferDuration * srate)), len(self.channelNames)
+            )
+        self.__hrv = None if ppgSrate is None else StreamingHRV(ppgSrate)
+        self.__beats = deque()
+        self.__features = [
+            (k, name[len("eeg_"):]) for k, name in enumerate(model.features)
+            if name.startswith("eeg_")
+            ]
+        self.__ppgFeatures = [
+            (k, name[len("ppg_"):]) for k, name in enumerate(model.features)
+            if name.startswith("ppg_") and name[len("ppg_"):] in _PPG_METRICS
+            ]
+        self.__pending = deque()
+        self.__latencies = deque(maxlen=numLatencies)
+        self.__costs = deque(maxlen=50)
+        self.numPredicted = 0
+        self.numDropped = 0
+
+    def reset(self):
+        """Forget every sample, beat and pending trial."""
+        self.__eeg.clear()
+        if self.__hrv is not None:
+            self.__hrv.reset()
+        self.__beats.clear()
+        self.__pending.clear()
+
+    def addEEG(self, samples, timestamps, arrivalTime=None):
+        """Add EEG samples.
+
+        Parameters
+        ----------
+        samples : numpy.ndarray
+            The samples, with shape `(samples, channels)`.
+        timestamps : numpy.ndarray
+            The time stamp of each sample.
+        arrivalTime : float, optional
+            When the samples were received (`pylsl.local_clock`). Defaults to
+            now.
+        """
+        if len(timestamps) == 0:
+            return
+        arrivalTime = local_clock() if arrivalTime is None else arrivalTime
+        self.__eeg.extend(samples, timestamps)
+        lastTime = self.__eeg.lastTime
+        for trial in self.__pending:
+            if (
+                    trial["ready_at"] is None
+                    and trial["onset"] + self.__end <= lastTime
+                    ):
+                trial["ready_at"] = arrivalTime
+
+    def addPPG(self, samples, timestamps):
+        """Add PPG samples, with shape `(samples, channels)`."""
+        if self.__hrv is None or len(timestamps) == 0:
+            return
+        x = np.asarray(samples, dtype=float)[:, self.ppgChannel]
+        for beat in self.__hrv.process(x, timestamps):
+            ibi = beat["ibi_ms"]
+            self.__beats.append((
+                beat["time"], np.nan if ibi is None else ibi / 1000,
+                beat["valid"]
+                ))
+        # Beats before the PPG window of any trial in the buffer are not
+        # needed
+        firstTime = self.__eeg.firstTime
+        while (
+                firstTime is not None and len(self.__beats) > 0
+                and self.__beats[0][0] < firstTime + self.ppgWindow[0]
+                ):
+            self.__beats.popleft()
+
+    def addOnset(self, onset, arrivalTime=None):
+        """Add the onset of a trial (the time stamp of its marker)."""
+        arrivalTime = local_clock() if arrivalTime is None else arrivalTime
+        lastTime = self.__eeg.lastTime
+        ready = lastTime is not None and onset + self.__end <= lastTime
+        self.__pending.append({
+            "onset" : onset, "ready_at" : arrivalTime if ready else None
+            })
+
+    def features(self, onset):
+        """Compute the features of the trial at `onset`.
+
+        Returns
+        -------
+        x : numpy.ndarray
+            The value of each of the model's features (NaN if missing).
+        reject : bool
+            Whether the trial's epoch contains artifacts.
+        """
+        x = np.full(len(self.model.features), np.nan)
+        times, samples = self.__eeg.arrays()
+        row = windowFeatures(
+            self.pipe,
+            {
+                'time_series' : samples, 'time_stamps' : times,
+                'info' : self.__info
+                },
+            [onset], padding=self.padding, lookahead=self.lookahead
+            ).row(0, named=True)
+        reject = bool(row["reject"])
+        for k, name in self.__features:
+            value = row.get(name)
+            x[k] = np.nan if value is None else value
+
+        if len(self.__ppgFeatures) > 0 and len(self.__beats) > 1:
+            beatTimes, ibi, valid = (np.array(v) for v in zip(*self.__beats))
+            # The interval ending at the oldest beat is not known
+            metrics = windowMetrics(
+                beatTimes, np.nan_to_num(ibi[1:]), valid[1:].astype(bool),
+                np.array([onset + self.ppgWindow[0]]),
+                np.array([onset + self.ppgWindow[1]])
+                )
+            for k, name in self.__ppgFeatures:
+                x[k] = metrics[name][0]
+        return x, reject
+
+    def predict(self, publish=None):
+        """Predict the state of the trials whose epoch has been received.
+
+        Parameters
+        ----------
+        publish : Callable[[dict], None], optional
+            Called with each prediction as soon as it is made (eg. to push
+            it to an outlet), before its latency is measured.
+
+        Returns
+        -------
+        list of dict
+            One item per trial predicted, in order, with the trial's "onset",
+            the probability it is in the zone ("p_in_zone"), the prediction
+            ("in_zone"), whether its epoch was rejected ("reject") and the
+            latency ("latency_ms").
+        """
+        # Trials that can no longer be predicted, as their EEG has left the
+        # buffer
+        firstTime = self.__eeg.firstTime
+        while (
+                len(self.__pending) > 0 and firstTime is not None
+                and self.__pending[0]["onset"] + self.tmin - self.padding
+                < firstTime
+                and self.__pending[0]["ready_at"] is None
+                ):
+            self.__pending.popleft()
+            self.numDropped += 1
+
+        predictions = []
+        while (
+                len(self.__pending) > 0
+                and self.__pending[0]["ready_at"] is not None
+                ):
+            trial = self.__pending.popleft()
+            nextReady = (
+                len(self.__pending) > 0
+                and self.__pending[0]["ready_at"] is not None
+                )
+            # Drop trials that would exceed the budget if a more recent one
+            # is waiting
+            cost = float(np.median(self.__costs)) if self.__costs else 0.0
+            if nextReady and (
+                    (local_clock() - trial["ready_at"] + cost) * 1000
+                    > self.budgetMs
+                    ):
+                self.numDropped += 1
+                continue
+
+            start = local_clock()
+            x, reject = self.features(trial["onset"])
+            p = float(self.model.predictProba(x)[0])
+            prediction = {
+                "onset" : trial["onset"],
+                "p_in_zone" : p,
+                "in_zone" : p > 0.5,
+                "reject" : reject
+                }
+            if publish is not None:
+                publish(prediction)
+            end = local_clock()
+            self.__costs.append(end - start)
+            prediction["latency_ms"] = (end - trial["ready_at"]) * 1000
+            self.__latencies.append(prediction["latency_ms"])
+            self.numPredicted += 1
+            predictions.append(prediction)
+        return predictions
+
+    def latencyStats(self):
+        """Get summary statistics of the latency of recent predictions.
+
+        Returns
+        -------
+        dict
+            The number of predictions made ("num_predicted") and dropped
+            ("num_dropped"), the mean, median, 99th percentile and maximum
+            latency of recent predictions in milliseconds ("mean_ms",
+            "median_ms", "p99_ms", "max_ms"), and whether the 99th percentile
+            is within the budget ("within_budget").
+        """
+        stats = {
+            "num_predicted" : self.numPredicted,
+            "num_dropped" : self.numDropped
+            }
+        if len(self.__latencies) == 0:
+            return {
+                **stats, "mean_ms" : np.nan, "median_ms" : np.nan,
+                "p99_ms" : np.nan, "max_ms" : np.nan, "within_budget" : True
+                }
+        x = np.asarray(self.__latencies)
+        p50, p99 = np.percentile(x, [50, 99])
+        return {
+            **stats,
+            "mean_ms" : float(x.mean()),
+            "median_ms" : float(p50),
+            "p99_ms" : float(p99),
+            "max_ms" : float(x.max()),
+            "within_budget" : bool(p99 <= self.budgetMs)
+            }
+
+class AttentionMonitor:
+    """Predict the attentional state of each trial of a live gradCPT run.
+
+    Reads the EEG, PPG and stimuli marker streams in a background thread,
+    feeds them to an `AttentionPredictor`, and pushes every prediction to an
+    LSL stream of irregular rate, with the channels `OUTPUT_CHANNELS`: the
+    probability that the trial is in the zone, the prediction (1 or 0),
+    whether its epoch was rejected (1 or 0) and the onset of the trial.
+
+    Parameters
+    ----------
+    model : AttentionModel
+        A fitted model (see `trainModel`).
+    callback : Callable[[dict], None], optional
+        Called from the background thread with each prediction (see
+        `AttentionPredictor.predict`).
+    outletName : str, default="attention_state"
+        The name of the stream the predictions are published on.
+    eegStreamType, ppgStreamType : str, default="EEG", "PPG"
+        The types of the EEG and PPG streams. The PPG is only read if the
+        model uses PPG features.
+    stimStreamName : str, default="stimuli_marker_stream"
+        The name of the stimuli marker stream.
+    budgetMs : float, default=50.0
+        The latency budget of each prediction (see `AttentionPredictor`).
+    **kwargs
+        Passed to `AttentionPredictor`.
+    """
+    def __init__(
+            self, model, callback=None, outletName="attention_state",
+            eegStreamType="EEG", ppgStreamType="PPG",
+            stimStreamName="stimuli_marker_stream", budgetMs=50.0, **kwargs
+            ):
+        self.model = model
+        self.callback = callback
+        self.outletName = outletName
+        self.eegStreamType = eegStreamType
+        self.ppgStreamType = ppgStreamType
+        self.stimStreamName = stimStreamName
+        self.budgetMs = budgetMs
+        self.__kwargs = kwargs
+        self.predictor = None
+        self.__stopEvent = threading.Event()
+        self.__thread = None
+
+    def __enter__(self):
+        self.__thread = threading.Thread(
+            target=self.__watch, name="attention-monitor", daemon=True
+            )
+        self.__thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_tb):
+        self.__stopEvent.set()
+        self.__thread.join()
+
+    def latencyStats(self):
+        """Get the latency statistics of the predictions so far (see
+        `AttentionPredictor.latencyStats`)."""
+        if self.predictor is None:
+            return None
+        return self.predictor.latencyStats()
+
+    def __resolve(self, prop, value):
+        streams = []
+        while len(streams) == 0:
+            if self.__stopEvent.is_set():
+                return None
+            streams = resolve_byprop(prop, value, timeout=0.5)
+        return StreamInlet(streams[0])
+
+    def __outlet(self):
+        info = StreamInfo(
+            self.outletName, "AttentionState", len(OUTPUT_CHANNELS),
+            IRREGULAR_RATE, "double64", self.outletName
+            )
+        channels = info.desc().append_child("channels")
+        for name in OUTPUT_CHANNELS:
+            channels.append_child("channel").append_child_value("label", name)
+        return StreamOutlet(info)
+
+    def __watch(self):
+        eegInlet = self.__resolve("type", self.eegStreamType)
+        stimInlet = self.__resolve("name", self.stimStreamName)
+        usesPPG = any(f.startswith("ppg_") for f in self.model.features)
+        ppgInlet = (
+            self.__resolve("type", self.ppgStreamType) if usesPPG else None
+            )
+        if eegInlet is None or stimInlet is None or (
+                usesPPG and ppgInlet is None
+                ):
+            return
+
+        eegInfo = eegInlet.info()
+        channel = eegInfo.desc().child("channels").child("channel")
+        channelNames = []
+        for _ in range(eegInfo.channel_count()):
+            channelNames.append(channel.child_value("label"))
+            channel = channel.next_sibling()
+        self.predictor = AttentionPredictor(
+            self.model, eegInfo.nominal_srate(), channelNames,
+            ppgSrate=None if ppgInlet is None else (
+                ppgInlet.info().nominal_srate()
+                ),
+            budgetMs=self.budgetMs, **self.__kwargs
+            )
+        outlet = self.__outlet()
+
+        def publish(prediction):
+            outlet.push_sample([
+                prediction["p_in_zone"], float(prediction["in_zone"]),
+                float(prediction["reject"]), prediction["onset"]
+                ])
+
+        # Wait for EEG for at most half the budget, so that markers and PPG
+        # are read promptly when the EEG stalls
+        timeout = min(0.05, self.budgetMs / 2000)
+        while not self.__stopEvent.is_set():
+            samples, timestamps = eegInlet.pull_chunk(timeout=timeout)
+            self.predictor.addEEG(samples, timestamps)
+            if ppgInlet is not None:
+                samples, timestamps = ppgInlet.pull_chunk(timeout=0.0)
+                self.predictor.addPPG(samples, timestamps)
+            markers, markerTimes = stimInlet.pull_chunk(timeout=0.0)
+            for sample, t in zip(markers, markerTimes):
+                if sample[0] == self.predictor.marker:
+                    self.predictor.addOnset(t)
+            for prediction in self.predictor.predict(publish):
+                if self.callback is not None:
+                    self.callback(prediction)
@@ -0,0 +1,351 @@
+"""Behavioural metrics for gradCPT blocks.
+
+Responses are assigned to trials with the rules used for the gradCPT by
+Esterman et al. (2013), implemented with sorted-array operations:
+
+1. A response made after the current image is at least 70% coherent, and
+   before the next image is 40% coherent, is assigned to the current trial
+   (unambiguous).
+2. A response made between 40% and 70% coherence of an image is ambiguous
+   between that trial and the previous one. It is assigned to whichever of
+   the two has no unambiguous response. If neither does, it is assigned to
+   the closest (most coherent) image, unless one of the two is a rare (no-go)
+   target, in which case it is assigned to the common (go) target.
+3. If a trial is assigned several responses, only the first is kept.
+
+Ambiguous responses are resolved together rather than one after another, so
+if two ambiguous responses compete for the same free trial, the first one
+gets it and the other is discarded.
+
+Reaction times are measured from the onset of the trial's image transition
+("transition_period_start"). Common targets are "go" trials and rare targets
+"no-go" trials: a commission error is a response to a rare target and an
+omission error a missing response to a common target. d′ and the criterion
+use responses to common targets as hits and responses to rare targets as
+false alarms, with a log-linear correction for rates of 0 or 1.
+
+Trials of many blocks (eg. a whole study) are processed in a single batched
+call by `trialTable`.
+"""
+import numpy as np
+import polars as pl
+from scipy.special import ndtri
+
+from .epochs import markerTimes
+
+# Coherence of an image, as a fraction of its transition period, at which
+# responses stop or start being unambiguous
+UNAMBIGUOUS_START = 0.7
+UNAMBIGUOUS_END = 0.4
+
+def blockInputs(
+        block, transitionTimeMs, staticTimeMs, sessionName=None
+        ):
+    """Get the inputs to `trialTable` for a block.
+
+    Parameters
+    ----------
+    block : GradCPTBlock
+        A block (from `data_analysis.block`) with data.
+    transitionTimeMs, staticTimeMs : float
+        The length of the transition and static periods of each trial (the
+        session's "stim_transition_time_ms" and "stim_static_time_ms").
+    sessionName : str, optional
+        The name of the block's session.
+
+    Returns
+    -------
+    dict or None
+        The block's inputs, or None if the block has no data.
+    """
+    if block.data is None:
+        return None
+    responses = block.data.get('response_marker_stream')
+    return {
+        "session_name" : sessionName,
+        "block_name" : block.name,
+        "onsets" : markerTimes(
+            block.data['stimuli_marker_stream'], "transition_period_start"
+            ),
+        "responses" : (
+            markerTimes(responses, "response") if responses is not None
+            else np.empty(0)
+            ),
+        "target_types" : block.stimSequence["target_type"].to_numpy(),
+        "transition_time" : transitionTimeMs / 1000,
+        "static_time" : staticTimeMs / 1000
+        }
+
+def assignResponses(
+        onsets, responses, isRare, transitionTime, trialTime, isFirst=None
+        ):
+    """Assign responses to trials.
+
+    All arguments may cover several blocks, concatenated in time order with a
+    gap of at least one trial between blocks (see `trialTable`).
+
+    Parameters
+    ----------
+    onsets : numpy.ndarray
+        The (sorted) onset time of each trial.
+    responses : numpy.ndarray
+        The (sorted) time of each response.
+    isRare : numpy.ndarray of bool
+        Whether each trial is a rare (no-go) target.
+    transitionTime, trialTime : float or numpy.ndarray
+        The length of the transition period and of the whole trial, in
+        seconds (may be given per trial).
+    isFirst : numpy.ndarray of bool, optional
+        Whether each trial is the first of its block. Responses are never
+        assigned across blocks.
+
+    Returns
+    -------
+    numpy.ndarray
+        The time of the response assigned to each trial, or NaN if none.
+    """
+    onsets = np.asarray(onsets, dtype=float)
+    responses = np.asarray(responses, dtype=float)
+    isRare = np.asarray(isRare, dtype=bool)
+    numTrials = len(onsets)
+    tp = np.broadcast_to(np.asarray(transitionTime, dtype=float), numTrials)
+    period = np.broadcast_to(np.asarray(trialTime, dtype=float), numTrials)
+    if isFirst is None:
+        isFirst = np.zeros(numTrials, dtype=bool)
+        if numTrials > 0:
+            isFirst[0] = True
+    assigned = np.full(numTrials, np.nan)
+    if numTrials == 0 or len(responses) == 0:
+        return assigned
+
+    # The trial whose image transition started most recently before each
+    # response, and how far into that trial the response was made
+    k = np.searchsorted(onsets, responses, side="right") - 1
+    valid = k >= 0
+    responses, k = responses[valid], k[valid]
+    d = responses - onsets[k]
+    dFrac = d / tp[k]
+    hasPrev = ~isFirst[k]
+
+    # Responses after the last trial of a block's window are discarded
+    inWindow = d < period[k] + UNAMBIGUOUS_END * tp[k]
+
+    # Unambiguous responses: to the current trial, or to the previous trial
+    # before the current image is 40% coherent
+    toCurrent = inWindow & (dFrac >= UNAMBIGUOUS_START)
+    toPrev = (dFrac < UNAMBIGUOUS_END) & hasPrev
+    ambiguous = inWindow & ~toCurrent & ~toPrev
+
+    trial = np.where(toCurrent, k, np.where(toPrev, k - 1, -1))
+    _assignFirst(assigned, trial, responses)
+
+    # Ambiguous responses: assign to the free one of the previous and current
+    # trials, or by coherence and target type if both are free
+    prev = np.where(hasPrev, k - 1, k)
+    prevFree = np.isnan(assigned[prev]) & hasPrev
+    curFree = np.isnan(assigned[k])
+    preferCurrent = np.where(
+        isRare[prev] != isRare[k], isRare[prev], dFrac >= 0.5
+        )
+    choice = np.where(
+        prevFree & curFree,
+        np.where(preferCurrent, k, prev),
+        np.where(curFree, k, np.where(prevFree, prev, -1))
+        )
+    trial = np.where(ambiguous, choice, -1)
+    _assignFirst(assigned, trial, responses)
+    return assigned
+
+def _assignFirst(assigned, trial, responses):
+    # Assign the first of the responses mapped to each trial (-1 for none) to
+    # trials that do not have a response yet
+    mask = trial >= 0
+    trials, first = np.unique(trial[mask], return_index=True)
+    free = np.isnan(assigned[trials])
+    assigned[trials[free]] = responses[mask][first[free]]
+
+def trialTable(blocks):
+    """Get the behaviour in every trial of several blocks.
+
+    Parameters
+    ----------
+    blocks : Iterable of dict
+        The inputs of each block, as returned by `blockInputs`. Blocks that
+        are None are skipped.
+
+    Returns
+    -------
+    polars.DataFrame
+        One row per trial, with the columns "session_name", "block_name",
+        "trial" (index within the block), "target_type", "onset",
+        "responded", "rt_ms", "commission_error", "omission_error" and
+        "correct".
+    """
+    blocks = [b for b in blocks if b is not None]
+    columns = {
+        "session_name" : [], "block_name" : [], "trial" : [],
+        "target_type" : [], "onset" : []
+        }
+    onsets, responses, tp, period, isFirst = [], [], [], [], []
+
+    # Shift each block's times so that blocks follow each other, separated
+    # by a gap, and can be processed together
+    shift = 0.0
+    for block in blocks:
+        numTrials = min(len(block["onsets"]), len(block["target_types"]))
+        if numTrials == 0:
+            continue
+        blockOnsets = np.asarray(block["onsets"], dtype=float)[:numTrials]
+        trialTime = block["transition_time"] + block["static_time"]
+        
+        # Only responses during the block's trials can be assigned to them
+        blockEnd = (
+            blockOnsets[-1] + trialTime 
+            + UNAMBIGUOUS_END * block["transition_time"]
+            )
+        blockResponses = np.sort(np.asarray(block["responses"], dtype=float))
+        blockResponses = blockResponses[
+            (blockResponses >= blockOnsets[0]) & (blockResponses < blockEnd)
+            ]
+        
+        offset = shift - blockOnsets[0]
+        onsets.append(blockOnsets + offset)
+        responses.append(blockResponses + offset)
+        tp.append(np.full(numTrials, block["transition_time"]))
+        period.append(np.full(numTrials, trialTime))
+        first = np.zeros(numTrials, dtype=bool)
+        first[0] = True
+        isFirst.append(first)
+        shift += blockEnd - blockOnsets[0] + trialTime
+
+        columns["session_name"].extend([block["session_name"]] * numTrials)
+        columns["block_name"].extend([block["block_name"]] * numTrials)
+        columns["trial"].append(np.arange(numTrials))
+        columns["target_type"].append(
+            np.asarray(block["target_types"]).astype(str)[:numTrials]
+            )
+        columns["onset"].append(blockOnsets)
+
+    if len(onsets) == 0:
+        return pl.DataFrame(
+            schema={
+                "session_name" : pl.Utf8, "block_name" : pl.Utf8,
+                "trial" : pl.Int64, "target_type" : pl.Utf8,
+                "onset" : pl.Float64, "responded" : pl.Boolean,
+                "rt_ms" : pl.Float64, "commission_error" : pl.Boolean,
+                "omission_error" : pl.Boolean, "correct" : pl.Boolean
+                }
+            )
+
+    onsets = np.concatenate(onsets)
+    targetTypes = np.concatenate(columns["target_type"])
+    isRare = targetTypes == "rare"
+    responseTimes = assignResponses(
+        onsets,
+        np.concatenate(responses),
+        isRare,
+        np.concatenate(tp),
+        np.concatenate(period),
+        isFirst=np.concatenate(isFirst)
+        )
+
+    responded = ~np.isnan(responseTimes)
+    table = pl.DataFrame({
+        "session_name" : pl.Series(columns["session_name"], dtype=pl.Utf8),
+        "block_name" : pl.Series(columns["block_name"], dtype=pl.Utf8),
+        "trial" : np.concatenate(columns["trial"]),
+        "target_type" : targetTypes,
+        "onset" : np.concatenate(columns["onset"]),
+        "responded" : responded,
+        "rt_ms" : (responseTimes - onsets) * 1000,
+        "commission_error" : isRare & responded,
+        "omission_error" : ~isRare & ~responded,
+        "correct" : isRare != responded
+        })
+    return table.with_columns(pl.col("rt_ms").fill_nan(None))
+
+def blockSummary(trials, by=("session_name", "block_name")):
+    """Summarize behaviour per block (or any other grouping).
+
+    Parameters
+    ----------
+    trials : polars.DataFrame
+        The trials, as returned by `trialTable`.
+    by : tuple of str, default=("session_name", "block_name")
+        The columns to group trials by.
+
+    Returns
+    -------
+    polars.DataFrame
+        One row per group, with the number of trials ("num_trials",
+        "num_common", "num_rare"), the commission and omission error rates
+        ("commission_rate", "omission_rate"), the mean and coefficient of
+        variation of the reaction time to common targets ("mean_rt_ms",
+        "rt_cv"), "d_prime" and "criterion".
+    """
+    isCommon = pl.col("target_type") == "common"
+    isRare = pl.col("target_type") == "rare"
+    commonRT = pl.col("rt_ms").filter(isCommon & pl.col("responded"))
+    summary = trials.groupby(list(by), maintain_order=True).agg(
+        pl.count().alias("num_trials"),
+        isCommon.sum().alias("num_common"),
+        isRare.sum().alias("num_rare"),
+        (isCommon & pl.col("responded")).sum().alias("num_hits"),
+        pl.col("commission_error").sum().alias("num_false_alarms"),
+        pl.col("omission_error").sum().alias("num_omissions"),
+        commonRT.mean().alias("mean_rt_ms"),
+        (commonRT.std() / commonRT.mean()).alias("rt_cv")
+        )
+
+    # Rates with a log-linear correction, so that z-scores are finite
+    hitRate = (
+        (summary["num_hits"].to_numpy() + 0.5)
+        / (summary["num_common"].to_numpy() + 1)
+        )
+    faRate = (
+        (summary["num_false_alarms"].to_numpy() + 0.5)
+        / (summary["num_rare"].to_numpy() + 1)
+        )
+    zHit = ndtri(hitRate)
+    zFA = ndtri(faRate)
+    numCommon = summary["num_common"].to_numpy()
+    numRare = summary["num_rare"].to_numpy()
+    return summary.with_columns(
+        pl.Series(
+            "commission_rate",
+            summary["num_false_alarms"].to_numpy() / np.maximum(numRare, 1)
+            ),
+        pl.Series(
+            "omission_rate",
+            summary["num_omissions"].to_numpy() / np.maximum(numCommon, 1)
+            ),
+        pl.Series("d_prime", zHit - zFA),
+        pl.Series("criterion", -(zHit + zFA) / 2)
+        )
+
+def studyBehaviour(sessions):
+    """Get the behaviour of every block of several sessions at once.
+
+    Parameters
+    ----------
+    sessions : Iterable of GradCPTSession
+        Sessions (from `data_analysis.block`), eg. every session of a study.
+
+    Returns
+    -------
+    trials : polars.DataFrame
+        The behaviour in every trial (see `trialTable`).
+    summary : polars.DataFrame
+        The behaviour in every block (see `blockSummary`).
+    """
+    inputs = [
+        blockInputs(
+            block,
+            session.info["stim_transition_time_ms"],
+            session.info["stim_static_time_ms"],
+            sessionName=session.info["session_name"]
+            )
+        for session in sessions for block in session.blocks.values()
+        ]
+    trials = trialTable(inputs)
+    return trials, blockSummary(trials)
@@ -2,14 +2,34 @@ import json
 import csv
 import polars as pl
 import matplotlib.pyplot as plt
+from matplotlib.lines import Line2D
 import os
 import pyxdf
 import numpy as np
 
-from attention_monitoring.src.config import CONFIG
+from src.config import CONFIG
+from .alignment import alignStreams
+from .artifacts import detectArtifacts
+from .behaviour import studyBehaviour
+from .decimate import DecimatedLine
+from .epochs import Epochs, markerTimes
+from .filters import filterStream
+from .pipeline import DataPipe, fileFingerprint
+from .ppg import analyzePPG, windowMetrics
+from .viewer import ScrollViewer, SignalStore
+from .vtc import varianceTimeCourse
 
 # TODO: plot stim types as target or nontarget
-# TODO: calculate response times
+
+# The categories of markers plotted with a signal, as the marker stream, the
+# marker values (all values if None) and the color of the markers. Stimulus
+# onset is at the start of the transition period. Only one value is possible
+# in the response marker stream ('response').
+_MARKER_CATEGORIES = [
+    ('stimuli_marker_stream', ["transition_period_start"], 'r'),
+    ('stimuli_marker_stream', ["block_start", "block_stop"], 'y'),
+    ('response_marker_stream', None, 'g')
+    ]
 
 class GradCPTSession:
     def __init__(self, infoFile):
@@ -41,9 +61,43 @@ class GradCPTSession:
 
         return self.__blocks
 
+    def behaviour(self):
+        """Get the behaviour in every trial and block of this session.
+
+        Use `behaviour.studyBehaviour` to get the behaviour of several 
+        sessions at once.
+
+        Returns
+        -------
+        trials : polars.DataFrame
+            The reaction time and errors in every trial (see 
+            `behaviour.trialTable`).
+        summary : polars.DataFrame
+            Error rates, reaction time statistics, d′ and criterion for every
+            block (see `behaviour.blockSummary`).
+        """
+        return studyBehaviour([self])
+
+    def vtc(self, fwhm=9.0, truncate=3.0):
+        """Get the variance time course of every block of this session.
+
+        Parameters
+        ----------
+        fwhm, truncate : float, default=9.0, 3.0
+            Parameters of the Gaussian smoothing kernel (see 
+            `vtc.varianceTimeCourse`).
+
+        Returns
+        -------
+        polars.DataFrame
+            The behaviour, VTC and in/out of the zone state of every trial.
+        """
+        trials, _ = self.behaviour()
+        return varianceTimeCourse(trials, fwhm=fwhm, truncate=truncate)
+
     def display(
             self, fig=None, blockNames=[], signalType='eeg', channelNames=[], 
-            domain=[-np.inf, np.inf], rereferenceTime=True
+            domain=[-np.inf, np.inf], rereferenceTime=True, filters=None
             ):
 
         invalidBlocks = [b for b in blockNames if b not in self.blocks.keys()]
@@ -71,7 +125,8 @@ class GradCPTSession:
                 signalType=signalType,
                 channelNames=channelNames,
                 domain=domain,
-                rereferenceTime=rereferenceTime
+                rereferenceTime=rereferenceTime,
+                filters=filters
                 )
 
         _fig.suptitle(f"Session '{self.info['session_name']}'")
@@ -168,11 +223,15 @@ class GradCPTBlock:
     def data(self):
         if self.__data is None and self.dataFile is not None:
             if os.path.isfile(self.dataFile):
-                self.__data = self.__loadData(self.dataFile)
+                self.__data = self.loadData(self.dataFile)
         return self.__data
 
+    @data.setter
+    def data(self, val):
+        self.__data = val
+
     @classmethod
-    def __loadData(cls, dataFile):
+    def loadData(cls, dataFile, dejitter=True):
         """Load data from an xdf file created by a gradCPT session.
 
         Relevant data streams are returned in a dictionary after some 
@@ -182,6 +241,10 @@ class GradCPTBlock:
         ----------
         dataFile : str
             The file path to the data file to load.
+        dejitter : bool, default=True
+            Whether `pyxdf` should dejitter the time stamps of regularly
+            sampled streams. Use False to keep the recorded time stamps (eg.
+            to dejitter them with `alignment.dejitter` instead).
 
         Returns
         -------
@@ -194,7 +257,9 @@ class GradCPTBlock:
                 errno.ENOENT, "Specified data file cannot be found.", dataFile
                 )
 
-        data, header = pyxdf.load_xdf(dataFile)
+        data, header = pyxdf.load_xdf(
+            dataFile, dejitter_timestamps=dejitter
+            )
 
         dataStreams = {}
         markerStreamNames = ["response_marker_stream", "stimuli_marker_stream"]
@@ -224,10 +289,176 @@ class GradCPTBlock:
         """
         return pl.read_csv(self.stimSequenceFile)
 
+    def epochs(
+            self, marker="transition_period_start", tmin=-0.2, tmax=0.8,
+            signalType='eeg', baseline=None, asView=False, artifacts=None
+            ):
+        """Cut epochs out of a signal around a marker.
+
+        Parameters
+        ----------
+        marker : str, default="transition_period_start"
+            The marker to cut epochs around. "response" uses the response
+            marker stream, any other marker the stimuli marker stream.
+        tmin, tmax : float, default=-0.2, 0.8
+            The start and end of each epoch in seconds, relative to its
+            marker.
+        signalType : str, default='eeg'
+            The signal to cut epochs out of.
+        baseline : tuple of (float or None, float or None), optional
+            If specified, the baseline period used to baseline correct the
+            epochs (see `epochs.baselineCorrect`).
+        asView : bool, default=False
+            Whether to return the epochs as a view of the signal if possible
+            (see `epochs.gatherEpochs`).
+        artifacts : artifacts.Artifacts, optional
+            Artifacts detected in the signal (see `artifacts`). Epochs that
+            contain any are marked for rejection.
+
+        Returns
+        -------
+        Epochs or None
+            The epochs, or None if there is no data for this block.
+        """
+        if self.data is None:
+            return None
+
+        markerStream = (
+            self.data['response_marker_stream'] if marker == "response"
+            else self.data['stimuli_marker_stream']
+            )
+        sigData = self.data[signalType]
+        sigInfo = sigData['info']
+        channels = sigInfo['desc'][0]['channels'][0]['channel']
+        epochs = Epochs.fromSignal(
+            sigData['time_series'],
+            sigData['time_stamps'],
+            markerTimes(markerStream, marker),
+            tmin=tmin,
+            tmax=tmax,
+            srate=sigInfo.get('effective_srate') or None,
+            channelNames=[c['label'][0] for c in channels],
+            asView=asView
+            )
+        if artifacts is not None:
+            if artifacts.numSamples != len(sigData['time_stamps']):
+                raise ValueError(
+                    "The artifacts were not detected in this signal."
+                    )
+            epochs.markReject(sampleMask=artifacts.sampleMask())
+        if baseline is not None:
+            epochs.applyBaseline(baseline)
+        return epochs
+
+    def artifacts(self, signalType='eeg', **kwargs):
+        """Detect artifacts in a signal of this block.
+
+        Parameters
+        ----------
+        signalType : str, default='eeg'
+            The signal to detect artifacts in.
+        **kwargs
+            Passed to `artifacts.detectArtifacts` (eg. thresholds).
+
+        Returns
+        -------
+        artifacts.Artifacts or None
+            The artifacts, or None if there is no data for this block.
+        """
+        if self.data is None:
+            return None
+        return detectArtifacts(self.data, signalType=signalType, **kwargs)
+
+    def align(self, signalTypes=None, srate=None, **kwargs):
+        """Resample signals of this block onto a common timebase.
+
+        Parameters
+        ----------
+        signalTypes : list of str, optional
+            The signals to align (eg. `['eeg', 'ppg']`). Defaults to every
+            Muse signal of this block.
+        srate : float, optional
+            The rate of the common timebase. Defaults to the lowest nominal
+            rate of the signals.
+        **kwargs
+            Passed to `alignment.alignStreams` (eg. `method`,
+            `chunkDuration` or `out`).
+
+        Returns
+        -------
+        tuple of (numpy.ndarray, numpy.ndarray, list of str) or None
+            The common timebase, the aligned signals (one column per
+            channel) and the name of each column (see
+            `alignment.alignStreams`), or None if there is no data for this
+            block.
+        """
+        if self.data is None:
+            return None
+        return alignStreams(
+            self.data, signalTypes=signalTypes, srate=srate, **kwargs
+            )
+
+    def heartRate(self, trialWindow=None, **kwargs):
+        """Get the heart rate and HRV of this block from its PPG.
+
+        Parameters
+        ----------
+        trialWindow : tuple of (float, float), optional
+            If specified, the metrics are also computed over this window
+            (in seconds, relative to the stimulus onset) around each trial.
+        **kwargs
+            Passed to `ppg.analyzePPG`.
+
+        Returns
+        -------
+        dict or None
+            The beats and metrics of the block (see `ppg.analyzePPG`), and
+            if `trialWindow` is specified the metrics of each trial
+            ("trials", see `ppg.windowMetrics`). None if there is no PPG for
+            this block.
+        """
+        if self.data is None or 'ppg' not in self.data:
+            return None
+        result = analyzePPG(self.data['ppg'], **kwargs)
+        if trialWindow is not None:
+            onsets = markerTimes(self.data['stimuli_marker_stream'])
+            result["trials"] = windowMetrics(
+                result["beat_times"], result["ibi"], result["valid"],
+                onsets + trialWindow[0], onsets + trialWindow[1]
+                )
+        return result
+
+    def process(self):
+        """Apply this block's pipeline (`pipeline`) to its data.
+
+        Results are cached per step (see `pipeline.DataPipe`), keyed by the
+        data file and the actions in the pipe.
+
+        Returns
+        -------
+        Any
+            The processed data, or None if there is no data for this block.
+        """
+        if self.data is None:
+            return None
+        return self.pipeline.execute(
+            self.data, inputKey=fileFingerprint(self.dataFile)
+            )
+
     def display(
             self, fig=None, signalType='eeg', channelNames=[], 
-            domain=[-np.inf, np.inf], rereferenceTime=True
+            domain=[-np.inf, np.inf], rereferenceTime=True, filters=None
             ):
+        """Plot a signal of this block, with its markers.
+
+        Parameters
+        ----------
+        filters : "default" or list of tuple, optional
+            Filters to apply to the signal before plotting (see 
+            `filters.filterStream`). "default" uses the default filters for 
+            `signalType` (see `filters.defaultFilters`). If unspecified, only
+            the mean of each channel is subtracted.
+        """
 
         if self.data is None:
             print("No data to display")
@@ -285,74 +516,36 @@ class GradCPTBlock:
         plotter = BlockPlotter(self)
         _fig = fig if fig is not None else plt.figure(layout="constrained")
         gs = _fig.add_gridspec(numChannels, hspace=0)
-        axs = gs.subplots(sharex=True, sharey=True)
-
-        # Define callback that is applied to every plot
-        def baseCB(x, y):
-            x_, y_ = x, y
-            # Rereference time axis to common start time
-            x_ = x_ - startTime
-            # Only plot data within the specified domain
-            mask = np.logical_and(x_ >= domain[0], x_ <= domain[1])
-            x_ = x_[mask]
-            y_ = y_[mask]
-            return x_, y_
-
-        # Plot data for specified signal type
-        def sigCB(x, y):
-            x_, y_ = x, y
-            # Average reference channel
-            y_ = y_ - y_.mean()
-            return baseCB(x_, y_)   
-
-        for k in range(numChannels):
-            plotter.plotMuseSig(
-                axs[k], signalType, k, 
-                "b", 
-                callback=sigCB, 
-                linewidth=1
-                )
-
-        # Plot stimuli onset
-        def stimOnsetCB(x, y):
-            x_, y_ = x, y
-            # Stimulus onset is at the start of the transition period
-            mask = (y_ == "transition_period_start")
-            x_ = x_[mask]
-            y_ = y_[mask]
-            return baseCB(x_, y_)
+        axs = np.atleast_1d(gs.subplots(sharex=True, sharey=True))
 
-        for k in range(numChannels):
-            plotter.plotStimMarkers(
-                axs[k], 
-                callback=stimOnsetCB, 
-                color='r'
-                )
+        # Convert, rereference and mask each stream once, for all channels
+        def inDomain(x):
+            return np.logical_and(x >= domain[0], x <= domain[1])
 
-        # Plot block start and end
-        def blockTimeCB(x, y):
-            x_, y_ = x, y
-            mask = np.logical_or(y == "block_start", y == "block_stop")
-            x_ = x_[mask]
-            y_ = y_[mask]
-            return baseCB(x_, y_)
+        sigData = self.data[signalType]
+        x = np.asarray(sigData['time_stamps'], dtype=float).ravel() - startTime
+        channelIndices = [channel['index'] for channel in channels]
+        if filters is None:
+            # Average reference channel
+            y = np.asarray(sigData['time_series'])[:, channelIndices]
+            y = y - y.mean(axis=0)
+        else:
+            # Filter every channel of the signal at once
+            y = filterStream(
+                sigData,
+                signalType,
+                filters=None if filters == "default" else filters
+                )[:, channelIndices]
+        mask = inDomain(x)
+        x, y = x[mask], y[mask]
 
         for k in range(numChannels):
-            plotter.plotStimMarkers(
-                axs[k], 
-                callback=blockTimeCB, 
-                color='y'
-                )
+            plotter.plotSignal(axs[k], x, y[:, k], "b", linewidth=1)
 
-        # Plot response markers
-        for k in range(numChannels):
-            # Only one possible value in response marker stream ('response'),
-            # so no need to specify additional callbacks
-            plotter.plotResponseMarkers(
-                axs[k], 
-                callback=baseCB, 
-                color='g'
-                )
+        # Plot each category of markers once, on every channel
+        for streamName, values, color in _MARKER_CATEGORIES:
+            times = plotter.markerTimes(streamName, values) - startTime
+            plotter.plotMarkers(axs, times[inDomain(times)], color=color)
 
         # Label each channel
         for k in range(numChannels):
@@ -362,15 +555,87 @@ class GradCPTBlock:
         _fig.suptitle(f"Block '{self.name}'")
         _fig.supxlabel("Time (s)")
         _fig.supylabel(
-            f"{channels[0]['type'][0]}: Average Referenced ("
-            + f"{channels[0]['unit'][0]})"
+            f"{channels[0]['type'][0]}: "
+            + ("Average Referenced" if filters is None else "Filtered")
+            + f" ({channels[0]['unit'][0]})"
             )
 
         return _fig
 
+    def scroll(
+            self, storeDir, signalType='eeg', filters=None, width=10.0,
+            fig=None, rereferenceTime=True, **kwargs
+            ):
+        """Scroll through a signal of this block, with its markers.
+
+        The signal is first written to a memory-mapped store, which is then
+        viewed one window at a time (see `viewer.ScrollViewer`), so that long
+        recordings can be inspected without plotting them all at once.
+
+        Parameters
+        ----------
+        storeDir : str
+            The directory to write the store to (see `viewer.SignalStore`).
+        signalType : {'eeg', 'ppg', 'acc', 'gyr'}, default='eeg'
+            The signal to view.
+        filters : "default" or list of tuple, optional
+            Filters to apply to the signal (see `display`). The signal is
+            filtered in chunks directly into the store.
+        width : float, default=10.0
+            The width of the view, in seconds.
+        fig : matplotlib.figure.Figure, optional
+            The figure to plot on.
+        rereferenceTime : bool, default=True
+            Whether to plot times relative to the start of the block.
+        **kwargs
+            Passed to `viewer.ScrollViewer`.
+
+        Returns
+        -------
+        viewer.ScrollViewer
+            The viewer, which must be kept referenced while it is used.
+        """
+        if self.data is None:
+            print("No data to display")
+            return
+
+        sigData = self.data[signalType]
+        channelInfo = sigData['info']['desc'][0]['channels'][0]['channel']
+        timeSeries = np.asarray(sigData['time_series'])
+        store = SignalStore.create(
+            storeDir, sigData['time_stamps'], timeSeries.shape[1],
+            channelNames=[channel['label'][0] for channel in channelInfo]
+            )
+        if filters is None:
+            store.timeSeries[:] = timeSeries - timeSeries.mean(axis=0)
+        else:
+            filterStream(
+                sigData, signalType,
+                filters=None if filters == "default" else filters,
+                chunkSize=2**16, out=store.timeSeries
+                )
+        store.close()
+
+        plotter = BlockPlotter(self)
+        markers = [
+            (plotter.markerTimes(streamName, values), {'color' : color})
+            for streamName, values, color in _MARKER_CATEGORIES
+            ]
+        startTime = (
+            0 if not rereferenceTime
+            else min(np.min(x['time_stamps']) for x in self.data.values())
+            )
+        viewer = ScrollViewer(
+            SignalStore(storeDir), markers=markers, width=width, fig=fig,
+            startTime=startTime, **kwargs
+            )
+        viewer.fig.suptitle(f"Block '{self.name}'")
+        return viewer
+
 class BlockPlotter:
     def __init__(self, block):
         self.block = block
+        self.__markerCategories = {}
 
     def __validateData(self):
         dataExists = self.block.data is not None
@@ -379,7 +644,17 @@ class BlockPlotter:
         return dataExists
 
 
-    def plotMuseSig(self, ax, signalType, channel, *args, callback=None, **kwargs):
+    def plotMuseSig(
+            self, ax, signalType, channel, *args, callback=None, decimate=True,
+            **kwargs
+            ):
+        """Plot a channel of a signal.
+
+        If `decimate` is True, the signal is decimated to the width of the
+        axis, and decimated again for the visible range whenever the axis is
+        zoomed or panned (see `decimate.DecimatedLine`), which keeps peaks
+        visible while only plotting a few points per pixel.
+        """
         if self.__validateData():
             sigData = self.block.data[signalType]
             x = np.array(sigData['time_stamps']).flatten()
@@ -387,160 +662,136 @@ class BlockPlotter:
             if callback is not None:
                 x, y = callback(x, y)
 
+            if decimate:
+                return DecimatedLine(ax, x, y, *args, **kwargs)
             ax.plot(x, y, *args, **kwargs)
 
-    def plotStimMarkers(self, ax, callback=None, **kwargs):
-        if self.__validateData():
-            stimData = self.block.data['stimuli_marker_stream']
-            x = np.array(stimData['time_stamps']).flatten()
-            y = np.array(stimData['time_series']).flatten()
-            if callback is not None:
-                x, y = callback(x, y)
-
-            # TODO: fix height of markers
-            ylim = ax.get_ylim()
-            ax.vlines(x, ylim[0], ylim[1], **kwargs)
-
-    def plotResponseMarkers(self, ax, callback=None, **kwargs):
-        if self.__validateData():
-            stimData = self.block.data['response_marker_stream']
-            x = np.array(stimData['time_stamps']).flatten()
-            y = np.array(stimData['time_series']).flatten()
-            if callback is not None:
-                x, y = callback(x, y)
-
-            ylim = ax.get_ylim()
-            ax.vlines(x, ylim[0], ylim[1], **kwargs)
-
-
-
-
-
+    def plotSignal(self, ax, x, y, *args, decimate=True, **kwargs):
+        """Plot a signal that has already been converted to arrays.
 
+        Unlike `plotMuseSig`, the time stamps and samples are not converted
+        again for each plot, so `x` can be shared by every channel.
 
+        Parameters
+        ----------
+        ax : matplotlib.axes.Axes
+            The axis to plot on.
+        x, y : numpy.ndarray
+            The time of each sample and the (1D) signal.
+        decimate : bool, default=True
+            See `plotMuseSig`.
+        *args, **kwargs
+            Passed to `ax.plot`.
+        """
+        if decimate:
+            return DecimatedLine(ax, x, y, *args, **kwargs)
+        ax.plot(x, y, *args, **kwargs)
 
+    def markerCategories(self, streamName):
+        """Encode the markers of a stream as categories.
 
-class DataPipe:
-    """Data analysis pipeline
-    
-    Maintains a list of "actions" that can be applied to data from a gradCPT
-    session. An action consists of a unique name and a function that accepts
-    gradCPT data as input, processes it in some way, and returns the 
-    (potentially) modified gradCPT data. The pipeline follows the same
-    structure as a `list`. When executed, each action in the pipe will be
-    applied to the specified data in sequential order.
+        The encoding is computed once per stream, so that selecting markers
+        by value does not compare strings over the whole stream each time.
 
-    To use, create a `DataPipe` object, add or remove actions to the pipe 
-    (`add`, `remove`, `clear`), and apply to gradCPT data (`execute`). The
-    pipe's contents can be obtained using `actions`, and a list of valid
-    actions can be obtained using `DataPipe.validActions`.
+        Parameters
+        ----------
+        streamName : {'stimuli_marker_stream', 'response_marker_stream'}
+            The marker stream.
 
-    Attributes
-    ----------
-    actions : list of tuple
-        Names and descriptions of all actions in the pipe.
-    """
+        Returns
+        -------
+        times : numpy.ndarray
+            The time stamp of each marker.
+        codes : numpy.ndarray
+            The index in `categories` of the value of each marker.
+        categories : numpy.ndarray
+            The (sorted) unique values of the markers.
+        """
+        if streamName not in self.__markerCategories:
+            markerData = self.block.data[streamName]
+            times = np.asarray(markerData['time_stamps'], dtype=float).ravel()
+            values = np.asarray(markerData['time_series'], dtype=str).ravel()
+            categories, codes = np.unique(values, return_inverse=True)
+            self.__markerCategories[streamName] = (
+                times, codes.ravel(), categories
+                )
+        return self.__markerCategories[streamName]
 
-    # TODO fix this
-    # Stores: {str : action name -> method : function to create action object}
-    __validActions = {
-        # "mean" : __DataPipe__mean
-        }
+    def markerTimes(self, streamName, values=None):
+        """Get the times of the markers of a stream with the given values.
 
-    def __init__(self):
-        self._pipe = []
+        Parameters
+        ----------
+        streamName : {'stimuli_marker_stream', 'response_marker_stream'}
+            The marker stream.
+        values : list of str, optional
+            The values of the markers to get. If unspecified, every marker is
+            returned.
 
-    def validActions():
-        """Get a list of all valid action names and their documentation."""
-        return [(name, func.__doc__) for name, func in __validActions.items()]
+        Returns
+        -------
+        numpy.ndarray
+            The time stamps of the markers.
+        """
+        times, codes, categories = self.markerCategories(streamName)
+        if values is None:
+            return times
+        return times[np.isin(codes, np.flatnonzero(np.isin(categories, values)))]
 
-    @property
-    def actions(self):
-        """Names and descriptions of all actions in the pipe."""
-        return [(action.name, action.desc) for action in self._pipe]
+    def plotMarkers(self, axs, times, **kwargs):
+        """Plot markers as vertical lines spanning the height of each axis.
 
-    def add(self, action, position=-1, *args, **kwargs):
-        """Add an action to the pipe.
+        The markers are drawn as a single line on each axis, whose segments
+        are separated by NaNs, which Agg draws much faster than a collection
+        of as many segments. The segments are positioned in axis coordinates
+        vertically, so they always span the axis even when its y limits
+        change.
 
         Parameters
         ----------
-        action : str
-            The action to add. Must be a valid action.
-        position : int, default=-1
-            The index in the pipe where the action should be added (follows
-            `list` inexing). Behaviour is equivalent to that of the `insert`
-            method for python lists.
-        *args
-            Positional arguments required by action.
+        axs : matplotlib.axes.Axes or Iterable of matplotlib.axes.Axes
+            The axes to plot on.
+        times : numpy.ndarray
+            The time of each marker.
         **kwargs
-            Keyword arguments required by action.
+            Passed to `matplotlib.lines.Line2D`.
 
         Returns
         -------
-        self
-            The `DataPipe` object that called this method. Allows consecutive
-            calls to `add` to be chained together.
+        list of matplotlib.lines.Line2D
+            The markers plotted on each axis.
         """
-        if __isValidAction(action):
-            actionMaker = __validActions[action]
-            _action = actionMaker(*args, **kwargs)
-            self._pipe.insert(position, _action)
-        else:
-            raise ValueError(f"Invalid Action: {action}")
+        times = np.asarray(times, dtype=float).ravel()
+        x = np.repeat(times, 3)
+        x[2::3] = np.nan
+        y = np.tile([0.0, 1.0, np.nan], len(times))
+
+        lines = []
+        for ax in np.atleast_1d(axs):
+            line = Line2D(x, y, transform=ax.get_xaxis_transform(), **kwargs)
+            ax.add_line(line)
+            lines.append(line)
+        return lines
 
-        return self
-
-    def remove(self, position):
-        """Remove an action from the pipe.
-
-        Paramaters
-        ----------
-        position : int
-            The index in the pipe of the action to remove (follows `list` 
-            indexing).
-        """
-        self._pipe.pop(position)
+    def plotStimMarkers(self, ax, callback=None, **kwargs):
+        if self.__validateData():
+            stimData = self.block.data['stimuli_marker_stream']
+            x = np.array(stimData['time_stamps']).flatten()
+            y = np.array(stimData['time_series']).flatten()
+            if callback is not None:
+                x, y = callback(x, y)
 
-    def clear(self):
-        """Remove all members from the pipe."""
-        self._pipe = []
+            # TODO: fix height of markers
+            ylim = ax.get_ylim()
+            ax.vlines(x, ylim[0], ylim[1], **kwargs)
 
-    def execute(self, data):
-        """Execute the pipe on the specified gradCPT data. 
-        
-        Each action in the pipe is applied to the data in sequential order
-        starting at the front of the pipe (in order of increasing index).
-        """
-        _data = data
-        for action in self._pipe:
-            _data = action.execute(_data)
-        return _data
-    
-    def __isValidAction(action):
-        """Check whether the specified action is valid."""
-        return action in __validActions
-
-    def __mean(dim=1):
-        """"Average the data.
+    def plotResponseMarkers(self, ax, callback=None, **kwargs):
+        if self.__validateData():
+            stimData = self.block.data['response_marker_stream']
+            x = np.array(stimData['time_stamps']).flatten()
+            y = np.array(stimData['time_series']).flatten()
+            if callback is not None:
+                x, y = callback(x, y)
 
-        Parameters
-        ----------
-        dim : int, default=1
-            The dimension along which to operate.
-        """
-        desc = {"dim" : dim}
-        def mean(data):
-            # use dim as a constant here
-            pass
-        meanAction = __Action("mean", mean, desc=desc)
-        return meanAction
-
-    class __Action:
-        def __init__(self, name, func, desc=None):
-            self.name = name
-            self.func = func
-            self.desc = desc if desc is not None else ""
-
-        def execute(self, data):
-            return self.func(data)
-        
\ No newline at end of file
+            ylim = ax.get_ylim()
+            ax.vlines(x, ylim[0], ylim[1], **kwargs)
@@ -0,0 +1,194 @@
+"""Decimation of long signals for plotting.
+
+Plotting every sample of a long recording is slow to render and to pan and
+zoom, but plotting every n-th sample hides peaks (eg. blinks). Instead, the
+signal is reduced to the minimum and maximum of the samples falling into
+each horizontal pixel, which looks the same as plotting every sample.
+
+A `MinMaxPyramid` precomputes the minimum and maximum of blocks of samples at
+several resolutions, so that the envelope of any range of the signal can be
+computed from at most a few samples per pixel, regardless of the length of
+the range. A `DecimatedLine` plots a signal on a matplotlib axis and
+recomputes its envelope for the visible range whenever the x limits change
+(eg. when zooming or panning).
+"""
+import numpy as np
+
+class MinMaxPyramid:
+    """Minimum and maximum of a signal over blocks of samples, at several
+    resolutions.
+
+    Level `l` of the pyramid stores the minimum and maximum of each block of
+    `factor ** l` consecutive samples (level 0 is the signal itself).
+
+    Parameters
+    ----------
+    x : numpy.ndarray
+        The (sorted) time of each sample.
+    y : numpy.ndarray
+        The signal, with shape `(samples,)` or `(samples, channels)`. All
+        channels are decimated together.
+    factor : int, default=4
+        The number of blocks of each level in a block of the next level.
+    minSize : int, default=256
+        Levels with fewer blocks than this are not computed.
+    """
+    def __init__(self, x, y, factor=4, minSize=256):
+        self.x = np.asarray(x, dtype=float)
+        y = np.asarray(y)
+        self.is1D = y.ndim == 1
+        y = y[:, np.newaxis] if self.is1D else y
+        if len(self.x) != len(y):
+            raise ValueError(
+                f"x and y must have the same length: {len(self.x)}, {len(y)}"
+                )
+        self.factor = factor
+        self.mins = [y]
+        self.maxs = [y]
+
+        # Each level from the previous one, padding the last block with the
+        # last value of the previous level
+        while len(self.mins[-1]) >= factor * minSize:
+            prevMin, prevMax = self.mins[-1], self.maxs[-1]
+            pad = -len(prevMin) % factor
+            if pad > 0:
+                prevMin = np.concatenate(
+                    (prevMin, np.repeat(prevMin[-1:], pad, axis=0))
+                    )
+                prevMax = np.concatenate(
+                    (prevMax, np.repeat(prevMax[-1:], pad, axis=0))
+                    )
+            shape = (-1, factor, y.shape[1])
+            self.mins.append(prevMin.reshape(shape).min(axis=1))
+            self.maxs.append(prevMax.reshape(shape).max(axis=1))
+
+    @property
+    def numLevels(self):
+        return len(self.mins)
+
+    def __len__(self):
+        return len(self.x)
+
+    def query(self, xmin=-np.inf, xmax=np.inf, numBins=1000):
+        """Get the min/max envelope of part of the signal.
+
+        Parameters
+        ----------
+        xmin, xmax : float
+            The range of the signal to get (eg. the x limits of an axis). One
+            sample on either side of the range is included, so that lines
+            reach the edges of the axis.
+        numBins : int, default=1000
+            The number of bins to divide the range into (eg. the width of
+            the axis in pixels).
+
+        Returns
+        -------
+        x : numpy.ndarray
+            The time of each point of the envelope.
+        y : numpy.ndarray
+            The value of each point, with shape `(points,)` or `(points,
+            channels)` (like the signal). If the range contains at most two
+            samples per bin, these are the samples themselves. Otherwise,
+            each bin is represented by its minimum (at the time of its first
+            sample) and maximum (at the time of its last sample).
+        """
+        n = len(self.x)
+        start = max(np.searchsorted(self.x, xmin, side="left") - 1, 0)
+        stop = min(np.searchsorted(self.x, xmax, side="right") + 1, n)
+        numSamples = stop - start
+        if numSamples <= 2 * numBins:
+            return self.x[start:stop], self.__out(self.mins[0][start:stop])
+
+        # The coarsest level with at least one block per bin
+        level = 0
+        while (
+                level + 1 < self.numLevels
+                and numSamples / self.factor ** (level + 1) >= numBins
+                ):
+            level += 1
+        blockSize = self.factor ** level
+        first = start // blockSize
+        last = min(-(-stop // blockSize), len(self.mins[level]))
+        mins = self.mins[level][first:last]
+        maxs = self.maxs[level][first:last]
+
+        # Combine the blocks into bins
+        edges = np.unique(
+            np.linspace(0, last - first, numBins + 1).astype(np.intp)
+            )
+        binStarts = edges[:-1]
+        binMins = np.minimum.reduceat(mins, binStarts, axis=0)
+        binMaxs = np.maximum.reduceat(maxs, binStarts, axis=0)
+        xStart = self.x[np.minimum((first + binStarts) * blockSize, n - 1)]
+        xEnd = self.x[np.minimum((first + edges[1:]) * blockSize, n) - 1]
+
+        x = np.empty(2 * len(binStarts))
+        x[0::2] = xStart
+        x[1::2] = xEnd
+        y = np.empty((2 * len(binStarts), binMins.shape[1]), dtype=binMins.dtype)
+        y[0::2] = binMins
+        y[1::2] = binMaxs
+        return x, self.__out(y)
+
+    def __out(self, y):
+        return y[:, 0] if self.is1D else y
+
+class DecimatedLine:
+    """A line plot of a long signal that is decimated to the axis' width.
+
+    The envelope of the visible part of the signal (see
+    `MinMaxPyramid.query`) is plotted, and replotted whenever the x limits
+    of the axis change.
+
+    Parameters
+    ----------
+    ax : matplotlib.axes.Axes
+        The axis to plot on.
+    x, y : numpy.ndarray
+        The time of each sample and the (1D) signal.
+    *args, **kwargs
+        Passed to `ax.plot`.
+    pyramid : MinMaxPyramid, optional
+        A pyramid of the signal, if one has already been computed.
+    binsPerPixel : float, default=1.0
+        The number of bins per horizontal pixel of the axis.
+
+    Attributes
+    ----------
+    line : matplotlib.lines.Line2D
+        The plotted line.
+    """
+    def __init__(
+            self, ax, x, y, *args, pyramid=None, binsPerPixel=1.0, **kwargs
+            ):
+        self.ax = ax
+        self.pyramid = pyramid if pyramid is not None else MinMaxPyramid(x, y)
+        self.binsPerPixel = binsPerPixel
+        xs, ys = self.pyramid.query(numBins=self.__numBins())
+        self.line, = ax.plot(xs, ys, *args, **kwargs)
+
+        # A closure rather than a bound method, as the callback registry
+        # only keeps weak references to bound methods
+        self.__cid = ax.callbacks.connect(
+            "xlim_changed", lambda _: self.update()
+            )
+
+    def __numBins(self):
+        width = self.ax.bbox.width if self.ax.bbox is not None else 0
+        return max(int(width * self.binsPerPixel), 100)
+
+    def update(self):
+        """Replot the envelope of the visible part of the signal.
+
+        The figure is not redrawn, as this is called while the x limits
+        change, before the figure is redrawn with the new limits.
+        """
+        xmin, xmax = sorted(self.ax.get_xlim())
+        xs, ys = self.pyramid.query(xmin, xmax, self.__numBins())
+        self.line.set_data(xs, ys)
+
+    def remove(self):
+        """Remove the line from its axis and stop updating it."""
+        self.ax.callbacks.disconnect(self.__cid)
+        self.line.remove()
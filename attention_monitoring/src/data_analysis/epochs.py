@@ -0,0 +1,374 @@
+"""Cutting trials ("epochs") out of continuous signals around markers.
+
+Every step is vectorized over trials and channels: epoch start indices are
+found with a single `np.searchsorted` against the signal's timestamps, the
+`(trials, channels, samples)` array is built with a single gather (or, when
+the epochs are evenly spaced, as a zero-copy strided view of the signal),
+and baseline correction and rejection operate on whole arrays at once.
+"""
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+
+def markerTimes(markerStream, marker="transition_period_start"):
+    """Get the timestamps of a marker in a marker stream.
+
+    Parameters
+    ----------
+    markerStream : dict
+        A marker stream loaded by `pyxdf` (eg. the "stimuli_marker_stream").
+    marker : str, default="transition_period_start"
+        The marker to get the timestamps of.
+
+    Returns
+    -------
+    numpy.ndarray
+        The timestamps of every occurrence of `marker`, in order.
+    """
+    values = np.asarray(markerStream['time_series']).ravel()
+    timestamps = np.asarray(markerStream['time_stamps']).ravel()
+    return timestamps[values == marker]
+
+def estimateSampleRate(timestamps):
+    """Estimate the sample rate of a signal from its timestamps."""
+    timestamps = np.asarray(timestamps)
+    if len(timestamps) < 2:
+        raise ValueError("At least two timestamps are needed.")
+    return (len(timestamps) - 1) / (timestamps[-1] - timestamps[0])
+
+def epochStarts(timestamps, eventTimes, tmin, numSamples):
+    """Get the index of the first sample of each epoch.
+
+    Parameters
+    ----------
+    timestamps : numpy.ndarray
+        The (sorted) timestamps of the signal's samples.
+    eventTimes : numpy.ndarray
+        The time of each event to cut an epoch around.
+    tmin : float
+        The start of each epoch in seconds, relative to its event.
+    numSamples : int
+        The number of samples in each epoch.
+
+    Returns
+    -------
+    starts : numpy.ndarray of int
+        The index of the first sample of each epoch, for every event.
+    valid : numpy.ndarray of bool
+        Whether each epoch lies entirely within the signal.
+    """
+    timestamps = np.asarray(timestamps)
+    eventTimes = np.asarray(eventTimes, dtype=float)
+    starts = np.searchsorted(timestamps, eventTimes + tmin, side="left")
+    valid = (
+        (eventTimes + tmin >= timestamps[0])
+        & (starts + numSamples <= len(timestamps))
+        )
+    return starts, valid
+
+def gatherEpochs(data, starts, numSamples, asView=False):
+    """Build an array of epochs from a signal.
+
+    Parameters
+    ----------
+    data : numpy.ndarray
+        The signal, with shape `(samples, channels)` (as loaded by `pyxdf`).
+    starts : numpy.ndarray of int
+        The index of the first sample of each epoch. All epochs must lie
+        within the signal.
+    numSamples : int
+        The number of samples in each epoch.
+    asView : bool, default=False
+        If True and the epochs are evenly spaced, return a read-only strided
+        view of `data` instead of a copy (no data is copied). Otherwise, the
+        epochs are copied.
+
+    Returns
+    -------
+    numpy.ndarray
+        The epochs, with shape `(trials, channels, samples)`.
+    """
+    data = np.asarray(data)
+    if data.ndim == 1:
+        data = data[:, np.newaxis]
+    starts = np.asarray(starts, dtype=np.intp)
+    numTrials = len(starts)
+    numChannels = data.shape[1]
+
+    if asView and numTrials > 0:
+        steps = np.diff(starts)
+        if numTrials == 1 or np.all(steps == steps[0]):
+            step = steps[0] if numTrials > 1 else 0
+            sampleStride, channelStride = data.strides
+            return as_strided(
+                data[starts[0]:],
+                shape=(numTrials, numChannels, numSamples),
+                strides=(step * sampleStride, channelStride, sampleStride),
+                writeable=False
+                )
+
+    # Gather every epoch of every channel at once from a channel-major copy
+    # of the signal, then arrange as (trials, channels, samples)
+    dataT = np.ascontiguousarray(data.T)
+    index = starts[:, np.newaxis] + np.arange(numSamples)[np.newaxis, :]
+    epochs = np.take(dataT, index, axis=1)
+    return np.ascontiguousarray(epochs.transpose(1, 0, 2))
+
+def baselineCorrect(epochs, times, baseline=(None, 0), inplace=False):
+    """Subtract the mean of a baseline period from each epoch and channel.
+
+    Parameters
+    ----------
+    epochs : numpy.ndarray
+        The epochs, with shape `(trials, channels, samples)`.
+    times : numpy.ndarray
+        The time of each sample of an epoch, relative to its event.
+    baseline : tuple of (float or None, float or None), default=(None, 0)
+        The start and end of the baseline period in seconds. None means the
+        start or end of the epoch, respectively.
+    inplace : bool, default=False
+        Whether to modify `epochs` in place. Not possible for views returned
+        by `gatherEpochs`.
+
+    Returns
+    -------
+    numpy.ndarray
+        The baseline corrected epochs.
+    """
+    start = times[0] if baseline[0] is None else baseline[0]
+    stop = times[-1] if baseline[1] is None else baseline[1]
+    mask = (times >= start) & (times <= stop)
+    if not mask.any():
+        raise ValueError(f"No samples in the baseline period: {baseline}")
+    means = epochs[..., mask].mean(axis=-1, keepdims=True)
+    if inplace:
+        epochs -= means
+        return epochs
+    return epochs - means
+
+def peakToPeakMask(epochs, maxPeakToPeak=None, minPeakToPeak=None):
+    """Find epochs to reject based on their peak-to-peak amplitude.
+
+    Parameters
+    ----------
+    epochs : numpy.ndarray
+        The epochs, with shape `(trials, channels, samples)`.
+    maxPeakToPeak : float or numpy.ndarray, optional
+        Epochs in which any channel's peak-to-peak amplitude exceeds this are
+        rejected (eg. blinks). May be given per channel.
+    minPeakToPeak : float or numpy.ndarray, optional
+        Epochs in which any channel's peak-to-peak amplitude is below this are
+        rejected (eg. flat or disconnected channels). May be given per
+        channel.
+
+    Returns
+    -------
+    numpy.ndarray of bool
+        Whether each epoch should be rejected.
+    """
+    ptp = np.ptp(epochs, axis=-1)
+    reject = np.zeros(epochs.shape[0], dtype=bool)
+    if maxPeakToPeak is not None:
+        reject |= (ptp > maxPeakToPeak).any(axis=-1)
+    if minPeakToPeak is not None:
+        reject |= (ptp < minPeakToPeak).any(axis=-1)
+    return reject
+
+def sampleMaskToTrialMask(sampleMask, starts, numSamples):
+    """Find the epochs that contain any flagged sample.
+
+    Uses a cumulative sum over the sample mask, so the cost does not depend
+    on the length of the epochs.
+
+    Parameters
+    ----------
+    sampleMask : numpy.ndarray of bool
+        Whether each sample of the signal is flagged (eg. as an artifact).
+    starts : numpy.ndarray of int
+        The index of the first sample of each epoch.
+    numSamples : int
+        The number of samples in each epoch.
+
+    Returns
+    -------
+    numpy.ndarray of bool
+        Whether each epoch contains a flagged sample.
+    """
+    counts = np.concatenate(([0], np.cumsum(sampleMask, dtype=np.int64)))
+    starts = np.asarray(starts, dtype=np.intp)
+    return counts[starts + numSamples] - counts[starts] > 0
+
+class Epochs:
+    """Trials cut out of a signal around a set of events.
+
+    Use `Epochs.fromSignal` to create epochs from a signal and event times.
+
+    Parameters
+    ----------
+    data : numpy.ndarray
+        The epochs, with shape `(trials, channels, samples)`.
+    times : numpy.ndarray
+        The time of each sample of an epoch in seconds, relative to its event.
+    eventTimes : numpy.ndarray
+        The time of the event of each epoch.
+    srate : float
+        The sample rate of the signal.
+    channelNames : list of str, optional
+        The name of each channel.
+    starts : numpy.ndarray of int, optional
+        The index in the signal of the first sample of each epoch.
+    events : numpy.ndarray of int, optional
+        The index of the event of each epoch among the events the epochs
+        were cut around (see `fromSignal`, which drops some events).
+        Defaults to the index of each epoch.
+
+    Attributes
+    ----------
+    reject : numpy.ndarray of bool
+        Whether each epoch has been marked for rejection (see `markReject`).
+    """
+    def __init__(
+            self, data, times, eventTimes, srate, channelNames=None,
+            starts=None, events=None
+            ):
+        self.data = data
+        self.times = times
+        self.eventTimes = eventTimes
+        self.srate = srate
+        self.channelNames = (
+            channelNames if channelNames is not None
+            else [str(k) for k in range(data.shape[1])]
+            )
+        self.starts = starts
+        self.events = (
+            np.arange(data.shape[0]) if events is None else events
+            )
+        self.reject = np.zeros(data.shape[0], dtype=bool)
+
+    @classmethod
+    def fromSignal(
+            cls, data, timestamps, eventTimes, tmin=-0.2, tmax=0.8,
+            srate=None, channelNames=None, asView=False
+            ):
+        """Cut epochs out of a signal around the specified events.
+
+        Events whose epochs do not lie entirely within the signal are
+        dropped.
+
+        Parameters
+        ----------
+        data : numpy.ndarray
+            The signal, with shape `(samples, channels)`.
+        timestamps : numpy.ndarray
+            The (sorted) timestamps of the signal's samples.
+        eventTimes : numpy.ndarray
+            The time of each event (eg. from `markerTimes`).
+        tmin, tmax : float, default=-0.2, 0.8
+            The start and end of each epoch in seconds, relative to its event.
+        srate : float, optional
+            The sample rate of the signal. Estimated from `timestamps` if
+            unspecified.
+        channelNames : list of str, optional
+            The name of each channel.
+        asView : bool, default=False
+            Whether to return the epochs as a view of the signal if possible
+            (see `gatherEpochs`).
+
+        Returns
+        -------
+        Epochs
+        """
+        if tmax <= tmin:
+            raise ValueError(f"tmax ({tmax}) must be greater than tmin ({tmin})")
+        timestamps = np.asarray(timestamps).ravel()
+        eventTimes = np.asarray(eventTimes, dtype=float).ravel()
+        srate = estimateSampleRate(timestamps) if srate is None else srate
+        firstSample = int(np.round(tmin * srate))
+        numSamples = int(np.round(tmax * srate)) - firstSample
+        times = (firstSample + np.arange(numSamples)) / srate
+
+        starts, valid = epochStarts(
+            timestamps, eventTimes, firstSample / srate, numSamples
+            )
+        starts = starts[valid]
+        epochs = gatherEpochs(data, starts, numSamples, asView=asView)
+        return cls(
+            epochs, times, eventTimes[valid], srate,
+            channelNames=channelNames, starts=starts,
+            events=np.flatnonzero(valid)
+            )
+
+    @classmethod
+    def concatenate(cls, epochsList):
+        """Concatenate epochs (eg. from several sessions) along trials.
+
+        The epochs must have the same times and channels. Start indices are
+        not kept, as they refer to different signals.
+        """
+        first = epochsList[0]
+        for other in epochsList[1:]:
+            if (
+                    len(other.times) != len(first.times)
+                    or other.channelNames != first.channelNames
+                    ):
+                raise ValueError(
+                    "Epochs must have the same times and channels."
+                    )
+        out = cls(
+            np.concatenate([e.data for e in epochsList]),
+            first.times,
+            np.concatenate([e.eventTimes for e in epochsList]),
+            first.srate,
+            channelNames=first.channelNames,
+            events=np.concatenate([e.events for e in epochsList])
+            )
+        out.reject = np.concatenate([e.reject for e in epochsList])
+        return out
+
+    @property
+    def numTrials(self):
+        return self.data.shape[0]
+
+    def applyBaseline(self, baseline=(None, 0)):
+        """Baseline correct the epochs (see `baselineCorrect`).
+
+        Returns
+        -------
+        self
+        """
+        self.data = baselineCorrect(
+            self.data, self.times, baseline,
+            inplace=self.data.flags.writeable
+            )
+        return self
+
+    def markReject(
+            self, maxPeakToPeak=None, minPeakToPeak=None, sampleMask=None
+            ):
+        """Mark epochs for rejection.
+
+        Parameters
+        ----------
+        maxPeakToPeak, minPeakToPeak : float or numpy.ndarray, optional
+            Peak-to-peak amplitude limits (see `peakToPeakMask`).
+        sampleMask : numpy.ndarray of bool, optional
+            Flagged samples of the signal the epochs were cut from (see
+            `sampleMaskToTrialMask`). Epochs containing any are rejected.
+
+        Returns
+        -------
+        numpy.ndarray of bool
+            Whether each epoch is marked for rejection (also stored in
+            `reject`).
+        """
+        self.reject |= peakToPeakMask(self.data, maxPeakToPeak, minPeakToPeak)
+        if sampleMask is not None:
+            if self.starts is None:
+                raise ValueError("Start indices of the epochs are unknown.")
+            self.reject |= sampleMaskToTrialMask(
+                sampleMask, self.starts, len(self.times)
+                )
+        return self.reject
+
+    def kept(self):
+        """Get the epochs that are not marked for rejection."""
+        return self.data[~self.reject]
@@ -0,0 +1,590 @@
+"""Persistent store of per-trial features of every block of a study.
+
+A `FeatureStore` is a directory of Parquet files, one per block, partitioned
+by study, session and block:
+
+    [store]/study=[study]/session=[session name]/block=[block name]/
+        trials.parquet
+        provenance.json
+
+Each row of `trials.parquet` is a trial, identified by the columns "study",
+"session_name", "participant_id", "block_name" and "trial", with:
+
+- Its behaviour (see `behaviour.trialTable`) and VTC (see
+  `vtc.varianceTimeCourse`).
+- The EEG features of its epoch (columns "eeg_[channel]_[feature]", see
+  `features`, and "eeg_reject" if the epoch contains artifacts), computed
+  with a `pipeline.DataPipe`.
+- The heart rate and HRV in a window around it (columns "ppg_[metric]", see
+  `ppg.windowMetrics`).
+
+The features are computed as they are during a run (see `trialFeatures`),
+so that a model trained on the store gets the same features live: the
+pipeline is applied to a short window of EEG around each trial, and heart
+beats are detected with a causal filter.
+
+`provenance.json` records how the partition was computed: the input files
+(data file and stimulus sequence) with their size, modification time and
+hash, the pipeline and settings, and the version of the store's format. As
+for `summary.summarizeStudy`, `FeatureStore.update` only recomputes the
+partitions of blocks that are new, or whose inputs or settings have changed,
+and partitions are replaced only once they have been written completely.
+
+`FeatureStore.scan` returns a lazy frame over any subset of partitions, so
+queries only read the partitions, columns and row groups they need (filters
+are pushed down to every file).
+"""
+import json
+import os
+import shutil
+from datetime import datetime
+from urllib.parse import quote, unquote
+
+import numpy as np
+import polars as pl
+
+from .alignment import nominalRate
+from .behaviour import blockInputs, trialTable
+from .block import GradCPTBlock
+from .epochs import markerTimes
+from .pipeline import DataPipe
+from .ppg import replayPPG, windowMetrics
+from .summary import defaultPipeline, findBlocks, inputFiles, updateBlocks
+from .vtc import varianceTimeCourse
+
+# Increment when the columns of the store change, so that existing
+# partitions are recomputed
+STORE_VERSION = 3
+
+KEY_COLUMNS = [
+    "study", "session_name", "participant_id", "block_name", "trial"
+    ]
+
+_DATA_FILE = "trials.parquet"
+_PROVENANCE_FILE = "provenance.json"
+_PPG_COLUMNS = ["num_beats", "hr_bpm", "sdnn_ms", "rmssd_ms"]
+# How beats are detected in the PPG: causally, as during a run
+_PPG_METHOD = "replay"
+
+def _partitionDir(storeDir, study, sessionName, blockName):
+    return os.path.join(
+        storeDir,
+        f"study={quote(str(study), safe='')}",
+        f"session={quote(str(sessionName), safe='')}",
+        f"block={quote(str(blockName), safe='')}"
+        )
+
+def _partitionValue(name, key):
+    # The value of a partition directory named "[key]=[value]"
+    prefix = f"{key}="
+    return unquote(name[len(prefix):]) if name.startswith(prefix) else None
+
+def _writeAtomic(filePath, write):
+    # Write a file with `write(path)` so that it is replaced only once it is
+    # complete
+    tmpFile = f"{filePath}.tmp"
+    write(tmpFile)
+    os.replace(tmpFile, filePath)
+
+def _writeJSON(filePath, obj):
+    with open(filePath, "w") as f:
+        json.dump(obj, f, indent=4, default=str)
+
+def epochParameters(pipeline):
+    """Get the parameters of the "epoch" action of a pipeline.
+
+    Returns
+    -------
+    dict
+        The parameters, including the defaults of those that were not
+        specified (eg. "marker", "tmin" and "tmax").
+    """
+    params = dict(DataPipe.actionParameters("epoch"))
+    for action, actionParams in pipeline.actions:
+        if action == "epoch":
+            params.update(actionParams)
+    return params
+
+def windowFeatures(pipeline, eeg, onsets, padding=1.0, lookahead=0.25):
+    """Compute the EEG features of trials as they are computed during a run.
+
+    Rather than to the whole block, the pipeline is applied to the EEG from
+    `padding` seconds before each trial's epoch to `lookahead` seconds after
+    it, at the stream's nominal sample rate, as
+    `attention_model.AttentionPredictor` does with the EEG it has received.
+    The edges of the window affect the filtered signal (especially at low
+    frequencies), so features computed from the whole block differ from
+    those computed live.
+
+    Parameters
+    ----------
+    pipeline : DataPipe
+        The pipeline (see `summary.defaultPipeline`). Must cut epochs around
+        stimulus markers and end with the "features" action.
+    eeg : dict
+        The EEG stream (eg. `GradCPTBlock.data['eeg']`).
+    onsets : numpy.ndarray
+        The time of the marker of each trial's epoch.
+    padding, lookahead : float, default=1.0, 0.25
+        The EEG before and after each epoch that is filtered with it, in
+        seconds.
+
+    Returns
+    -------
+    polars.DataFrame
+        One row per onset, with the columns "trial" (the index of the
+        onset), "reject" and "[channel]_[feature]" for every channel and
+        feature. Trials whose epoch is not in the EEG are rejected and have
+        no features.
+    """
+    epoch = epochParameters(pipeline)
+    if epoch["marker"] == "response":
+        raise ValueError("Epochs must be cut around stimulus markers.")
+    srate = nominalRate(eeg)
+    info = {**eeg['info'], 'effective_srate' : srate}
+    times = np.asarray(eeg['time_stamps'], dtype=float)
+    samples = np.asarray(eeg['time_series'], dtype=float)
+    onsets = np.asarray(onsets, dtype=float).ravel()
+    first, last = (
+        np.searchsorted(times, onsets + epoch["tmin"] - padding),
+        np.searchsorted(
+            times, onsets + epoch["tmax"] + lookahead + 1 / srate
+            )
+        )
+
+    rows = []
+    for k, onset in enumerate(onsets):
+        row = {"trial" : k, "reject" : True}
+        if last[k] > first[k]:
+            table = pipeline.execute({
+                'eeg' : {
+                    'time_series' : samples[first[k]:last[k]],
+                    'time_stamps' : times[first[k]:last[k]],
+                    'info' : info
+                    },
+                'stimuli_marker_stream' : {
+                    'time_series' : [[epoch["marker"]]],
+                    'time_stamps' : np.array([onset])
+                    }
+                })
+            if len(table) > 0:
+                row.update(table.drop(["trial", "event_time"]).row(
+                    0, named=True
+                    ))
+        rows.append(row)
+    if len(rows) == 0:
+        return pl.DataFrame(schema={"trial" : pl.Int64, "reject" : pl.Boolean})
+    return pl.from_dicts(rows, infer_schema_length=None).with_columns(
+        pl.col("trial").cast(pl.Int64), pl.col("reject").cast(pl.Boolean)
+        )
+
+def trialFeatures(
+        data, pipeline=None, ppgWindow=(-10.0, 0.0), padding=1.0,
+        lookahead=0.25
+        ):
+    """Compute the EEG and PPG features of every trial of a block.
+
+    The features are computed as they are during a run (see
+    `windowFeatures` and `ppg.replayPPG`), so that a model trained on them
+    gets the same features live (see `attention_model.AttentionPredictor`).
+
+    Parameters
+    ----------
+    data : dict
+        The block's data (eg. `GradCPTBlock.data`).
+    pipeline : DataPipe, optional
+        The pipeline used to compute EEG features (see
+        `summary.defaultPipeline`, the default).
+    ppgWindow : tuple of (float, float), default=(-10.0, 0.0)
+        The window around each trial's onset (in seconds) over which heart
+        rate and HRV are computed.
+    padding, lookahead : float, default=1.0, 0.25
+        See `windowFeatures`.
+
+    Returns
+    -------
+    polars.DataFrame
+        One row per trial (marker of the pipeline's epochs), with the
+        columns "trial", "eeg_reject", "eeg_[channel]_[feature]" and
+        "ppg_[metric]", for the signals the block has.
+    """
+    pipeline = defaultPipeline() if pipeline is None else pipeline
+    onsets = markerTimes(
+        data['stimuli_marker_stream'], epochParameters(pipeline)["marker"]
+        )
+    features = pl.DataFrame({"trial" : np.arange(len(onsets))})
+
+    if 'eeg' in data and len(pipeline.actions) > 0:
+        eegFeatures = windowFeatures(
+            pipeline, data['eeg'], onsets, padding=padding,
+            lookahead=lookahead
+            )
+        features = features.join(
+            eegFeatures.rename({
+                c : "eeg_reject" if c == "reject" else f"eeg_{c}"
+                for c in eegFeatures.columns if c != "trial"
+                }),
+            on="trial", how="left"
+            )
+
+    if 'ppg' in data and len(data['ppg']['time_stamps']) > 0:
+        beats = replayPPG(data['ppg'])
+        metrics = windowMetrics(
+            beats["beat_times"], beats["ibi"], beats["valid"],
+            onsets + ppgWindow[0], onsets + ppgWindow[1]
+            )
+        features = features.with_columns([
+            pl.Series(f"ppg_{c}", metrics[c]) for c in _PPG_COLUMNS
+            ])
+    return features
+
+def _blockTrials(block, actions, ppgWindow, padding, lookahead):
+    # The features of every trial of a block
+    gradCPTBlock = GradCPTBlock(
+        block["block_name"], "", 0, block["stim_sequence_file"],
+        block["data_file"]
+        )
+    data = gradCPTBlock.data
+    if data is None:
+        raise FileNotFoundError(f"Data file not found: {block['data_file']}")
+
+    # Behaviour and VTC
+    inputs = blockInputs(
+        gradCPTBlock,
+        block["stim_transition_time_ms"],
+        block["stim_static_time_ms"],
+        sessionName=block["session_name"]
+        )
+    trials = varianceTimeCourse(trialTable([inputs])).drop(
+        ["vtc_raw", "rt_interp_ms"]
+        )
+
+    # EEG and PPG features, matched to trials by the index of their onset
+    pipe = DataPipe(cache=False)
+    for action, params in actions:
+        pipe.add(action, **params)
+    trials = trials.join(
+        trialFeatures(
+            data, pipe, ppgWindow=ppgWindow, padding=padding,
+            lookahead=lookahead
+            ),
+        on="trial", how="left"
+        )
+
+    return trials.with_columns([
+        pl.lit(block["study"], dtype=pl.Utf8).alias("study"),
+        pl.lit(block["participant_id"]).cast(pl.Int64).alias("participant_id")
+        ]).select(
+            KEY_COLUMNS
+            + [c for c in trials.columns if c not in KEY_COLUMNS]
+            )
+
+def _computePartition(
+        block, actions, ppgWindow, padding, lookahead, storeDir
+        ):
+    # Write the trials of a block to its partition (in a worker process)
+    trials = _blockTrials(block, actions, ppgWindow, padding, lookahead)
+    partitionDir = _partitionDir(
+        storeDir, block["study"], block["session_name"], block["block_name"]
+        )
+    os.makedirs(partitionDir, exist_ok=True)
+    _writeAtomic(
+        os.path.join(partitionDir, _DATA_FILE), trials.write_parquet
+        )
+    return len(trials)
+
+class FeatureStore:
+    """Per-trial features of the blocks of studies, stored as Parquet.
+
+    Parameters
+    ----------
+    storeDir : str
+        The directory of the store (created if needed).
+    """
+    def __init__(self, storeDir):
+        self.storeDir = storeDir
+
+    def partitions(self, study=None, sessions=None, blocks=None):
+        """Get the partitions of the store.
+
+        Parameters
+        ----------
+        study : str, optional
+            Only get partitions of this study.
+        sessions, blocks : list of str, optional
+            Only get partitions of these sessions and blocks.
+
+        Returns
+        -------
+        list of dict
+            The "study", "session_name", "block_name" and directory ("path")
+            of each partition with data, in order.
+        """
+        found = []
+        if not os.path.isdir(self.storeDir):
+            return found
+        levels = [
+            ("study", None if study is None else [study]),
+            ("session", sessions),
+            ("block", blocks)
+            ]
+
+        def walk(path, depth, values):
+            if depth == len(levels):
+                if os.path.isfile(os.path.join(path, _DATA_FILE)):
+                    found.append({
+                        "study" : values[0], "session_name" : values[1],
+                        "block_name" : values[2], "path" : path
+                        })
+                return
+            key, allowed = levels[depth]
+            for entry in sorted(os.scandir(path), key=lambda e: e.name):
+                value = _partitionValue(entry.name, key)
+                if (
+                        entry.is_dir() and value is not None
+                        and (allowed is None or value in allowed)
+                        ):
+                    walk(entry.path, depth + 1, values + [value])
+
+        walk(self.storeDir, 0, [])
+        return found
+
+    def provenance(self, study=None):
+        """Get the provenance of every partition.
+
+        Returns
+        -------
+        list of dict
+            The contents of each partition's provenance file.
+        """
+        records = []
+        for partition in self.partitions(study=study):
+            record = self.__readProvenance(partition["path"])
+            if record is not None:
+                records.append(record)
+        return records
+
+    def scan(self, study=None, sessions=None, blocks=None):
+        """Get a lazy frame of the trials in the store.
+
+        Parameters
+        ----------
+        study : str, optional
+            Only scan partitions of this study.
+        sessions, blocks : list of str, optional
+            Only scan partitions of these sessions and blocks. Partitions
+            that are not selected are not read at all.
+
+        Returns
+        -------
+        polars.LazyFrame
+            The trials of every selected partition. Partitions without some
+            columns (eg. blocks without PPG) have null values in them.
+        """
+        files = [
+            os.path.join(p["path"], _DATA_FILE)
+            for p in self.partitions(study, sessions, blocks)
+            ]
+        if len(files) == 0:
+            return pl.DataFrame(schema={
+                "study" : pl.Utf8, "session_name" : pl.Utf8,
+                "participant_id" : pl.Int64, "block_name" : pl.Utf8,
+                "trial" : pl.Int64
+                }).lazy()
+        return pl.concat(
+            [pl.scan_parquet(f) for f in files], how="diagonal"
+            )
+
+    def query(
+            self, predicate=None, columns=None, study=None, sessions=None,
+            blocks=None
+            ):
+        """Read the trials that match a predicate.
+
+        Parameters
+        ----------
+        predicate : polars.Expr, optional
+            The trials to read (eg. `pl.col("participant_id") == 3`).
+        columns : list of str, optional
+            The columns to read. Defaults to every column.
+        study, sessions, blocks
+            See `scan`.
+
+        Returns
+        -------
+        polars.DataFrame
+        """
+        lf = self.scan(study=study, sessions=sessions, blocks=blocks)
+        if predicate is not None:
+            lf = lf.filter(predicate)
+        if columns is not None:
+            lf = lf.select(columns)
+        return lf.collect()
+
+    @staticmethod
+    def __readProvenance(partitionDir):
+        try:
+            with open(os.path.join(partitionDir, _PROVENANCE_FILE), "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def update(
+            self, studyDir, study=None, pipeline=None, ppgWindow=(-10.0, 0.0),
+            padding=1.0, lookahead=0.25, numWorkers=None, force=False,
+            progress=None
+            ):
+        """Compute the partitions of the new and changed blocks of a study.
+
+        Partitions of blocks that no longer exist are removed, unless their
+        session could not be read.
+
+        Parameters
+        ----------
+        studyDir : str
+            The study's data directory (eg. `src/data/gradCPT`).
+        study : str, optional
+            The name of the study in the store. Defaults to the name of
+            `studyDir`.
+        pipeline : DataPipe, optional
+            The pipeline used to compute EEG features of each trial (see
+            `summary.defaultPipeline`, the default). Must end with the
+            "features" action.
+        ppgWindow : tuple of (float, float), default=(-10.0, 0.0)
+            The window around each trial's onset (in seconds) over which
+            heart rate and HRV are computed. The default only uses beats
+            before the trial, so that the features can also be computed
+            during a run (see `attention_model.AttentionPredictor`).
+        padding, lookahead : float, default=1.0, 0.25
+            The EEG before and after each epoch that is filtered with it, in
+            seconds (see `windowFeatures`). During a run, the prediction of
+            each trial waits for `lookahead` seconds of EEG after its epoch.
+        numWorkers : int, optional
+            The number of worker processes. Defaults to the number of CPUs.
+            If 0, blocks are processed one after the other in this process.
+        force : bool, default=False
+            Whether to recompute every partition.
+        progress : Callable[[int, int], None], optional
+            Called with the number of blocks processed so far and the number
+            to process, every time a block has been processed.
+
+        Returns
+        -------
+        dict
+            The number of partitions that were "computed", "unchanged"
+            (including those that only needed to be hashed), "removed" and
+            "failed", and the reason for each failure ("errors", see
+            `summary.summarizeStudy`). Failed blocks keep their previous
+            partition, if any, and are computed again next time.
+        """
+        study = (
+            os.path.basename(os.path.normpath(studyDir)) if study is None
+            else study
+            )
+        pipeline = defaultPipeline() if pipeline is None else pipeline
+        actions = pipeline.actions
+        pipelineKey = pipeline.keys("")[-1] if len(actions) > 0 else ""
+        ppgWindow = [float(t) for t in ppgWindow]
+        padding, lookahead = float(padding), float(lookahead)
+
+        stats = {
+            "computed" : 0, "unchanged" : 0, "removed" : 0, "failed" : 0,
+            "errors" : {}
+            }
+        blocks = findBlocks(studyDir, errors=stats["errors"])
+        current = set()
+        for block in blocks:
+            block["study"] = study
+            block["partition_dir"] = _partitionDir(
+                self.storeDir, study, block["session_name"],
+                block["block_name"]
+                )
+            current.add(os.path.abspath(block["partition_dir"]))
+
+        def previous(block):
+            # The provenance of the block's partition, if it has data
+            partitionDir = block["partition_dir"]
+            if not os.path.isfile(os.path.join(partitionDir, _DATA_FILE)):
+                return None
+            return self.__readProvenance(partitionDir)
+
+        computedAt = datetime.now().isoformat(timespec="seconds")
+
+        def writeProvenance(block, numTrials, computedAt):
+            record = {
+                "store_version" : STORE_VERSION,
+                "study" : study,
+                "session_name" : block["session_name"],
+                "block_name" : block["block_name"],
+                "inputs" : {
+                    f : {
+                        "size" : os.path.getsize(f),
+                        "mtime_ns" : os.stat(f).st_mtime_ns
+                        } for f in inputFiles(block)
+                    },
+                "inputs_stat" : block["inputs_stat"],
+                "inputs_hash" : block["inputs_hash"],
+                "settings_key" : block["settings_key"],
+                "pipeline" : [[a, p] for a, p in actions],
+                "ppg_window" : ppgWindow,
+                "ppg_method" : _PPG_METHOD,
+                "padding" : padding,
+                "lookahead" : lookahead,
+                "num_trials" : numTrials,
+                "computed_at" : computedAt
+                }
+            _writeAtomic(
+                os.path.join(block["partition_dir"], _PROVENANCE_FILE),
+                lambda path: _writeJSON(path, record)
+                )
+
+        for block, old, status, result in updateBlocks(
+                blocks, _computePartition,
+                lambda block: [
+                    STORE_VERSION, pipelineKey, ppgWindow, _PPG_METHOD,
+                    padding, lookahead, block["stim_transition_time_ms"],
+                    block["stim_static_time_ms"]
+                    ],
+                previous,
+                args=(actions, ppgWindow, padding, lookahead, self.storeDir),
+                numWorkers=numWorkers, force=force, progress=progress
+                ):
+            key = (block["session_name"], block["block_name"])
+            if status == "failed":
+                stats["failed"] += 1
+                stats["errors"][key] = f"{type(result).__name__}: {result}"
+            elif status == "processed":
+                writeProvenance(block, result, computedAt)
+                stats["computed"] += 1
+            else:
+                if status == "hashed":
+                    writeProvenance(
+                        block, old["num_trials"], old["computed_at"]
+                        )
+                stats["unchanged"] += 1
+
+        # Remove the partitions of blocks that no longer exist: those of
+        # sessions that have been deleted, or that were read and no longer
+        # list the block. Sessions that could not be read (whose directory
+        # is named after them) keep their partitions.
+        sessionsDir = os.path.join(studyDir, "sessions")
+        unread = {
+            os.path.abspath(source) for source in stats["errors"]
+            if not isinstance(source, tuple)
+            }
+        for partition in self.partitions(study=study):
+            if os.path.abspath(partition["path"]) in current:
+                continue
+            sessionDir = os.path.abspath(
+                os.path.join(sessionsDir, partition["session_name"])
+                )
+            if sessionDir in unread or (
+                    os.path.isdir(sessionDir)
+                    and not os.path.isfile(
+                        os.path.join(sessionDir, "info.json")
+                        )
+                    ):
+                continue
+            shutil.rmtree(partition["path"])
+            stats["removed"] += 1
+        return stats
@@ -0,0 +1,307 @@
+"""Spectral features of epochs: band powers and their ratios.
+
+Power spectra are estimated for every trial and channel at once, with a
+single batched real FFT over an array of epochs of shape
+`(trials, channels, samples)`:
+
+- Welch's method (`welchPSD`): the mean periodogram of overlapping,
+  windowed segments of each epoch. Segments are strided views of the epochs.
+- The multitaper method (`multitaperPSD`): the mean periodogram of each
+  epoch multiplied by discrete prolate spheroidal sequences (DPSS), which
+  has a lower variance than a single periodogram of short epochs.
+
+Windows, tapers and the matrices reducing spectra to band powers depend only
+on the length of the epochs and the sample rate, so they are cached. Band
+powers are the integral of the spectrum over each band, computed for every
+band at once as a matrix product.
+
+`spectralFeatures` processes epochs a chunk of trials at a time, so that the
+memory used by the spectra is bounded whatever the number of trials (eg.
+every trial of a study, see `Epochs.concatenate`).
+"""
+from functools import lru_cache
+
+import numpy as np
+import polars as pl
+from scipy import fft as spfft
+from scipy import signal as spsignal
+
+DEFAULT_BANDS = (
+    ("delta", 1, 4), ("theta", 4, 8), ("alpha", 8, 13), ("beta", 13, 30)
+    )
+
+# The ratios of band powers, as (numerator, denominator). The theta / beta
+# ratio is a common index of (in)attention.
+DEFAULT_RATIOS = (("theta", "beta"), ("theta", "alpha"))
+
+def _readOnly(x):
+    x.flags.writeable = False
+    return x
+
+@lru_cache(maxsize=32)
+def _window(window, length, dtype):
+    return _readOnly(
+        spsignal.get_window(window, length, fftbins=True).astype(dtype)
+        )
+
+@lru_cache(maxsize=32)
+def _tapers(length, halfBandwidth, numTapers, dtype):
+    tapers = spsignal.windows.dpss(length, halfBandwidth, Kmax=numTapers)
+    return _readOnly(np.atleast_2d(tapers).astype(dtype))
+
+def _oneSided(power, nfft, scale):
+    # Scale a batch of periodograms (frequencies along the last axis) as a
+    # one-sided density, in place
+    power *= scale
+    last = None if nfft % 2 else -1
+    power[..., 1:last] *= 2
+    return power
+
+def welchPSD(
+        epochs, srate, nperseg=256, noverlap=None, window="hann",
+        dtype=np.float64
+        ):
+    """Estimate the power spectral density of epochs with Welch's method.
+
+    Gives the same result as `scipy.signal.welch` (with constant detrending
+    and a one-sided density), for every trial and channel at once.
+
+    Parameters
+    ----------
+    epochs : numpy.ndarray
+        The epochs, with samples along the last axis (eg. with shape
+        `(trials, channels, samples)`).
+    srate : float
+        The sample rate of the epochs.
+    nperseg : int, default=256
+        The length of each segment. Shorter epochs form a single segment.
+    noverlap : int, optional
+        The number of samples shared by consecutive segments. Defaults to
+        half a segment.
+    window : str, default="hann"
+        The window applied to each segment (see `scipy.signal.get_window`).
+    dtype : numpy.dtype, default=numpy.float64
+        The precision of the computation (eg. `numpy.float32` to halve the
+        memory used and speed up the FFT).
+
+    Returns
+    -------
+    freqs : numpy.ndarray
+        The frequency of each bin of the spectra.
+    psd : numpy.ndarray
+        The spectra, with frequencies along the last axis.
+    """
+    epochs = np.asarray(epochs, dtype=dtype)
+    n = epochs.shape[-1]
+    nperseg = min(nperseg, n)
+    noverlap = nperseg // 2 if noverlap is None else noverlap
+    step = nperseg - noverlap
+    w = _window(window, nperseg, np.dtype(dtype))
+
+    # Views of the segments, with shape (..., segments, nperseg)
+    segments = np.lib.stride_tricks.sliding_window_view(
+        epochs, nperseg, axis=-1
+        )[..., ::step, :]
+    segments = segments - segments.mean(axis=-1, keepdims=True)
+    segments *= w
+    spectra = spfft.rfft(segments, axis=-1)
+    power = (spectra.real ** 2 + spectra.imag ** 2).mean(axis=-2)
+    freqs = spfft.rfftfreq(nperseg, 1 / srate)
+    return freqs, _oneSided(power, nperseg, 1 / (srate * np.sum(w * w)))
+
+def multitaperPSD(
+        epochs, srate, bandwidth=4.0, numTapers=None, dtype=np.float64
+        ):
+    """Estimate the power spectral density of epochs with DPSS tapers.
+
+    Parameters
+    ----------
+    epochs : numpy.ndarray
+        The epochs, with samples along the last axis (eg. with shape
+        `(trials, channels, samples)`).
+    srate : float
+        The sample rate of the epochs.
+    bandwidth : float, default=4.0
+        The frequency resolution (full bandwidth) of the tapers, in Hz.
+    numTapers : int, optional
+        The number of tapers. Defaults to those with good spectral
+        concentration, `floor(2 * NW) - 1`, where `NW = bandwidth * duration
+        / 2` is the time-halfbandwidth product.
+    dtype : numpy.dtype, default=numpy.float64
+        The precision of the computation.
+
+    Returns
+    -------
+    freqs : numpy.ndarray
+        The frequency of each bin of the spectra.
+    psd : numpy.ndarray
+        The spectra, with frequencies along the last axis.
+    """
+    epochs = np.asarray(epochs, dtype=dtype)
+    n = epochs.shape[-1]
+    halfBandwidth = bandwidth * n / (2 * srate)
+    if numTapers is None:
+        numTapers = max(int(np.floor(2 * halfBandwidth)) - 1, 1)
+    tapers = _tapers(n, halfBandwidth, numTapers, np.dtype(dtype))
+
+    x = epochs - epochs.mean(axis=-1, keepdims=True)
+    spectra = spfft.rfft(x[..., np.newaxis, :] * tapers, axis=-1)
+    power = (spectra.real ** 2 + spectra.imag ** 2).mean(axis=-2)
+    freqs = spfft.rfftfreq(n, 1 / srate)
+    # The tapers have unit energy
+    return freqs, _oneSided(power, n, 1 / srate)
+
+@lru_cache(maxsize=32)
+def _bandMatrix(freqs, bands):
+    # The matrix integrating a spectrum over each band (rectangle rule), with
+    # shape (frequencies, bands)
+    freqs = np.frombuffer(freqs)
+    df = freqs[1] - freqs[0] if len(freqs) > 1 else 1.0
+    matrix = np.column_stack([
+        (freqs >= low) & (freqs < high) for _, low, high in bands
+        ]) * df
+    return _readOnly(matrix)
+
+def bandPowers(freqs, psd, bands=DEFAULT_BANDS):
+    """Integrate spectra over frequency bands.
+
+    Parameters
+    ----------
+    freqs : numpy.ndarray
+        The frequency of each bin of the spectra.
+    psd : numpy.ndarray
+        The spectra, with frequencies along the last axis.
+    bands : tuple of (str, float, float), default=DEFAULT_BANDS
+        The name, lower (inclusive) and upper (exclusive) frequency in Hz of
+        each band.
+
+    Returns
+    -------
+    numpy.ndarray
+        The power in each band, along the last axis.
+    """
+    matrix = _bandMatrix(
+        np.asarray(freqs, dtype=float).tobytes(), tuple(map(tuple, bands))
+        )
+    return psd @ matrix.astype(psd.dtype)
+
+def spectralFeatures(
+        epochs, srate, bands=DEFAULT_BANDS, ratios=DEFAULT_RATIOS,
+        method="welch", relative=False, log=False, chunkSize=None,
+        maxMemory=2**28, dtype=np.float32, **kwargs
+        ):
+    """Compute band powers and their ratios for every trial and channel.
+
+    Parameters
+    ----------
+    epochs : numpy.ndarray
+        The epochs, with shape `(trials, channels, samples)`.
+    srate : float
+        The sample rate of the epochs.
+    bands : tuple of (str, float, float), default=DEFAULT_BANDS
+        See `bandPowers`.
+    ratios : tuple of (str, str), default=DEFAULT_RATIOS
+        The numerator and denominator band of each ratio.
+    method : {'welch', 'multitaper'}, default='welch'
+        How to estimate the spectra (see `welchPSD` and `multitaperPSD`).
+    relative : bool, default=False
+        Whether to divide the power in each band by the total power of the
+        spectrum. Ratios are unaffected.
+    log : bool, default=False
+        Whether to return the base 10 logarithm of band powers and ratios.
+    chunkSize : int, optional
+        The number of trials processed at once. Defaults to as many as fit
+        in `maxMemory`.
+    maxMemory : int, default=2**28
+        The approximate number of bytes used by the spectra of a chunk.
+    dtype : numpy.dtype, default=numpy.float32
+        The precision of the spectra (see `welchPSD`). Features are returned
+        in double precision.
+    **kwargs
+        Passed to `welchPSD` or `multitaperPSD`.
+
+    Returns
+    -------
+    features : numpy.ndarray
+        The features, with shape `(trials, channels, features)`.
+    names : list of str
+        The name of each feature: the name of each band, then
+        "[numerator]_[denominator]" for each ratio.
+    """
+    if method not in ("welch", "multitaper"):
+        raise ValueError(f"Invalid method: {method}")
+    bandNames = [name for name, _, _ in bands]
+    invalid = [
+        r for r in ratios if r[0] not in bandNames or r[1] not in bandNames
+        ]
+    if len(invalid) > 0:
+        raise ValueError(f"Invalid ratios: {invalid}")
+    numTrials, numChannels, n = epochs.shape
+    estimate = welchPSD if method == "welch" else multitaperPSD
+
+    if chunkSize is None:
+        # The segments (or tapered epochs) and their complex spectra, for
+        # each trial
+        if method == "welch":
+            nperseg = min(kwargs.get("nperseg", 256), n)
+            step = nperseg - kwargs.get("noverlap", nperseg // 2)
+            copies = (n - nperseg) // step + 1
+        else:
+            bandwidth = kwargs.get("bandwidth", 4.0)
+            copies = kwargs.get("numTapers") or max(
+                int(np.floor(bandwidth * n / srate)) - 1, 1
+                )
+        itemsize = np.dtype(dtype).itemsize
+        bytesPerTrial = 4 * numChannels * copies * n * itemsize
+        chunkSize = max(int(maxMemory // bytesPerTrial), 1)
+
+    names = bandNames + [f"{a}_{b}" for a, b in ratios]
+    out = np.empty((numTrials, numChannels, len(names)))
+    index = {name : k for k, name in enumerate(bandNames)}
+    for start in range(0, numTrials, chunkSize):
+        stop = min(start + chunkSize, numTrials)
+        freqs, psd = estimate(
+            epochs[start:stop], srate, dtype=dtype, **kwargs
+            )
+        power = bandPowers(freqs, psd, bands).astype(float)
+        for k, (a, b) in enumerate(ratios):
+            out[start:stop, :, len(bands) + k] = (
+                power[..., index[a]] / power[..., index[b]]
+                )
+        if relative:
+            power /= psd.sum(axis=-1, dtype=float)[..., np.newaxis] * (
+                freqs[1] - freqs[0]
+                )
+        out[start:stop, :, :len(bands)] = power
+    if log:
+        with np.errstate(divide="ignore"):
+            np.log10(out, out=out)
+    return out, names
+
+def featureTable(epochs, **kwargs):
+    """Compute the spectral features of `Epochs` as a table.
+
+    Parameters
+    ----------
+    epochs : Epochs
+        The epochs.
+    **kwargs
+        Passed to `spectralFeatures`.
+
+    Returns
+    -------
+    polars.DataFrame
+        One row per epoch, with the columns "trial" (the index of its event,
+        see `Epochs.events`), "event_time", "reject" and
+        "[channel]_[feature]" for every channel and feature.
+    """
+    features, names = spectralFeatures(epochs.data, epochs.srate, **kwargs)
+    columns = {
+        "trial" : epochs.events,
+        "event_time" : epochs.eventTimes,
+        "reject" : epochs.reject
+        }
+    for k, channel in enumerate(epochs.channelNames):
+        for j, name in enumerate(names):
+            columns[f"{channel}_{name}"] = features[:, k, j]
+    return pl.DataFrame(columns)
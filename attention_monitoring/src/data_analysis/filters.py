@@ -0,0 +1,352 @@
+"""Filtering of Muse signals (EEG, PPG, accelerometer and gyroscope).
+
+Filters are designed as second-order sections (SOS), which are numerically
+stable at high orders and low cutoff frequencies. Designs are cached by
+(kind, band, sample rate, order), so that filtering many blocks, or many
+chunks of a stream, does not redesign the same filter. Several filters (eg.
+a bandpass and a notch) are combined into a single cascade of sections.
+
+Signals have shape `(samples, channels)` (as loaded by `pyxdf`), and every
+channel is filtered at once. Filters can be applied:
+
+- Offline with zero phase (`zeroPhaseFilter`), filtering forwards then
+  backwards with odd extension of the edges and initial filter states
+  matched to the edges (as `scipy.signal.sosfiltfilt`), optionally in chunks
+  to bound the memory used on long recordings (eg. writing to a memmap).
+- Causally, in chunks as they arrive (`StreamingFilter`), carrying the filter
+  state between chunks so that the result is identical to filtering the
+  whole signal at once.
+"""
+from functools import lru_cache
+
+import numpy as np
+from scipy import signal as spsignal
+
+from .epochs import estimateSampleRate
+
+FILTER_KINDS = ("lowpass", "highpass", "bandpass", "bandstop", "notch")
+
+def defaultFilters(signalType, lineFreq=60.0):
+    """Get the default filters for a Muse signal.
+
+    Parameters
+    ----------
+    signalType : {'eeg', 'ppg', 'acc', 'gyr'}
+        The signal (named as in `GradCPTBlock.data`).
+    lineFreq : float, default=60.0
+        The frequency of the mains power line (50 Hz in most of Europe, Asia
+        and Africa, 60 Hz in North America), removed from EEG with a notch
+        filter.
+
+    Returns
+    -------
+    list of tuple of (str, float or tuple of float)
+        The kind and band of each filter (see `designFilter`).
+    """
+    filters = {
+        # Cortical rhythms of interest, without drift or line noise
+        'eeg' : [("bandpass", (1.0, 40.0)), ("notch", lineFreq)],
+        # Heart rate (30 to 240 bpm) and its first harmonic
+        'ppg' : [("bandpass", (0.5, 8.0))],
+        # Movement, without gravity (accelerometer) or sensor drift
+        'acc' : [("bandpass", (0.1, 20.0))],
+        'gyr' : [("bandpass", (0.1, 20.0))]
+        }
+    if signalType not in filters:
+        raise ValueError(f"Invalid signalType: {signalType}")
+    return filters[signalType]
+
+def designFilter(kind, band, srate, order=4, quality=30.0):
+    """Design a Butterworth or notch filter as second-order sections.
+
+    Designs are cached, so repeated calls with the same arguments are cheap.
+
+    Parameters
+    ----------
+    kind : {'lowpass', 'highpass', 'bandpass', 'bandstop', 'notch'}
+        The kind of filter.
+    band : float or tuple of (float, float)
+        The cutoff frequency in Hz ('lowpass' and 'highpass'), the lower and
+        upper cutoff frequencies ('bandpass' and 'bandstop') or the frequency
+        to remove ('notch').
+    srate : float
+        The sample rate of the signal.
+    order : int, default=4
+        The order of the Butterworth filter. Ignored for 'notch' filters,
+        which are always second order.
+    quality : float, default=30.0
+        The quality factor of a 'notch' filter (the notch frequency divided
+        by the width of the notch).
+
+    Returns
+    -------
+    numpy.ndarray
+        The (read-only) second-order sections, with shape `(sections, 6)`.
+    """
+    if kind not in FILTER_KINDS:
+        raise ValueError(f"Invalid filter kind: {kind}")
+    band = (
+        tuple(float(f) for f in band) if np.ndim(band) > 0
+        else float(band)
+        )
+    numFreqs = 2 if kind in ("bandpass", "bandstop") else 1
+    if np.size(band) != numFreqs:
+        raise ValueError(
+            f"A {kind} filter requires {numFreqs} frequencies: {band}"
+            )
+    if any(not 0 < f < srate / 2 for f in np.atleast_1d(band)):
+        raise ValueError(
+            f"Frequencies must be between 0 Hz and the Nyquist frequency "
+            + f"({srate / 2} Hz): {band}"
+            )
+    return _designFilter(kind, band, float(srate), int(order), float(quality))
+
+@lru_cache(maxsize=256)
+def _designFilter(kind, band, srate, order, quality):
+    if kind == "notch":
+        b, a = spsignal.iirnotch(band, quality, fs=srate)
+        sos = spsignal.tf2sos(b, a)
+    else:
+        sos = spsignal.butter(order, band, btype=kind, fs=srate, output="sos")
+    sos.flags.writeable = False
+    return sos
+
+def designFilters(filters, srate, order=4, quality=30.0):
+    """Design a cascade of filters as a single set of second-order sections.
+
+    Parameters
+    ----------
+    filters : Iterable of tuple of (str, float or tuple of float)
+        The kind and band of each filter (see `designFilter`).
+    srate, order, quality
+        See `designFilter`.
+
+    Returns
+    -------
+    numpy.ndarray
+        The second-order sections of all the filters, in order.
+    """
+    sections = [
+        designFilter(kind, band, srate, order=order, quality=quality)
+        for kind, band in filters
+        ]
+    if len(sections) == 0:
+        raise ValueError("At least one filter is required.")
+    return np.vstack(sections)
+
+def padLength(sos):
+    """Get the length of the edge extension used for zero-phase filtering.
+
+    The same as the default of `scipy.signal.sosfiltfilt`.
+    """
+    numZeros = min((sos[:, 2] == 0).sum(), (sos[:, 5] == 0).sum())
+    return 3 * (2 * len(sos) + 1 - numZeros)
+
+def _initialState(sos, x0):
+    # Filter state for a signal that has been at `x0` (one value per
+    # channel) forever, so that filtering does not start with a transient
+    zi = spsignal.sosfilt_zi(sos)
+    x0 = np.asarray(x0, dtype=float)
+    return zi.reshape(zi.shape + (1,) * x0.ndim) * x0
+
+def zeroPhaseFilter(x, sos, axis=0, chunkSize=None, out=None):
+    """Filter a signal forwards and backwards, so that it is not delayed.
+
+    The edges of the signal are extended by odd reflection (see `padLength`,
+    or shorter for short signals) before filtering, and the initial state of
+    the filter is matched to the first sample in each direction, as in
+    `scipy.signal.sosfiltfilt`.
+
+    Parameters
+    ----------
+    x : numpy.ndarray
+        The signal.
+    sos : numpy.ndarray
+        The second-order sections of the filter (eg. from `designFilters`).
+    axis : int, default=0
+        The axis of `x` along which to filter (time).
+    chunkSize : int, optional
+        If specified, filter this many samples at a time, so that only
+        `out` and a chunk of intermediate values are held in memory. The
+        result is the same as filtering the whole signal at once (up to
+        rounding).
+    out : numpy.ndarray, optional
+        Array (eg. a `numpy.memmap`) to write the result to, with the same
+        shape as `x`. Only used if `chunkSize` is specified.
+
+    Returns
+    -------
+    numpy.ndarray
+        The filtered signal.
+    """
+    x = np.asarray(x)
+    n = x.shape[axis]
+    if n < 2:
+        return x.astype(float)
+    padlen = min(padLength(sos), n - 1)
+    if chunkSize is None:
+        return spsignal.sosfiltfilt(
+            sos, x, axis=axis, padtype="odd", padlen=padlen
+            )
+
+    x = np.moveaxis(x, axis, 0)
+    if out is None:
+        out = np.empty(x.shape, dtype=float)
+    else:
+        out = np.moveaxis(out, axis, 0)
+        if out.shape != x.shape:
+            raise ValueError(
+                f"out must have the same shape as x: {out.shape}, {x.shape}"
+                )
+
+    # Odd extensions of the start and end of the signal
+    x0, x1 = x[0].astype(float), x[-1].astype(float)
+    left = 2 * x0 - x[padlen:0:-1]
+    right = 2 * x1 - x[-2:-padlen - 2:-1]
+
+    # Forward pass, through the left extension, the signal and the right
+    # extension
+    state = _initialState(sos, left[0] if padlen > 0 else x0)
+    _, state = spsignal.sosfilt(sos, left, axis=0, zi=state)
+    for start in range(0, n, chunkSize):
+        stop = min(start + chunkSize, n)
+        out[start:stop], state = spsignal.sosfilt(
+            sos, x[start:stop], axis=0, zi=state
+            )
+    right, _ = spsignal.sosfilt(sos, right, axis=0, zi=state)
+
+    # Backward pass, through the filtered right extension then the signal
+    end = right[-1] if padlen > 0 else out[-1]
+    state = _initialState(sos, end)
+    _, state = spsignal.sosfilt(sos, right[::-1], axis=0, zi=state)
+    for stop in range(n, 0, -chunkSize):
+        start = max(stop - chunkSize, 0)
+        chunk, state = spsignal.sosfilt(
+            sos, out[start:stop][::-1], axis=0, zi=state
+            )
+        out[start:stop] = chunk[::-1]
+
+    return np.moveaxis(out, 0, axis)
+
+class StreamingFilter:
+    """Causal filter for a signal that arrives in chunks.
+
+    The filter state is carried from one chunk to the next, so filtering a
+    signal in chunks gives the same result as filtering it all at once. The
+    state is initialized from the first sample, so that the output does not
+    start with a transient.
+
+    Parameters
+    ----------
+    sos : numpy.ndarray
+        The second-order sections of the filter (eg. from `designFilters`).
+
+    """
+    def __init__(self, sos):
+        self.sos = sos
+        self.__state = None
+
+    def reset(self):
+        """Forget the filter state (eg. after a gap in the signal)."""
+        self.__state = None
+
+    def process(self, chunk):
+        """Filter the next chunk of the signal.
+
+        Parameters
+        ----------
+        chunk : numpy.ndarray
+            The next samples, with shape `(samples,)` or `(samples,
+            channels)`.
+
+        Returns
+        -------
+        numpy.ndarray
+            The filtered samples.
+        """
+        chunk = np.asarray(chunk, dtype=float)
+        if len(chunk) == 0:
+            return chunk.copy()
+        if self.__state is None:
+            self.__state = _initialState(self.sos, chunk[0])
+        y, self.__state = spsignal.sosfilt(
+            self.sos, chunk, axis=0, zi=self.__state
+            )
+        return y
+
+def filterSignal(
+        x, srate, filters, order=4, quality=30.0, zeroPhase=True,
+        chunkSize=None, out=None
+        ):
+    """Filter every channel of a signal.
+
+    Parameters
+    ----------
+    x : numpy.ndarray
+        The signal, with shape `(samples,)` or `(samples, channels)`.
+    srate : float
+        The sample rate of the signal.
+    filters : Iterable of tuple of (str, float or tuple of float)
+        The kind and band of each filter (see `designFilter` and
+        `defaultFilters`).
+    order, quality
+        See `designFilter`.
+    zeroPhase : bool, default=True
+        Whether to filter with zero phase (`zeroPhaseFilter`). Otherwise, the
+        signal is filtered causally (as by a `StreamingFilter`).
+    chunkSize : int, optional
+        If specified, filter this many samples at a time.
+    out : numpy.ndarray, optional
+        Array (eg. a `numpy.memmap`) to write the result to, with the same
+        shape as `x`. Only used if `chunkSize` is specified.
+
+    Returns
+    -------
+    numpy.ndarray
+        The filtered signal.
+    """
+    sos = designFilters(filters, srate, order=order, quality=quality)
+    if zeroPhase:
+        return zeroPhaseFilter(x, sos, chunkSize=chunkSize, out=out)
+    streamingFilter = StreamingFilter(sos)
+    if chunkSize is None:
+        return streamingFilter.process(x)
+    if out is None:
+        out = np.empty(np.shape(x), dtype=float)
+    for k in range(0, len(x), chunkSize):
+        out[k:k + chunkSize] = streamingFilter.process(x[k:k + chunkSize])
+    return out
+
+def filterStream(
+        stream, signalType=None, filters=None, lineFreq=60.0, **kwargs
+        ):
+    """Filter the signal of a stream loaded by `pyxdf`.
+
+    Parameters
+    ----------
+    stream : dict
+        The stream (eg. `GradCPTBlock.data['eeg']`).
+    signalType : {'eeg', 'ppg', 'acc', 'gyr'}, optional
+        The signal of the stream, used to choose the default filters.
+    filters : Iterable of tuple of (str, float or tuple of float), optional
+        The filters to apply. Defaults to the filters for `signalType` (see
+        `defaultFilters`).
+    lineFreq : float, default=60.0
+        See `defaultFilters`.
+    **kwargs
+        Passed to `filterSignal`.
+
+    Returns
+    -------
+    numpy.ndarray
+        The filtered signal, with shape `(samples, channels)`.
+    """
+    if filters is None:
+        if signalType is None:
+            raise ValueError("One of signalType and filters is required.")
+        filters = defaultFilters(signalType, lineFreq=lineFreq)
+    srate = (
+        stream['info'].get('effective_srate')
+        or estimateSampleRate(stream['time_stamps'])
+        )
+    return filterSignal(stream['time_series'], srate, filters, **kwargs)
@@ -0,0 +1,1231 @@
+"""Memoizing analysis pipelines for gradCPT data.
+
+A `DataPipe` is a list of actions applied in order to the data of a gradCPT
+block (the dict of streams returned by `GradCPTBlock.data`). Actions are
+chosen by name from a registry, and each one declares its parameters as the
+keyword arguments of the function implementing it. New actions are
+registered with the `registerAction` decorator.
+
+The result of every step is cached, keyed by a fingerprint of the pipe's
+input, and the names, versions and parameters of the actions up to and
+including that step. Executing a pipe resumes from the last step with a
+cached result, so changing a step only recomputes that step and the steps
+after it. Results are kept in memory (least recently used results are
+evicted first) and, optionally, on disk.
+
+Actions must not modify their input in place, and cached results must not be
+modified by the caller, as they are shared between executions.
+
+A pipe can also be applied to many blocks and sessions at once
+(`DataPipe.executeMany`), across a pool of worker processes that exchange
+arrays through shared memory. Each block is isolated from the failures of
+the others, and results are returned in the order of the inputs.
+"""
+from collections import OrderedDict, deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+import copy
+from fractions import Fraction
+import hashlib
+import inspect
+import itertools
+import json
+from multiprocessing import resource_tracker, shared_memory
+import os
+import pickle
+import threading
+import time
+import traceback
+
+import numpy as np
+import polars as pl
+from scipy import signal as spsignal
+
+from .alignment import segmentBoundaries
+from .artifacts import detectArtifacts
+from .epochs import (
+    Epochs, estimateSampleRate, markerTimes, sampleMaskToTrialMask
+    )
+from .features import DEFAULT_BANDS, featureTable
+from .filters import designFilters, zeroPhaseFilter
+
+# Stores: {str : action name -> _ActionSpec}
+_ACTIONS = {}
+
+class _ActionSpec:
+    def __init__(self, name, func, version):
+        self.name = name
+        self.func = func
+        self.version = version
+        self.signature = inspect.signature(func)
+        self.doc = inspect.getdoc(func) or ""
+
+    @property
+    def parameters(self):
+        # All parameters except for the data, with their defaults (or
+        # `inspect.Parameter.empty` if they are required)
+        params = list(self.signature.parameters.values())[1:]
+        return {p.name : p.default for p in params}
+
+def registerAction(name, version=1):
+    """Register a function as a pipeline action.
+
+    The function must accept the data as its first argument and the action's
+    parameters as the remaining (keyword) arguments, and return the
+    processed data.
+
+    Parameters
+    ----------
+    name : str
+        The name of the action. Must be unique.
+    version : int, default=1
+        The version of the action's implementation. Increase it when the
+        results of the action change, so that cached results are not reused.
+    """
+    def decorator(func):
+        if name in _ACTIONS:
+            raise ValueError(f"An action named '{name}' already exists.")
+        _ACTIONS[name] = _ActionSpec(name, func, version)
+        return func
+    return decorator
+
+def fingerprint(obj):
+    """Get a fingerprint of the contents of some data.
+
+    Numpy arrays, polars data frames, `Epochs`, dicts, lists, tuples and
+    scalars are supported, nested to any depth.
+
+    Returns
+    -------
+    str
+        A hex digest that only depends on the contents of `obj`.
+    """
+    h = hashlib.blake2b(digest_size=16)
+    _updateFingerprint(h, obj)
+    return h.hexdigest()
+
+def _updateFingerprint(h, obj):
+    if isinstance(obj, np.ndarray):
+        h.update(f"ndarray{obj.dtype.str}{obj.shape}".encode())
+        if obj.dtype.hasobject:
+            for item in obj.ravel():
+                _updateFingerprint(h, item)
+        else:
+            h.update(np.ascontiguousarray(obj).data)
+    elif isinstance(obj, dict):
+        h.update(f"dict{len(obj)}".encode())
+        for key in sorted(obj.keys(), key=repr):
+            _updateFingerprint(h, key)
+            _updateFingerprint(h, obj[key])
+    elif isinstance(obj, (list, tuple)):
+        h.update(f"{type(obj).__name__}{len(obj)}".encode())
+        for item in obj:
+            _updateFingerprint(h, item)
+    elif isinstance(obj, pl.DataFrame):
+        h.update(f"DataFrame{obj.schema}".encode())
+        h.update(obj.hash_rows().to_numpy().data)
+    elif isinstance(obj, Epochs):
+        _updateFingerprint(h, vars(obj))
+    else:
+        h.update(repr(obj).encode())
+
+def fileFingerprint(filePath):
+    """Get a fingerprint of a file from its path, size and modification time.
+
+    Much cheaper than `fingerprint` for data loaded from a file, but changes
+    whenever the file is modified, even if its contents do not.
+    """
+    stat = os.stat(filePath)
+    return hashlib.blake2b(
+        f"{os.path.abspath(filePath)}|{stat.st_size}|{stat.st_mtime_ns}"
+        .encode(),
+        digest_size=16
+        ).hexdigest()
+
+class PipelineCache:
+    """Cache of the results of pipeline steps.
+
+    Results are kept in memory, evicting the least recently used results once
+    there are more than `maxItems`. If `cacheDir` is specified, results are
+    also written to (and read from) files in that directory, which are never
+    evicted.
+
+    Parameters
+    ----------
+    maxItems : int, default=32
+        The maximum number of results kept in memory.
+    cacheDir : str, optional
+        The directory to store results in on disk. Created if it does not
+        exist.
+
+    Attributes
+    ----------
+    hits, misses : int
+        The number of lookups that found or did not find a result.
+    """
+    def __init__(self, maxItems=32, cacheDir=None):
+        self.maxItems = maxItems
+        self.cacheDir = cacheDir
+        if cacheDir is not None:
+            os.makedirs(cacheDir, exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+        self.__items = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.__items)
+
+    def __contains__(self, key):
+        with self.__lock:
+            if key in self.__items:
+                return True
+        return self.cacheDir is not None and os.path.isfile(self.__path(key))
+
+    def __path(self, key):
+        return os.path.join(self.cacheDir, f"{key}.pkl")
+
+    def get(self, key, default=None):
+        """Get the result stored under `key`, or `default` if there is none."""
+        with self.__lock:
+            if key in self.__items:
+                self.__items.move_to_end(key)
+                self.hits += 1
+                return self.__items[key]
+
+        if self.cacheDir is not None and os.path.isfile(self.__path(key)):
+            with open(self.__path(key), "rb") as f:
+                value = pickle.load(f)
+            self.__remember(key, value)
+            with self.__lock:
+                self.hits += 1
+            return value
+
+        with self.__lock:
+            self.misses += 1
+        return default
+
+    def put(self, key, value):
+        """Store a result under `key`."""
+        self.__remember(key, value)
+        if self.cacheDir is not None:
+            path = self.__path(key)
+            tmpPath = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmpPath, "wb") as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmpPath, path)
+
+    def clear(self, disk=False):
+        """Remove all results from memory, and from disk if `disk` is True."""
+        with self.__lock:
+            self.__items.clear()
+        if disk and self.cacheDir is not None:
+            for fileName in os.listdir(self.cacheDir):
+                if fileName.endswith(".pkl"):
+                    os.remove(os.path.join(self.cacheDir, fileName))
+
+    def __remember(self, key, value):
+        with self.__lock:
+            self.__items[key] = value
+            self.__items.move_to_end(key)
+            while len(self.__items) > self.maxItems:
+                self.__items.popitem(last=False)
+
+# Cache shared by all pipes that are not given their own
+DEFAULT_CACHE = PipelineCache()
+
+class DataPipe:
+    """Data analysis pipeline
+
+    Maintains a list of "actions" that can be applied to data from a gradCPT
+    session. An action consists of a unique name and a function that accepts
+    gradCPT data as input, processes it in some way, and returns the
+    (potentially) modified gradCPT data. The pipeline follows the same
+    structure as a `list`. When executed, each action in the pipe will be
+    applied to the specified data in sequential order.
+
+    To use, create a `DataPipe` object, add or remove actions to the pipe
+    (`add`, `remove`, `clear`), and apply to gradCPT data (`execute`). The
+    pipe's contents can be obtained using `actions`, and a list of valid
+    actions can be obtained using `DataPipe.validActions`.
+
+    The result of each step is memoized (see the module documentation), so
+    executing the pipe again only recomputes the steps after the first one
+    that has changed.
+
+    Parameters
+    ----------
+    cache : PipelineCache, optional
+        The cache to store the results of each step in. By default, a cache
+        shared by all pipes is used. If False, results are not cached.
+
+    Attributes
+    ----------
+    actions : list of tuple
+        Names and parameters of all actions in the pipe.
+    """
+    def __init__(self, cache=None):
+        self._pipe = []
+        self.cache = (
+            DEFAULT_CACHE if cache is None
+            else None if cache is False
+            else cache
+            )
+
+    @staticmethod
+    def validActions():
+        """Get a list of all valid action names and their documentation."""
+        return [(name, spec.doc) for name, spec in _ACTIONS.items()]
+
+    @staticmethod
+    def actionParameters(action):
+        """Get the parameters of an action and their default values.
+
+        Required parameters have the default value `inspect.Parameter.empty`.
+        """
+        if action not in _ACTIONS:
+            raise ValueError(f"Invalid Action: {action}")
+        return _ACTIONS[action].parameters
+
+    @property
+    def actions(self):
+        """Names and parameters of all actions in the pipe."""
+        return [(action.name, dict(action.params)) for action in self._pipe]
+
+    def add(self, action, position=None, *args, **kwargs):
+        """Add an action to the pipe.
+
+        Parameters
+        ----------
+        action : str
+            The action to add. Must be a valid action.
+        position : int, optional
+            The index in the pipe where the action should be added (follows
+            `list` inexing). Behaviour is equivalent to that of the `insert`
+            method for python lists. If unspecified, the action is added to
+            the end of the pipe.
+        *args
+            Positional arguments required by action.
+        **kwargs
+            Keyword arguments required by action.
+
+        Returns
+        -------
+        self
+            The `DataPipe` object that called this method. Allows consecutive
+            calls to `add` to be chained together.
+        """
+        if not self.__isValidAction(action):
+            raise ValueError(f"Invalid Action: {action}")
+        _action = _Action(_ACTIONS[action], *args, **kwargs)
+        if position is None:
+            self._pipe.append(_action)
+        else:
+            self._pipe.insert(position, _action)
+
+        return self
+
+    def remove(self, position):
+        """Remove an action from the pipe.
+
+        Paramaters
+        ----------
+        position : int
+            The index in the pipe of the action to remove (follows `list`
+            indexing).
+        """
+        self._pipe.pop(position)
+
+    def clear(self):
+        """Remove all members from the pipe."""
+        self._pipe = []
+
+    def keys(self, inputKey):
+        """Get the cache key of the result of each step of the pipe.
+
+        Parameters
+        ----------
+        inputKey : str
+            The fingerprint of the pipe's input.
+
+        Returns
+        -------
+        list of str
+            The key of the result after each action, in order.
+        """
+        keys = []
+        key = inputKey
+        for action in self._pipe:
+            key = hashlib.blake2b(
+                f"{key}|{action.key}".encode(), digest_size=16
+                ).hexdigest()
+            keys.append(key)
+        return keys
+
+    def execute(
+            self, data, inputKey=None, numWorkers=None, timeout=None,
+            progress=None
+            ):
+        """Execute the pipe on the specified gradCPT data.
+
+        Each action in the pipe is applied to the data in sequential order
+        starting at the front of the pipe (in order of increasing index).
+        Steps whose results are cached are skipped.
+
+        `data` may also be a block or session, or a list of data, blocks and
+        sessions (eg. every session of a study), in which case the pipe is
+        applied to each of them across a pool of worker processes (see
+        `executeMany`).
+
+        Parameters
+        ----------
+        data : Any
+            The data to process (usually the streams of a block), or blocks
+            or sessions to process.
+        inputKey : str, optional
+            A fingerprint identifying `data` (eg. from `fileFingerprint`). If
+            unspecified, it is computed from the contents of `data` (see
+            `fingerprint`). Ignored for blocks and sessions.
+        numWorkers, timeout, progress
+            Options for processing blocks and sessions (see `executeMany`).
+        """
+        if isinstance(data, list) or _isBlock(data) or _isSession(data):
+            items = data if isinstance(data, list) else [data]
+            results = self.executeMany(
+                items, numWorkers=numWorkers, timeout=timeout,
+                progress=progress
+                )
+            return results if isinstance(data, list) else results[0]
+        return self.__executeOne(data, inputKey)
+
+    def __executeOne(self, data, inputKey=None):
+        if self.cache is None or len(self._pipe) == 0:
+            _data = data
+            for action in self._pipe:
+                _data = action.execute(_data)
+            return _data
+
+        if inputKey is None:
+            inputKey = fingerprint(data)
+        keys = self.keys(inputKey)
+
+        # Resume from the last step with a cached result
+        _data = data
+        start = 0
+        missing = object()
+        for k in range(len(keys) - 1, -1, -1):
+            cached = self.cache.get(keys[k], missing)
+            if cached is not missing:
+                _data = cached
+                start = k + 1
+                break
+
+        for k in range(start, len(self._pipe)):
+            _data = self._pipe[k].execute(_data)
+            self.cache.put(keys[k], _data)
+        return _data
+
+    def executeMany(self, items, numWorkers=None, timeout=None, progress=None):
+        """Execute the pipe on many inputs across a pool of processes.
+
+        Blocks are loaded from their data files by the workers. Arrays in
+        data passed directly, and in the results, are passed between
+        processes through shared memory.
+
+        A failure to process one input (eg. a corrupt data file, or a worker
+        process crashing) does not affect the others: its result is a
+        `PipeError` describing the failure. Blocks or data being processed
+        when a worker process crashes are retried once, one at a time, as the
+        crash may have been caused by another of them.
+
+        Results are stored in the pipe's cache (if any), and inputs whose
+        results are already in the cache are not processed again. If the
+        cache stores results on disk, the workers use it too.
+
+        Parameters
+        ----------
+        items : Iterable
+            The inputs to process. Each may be data (eg. the streams of a
+            block), a block (a `GradCPTBlock`, from `data_analysis.block`) or
+            a session (a `GradCPTSession`), whose blocks are all processed.
+        numWorkers : int, optional
+            The number of worker processes. Defaults to the number of CPUs.
+            If 0, inputs are processed one after the other in this process,
+            and `timeout` is ignored.
+        timeout : float, optional
+            The maximum time in seconds to spend processing each block or
+            data. Workers processing a block for longer are terminated.
+        progress : Callable[[int, int], None], optional
+            Called with the number of blocks or data processed so far and the
+            total number, every time one has been processed.
+
+        Returns
+        -------
+        list
+            The result for each input, in the same order as `items`. The
+            result for a session is a dict mapping the names of its blocks
+            to their results. The result for a block without data is None,
+            and the result for an input that could not be processed is a
+            `PipeError`.
+        """
+        items = list(items)
+        numWorkers = os.cpu_count() if numWorkers is None else numWorkers
+
+        # Split sessions into their blocks
+        tasks = []
+        for n, item in enumerate(items):
+            if _isSession(item):
+                for name, block in item.blocks.items():
+                    tasks.append(_Task(n, name, block))
+            else:
+                tasks.append(_Task(n, None, item))
+
+        results = [None] * len(tasks)
+        todo = []
+        for k, task in enumerate(tasks):
+            if task.isEmpty:
+                continue
+            if self.cache is not None and len(self._pipe) > 0:
+                cached = self.cache.get(self.keys(task.inputKey)[-1], task)
+                if cached is not task:
+                    results[k] = cached
+                    continue
+            todo.append(k)
+
+        numDone = len(tasks) - len(todo)
+        if progress is not None and numDone > 0:
+            progress(numDone, len(tasks))
+
+        def onResult(k, result):
+            nonlocal numDone
+            results[k] = result
+            if (
+                    self.cache is not None and len(self._pipe) > 0
+                    and not isinstance(result, PipeError)
+                    ):
+                self.cache.put(self.keys(tasks[k].inputKey)[-1], result)
+            numDone += 1
+            if progress is not None:
+                progress(numDone, len(tasks))
+
+        if numWorkers == 0:
+            for k in todo:
+                try:
+                    inputKey = (
+                        tasks[k].inputKey if self.cache is not None else None
+                        )
+                    onResult(
+                        k, self.__executeOne(tasks[k].load(), inputKey)
+                        )
+                except Exception as e:
+                    onResult(k, PipeError.fromException(tasks[k], e))
+        elif len(todo) > 0:
+            _runPool(self, tasks, todo, numWorkers, timeout, onResult)
+
+        # Reassemble the results of each input
+        out = [None] * len(items)
+        for task, result in zip(tasks, results):
+            if task.blockName is None:
+                out[task.index] = result
+            else:
+                if out[task.index] is None:
+                    out[task.index] = {}
+                out[task.index][task.blockName] = result
+        for n, item in enumerate(items):
+            if _isSession(item) and out[n] is None:
+                out[n] = {}
+        return out
+
+    @staticmethod
+    def __isValidAction(action):
+        """Check whether the specified action is valid."""
+        return action in _ACTIONS
+
+class _Action:
+    def __init__(self, spec, *args, **kwargs):
+        try:
+            bound = spec.signature.bind(None, *args, **kwargs)
+        except TypeError as e:
+            raise ValueError(
+                f"Invalid parameters for action '{spec.name}': {e}"
+                ) from None
+        bound.apply_defaults()
+        self.spec = spec
+        self.params = OrderedDict(list(bound.arguments.items())[1:])
+        self.key = json.dumps(
+            [spec.name, spec.version, self.params], sort_keys=True,
+            default=repr
+            )
+
+    @property
+    def name(self):
+        return self.spec.name
+
+    def execute(self, data):
+        return self.spec.func(data, **self.params)
+
+class PipeError(Exception):
+    """The failure to process one of the inputs of `DataPipe.executeMany`.
+
+    Attributes
+    ----------
+    index : int
+        The index of the input that failed.
+    blockName : str or None
+        The name of the block that failed, if the input is a session.
+    details : str
+        The traceback of the original error, if any.
+    """
+    def __init__(self, message, index=None, blockName=None, details=""):
+        super().__init__(message)
+        self.index = index
+        self.blockName = blockName
+        self.details = details
+
+    @classmethod
+    def fromTask(cls, task, message, details=""):
+        return cls(
+            f"Failed to process {task.description}: {message}",
+            index=task.index,
+            blockName=task.blockName,
+            details=details
+            )
+
+    @classmethod
+    def fromException(cls, task, e):
+        return cls.fromTask(
+            task, f"{type(e).__name__}: {e}", details=traceback.format_exc()
+            )
+
+def _isBlock(item):
+    return hasattr(item, "dataFile") and hasattr(item, "loadData")
+
+def _isSession(item):
+    return hasattr(item, "blocks") and not isinstance(item, dict)
+
+class _Task:
+    # A block or data to process, from the input at index `index` (of block
+    # `blockName`, if the input is a session)
+    def __init__(self, index, blockName, item):
+        self.index = index
+        self.blockName = blockName
+        self.payload = None
+        self.__inputKey = None
+        if _isBlock(item):
+            dataFile = item.dataFile
+            self.item = None
+            self.loader = type(item).loadData
+            self.dataFile = (
+                dataFile if dataFile is not None and os.path.isfile(dataFile)
+                else None
+                )
+            self.isEmpty = self.dataFile is None
+            self.description = f"'{dataFile}'"
+        else:
+            self.item = item
+            self.loader = None
+            self.dataFile = None
+            self.isEmpty = item is None
+            self.description = f"input {index}"
+
+    @property
+    def inputKey(self):
+        if self.__inputKey is None:
+            self.__inputKey = (
+                fileFingerprint(self.dataFile) if self.loader is not None
+                else fingerprint(self.item)
+                )
+        return self.__inputKey
+
+    def load(self):
+        return self.loader(self.dataFile) if self.loader else self.item
+
+# Arrays smaller than this are pickled rather than put in shared memory
+_SHARED_MIN_BYTES = 1 << 16
+
+class _SharedArray:
+    # Reference to an array stored in a shared memory block
+    def __init__(self, name, shape, dtype):
+        self.name = name
+        self.shape = shape
+        self.dtype = dtype
+
+def _toShared(obj, segments, names=None):
+    # Copy the large arrays in `obj` to new shared memory blocks (appended to
+    # `segments`) and replace them with references. Blocks are given the
+    # successive names from the iterator `names`, if any.
+    if (
+            isinstance(obj, np.ndarray) and not obj.dtype.hasobject
+            and obj.nbytes >= _SHARED_MIN_BYTES
+            ):
+        shm = shared_memory.SharedMemory(
+            name=next(names) if names is not None else None, create=True,
+            size=obj.nbytes
+            )
+        segments.append(shm)
+        np.ndarray(obj.shape, obj.dtype, buffer=shm.buf)[...] = obj
+        return _SharedArray(shm.name, obj.shape, obj.dtype.str)
+    if isinstance(obj, dict):
+        return {k : _toShared(v, segments, names) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(_toShared(v, segments, names) for v in obj)
+    if isinstance(obj, Epochs):
+        out = copy.copy(obj)
+        for k, v in vars(obj).items():
+            setattr(out, k, _toShared(v, segments, names))
+        return out
+    return obj
+
+def _sharedNames(prefix):
+    # Names of the shared memory blocks holding a task's output
+    return (f"{prefix}{i}" for i in itertools.count())
+
+def _unlinkOutput(prefix):
+    # Unlink the shared memory blocks of the output of a task whose result
+    # was never received (eg. because its worker was stopped after writing
+    # the output). Blocks are created in the order of their names, so the
+    # first missing name ends the output.
+    for name in _sharedNames(prefix):
+        try:
+            shm = shared_memory.SharedMemory(name=name)
+        except FileNotFoundError:
+            return
+        _closeShared([shm], unlink=True)
+
+def _fromShared(obj, segments, copyArrays):
+    # Replace references to arrays in shared memory with the arrays (or with
+    # read-only views of the shared memory, if not `copyArrays`). Shared
+    # memory blocks are attached and appended to `segments`.
+    if isinstance(obj, _SharedArray):
+        shm = shared_memory.SharedMemory(name=obj.name)
+        segments.append(shm)
+        view = np.ndarray(obj.shape, np.dtype(obj.dtype), buffer=shm.buf)
+        if copyArrays:
+            return view.copy()
+        view.flags.writeable = False
+        return view
+    if isinstance(obj, dict):
+        return {
+            k : _fromShared(v, segments, copyArrays) for k, v in obj.items()
+            }
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(_fromShared(v, segments, copyArrays) for v in obj)
+    if isinstance(obj, Epochs):
+        out = copy.copy(obj)
+        for k, v in vars(obj).items():
+            setattr(out, k, _fromShared(v, segments, copyArrays))
+        return out
+    return obj
+
+def _closeShared(segments, unlink):
+    for shm in segments:
+        try:
+            shm.close()
+        except BufferError:
+            # Views of the block still exist. It is unmapped once they are
+            # garbage collected.
+            pass
+        if unlink:
+            try:
+                shm.unlink()
+            except FileNotFoundError:
+                pass
+    segments.clear()
+
+def _runTask(
+        actions, cacheDir, loader, dataFile, payload, inputKey, outputPrefix
+        ):
+    # Process one block or data in a worker process. Returns (True, result),
+    # with the result's arrays in shared memory blocks named with
+    # `outputPrefix`, or (False, (message, traceback)) if processing failed.
+    inputSegments = []
+    outputSegments = []
+    try:
+        pipe = DataPipe(
+            cache=(
+                PipelineCache(maxItems=1, cacheDir=cacheDir)
+                if cacheDir is not None else False
+                )
+            )
+        for name, params in actions:
+            pipe.add(name, **params)
+        data = (
+            loader(dataFile) if loader is not None
+            else _fromShared(payload, inputSegments, copyArrays=False)
+            )
+        result = pipe.execute(data, inputKey=inputKey)
+        shared = _toShared(
+            result, outputSegments, _sharedNames(outputPrefix)
+            )
+        _closeShared(outputSegments, unlink=False)
+        return True, shared
+    except Exception as e:
+        _closeShared(outputSegments, unlink=True)
+        return False, (f"{type(e).__name__}: {e}", traceback.format_exc())
+    finally:
+        pipe = data = result = None
+        _closeShared(inputSegments, unlink=False)
+
+def _terminate(executor):
+    # Stop a process pool without waiting for running tasks (eg. ones that
+    # have timed out). `ProcessPoolExecutor` has no public way to do this.
+    processes = list(getattr(executor, "_processes", {}).values())
+    for process in processes:
+        process.terminate()
+    executor.shutdown(wait=False, cancel_futures=True)
+    for process in processes:
+        process.join()
+
+def _runPool(pipe, tasks, todo, numWorkers, timeout, onResult):
+    # Run the tasks at the indices `todo` on a process pool, calling
+    # `onResult` with the index and result of each task as it finishes. The
+    # pool is replaced whenever a task times out or a worker crashes.
+    actions = pipe.actions
+    cacheDir = pipe.cache.cacheDir if pipe.cache is not None else None
+
+    # Start the resource tracker before the workers, so that they share it
+    # and it does not remove shared memory blocks when a worker exits
+    resource_tracker.ensure_running()
+
+    pending = deque(todo)
+    crashes = dict.fromkeys(todo, 0)
+    inputs = {}
+    running = {}
+    executor = None
+    # Prefix of the names of the output blocks of each submitted task, so
+    # that the output of a task whose result is lost can be unlinked
+    outputs = {}
+    submissions = itertools.count()
+
+    def release(k):
+        _closeShared(inputs.pop(k, []), unlink=True)
+
+    def discard(keys):
+        # Unlink the output of tasks whose workers have been stopped
+        for k in keys:
+            _unlinkOutput(outputs.pop(k))
+
+    try:
+        while len(pending) > 0 or len(running) > 0:
+            if executor is None:
+                executor = ProcessPoolExecutor(
+                    max_workers=min(numWorkers, len(pending) + len(running))
+                    )
+            while len(pending) > 0 and len(running) < numWorkers:
+                # Tasks that were running when a worker crashed are retried
+                # alone, so that a crash is only blamed on the task causing it
+                if crashes[pending[0]] > 0 and len(running) > 0:
+                    break
+                if any(crashes[j] > 0 for j, _ in running.values()):
+                    break
+                k = pending.popleft()
+                task = tasks[k]
+                if task.loader is None and k not in inputs:
+                    inputs[k] = []
+                    task.payload = _toShared(task.item, inputs[k])
+                outputs[k] = f"dp{os.getpid()}_{next(submissions)}_"
+                future = executor.submit(
+                    _runTask, actions, cacheDir, task.loader, task.dataFile,
+                    task.payload,
+                    task.inputKey if cacheDir is not None else None,
+                    outputs[k]
+                    )
+                running[future] = (k, time.monotonic())
+
+            waitTime = None
+            if timeout is not None:
+                firstStart = min(t0 for _, t0 in running.values())
+                waitTime = max(firstStart + timeout - time.monotonic(), 0)
+            done, _ = wait(
+                running, timeout=waitTime, return_when=FIRST_COMPLETED
+                )
+
+            restart = False
+            # Tasks whose results were not received, and whose output is
+            # unlinked once their workers have stopped
+            lost = []
+            for future in done:
+                k, _ = running.pop(future)
+                try:
+                    ok, value = future.result()
+                except BrokenProcessPool:
+                    restart = True
+                    lost.append(k)
+                    crashes[k] += 1
+                    if crashes[k] < 2:
+                        pending.appendleft(k)
+                        continue
+                    release(k)
+                    onResult(k, PipeError.fromTask(
+                        tasks[k], "The worker process crashed."
+                        ))
+                    continue
+                except Exception as e:
+                    lost.append(k)
+                    release(k)
+                    onResult(k, PipeError.fromException(tasks[k], e))
+                    continue
+
+                outputs.pop(k)
+                release(k)
+                if ok:
+                    segments = []
+                    try:
+                        result = _fromShared(value, segments, copyArrays=True)
+                    finally:
+                        _closeShared(segments, unlink=True)
+                else:
+                    result = PipeError.fromTask(
+                        tasks[k], value[0], details=value[1]
+                        )
+                onResult(k, result)
+
+            if timeout is not None:
+                now = time.monotonic()
+                for future, (k, t0) in list(running.items()):
+                    if now - t0 >= timeout:
+                        running.pop(future)
+                        lost.append(k)
+                        release(k)
+                        onResult(k, PipeError.fromTask(
+                            tasks[k], f"Timed out after {timeout} s."
+                            ))
+                        restart = True
+
+            if restart:
+                # Resubmit the other running tasks to a new pool
+                for k, _ in running.values():
+                    pending.appendleft(k)
+                    lost.append(k)
+                running.clear()
+                _terminate(executor)
+                executor = None
+            # Every worker that ran a lost task has now finished or been
+            # stopped, so the task can no longer write its output
+            discard(lost)
+    finally:
+        if executor is not None:
+            if len(running) > 0:
+                _terminate(executor)
+                discard(k for k, _ in running.values())
+            else:
+                executor.shutdown()
+        for k in list(inputs.keys()):
+            release(k)
+
+def _channelNames(stream):
+    channels = stream['info']['desc'][0]['channels'][0]['channel']
+    return [c['label'][0] for c in channels]
+
+def _sampleRate(stream):
+    srate = stream['info'].get('effective_srate')
+    return srate if srate else estimateSampleRate(stream['time_stamps'])
+
+def _replaceStream(data, signalType, **items):
+    # Get a copy of the data in which the items of a stream are replaced.
+    # Other streams are shared with the original data.
+    if signalType not in data:
+        raise ValueError(f"No data for signal type: {signalType}")
+    stream = dict(data[signalType])
+    stream.update(items)
+    _data = dict(data)
+    _data[signalType] = stream
+    return _data
+
+def _channelIndex(names, channels):
+    missing = [c for c in channels if c not in names]
+    if len(missing) > 0:
+        raise ValueError(f"Invalid channel names: {missing}")
+    return [names.index(c) for c in channels]
+
+@registerAction("filter", version=2)
+def _filter(
+        data, lowFreq=None, highFreq=None, notchFreq=None, order=4,
+        signalType='eeg'
+        ):
+    """Filter a signal with zero-phase Butterworth and notch filters.
+
+    Parameters
+    ----------
+    lowFreq, highFreq : float, optional
+        The lower and upper cutoff frequencies in Hz. Specify only `lowFreq`
+        for a highpass filter, only `highFreq` for a lowpass filter, or both
+        for a bandpass filter.
+    notchFreq : float, optional
+        A frequency to remove with a notch filter (eg. 50 or 60 Hz line
+        noise).
+    order : int, default=4
+        The order of the filter.
+    signalType : str, default='eeg'
+        The signal to filter. Ignored for epochs.
+    """
+    filters = []
+    if lowFreq is not None and highFreq is not None:
+        filters.append(("bandpass", (lowFreq, highFreq)))
+    elif lowFreq is not None:
+        filters.append(("highpass", lowFreq))
+    elif highFreq is not None:
+        filters.append(("lowpass", highFreq))
+    if notchFreq is not None:
+        filters.append(("notch", notchFreq))
+    if len(filters) == 0:
+        raise ValueError(
+            "At least one of lowFreq, highFreq and notchFreq is required."
+            )
+
+    if isinstance(data, Epochs):
+        srate, x, axis = data.srate, data.data, -1
+    else:
+        stream = data[signalType]
+        srate, x, axis = _sampleRate(stream), stream['time_series'], 0
+    sos = designFilters(filters, srate, order=order)
+    y = zeroPhaseFilter(np.asarray(x, dtype=float), sos, axis=axis)
+
+    if isinstance(data, Epochs):
+        return _copyEpochs(data, y)
+    return _replaceStream(data, signalType, time_series=y)
+
+@registerAction("rereference")
+def _rereference(data, reference="average", signalType='eeg'):
+    """Rereference a signal.
+
+    Parameters
+    ----------
+    reference : "average" or list of str, default="average"
+        Subtract the average of all channels ("average") or of the specified
+        channels from every channel.
+    signalType : str, default='eeg'
+        The signal to rereference. Ignored for epochs.
+    """
+    if isinstance(data, Epochs):
+        x, names, axis = data.data, data.channelNames, 1
+    else:
+        stream = data[signalType]
+        x, names, axis = stream['time_series'], _channelNames(stream), 1
+    x = np.asarray(x, dtype=float)
+    index = (
+        slice(None) if reference == "average"
+        else _channelIndex(names, list(reference))
+        )
+    ref = np.take(x, np.arange(len(names))[index], axis=axis).mean(
+        axis=axis, keepdims=True
+        )
+
+    if isinstance(data, Epochs):
+        return _copyEpochs(data, x - ref)
+    return _replaceStream(data, signalType, time_series=x - ref)
+
+@registerAction("resample", version=2)
+def _resample(data, srate, signalType='eeg'):
+    """Resample a signal to a new, evenly spaced sample rate.
+
+    Uses polyphase filtering, so the signal is lowpass filtered to prevent
+    aliasing. The ratio between the new and original sample rates is
+    approximated by a fraction with a denominator of at most 1000. Each
+    segment of the signal between gaps (see `alignment.segmentBoundaries`)
+    is resampled separately, so that the gaps are kept.
+
+    Parameters
+    ----------
+    srate : float
+        The new sample rate in Hz.
+    signalType : str, default='eeg'
+        The signal to resample.
+    """
+    if isinstance(data, Epochs):
+        raise ValueError("'resample' must be applied before 'epoch'.")
+    stream = data[signalType]
+    origSrate = _sampleRate(stream)
+    ratio = Fraction(srate / origSrate).limit_denominator(1000)
+    newSrate = origSrate * ratio.numerator / ratio.denominator
+    x = np.asarray(stream['time_series'], dtype=float)
+    t = np.asarray(stream['time_stamps'], dtype=float)
+    bounds = segmentBoundaries(t)
+    segments, times, origIndex = [], [], []
+    for start, stop in zip(bounds[:-1], bounds[1:]):
+        y = spsignal.resample_poly(
+            x[start:stop], ratio.numerator, ratio.denominator, axis=0
+            )
+        n = np.arange(len(y))
+        segments.append(y)
+        times.append(t[start] + n / newSrate)
+        # The original sample at the start of each new sample
+        origIndex.append(np.minimum(
+            start + np.floor(n * origSrate / newSrate).astype(np.intp),
+            stop - 1
+            ))
+    if len(segments) == 0:
+        y, timestamps = x[:0], t[:0]
+        origIndex = np.empty(0, dtype=np.intp)
+    else:
+        y, timestamps = np.concatenate(segments), np.concatenate(times)
+        origIndex = np.concatenate(origIndex)
+    info = dict(stream['info'])
+    info['effective_srate'] = newSrate
+    info['nominal_srate'] = [str(newSrate)]
+    items = {'time_series' : y, 'time_stamps' : timestamps, 'info' : info}
+    if 'artifact_mask' in stream:
+        # Flag every new sample that overlaps a flagged original sample
+        width = max(int(np.ceil(origSrate / newSrate)), 1)
+        mask = stream['artifact_mask']
+        items['artifact_mask'] = sampleMaskToTrialMask(
+            np.concatenate((mask, np.zeros(width, dtype=bool))), origIndex,
+            width
+            )
+    return _replaceStream(data, signalType, **items)
+
+@registerAction("artifacts")
+def _artifacts(
+        data, amplitude=150.0, minStd=0.5, rails=None,
+        blinkChannels=("AF7", "AF8"), blinkThreshold=80.0, accThreshold=0.05,
+        gyrThreshold=10.0, padding=0.2, excludeChannels=None,
+        signalType='eeg'
+        ):
+    """Detect artifacts in a signal (see `artifacts.detectArtifacts`).
+
+    The flagged samples are stored with the signal (as its "artifact_mask"),
+    so that "epoch" marks the epochs that contain any for rejection. Should
+    be applied to the raw signal, before filtering.
+
+    Parameters
+    ----------
+    amplitude, minStd, rails, blinkChannels, blinkThreshold, accThreshold,
+    gyrThreshold, padding
+        See `artifacts.detectArtifacts`. Thresholds of None skip their
+        detector.
+    excludeChannels : list of str, optional
+        Channels whose artifacts are ignored.
+    signalType : str, default='eeg'
+        The signal to detect artifacts in.
+    """
+    if isinstance(data, Epochs):
+        raise ValueError("'artifacts' must be applied before 'epoch'.")
+    artifacts = detectArtifacts(
+        data, signalType=signalType, amplitude=amplitude, minStd=minStd,
+        rails=None if rails is None else tuple(rails),
+        blinkChannels=tuple(blinkChannels), blinkThreshold=blinkThreshold,
+        accThreshold=accThreshold, gyrThreshold=gyrThreshold, padding=padding
+        )
+    return _replaceStream(
+        data, signalType,
+        artifact_mask=artifacts.sampleMask(excludeChannels=excludeChannels)
+        )
+
+@registerAction("epoch", version=2)
+def _epoch(
+        data, marker="transition_period_start", tmin=-0.2, tmax=0.8,
+        baseline=None, signalType='eeg'
+        ):
+    """Cut epochs out of a signal around a marker (see `Epochs.fromSignal`).
+
+    If artifacts have been detected in the signal (see the "artifacts"
+    action), epochs containing any are marked for rejection.
+
+    Parameters
+    ----------
+    marker : str, default="transition_period_start"
+        The marker to cut epochs around. "response" uses the response marker
+        stream, any other marker the stimuli marker stream.
+    tmin, tmax : float, default=-0.2, 0.8
+        The start and end of each epoch in seconds, relative to its marker.
+    baseline : tuple of (float or None, float or None), optional
+        If specified, the baseline period used to baseline correct the
+        epochs.
+    signalType : str, default='eeg'
+        The signal to cut epochs out of.
+    """
+    if isinstance(data, Epochs):
+        raise ValueError("The data has already been epoched.")
+    markerStream = (
+        data['response_marker_stream'] if marker == "response"
+        else data['stimuli_marker_stream']
+        )
+    stream = data[signalType]
+    epochs = Epochs.fromSignal(
+        stream['time_series'],
+        stream['time_stamps'],
+        markerTimes(markerStream, marker),
+        tmin=tmin,
+        tmax=tmax,
+        srate=_sampleRate(stream),
+        channelNames=_channelNames(stream)
+        )
+    if 'artifact_mask' in stream:
+        epochs.markReject(sampleMask=stream['artifact_mask'])
+    if baseline is not None:
+        epochs.applyBaseline(tuple(baseline))
+    return epochs
+
+@registerAction("mean")
+def _mean(data, rejected=False):
+    """Average epochs across trials (eg. to get an event related potential).
+
+    Parameters
+    ----------
+    rejected : bool, default=False
+        Whether to include epochs that are marked for rejection.
+
+    Returns
+    -------
+    Epochs
+        A single epoch containing the average.
+    """
+    if not isinstance(data, Epochs):
+        raise ValueError("'mean' must be applied after 'epoch'.")
+    x = data.data if rejected else data.kept()
+    out = Epochs(
+        x.mean(axis=0, keepdims=True),
+        data.times,
+        np.array([np.nan]),
+        data.srate,
+        channelNames=data.channelNames
+        )
+    return out
+
+@registerAction("features", version=2)
+def _features(
+        data, bands=DEFAULT_BANDS, ratios=(), method="welch", relative=False,
+        log=False
+        ):
+    """Compute the power in frequency bands of every epoch and channel.
+
+    Power spectra are estimated for all epochs and channels at once (see
+    `features.spectralFeatures`).
+
+    Parameters
+    ----------
+    bands : tuple of (str, float, float)
+        The name, lower and upper frequency (in Hz) of each band.
+    ratios : tuple of (str, str), default=()
+        The numerator and denominator band of each ratio of band powers to
+        compute (eg. `[["theta", "beta"]]`).
+    method : {'welch', 'multitaper'}, default='welch'
+        How to estimate the spectra.
+    relative : bool, default=False
+        Whether to divide the power in each band by the total power.
+    log : bool, default=False
+        Whether to return the base 10 logarithm of the powers and ratios.
+
+    Returns
+    -------
+    polars.DataFrame
+        One row per epoch, with the columns "trial", "event_time", "reject"
+        and "[channel]_[band or ratio]" for every channel, band and ratio.
+    """
+    if not isinstance(data, Epochs):
+        raise ValueError("'features' must be applied after 'epoch'.")
+    return featureTable(
+        data, bands=tuple(map(tuple, bands)),
+        ratios=tuple(map(tuple, ratios)), method=method, relative=relative,
+        log=log
+        )
+
+def _copyEpochs(epochs, data):
+    # Get a copy of epochs with new data
+    out = Epochs(
+        data, epochs.times, epochs.eventTimes, epochs.srate,
+        channelNames=epochs.channelNames, starts=epochs.starts,
+        events=epochs.events
+        )
+    out.reject = epochs.reject.copy()
+    return out
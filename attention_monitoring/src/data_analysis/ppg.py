@@ -0,0 +1,638 @@
+"""Heart rate and heart rate variability (HRV) from Muse PPG.
+
+Heart beats are detected in the photoplethysmogram (PPG) as peaks of the
+bandpass filtered signal (see `filters.defaultFilters`) that are higher than
+a fraction of its rolling standard deviation and at least a refractory
+period apart. The time of each peak is refined by fitting a parabola to it
+and its neighbours, as the PPG (64 Hz) is sampled coarsely compared with
+the variability of the intervals between beats.
+
+The interval between consecutive beats (inter-beat interval, IBI) is only
+used if it is physiologically plausible and does not differ too much from
+the median of its neighbours (see `beatIntervals`), to ignore missed and
+spurious beats. The metrics are:
+
+- The heart rate (beats per minute), from the mean IBI.
+- SDNN, the standard deviation of the IBIs.
+- RMSSD, the root mean square of the differences between successive IBIs.
+
+`hrvMetrics` computes them for a whole block, and `windowMetrics` for any
+number of windows at once (eg. around each trial) from cumulative sums.
+`StreamingHRV` detects beats causally in a signal that arrives in chunks and
+updates the metrics at each beat, and `HeartRateMonitor` feeds it from the
+live Muse PPG stream. `replayPPG` feeds it a recorded stream, to get the
+beats that would have been detected live.
+"""
+from collections import deque
+import math
+import threading
+
+import numpy as np
+import polars as pl
+from pylsl import StreamInlet, resolve_byprop
+from scipy import signal as spsignal
+
+from .alignment import nominalRate
+from .artifacts import rollingStd
+from .epochs import estimateSampleRate
+from .filters import (
+    StreamingFilter, defaultFilters, designFilters, zeroPhaseFilter
+    )
+
+# The channel of the Muse PPG stream used by default (the infrared sensor;
+# the others are ambient light and red)
+PPG_CHANNEL = 1
+
+# Heart rates outside 30 to 200 beats per minute are implausible at rest
+MIN_IBI = 0.3
+MAX_IBI = 2.0
+
+def filterPPG(x, srate, order=2):
+    """Bandpass filter a PPG signal with zero phase.
+
+    Parameters
+    ----------
+    x : numpy.ndarray
+        The signal, with shape `(samples,)` or `(samples, channels)`.
+    srate : float
+        The sample rate of the signal.
+    order : int, default=2
+        The order of the filter (see `filters.designFilter`).
+
+    Returns
+    -------
+    numpy.ndarray
+        The filtered signal.
+    """
+    sos = designFilters(defaultFilters('ppg'), srate, order=order)
+    return zeroPhaseFilter(np.asarray(x, dtype=float), sos, axis=0)
+
+def _refinePeaks(x, peaks):
+    # Fit a parabola to each peak and its neighbours, and get the offset of
+    # its vertex from the peak (in samples, between -0.5 and 0.5)
+    inside = (peaks > 0) & (peaks < len(x) - 1)
+    offsets = np.zeros(len(peaks))
+    p = peaks[inside]
+    left, centre, right = x[p - 1], x[p], x[p + 1]
+    curvature = left - 2 * centre + right
+    with np.errstate(divide="ignore", invalid="ignore"):
+        offset = np.where(
+            curvature < 0, 0.5 * (left - right) / curvature, 0.0
+            )
+    offsets[inside] = np.clip(offset, -0.5, 0.5)
+    return offsets
+
+def detectBeats(
+        x, srate, refractory=MIN_IBI, threshold=0.5, stdWindow=5.0,
+        timestamps=None
+        ):
+    """Detect heart beats in a filtered PPG signal.
+
+    Parameters
+    ----------
+    x : numpy.ndarray
+        The filtered signal (see `filterPPG`), with shape `(samples,)`.
+    srate : float
+        The sample rate of the signal.
+    refractory : float, default=MIN_IBI
+        The minimum time in seconds between beats. Of peaks closer than
+        this, only the highest is kept.
+    threshold : float, default=0.5
+        Peaks lower than this fraction of the signal's rolling standard
+        deviation are ignored.
+    stdWindow : float, default=5.0
+        The length in seconds of the rolling standard deviation.
+    timestamps : numpy.ndarray, optional
+        The time stamp of each sample. Defaults to the time since the first
+        sample.
+
+    Returns
+    -------
+    indices : numpy.ndarray of int
+        The index of the sample at each beat.
+    times : numpy.ndarray
+        The time of each beat, between samples.
+    """
+    x = np.asarray(x, dtype=float)
+    if len(x) < 3:
+        return np.empty(0, dtype=np.intp), np.empty(0)
+    height = threshold * rollingStd(x, stdWindow * srate)
+    peaks, _ = spsignal.find_peaks(
+        x, height=height, distance=max(int(refractory * srate), 1)
+        )
+    offsets = _refinePeaks(x, peaks)
+    if timestamps is None:
+        times = (peaks + offsets) / srate
+    else:
+        timestamps = np.asarray(timestamps, dtype=float)
+        # Interpolate between the time stamps of the neighbouring samples
+        neighbour = np.clip(
+            peaks + np.sign(offsets).astype(np.intp), 0, len(x) - 1
+            )
+        times = timestamps[peaks] + np.abs(offsets) * (
+            timestamps[neighbour] - timestamps[peaks]
+            )
+    return peaks, times
+
+def beatIntervals(beatTimes, minIBI=MIN_IBI, maxIBI=MAX_IBI, maxChange=0.3):
+    """Get the intervals between consecutive beats and whether they are valid.
+
+    Parameters
+    ----------
+    beatTimes : numpy.ndarray
+        The time of each beat, in seconds.
+    minIBI, maxIBI : float, default=MIN_IBI, MAX_IBI
+        Intervals outside this range (in seconds) are invalid.
+    maxChange : float, default=0.3
+        Intervals that differ from the median of the five intervals around
+        them by more than this fraction of it are invalid (eg. when a beat
+        was missed or a spurious beat detected).
+
+    Returns
+    -------
+    ibi : numpy.ndarray
+        The interval ending at each beat after the first, in seconds.
+    valid : numpy.ndarray of bool
+        Whether each interval is valid.
+    """
+    ibi = np.diff(np.asarray(beatTimes, dtype=float))
+    valid = (ibi >= minIBI) & (ibi <= maxIBI)
+    if len(ibi) >= 5:
+        padded = np.pad(ibi, 2, mode="edge")
+        median = np.median(
+            np.lib.stride_tricks.sliding_window_view(padded, 5), axis=1
+            )
+        valid &= np.abs(ibi - median) <= maxChange * median
+    return ibi, valid
+
+def _metrics(n, sumIBI, sumSquares, numDiffs, sumDiffSquares):
+    # The heart rate and HRV metrics from the sums of valid intervals (in
+    # seconds), their squares and the squared differences between successive
+    # valid intervals
+    n, sumIBI, sumSquares, numDiffs, sumDiffSquares = (
+        np.asarray(v, dtype=float)
+        for v in (n, sumIBI, sumSquares, numDiffs, sumDiffSquares)
+        )
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean = np.where(n > 0, sumIBI / n, np.nan)
+        variance = np.where(
+            n > 1, (sumSquares - n * mean * mean) / (n - 1), np.nan
+            )
+        rmssd = np.where(
+            numDiffs > 0, np.sqrt(sumDiffSquares / numDiffs), np.nan
+            )
+    return {
+        "num_beats" : n.astype(np.int64),
+        "hr_bpm" : 60 / mean,
+        "mean_ibi_ms" : mean * 1000,
+        "sdnn_ms" : np.sqrt(np.maximum(variance, 0)) * 1000,
+        "rmssd_ms" : rmssd * 1000
+        }
+
+def _successiveDiffs(ibi, valid):
+    # The squared difference between each interval and the previous one,
+    # and whether both are valid
+    diffs = np.zeros(len(ibi))
+    both = np.zeros(len(ibi), dtype=bool)
+    diffs[1:] = np.diff(ibi) ** 2
+    both[1:] = valid[1:] & valid[:-1]
+    return diffs, both
+
+def hrvMetrics(ibi, valid=None):
+    """Get the heart rate and HRV of a series of inter-beat intervals.
+
+    Parameters
+    ----------
+    ibi : numpy.ndarray
+        The intervals, in seconds (see `beatIntervals`).
+    valid : numpy.ndarray of bool, optional
+        Whether each interval is valid. Invalid intervals are ignored, and
+        successive differences only use consecutive valid intervals.
+
+    Returns
+    -------
+    dict
+        The number of valid intervals ("num_beats"), the heart rate
+        ("hr_bpm"), the mean interval ("mean_ibi_ms"), "sdnn_ms" and
+        "rmssd_ms". Metrics that cannot be computed are NaN.
+    """
+    ibi = np.asarray(ibi, dtype=float)
+    valid = np.ones(len(ibi), dtype=bool) if valid is None else valid
+    diffs, both = _successiveDiffs(ibi, valid)
+    v = ibi[valid]
+    metrics = _metrics(
+        len(v), v.sum(), (v * v).sum(), both.sum(), diffs[both].sum()
+        )
+    return {
+        k : int(m) if k == "num_beats" else float(m)
+        for k, m in metrics.items()
+        }
+
+def windowMetrics(beatTimes, ibi, valid, starts, stops):
+    """Get the heart rate and HRV in any number of time windows at once.
+
+    An interval is in a window if the beat that ends it is.
+
+    Parameters
+    ----------
+    beatTimes : numpy.ndarray
+        The time of each beat (see `detectBeats`).
+    ibi, valid : numpy.ndarray
+        The intervals ending at each beat after the first and whether they
+        are valid (see `beatIntervals`).
+    starts, stops : numpy.ndarray
+        The start (inclusive) and end (exclusive) time of each window.
+
+    Returns
+    -------
+    polars.DataFrame
+        One row per window, with the columns "window_start", "window_stop"
+        and the metrics of `hrvMetrics`.
+    """
+    ends = np.asarray(beatTimes, dtype=float)[1:]
+    ibi = np.asarray(ibi, dtype=float)
+    valid = np.asarray(valid, dtype=bool)
+    starts = np.asarray(starts, dtype=float)
+    stops = np.asarray(stops, dtype=float)
+    diffs, both = _successiveDiffs(ibi, valid)
+
+    # Sums over the intervals in each window, from cumulative sums
+    w = valid.astype(float)
+    sums = np.zeros((len(ibi) + 1, 5))
+    np.cumsum(
+        np.column_stack((w, w * ibi, w * ibi * ibi, both, both * diffs)),
+        axis=0, out=sums[1:]
+        )
+    lo = np.searchsorted(ends, starts, side="left")
+    hi = np.searchsorted(ends, stops, side="left")
+    # The difference of the first interval of a window uses the interval
+    # before the window
+    lo2 = np.minimum(lo + 1, hi)
+    window = sums[hi] - sums[lo]
+    diffSums = sums[hi, 3:] - sums[lo2, 3:]
+    metrics = _metrics(
+        window[:, 0].round().astype(np.int64), window[:, 1], window[:, 2],
+        diffSums[:, 0].round(), diffSums[:, 1]
+        )
+    return pl.DataFrame({
+        "window_start" : starts, "window_stop" : stops, **metrics
+        })
+
+def analyzePPG(
+        stream, channel=PPG_CHANNEL, refractory=MIN_IBI, threshold=0.5,
+        maxChange=0.3
+        ):
+    """Detect the heart beats of a PPG stream and their intervals.
+
+    Parameters
+    ----------
+    stream : dict
+        The PPG stream (eg. `GradCPTBlock.data['ppg']`).
+    channel : int, default=PPG_CHANNEL
+        The channel to use.
+    refractory, threshold
+        See `detectBeats`.
+    maxChange
+        See `beatIntervals`.
+
+    Returns
+    -------
+    dict
+        The time of each beat ("beat_times"), the interval ending at each
+        beat after the first ("ibi", in seconds), whether it is valid
+        ("valid") and the metrics of the whole stream ("metrics", see
+        `hrvMetrics`).
+    """
+    timestamps = np.asarray(stream['time_stamps'], dtype=float)
+    x = np.asarray(stream['time_series'], dtype=float)
+    x = x[:, channel] if x.ndim == 2 else x
+    srate = (
+        stream['info'].get('effective_srate')
+        or estimateSampleRate(timestamps)
+        )
+    _, beatTimes = detectBeats(
+        filterPPG(x, srate), srate, refractory=refractory,
+        threshold=threshold, timestamps=timestamps
+        )
+    ibi, valid = beatIntervals(beatTimes, maxChange=maxChange)
+    return {
+        "beat_times" : beatTimes,
+        "ibi" : ibi,
+        "valid" : valid,
+        "metrics" : hrvMetrics(ibi, valid)
+        }
+
+class StreamingHRV:
+    """Detect heart beats in a PPG signal that arrives in chunks.
+
+    The signal is bandpass filtered causally (see `filters.StreamingFilter`),
+    which delays it by about a tenth of a second. A peak is confirmed as a
+    beat once no higher sample has followed it within the refractory period,
+    so every beat is reported at most `refractory` seconds (plus the filter
+    delay and the time to receive the chunk) after it occurred. The
+    threshold of `detectBeats` uses an exponentially weighted estimate of
+    the signal's standard deviation, updated at every sample, so that the
+    beats do not depend on how the signal is split into chunks.
+
+    Metrics are computed over the last `numIntervals` intervals, updated
+    with constant work per beat. Intervals are checked as in
+    `beatIntervals`, but against the median of the previous five intervals
+    in the plausible range only.
+
+    Parameters
+    ----------
+    srate : float
+        The sample rate of the signal.
+    refractory, threshold, stdWindow
+        See `detectBeats`. `stdWindow` is the time constant of the standard
+        deviation estimate.
+    numIntervals : int, default=30
+        The number of intervals the metrics are computed over.
+    minIBI, maxIBI, maxChange
+        See `beatIntervals`.
+    """
+    def __init__(
+            self, srate, refractory=MIN_IBI, threshold=0.5, stdWindow=5.0,
+            numIntervals=30, minIBI=MIN_IBI, maxIBI=MAX_IBI, maxChange=0.3
+            ):
+        self.srate = srate
+        self.refractory = refractory
+        self.threshold = threshold
+        self.numIntervals = numIntervals
+        self.minIBI = minIBI
+        self.maxIBI = maxIBI
+        self.maxChange = maxChange
+        self.__filter = StreamingFilter(
+            designFilters(defaultFilters('ppg'), srate, order=2)
+            )
+        self.__alpha = 1 - math.exp(-1 / (stdWindow * srate))
+        self.__distance = max(int(refractory * srate), 1)
+        self.reset()
+
+    def reset(self):
+        """Forget the signal and beats so far (eg. after a gap)."""
+        self.__filter.reset()
+        self.__variance = None
+        self.__buffer = np.empty(0)
+        self.__bufferTimes = np.empty(0)
+        self.__heights = np.empty(0)
+        self.__lastBeat = None
+        self.__lastBeatIndex = -self.__distance
+        self.__numSamples = 0
+        # Valid intervals in the window, and their running sums
+        self.__intervals = deque()
+        self.__recent = deque(maxlen=5)
+        self.__sum = 0.0
+        self.__sumSquares = 0.0
+        self.__diffs = deque()
+        self.__numDiffs = 0
+        self.__sumDiffSquares = 0.0
+        self.__previous = None
+
+    def __std(self, y):
+        # The exponentially weighted standard deviation at each sample
+        if self.__variance is None:
+            self.__variance = float(y[0] * y[0])
+        decay = 1 - self.__alpha
+        variance, _ = spsignal.lfilter(
+            [self.__alpha], [1, -decay], y * y, zi=[decay * self.__variance]
+            )
+        self.__variance = float(variance[-1])
+        return np.sqrt(variance)
+
+    def process(self, chunk, timestamps):
+        """Process the next chunk of the signal.
+
+        Parameters
+        ----------
+        chunk : numpy.ndarray
+            The next samples of the channel to use, with shape `(samples,)`.
+        timestamps : numpy.ndarray
+            The time stamp of each sample.
+
+        Returns
+        -------
+        list of dict
+            One item per beat confirmed in this chunk (see `update`).
+        """
+        chunk = np.asarray(chunk, dtype=float)
+        if len(chunk) == 0:
+            return []
+        y = self.__filter.process(chunk)
+        first = self.__numSamples - len(self.__buffer)
+        self.__buffer = np.concatenate((self.__buffer, y))
+        self.__heights = np.concatenate((
+            self.__heights, self.threshold * self.__std(y)
+            ))
+        self.__bufferTimes = np.concatenate((
+            self.__bufferTimes, np.asarray(timestamps, dtype=float)
+            ))
+        self.__numSamples += len(y)
+
+        # Samples within the refractory period of the last beat cannot be
+        # beats, nor hide later beats
+        candidates = self.__buffer.copy()
+        candidates[:max(self.__lastBeatIndex + self.__distance - first, 0)] = (
+            -np.inf
+            )
+        peaks, _ = spsignal.find_peaks(
+            candidates, height=self.__heights, distance=self.__distance
+            )
+        # Peaks whose refractory period has passed
+        confirmed = peaks[peaks + self.__distance < len(self.__buffer)]
+        offsets = _refinePeaks(self.__buffer, confirmed)
+        beats = []
+        for peak, offset in zip(confirmed, offsets):
+            neighbour = peak + (1 if offset > 0 else -1)
+            t = self.__bufferTimes[peak] + abs(offset) * (
+                self.__bufferTimes[neighbour] - self.__bufferTimes[peak]
+                )
+            self.__lastBeatIndex = first + peak
+            beats.append(self.update(t))
+
+        # Keep the samples that pending peaks are compared with
+        keep = max(len(self.__buffer) - 2 * self.__distance - 1, 0)
+        self.__buffer = self.__buffer[keep:]
+        self.__bufferTimes = self.__bufferTimes[keep:]
+        self.__heights = self.__heights[keep:]
+        return beats
+
+    def update(self, beatTime):
+        """Add a beat and update the metrics.
+
+        Parameters
+        ----------
+        beatTime : float
+            The time of the beat.
+
+        Returns
+        -------
+        dict
+            The "time" of the beat, the interval ending at it ("ibi_ms", or
+            None for the first beat), whether it is "valid", and the metrics
+            over the window of recent valid intervals (see `hrvMetrics`).
+        """
+        ibi = None if self.__lastBeat is None else beatTime - self.__lastBeat
+        self.__lastBeat = beatTime
+        valid = ibi is not None and self.minIBI <= ibi <= self.maxIBI
+        if valid and len(self.__recent) > 0:
+            median = float(np.median(self.__recent))
+            valid = abs(ibi - median) <= self.maxChange * median
+        if ibi is not None and self.minIBI <= ibi <= self.maxIBI:
+            self.__recent.append(ibi)
+
+        if valid:
+            self.__intervals.append(ibi)
+            self.__sum += ibi
+            self.__sumSquares += ibi * ibi
+            diff = None if self.__previous is None else (
+                (ibi - self.__previous) ** 2
+                )
+            self.__diffs.append(diff)
+            if diff is not None:
+                self.__numDiffs += 1
+                self.__sumDiffSquares += diff
+            if len(self.__intervals) > self.numIntervals:
+                old = self.__intervals.popleft()
+                self.__sum -= old
+                self.__sumSquares -= old * old
+                self.__diffs.popleft()
+                # The difference of the new first interval involves an
+                # interval that is no longer in the window
+                first = self.__diffs[0]
+                if first is not None:
+                    self.__numDiffs -= 1
+                    self.__sumDiffSquares -= first
+                    self.__diffs[0] = None
+        self.__previous = ibi if valid else None
+
+        metrics = _metrics(
+            len(self.__intervals), self.__sum, self.__sumSquares,
+            self.__numDiffs, max(self.__sumDiffSquares, 0.0)
+            )
+        return {
+            "time" : beatTime,
+            "ibi_ms" : None if ibi is None else ibi * 1000,
+            "valid" : valid,
+            **{
+                k : int(m) if k == "num_beats" else float(m)
+                for k, m in metrics.items()
+                }
+            }
+
+def replayPPG(stream, channel=PPG_CHANNEL, chunkDuration=0.05, **kwargs):
+    """Detect the heart beats of a recorded PPG stream as they are live.
+
+    The stream is fed to `StreamingHRV` in chunks, at its nominal sample
+    rate, as `attention_model.AttentionMonitor` does during a run, so that
+    the beats match those detected live. `analyzePPG` filters the whole
+    stream with zero phase instead, which detects beats at different times.
+
+    Parameters
+    ----------
+    stream : dict
+        The PPG stream (eg. `GradCPTBlock.data['ppg']`).
+    channel : int, default=PPG_CHANNEL
+        The channel to use.
+    chunkDuration : float, default=0.05
+        The duration in seconds of each chunk.
+    **kwargs
+        Passed to `StreamingHRV`.
+
+    Returns
+    -------
+    dict
+        The time of each beat ("beat_times"), the interval ending at each
+        beat after the first ("ibi", in seconds) and whether it is valid
+        ("valid"), as returned by `analyzePPG`.
+    """
+    timestamps = np.asarray(stream['time_stamps'], dtype=float)
+    x = np.asarray(stream['time_series'], dtype=float)
+    x = x[:, channel] if x.ndim == 2 else x
+    srate = nominalRate(stream)
+    hrv = StreamingHRV(srate, **kwargs)
+    size = max(int(round(chunkDuration * srate)), 1)
+    beats = []
+    for start in range(0, len(x), size):
+        beats.extend(hrv.process(
+            x[start:start + size], timestamps[start:start + size]
+            ))
+    return {
+        "beat_times" : np.array([b["time"] for b in beats], dtype=float),
+        "ibi" : np.array(
+            [b["ibi_ms"] / 1000 for b in beats[1:]], dtype=float
+            ),
+        "valid" : np.array([b["valid"] for b in beats[1:]], dtype=bool)
+        }
+
+class HeartRateMonitor:
+    """Compute the heart rate and HRV live from the Muse PPG stream.
+
+    Reads the PPG stream in a background thread, and calls `callback` at
+    every beat (see `StreamingHRV`). The detector is reset after gaps in the
+    stream.
+
+    Parameters
+    ----------
+    callback : Callable[[dict], None]
+        Called from the background thread at each beat, with the dict
+        returned by `StreamingHRV.update` and the delay between the beat and
+        the last sample received when it was detected ("latency_s").
+    streamType : str, default="PPG"
+        The type of the PPG stream.
+    channel : int, default=PPG_CHANNEL
+        The channel to use.
+    gapThreshold : float, default=0.5
+        The time in seconds between samples after which the detector is
+        reset.
+    **kwargs
+        Passed to `StreamingHRV`.
+    """
+    def __init__(
+            self, callback, streamType="PPG", channel=PPG_CHANNEL,
+            gapThreshold=0.5, **kwargs
+            ):
+        self.callback = callback
+        self.streamType = streamType
+        self.channel = channel
+        self.gapThreshold = gapThreshold
+        self.__kwargs = kwargs
+        self.hrv = None
+        self.__stopEvent = threading.Event()
+        self.__thread = None
+
+    def __enter__(self):
+        self.__thread = threading.Thread(
+            target=self.__watch, name="heart-rate-monitor", daemon=True
+            )
+        self.__thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_tb):
+        self.__stopEvent.set()
+        self.__thread.join()
+
+    def __watch(self):
+        streams = []
+        while len(streams) == 0:
+            if self.__stopEvent.is_set():
+                return
+            streams = resolve_byprop("type", self.streamType, timeout=0.5)
+        inlet = StreamInlet(streams[0])
+        srate = inlet.info().nominal_srate()
+        self.hrv = StreamingHRV(srate, **self.__kwargs)
+
+        lastTime = None
+        while not self.__stopEvent.is_set():
+            samples, timestamps = inlet.pull_chunk(timeout=0.05)
+            if len(samples) == 0:
+                continue
+            timestamps = np.asarray(timestamps, dtype=float)
+            if lastTime is not None and (
+                    timestamps[0] - lastTime > self.gapThreshold
+                    ):
+                self.hrv.reset()
+            lastTime = timestamps[-1]
+            x = np.asarray(samples, dtype=float)[:, self.channel]
+            for beat in self.hrv.process(x, timestamps):
+                self.callback({**beat, "latency_s" : lastTime - beat["time"]})
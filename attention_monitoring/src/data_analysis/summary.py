@@ -0,0 +1,439 @@
+"""Study-wide summary of the behaviour and EEG of every block.
+
+`summarizeStudy` finds every session of a study (in
+`src/data/[study type]/sessions`), computes summary metrics for each of
+their recorded blocks across a pool of worker processes, and writes them to a
+single Parquet table with one row per block:
+
+- The behaviour in the block (see `behaviour.blockSummary`).
+- The mean log10 power in each frequency band of each EEG channel, and the
+  mean ratios of band powers, over the block's trials without artifacts
+  (see `pipeline`, the "artifacts" and "features" actions).
+- The heart rate and HRV of the block, from its PPG (see `ppg`).
+
+Summaries are updated incrementally. Each row records a fingerprint of the
+analysis settings, of the size and modification time of the block's input
+files (its data file and stimulus sequence file) and a hash of their
+contents. When the table is updated, blocks whose settings and input files
+are unchanged are not analyzed again. If an input file's size or
+modification time has changed but its contents have not (eg. it was copied),
+the block is only hashed, not analyzed again. The incremental updates
+(`updateBlocks`) can be used to process blocks in other ways.
+"""
+import csv
+import hashlib
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+
+import numpy as np
+import polars as pl
+
+from .behaviour import blockInputs, blockSummary, trialTable
+from .block import GradCPTBlock
+from .features import DEFAULT_RATIOS
+from .pipeline import DataPipe, fileFingerprint, fingerprint
+from .ppg import analyzePPG
+
+# Increment when the metrics change, so that existing summaries are updated
+SUMMARY_VERSION = 2
+
+_BEHAVIOUR_COLUMNS = [
+    "num_trials", "num_common", "num_rare", "commission_rate",
+    "omission_rate", "mean_rt_ms", "rt_cv", "d_prime", "criterion"
+    ]
+
+def defaultPipeline():
+    """Get the pipeline used to compute EEG features of each trial.
+
+    Returns
+    -------
+    DataPipe
+        A pipe (without a cache) that detects artifacts in the raw EEG,
+        filters, average references and epochs it around stimulus onsets
+        (marking epochs with artifacts for rejection), then computes the
+        log10 power in each frequency band and the ratios of band powers of
+        each epoch.
+    """
+    return (
+        DataPipe(cache=False)
+        .add("artifacts")
+        .add("filter", lowFreq=1, highFreq=40)
+        .add("rereference")
+        .add("epoch", tmin=0.0, tmax=0.8)
+        .add("features", log=True, ratios=DEFAULT_RATIOS)
+        )
+
+def hashFile(filePath, chunkSize=2**20):
+    """Get the SHA-256 hash of the contents of a file."""
+    h = hashlib.sha256()
+    with open(filePath, "rb") as f:
+        for chunk in iter(lambda: f.read(chunkSize), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def _combine(parts):
+    return hashlib.blake2b(
+        "|".join(str(p) for p in parts).encode(), digest_size=16
+        ).hexdigest()
+
+def findBlocks(studyDir, errors=None):
+    """Find every recorded block of every session of a study.
+
+    Parameters
+    ----------
+    studyDir : str
+        The study's data directory (eg. `src/data/gradCPT`).
+    errors : dict, optional
+        If specified, the reason each session that could not be read was
+        skipped is added to it, mapped to by the session's directory.
+
+    Returns
+    -------
+    list of dict
+        One item per block whose data file exists, with the block's session
+        info ("session_name", "session_id", "participant_id", "date",
+        "stim_transition_time_ms", "stim_static_time_ms"), "block_index",
+        "block_name", "data_file" and "stim_sequence_file".
+    """
+    sessionsDir = os.path.join(studyDir, "sessions")
+    if not os.path.isdir(sessionsDir):
+        return []
+    errors = {} if errors is None else errors
+    blocks = []
+    for entry in sorted(os.scandir(sessionsDir), key=lambda e: e.name):
+        infoFile = os.path.join(entry.path, "info.json")
+        if not entry.is_dir() or not os.path.isfile(infoFile):
+            continue
+        try:
+            with open(infoFile, "r") as f:
+                info = json.load(f)
+            with open(info["blocks_file"], "r", newline="") as f:
+                rows = list(csv.DictReader(f))
+        except (OSError, ValueError, KeyError) as E:
+            errors[entry.path] = f"{type(E).__name__}: {E}"
+            continue
+
+        sessionInfo = {
+            key : info.get(key) for key in [
+                "session_name", "session_id", "participant_id", "date",
+                "stim_transition_time_ms", "stim_static_time_ms"
+                ]
+            }
+        for k, row in enumerate(rows):
+            if row["data_file"] == "" or not os.path.isfile(row["data_file"]):
+                continue
+            blocks.append({
+                **sessionInfo,
+                "block_index" : k,
+                "block_name" : row["block_name"],
+                "data_file" : row["data_file"],
+                "stim_sequence_file" : row["stim_sequence_file"]
+                })
+    return blocks
+
+def inputFiles(block):
+    """Get the input files of a block (see `findBlocks`) that exist."""
+    return [
+        f for f in (block["data_file"], block["stim_sequence_file"])
+        if f != "" and os.path.isfile(f)
+        ]
+
+def _runTask(task, block, args, knownHash):
+    # Run a task on a block in a worker process, unless the hash of the
+    # block's input files is `knownHash` (ie. the block is unchanged)
+    inputsHash = _combine(hashFile(f) for f in inputFiles(block))
+    if inputsHash == knownHash:
+        return inputsHash, None
+    return inputsHash, task(block, *args)
+
+def updateBlocks(
+        blocks, task, settings, previous, args=(), numWorkers=None,
+        force=False, progress=None
+        ):
+    """Run a task on the blocks of a study that are new or have changed.
+
+    A block is skipped if its settings, and the size and modification time
+    of its input files (see `inputFiles`), are those recorded when it was
+    last processed. If only the size or modification time of its input
+    files has changed, the block is hashed and only processed if their
+    contents have changed too. Blocks are processed across a pool of worker
+    processes.
+
+    Parameters
+    ----------
+    blocks : list of dict
+        The blocks (see `findBlocks`). A fingerprint of each block's
+        settings ("settings_key") and of the size and modification time of
+        its input files ("inputs_stat") are added to it, as well as the
+        hash of their contents ("inputs_hash") if the block was hashed.
+    task : Callable
+        The function that processes a block, called in a worker process as
+        `task(block, *args)`. Must be defined at the top level of a module.
+    settings : Callable[[dict], object]
+        Gets the settings a block is processed with, as an object that can
+        be fingerprinted (see `pipeline.fingerprint`).
+    previous : Callable[[dict], dict]
+        Gets the record of the last time a block was processed, with its
+        "settings_key", "inputs_stat" and "inputs_hash", or None if it has
+        not been processed.
+    args : tuple, optional
+        The other arguments of `task`.
+    numWorkers : int, optional
+        The number of worker processes. Defaults to the number of CPUs. If
+        0, blocks are processed one after the other in this process.
+    force : bool, default=False
+        Whether to process every block, even if it has not changed.
+    progress : Callable[[int, int], None], optional
+        Called with the number of blocks hashed or processed so far and the
+        number to check, every time a block has been checked.
+
+    Yields
+    ------
+    block : dict
+        A block, in order for unchanged blocks, then as they are checked.
+    old : dict
+        Its previous record, or None.
+    status : str
+        "unchanged" if its settings and input files have not changed,
+        "hashed" if only the size or modification time of its input files
+        has changed, otherwise "processed" or "failed".
+    result
+        The result of `task` if the block was processed, or the exception
+        it raised if it failed.
+    """
+    tasks = []
+    for block in blocks:
+        block["settings_key"] = fingerprint(settings(block))
+        block["inputs_stat"] = _combine(
+            fileFingerprint(f) for f in inputFiles(block)
+            )
+        old = None if force else previous(block)
+        if old is not None and old["settings_key"] == block["settings_key"]:
+            if old["inputs_stat"] == block["inputs_stat"]:
+                yield block, old, "unchanged", None
+                continue
+            tasks.append((block, old))
+        else:
+            tasks.append((block, None))
+
+    def results():
+        # The result of each task, or the exception it raised, as they
+        # complete
+        taskArgs = [
+            (task, block, args, None if old is None else old["inputs_hash"])
+            for block, old in tasks
+            ]
+        if numWorkers == 0:
+            for k in range(len(tasks)):
+                try:
+                    yield k, _runTask(*taskArgs[k])
+                except Exception as E:
+                    yield k, E
+            return
+        # Workers are spawned rather than forked, as polars (used by the
+        # workers to read stimulus sequences) can deadlock in a process
+        # forked after polars has been used (eg. to read previous results)
+        with ProcessPoolExecutor(
+                numWorkers, mp_context=multiprocessing.get_context("spawn")
+                ) as pool:
+            futures = {
+                pool.submit(_runTask, *taskArgs[k]) : k
+                for k in range(len(tasks))
+                }
+            for future in as_completed(futures):
+                try:
+                    yield futures[future], future.result()
+                except Exception as E:
+                    yield futures[future], E
+
+    for numDone, (k, result) in enumerate(results(), start=1):
+        block, old = tasks[k]
+        if progress is not None:
+            progress(numDone, len(tasks))
+        if isinstance(result, Exception):
+            yield block, old, "failed", result
+            continue
+        block["inputs_hash"], result = result
+        if result is None:
+            yield block, old, "hashed", None
+        else:
+            yield block, old, "processed", result
+
+def _summarizeBlock(block, actions):
+    # Summarize a block in a worker process
+    gradCPTBlock = GradCPTBlock(
+        block["block_name"], "", 0, block["stim_sequence_file"],
+        block["data_file"]
+        )
+    data = gradCPTBlock.data
+    if data is None:
+        raise FileNotFoundError(f"Data file not found: {block['data_file']}")
+    row = {}
+
+    # Behaviour
+    inputs = blockInputs(
+        gradCPTBlock,
+        block["stim_transition_time_ms"],
+        block["stim_static_time_ms"],
+        sessionName=block["session_name"]
+        )
+    trials = trialTable([inputs])
+    if len(trials) > 0:
+        summary = blockSummary(trials)
+        row.update(summary.select(_BEHAVIOUR_COLUMNS).row(0, named=True))
+
+    # Heart rate and HRV
+    if 'ppg' in data and len(data['ppg']['time_stamps']) > 0:
+        metrics = analyzePPG(data['ppg'])["metrics"]
+        row.update({
+            f"ppg_{k}" : metrics[k]
+            for k in ("hr_bpm", "sdnn_ms", "rmssd_ms")
+            })
+
+    # Mean band power of each EEG channel over the trials that were not
+    # rejected
+    if 'eeg' in data and len(actions) > 0:
+        eeg = data['eeg']
+        row["duration_s"] = float(
+            np.max(eeg['time_stamps']) - np.min(eeg['time_stamps'])
+            )
+        pipe = DataPipe(cache=False)
+        for action, params in actions:
+            pipe.add(action, **params)
+        features = pipe.execute(data).filter(~pl.col("reject"))
+        row["num_epochs"] = len(features)
+        for column in features.columns:
+            if column not in ("trial", "event_time", "reject"):
+                row[f"eeg_{column}"] = (
+                    float(features[column].mean()) if len(features) > 0
+                    else None
+                    )
+    return row
+
+def summarizeStudy(
+        studyDir, outputFile=None, pipeline=None, numWorkers=None,
+        force=False, progress=None
+        ):
+    """Summarize every recorded block of a study in a Parquet table.
+
+    Only blocks that are new, or whose input files or analysis settings
+    have changed since `outputFile` was last written, are analyzed. Rows of
+    blocks that no longer exist are removed.
+
+    Parameters
+    ----------
+    studyDir : str
+        The study's data directory (eg. `src/data/gradCPT`).
+    outputFile : str, optional
+        The Parquet file to write. Defaults to "summary.parquet" in
+        `studyDir`.
+    pipeline : DataPipe, optional
+        The pipeline used to compute EEG features of each trial (see
+        `defaultPipeline`, the default). Must end with the "features" action.
+    numWorkers : int, optional
+        The number of worker processes. Defaults to the number of CPUs. If
+        0, blocks are analyzed one after the other in this process.
+    force : bool, default=False
+        Whether to analyze every block, even if it has not changed.
+    progress : Callable[[int, int], None], optional
+        Called with the number of blocks analyzed so far and the number to
+        analyze, every time a block has been analyzed.
+
+    Returns
+    -------
+    table : polars.DataFrame
+        The summary of every block, as written to `outputFile`.
+    stats : dict
+        The number of blocks that were "analyzed", "unchanged" (including
+        those that only needed to be hashed) and "failed", and the reason
+        for each failure ("errors", mapping `(session name, block name)`, or
+        the directory of a session that could not be read, to a message).
+        Failed blocks, and the blocks of sessions that could not be read,
+        keep their previous summary, if any, and are analyzed again next
+        time.
+    """
+    outputFile = (
+        os.path.join(studyDir, "summary.parquet") if outputFile is None
+        else outputFile
+        )
+    pipeline = defaultPipeline() if pipeline is None else pipeline
+    actions = pipeline.actions
+    # Includes the version of each action
+    pipelineKey = pipeline.keys("")[-1] if len(actions) > 0 else ""
+
+    stats = {"analyzed" : 0, "unchanged" : 0, "failed" : 0, "errors" : {}}
+    blocks = findBlocks(studyDir, errors=stats["errors"])
+    unread = {os.path.abspath(path) for path in stats["errors"]}
+    previous = {}
+    if os.path.isfile(outputFile):
+        for row in pl.read_parquet(outputFile).iter_rows(named=True):
+            previous[(row["session_name"], row["block_name"])] = row
+
+    analyzedAt = datetime.now().isoformat(timespec="seconds")
+    rows = {}
+    for block, old, status, result in updateBlocks(
+            blocks, _summarizeBlock,
+            lambda block: [
+                SUMMARY_VERSION, pipelineKey,
+                block["stim_transition_time_ms"],
+                block["stim_static_time_ms"]
+                ],
+            lambda block: previous.get(
+                (block["session_name"], block["block_name"])
+                ),
+            args=(actions,), numWorkers=numWorkers, force=force,
+            progress=progress
+            ):
+        key = (block["session_name"], block["block_name"])
+        if status == "failed":
+            stats["failed"] += 1
+            stats["errors"][key] = f"{type(result).__name__}: {result}"
+            # Keep the previous summary, which is analyzed again next time
+            # as its fingerprints are not updated
+            if key in previous:
+                rows[key] = previous[key]
+        elif status == "processed":
+            rows[key] = {
+                **{k : v for k, v in block.items() if k not in (
+                    "stim_transition_time_ms", "stim_static_time_ms"
+                    )},
+                **result,
+                "analyzed_at" : analyzedAt
+                }
+            stats["analyzed"] += 1
+        else:
+            rows[key] = {**old, "inputs_stat" : block["inputs_stat"]}
+            stats["unchanged"] += 1
+
+    # Write the table in session and block order, replacing the previous one
+    # only once it has been written completely. The blocks of sessions that
+    # could not be read keep their previous summary (session directories are
+    # named after their session).
+    ordered = [
+        rows[key] for key in (
+            (b["session_name"], b["block_name"]) for b in blocks
+            ) if key in rows
+        ]
+    ordered += [
+        row for (sessionName, _), row in previous.items()
+        if os.path.abspath(os.path.join(studyDir, "sessions", sessionName))
+        in unread
+        ]
+    ordered.sort(key=lambda row: row["session_name"] or "")
+    table = (
+        pl.from_dicts(ordered, infer_schema_length=None) if len(ordered) > 0
+        else pl.DataFrame(schema={
+            column : pl.Utf8 for column in (
+                "session_name", "block_name", "settings_key", "inputs_stat",
+                "inputs_hash"
+                )
+            })
+        )
+    os.makedirs(os.path.dirname(os.path.abspath(outputFile)), exist_ok=True)
+    tmpFile = f"{outputFile}.tmp"
+    table.write_parquet(tmpFile)
+    os.replace(tmpFile, outputFile)
+    return table, stats
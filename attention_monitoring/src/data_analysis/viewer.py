@@ -0,0 +1,501 @@
+"""Interactive viewer for scrolling through long recordings.
+
+Plotting a whole multi-hour recording at once (eg. with
+`GradCPTBlock.display`) holds the whole signal in memory and draws every
+sample before anything can be inspected. Instead, a `ScrollViewer` only shows
+a fixed-width window of the recording, with its markers, and scrolls through
+it with the keyboard, mouse wheel or a slider.
+
+The signal is stored on disk as memory-mapped `.npy` files (`SignalStore`),
+and read in fixed-width windows through a `WindowCache`, which keeps the most
+recently used windows in memory (bounding the memory used regardless of the
+length of the recording) and loads the windows adjacent to the one being
+viewed on a background thread, so that they are ready before scrolling
+reaches them.
+"""
+import json
+import logging
+import math
+import os
+import queue
+import threading
+from collections import OrderedDict
+
+import matplotlib.pyplot as plt
+import numpy as np
+from matplotlib.collections import LineCollection
+from matplotlib.widgets import Slider
+
+_log = logging.getLogger(__name__)
+
+from .decimate import MinMaxPyramid
+
+class SignalStore:
+    """Time stamps and samples of a signal, memory-mapped from disk.
+
+    A store is a directory containing `time_stamps.npy` (shape
+    `(samples,)`), `time_series.npy` (shape `(samples, channels)`) and
+    `info.json` (the channel names). Only the parts of the signal that are
+    accessed are read from disk.
+
+    Parameters
+    ----------
+    directory : str
+        The directory of the store.
+    mode : {'r', 'r+'}, default='r'
+        The mode in which to open the files (see `numpy.memmap`).
+
+    Attributes
+    ----------
+    timeStamps : numpy.memmap
+        The (sorted) time of each sample.
+    timeSeries : numpy.memmap
+        The samples, with shape `(samples, channels)`.
+    channelNames : list of str
+        The name of each channel.
+    """
+    def __init__(self, directory, mode="r"):
+        self.directory = directory
+        self.timeStamps = np.load(
+            os.path.join(directory, "time_stamps.npy"), mmap_mode=mode
+            )
+        self.timeSeries = np.load(
+            os.path.join(directory, "time_series.npy"), mmap_mode=mode
+            )
+        with open(os.path.join(directory, "info.json"), "r") as f:
+            self.channelNames = json.load(f)['channel_names']
+
+    @classmethod
+    def create(cls, directory, timeStamps, numChannels, channelNames=None):
+        """Create a store whose samples are to be written.
+
+        Parameters
+        ----------
+        directory : str
+            The directory of the store, which is created if it does not exist.
+            Any existing store in it is overwritten.
+        timeStamps : numpy.ndarray
+            The (sorted) time of each sample.
+        numChannels : int
+            The number of channels.
+        channelNames : list of str, optional
+            The name of each channel. Defaults to the index of each channel.
+
+        Returns
+        -------
+        SignalStore
+            The store, opened for writing (mode 'r+'), with uninitialized
+            samples.
+        """
+        timeStamps = np.asarray(timeStamps, dtype=float).ravel()
+        if np.any(np.diff(timeStamps) < 0):
+            raise ValueError("timeStamps must be sorted.")
+        channelNames = (
+            [str(k) for k in range(numChannels)] if channelNames is None
+            else list(channelNames)
+            )
+        if len(channelNames) != numChannels:
+            raise ValueError(
+                f"Expected {numChannels} channel names: {channelNames}"
+                )
+
+        os.makedirs(directory, exist_ok=True)
+        np.save(os.path.join(directory, "time_stamps.npy"), timeStamps)
+        np.lib.format.open_memmap(
+            os.path.join(directory, "time_series.npy"), mode="w+",
+            dtype=float, shape=(len(timeStamps), numChannels)
+            ).flush()
+        with open(os.path.join(directory, "info.json"), "w") as f:
+            json.dump({'channel_names' : channelNames}, f)
+        return cls(directory, mode="r+")
+
+    @classmethod
+    def fromArrays(
+            cls, directory, timeStamps, timeSeries, channelNames=None,
+            chunkSize=2**16
+            ):
+        """Create a store from a signal in memory.
+
+        Parameters
+        ----------
+        directory, timeStamps, channelNames
+            See `create`.
+        timeSeries : numpy.ndarray
+            The samples, with shape `(samples, channels)`.
+        chunkSize : int, default=65536
+            The number of samples to write at a time.
+
+        Returns
+        -------
+        SignalStore
+            The store, opened for reading.
+        """
+        timeSeries = np.asarray(timeSeries)
+        if timeSeries.ndim == 1:
+            timeSeries = timeSeries[:, np.newaxis]
+        store = cls.create(
+            directory, timeStamps, timeSeries.shape[1],
+            channelNames=channelNames
+            )
+        for start in range(0, len(timeSeries), chunkSize):
+            store.timeSeries[start:start + chunkSize] = (
+                timeSeries[start:start + chunkSize]
+                )
+        store.close()
+        return cls(directory)
+
+    def __len__(self):
+        return len(self.timeStamps)
+
+    @property
+    def numChannels(self):
+        return self.timeSeries.shape[1]
+
+    @property
+    def startTime(self):
+        return float(self.timeStamps[0]) if len(self) > 0 else 0.0
+
+    @property
+    def endTime(self):
+        return float(self.timeStamps[-1]) if len(self) > 0 else 0.0
+
+    def read(self, start, stop):
+        """Read the samples between two times into memory.
+
+        Parameters
+        ----------
+        start, stop : float
+            The range of times to read, including `start` and excluding
+            `stop`.
+
+        Returns
+        -------
+        x : numpy.ndarray
+            The time of each sample.
+        y : numpy.ndarray
+            The samples, with shape `(samples, channels)`.
+        """
+        first, last = np.searchsorted(self.timeStamps, [start, stop])
+        return (
+            np.array(self.timeStamps[first:last]),
+            np.array(self.timeSeries[first:last])
+            )
+
+    def flush(self):
+        """Write any changes to the samples to disk."""
+        if isinstance(self.timeSeries, np.memmap):
+            self.timeSeries.flush()
+
+    def close(self):
+        """Write any changes and release the memory maps."""
+        self.flush()
+        self.timeStamps = self.timeSeries = None
+
+class WindowCache:
+    """Cache of fixed-width windows of a `SignalStore`, with prefetching.
+
+    Window `k` holds the samples from `store.startTime + k * windowSize`
+    (inclusive) to `store.startTime + (k + 1) * windowSize` (exclusive). At
+    most `maxWindows` windows are kept in memory, discarding the least
+    recently used. Windows can be loaded ahead of time on a background thread
+    with `prefetch`. A window that fails to load on the background thread is
+    logged and skipped, and loading it again is left to `get`.
+
+    Parameters
+    ----------
+    store : SignalStore
+        The signal.
+    windowSize : float
+        The width of each window, in seconds.
+    maxWindows : int, default=16
+        The maximum number of windows to keep in memory.
+    """
+    def __init__(self, store, windowSize, maxWindows=16):
+        if windowSize <= 0:
+            raise ValueError(f"windowSize must be positive: {windowSize}")
+        if maxWindows < 1:
+            raise ValueError(f"maxWindows must be at least 1: {maxWindows}")
+        self.store = store
+        self.windowSize = float(windowSize)
+        self.maxWindows = maxWindows
+        self.numWindows = math.floor(
+            (store.endTime - store.startTime) / self.windowSize
+            ) + 1
+
+        self.__windows = OrderedDict()
+        self.__loading = {}
+        self.__lock = threading.Lock()
+        self.__requests = queue.Queue()
+        self.__thread = threading.Thread(target=self.__prefetchLoop, daemon=True)
+        self.__thread.start()
+
+    def windowIndex(self, t):
+        """Get the index of the window containing a time."""
+        k = math.floor((t - self.store.startTime) / self.windowSize)
+        return min(max(k, 0), self.numWindows - 1)
+
+    def get(self, index):
+        """Get a window, loading it if it is not in memory.
+
+        Parameters
+        ----------
+        index : int
+            The index of the window.
+
+        Returns
+        -------
+        tuple of (numpy.ndarray, numpy.ndarray)
+            The time of each sample and the samples (see `SignalStore.read`).
+            These must not be modified.
+        """
+        if not 0 <= index < self.numWindows:
+            raise IndexError(f"Invalid window index: {index}")
+        while True:
+            with self.__lock:
+                if index in self.__windows:
+                    self.__windows.move_to_end(index)
+                    return self.__windows[index]
+                loading = self.__loading.get(index)
+                if loading is None:
+                    loading = self.__loading[index] = threading.Event()
+                    break
+            # Wait for the window to be loaded by the prefetch thread
+            loading.wait()
+        return self.__load(index, loading)
+
+    def __load(self, index, loading):
+        try:
+            start = self.store.startTime + index * self.windowSize
+            window = self.store.read(start, start + self.windowSize)
+            for array in window:
+                array.flags.writeable = False
+            with self.__lock:
+                self.__windows[index] = window
+                while len(self.__windows) > self.maxWindows:
+                    self.__windows.popitem(last=False)
+            return window
+        finally:
+            with self.__lock:
+                del self.__loading[index]
+            loading.set()
+
+    def prefetch(self, indices):
+        """Load windows on the background thread, if not already loaded.
+
+        Parameters
+        ----------
+        indices : Iterable of int
+            The indices of the windows to load, in order of priority. Invalid
+            indices are ignored.
+        """
+        for index in indices:
+            if 0 <= index < self.numWindows:
+                self.__requests.put(index)
+
+    def __prefetchLoop(self):
+        while True:
+            index = self.__requests.get()
+            if index is None:
+                return
+            with self.__lock:
+                if index in self.__windows or index in self.__loading:
+                    continue
+                loading = self.__loading[index] = threading.Event()
+            try:
+                self.__load(index, loading)
+            except Exception:
+                # Keep prefetching the other windows
+                _log.exception("Failed to prefetch window %s", index)
+
+    def __contains__(self, index):
+        with self.__lock:
+            return index in self.__windows
+
+    def __len__(self):
+        with self.__lock:
+            return len(self.__windows)
+
+    def close(self):
+        """Stop the prefetch thread."""
+        self.__requests.put(None)
+        self.__thread.join()
+
+class ScrollViewer:
+    """Scroll through a long recording, one window at a time.
+
+    Each channel is plotted on its own axis, with markers drawn as vertical
+    lines across every axis. Scroll with the left and right arrow keys (a
+    quarter of the view), page up and page down (the whole view), home and
+    end, the mouse wheel or the slider below the plot. Views containing more
+    than a few samples per pixel are decimated (see `decimate.MinMaxPyramid`).
+
+    Parameters
+    ----------
+    store : SignalStore
+        The signal.
+    markers : list of tuple of (numpy.ndarray, dict), optional
+        The time of each marker of each category of markers, with the keyword
+        arguments used to plot them (eg. `{'color' : 'r'}`), passed to
+        `matplotlib.collections.LineCollection`.
+    width : float, default=10.0
+        The width of the view, in seconds.
+    fig : matplotlib.figure.Figure, optional
+        The figure to plot on. Defaults to a new figure. Scrolling is
+        smoothest if the figure has no layout engine.
+    startTime : float, optional
+        The time plotted as 0 s. Defaults to the time of the first sample.
+    maxWindows : int, default=16
+        The maximum number of windows (each as wide as the view) to keep in
+        memory (see `WindowCache`).
+    numPrefetch : int, default=2
+        The number of windows to load ahead of the view in each direction.
+    **kwargs
+        Passed to `ax.plot` for every channel.
+    """
+    def __init__(
+            self, store, markers=None, width=10.0, fig=None, startTime=None,
+            maxWindows=16, numPrefetch=2, **kwargs
+            ):
+        self.store = store
+        self.width = float(width)
+        self.startTime = store.startTime if startTime is None else startTime
+        self.numPrefetch = numPrefetch
+        self.cache = WindowCache(
+            store, self.width, maxWindows=max(maxWindows, 2 * numPrefetch + 2)
+            )
+
+        # A fixed layout, as laying out the figure again (eg. with
+        # constrained layout) on every scroll takes longer than drawing it
+        self.fig = fig if fig is not None else plt.figure()
+        gs = self.fig.add_gridspec(
+            store.numChannels + 1, hspace=0,
+            height_ratios=[1] * store.numChannels + [0.1],
+            left=0.1, right=0.97, bottom=0.06, top=0.92
+            )
+        self.axs = [self.fig.add_subplot(gs[0])]
+        for k in range(1, store.numChannels):
+            self.axs.append(self.fig.add_subplot(
+                gs[k], sharex=self.axs[0], sharey=self.axs[0]
+                ))
+        kwargs.setdefault("linewidth", 1)
+        self.lines = []
+        for ax, channelName in zip(self.axs, store.channelNames):
+            self.lines.append(ax.plot([], [], **kwargs)[0])
+            ax.set_ylabel(channelName)
+        for ax in self.axs[:-1]:
+            ax.tick_params(labelbottom=False)
+        self.axs[-1].set_xlabel("Time (s)")
+
+        # Markers, relative to `startTime` and sorted so that the visible
+        # markers can be found by bisection
+        self.markers = []
+        for times, markerKwargs in (markers if markers is not None else []):
+            times = np.sort(np.asarray(times, dtype=float).ravel())
+            collections = [
+                ax.add_collection(
+                    LineCollection(
+                        [], transform=ax.get_xaxis_transform(), **markerKwargs
+                        ),
+                    autolim=False
+                    )
+                for ax in self.axs
+                ]
+            self.markers.append((times - self.startTime, collections))
+
+        duration = store.endTime - store.startTime
+        offset = store.startTime - self.startTime
+        self.slider = Slider(
+            self.fig.add_subplot(gs[-1]), "", offset,
+            offset + max(duration - self.width, 0), valinit=offset
+            )
+        self.slider.valtext.set_visible(False)
+        self.slider.drawon = False
+        self.slider.on_changed(self.__onSlider)
+        self.fig.canvas.mpl_connect("key_press_event", self.__onKey)
+        self.fig.canvas.mpl_connect("scroll_event", self.__onScroll)
+
+        self.position = None
+        self.__backward = False
+        self.scrollTo(offset)
+
+    def scrollTo(self, t):
+        """Show the view starting at a time.
+
+        Parameters
+        ----------
+        t : float
+            The start of the view, in seconds (relative to `startTime`). It is
+            clamped to the recording.
+        """
+        t = min(max(t, self.slider.valmin), self.slider.valmax)
+        if self.position is not None and t != self.position:
+            self.__backward = t < self.position
+        self.position = t
+        start, stop = t + self.startTime, t + self.startTime + self.width
+
+        # The windows overlapping the view, then the adjacent windows, those
+        # in the direction of the last scroll first
+        first = self.cache.windowIndex(start)
+        last = self.cache.windowIndex(stop)
+        windows = [self.cache.get(k) for k in range(first, last + 1)]
+        x = np.concatenate([w[0] for w in windows])
+        y = np.concatenate([w[1] for w in windows])
+        ahead = [last + n for n in range(1, self.numPrefetch + 1)]
+        behind = [first - n for n in range(1, self.numPrefetch + 1)]
+        self.cache.prefetch(
+            behind + ahead if self.__backward else ahead + behind
+            )
+
+        mask = np.logical_and(x >= start, x < stop)
+        x, y = x[mask] - self.startTime, y[mask]
+        numBins = max(int(self.axs[0].bbox.width), 100)
+        if len(x) > 2 * numBins:
+            x, y = MinMaxPyramid(x, y).query(t, t + self.width, numBins)
+        for k, line in enumerate(self.lines):
+            line.set_data(x, y[:, k])
+
+        for times, collections in self.markers:
+            a, b = np.searchsorted(times, [t, t + self.width])
+            segments = np.empty((b - a, 2, 2))
+            segments[:, :, 0] = times[a:b, np.newaxis]
+            segments[:, 0, 1] = 0
+            segments[:, 1, 1] = 1
+            for collection in collections:
+                collection.set_segments(segments)
+
+        self.axs[0].set_xlim(t, t + self.width)
+        if len(y) > 0:
+            low, high = np.nanmin(y), np.nanmax(y)
+            margin = 0.05 * (high - low) if high > low else 1.0
+            self.axs[0].set_ylim(low - margin, high + margin)
+
+        # Keep the slider in sync without scrolling again
+        if self.slider.val != t:
+            self.slider.eventson = False
+            self.slider.set_val(t)
+            self.slider.eventson = True
+        self.fig.canvas.draw_idle()
+
+    def scroll(self, amount):
+        """Scroll by a number of views (negative to scroll backwards)."""
+        self.scrollTo(self.position + amount * self.width)
+
+    def __onSlider(self, val):
+        self.scrollTo(val)
+
+    def __onKey(self, event):
+        steps = {
+            "right" : 0.25, "left" : -0.25,
+            "pagedown" : 1, "pageup" : -1,
+            "end" : math.inf, "home" : -math.inf
+            }
+        if event.key in steps:
+            self.scroll(steps[event.key])
+
+    def __onScroll(self, event):
+        self.scroll(-0.25 * event.step)
+
+    def close(self):
+        """Stop prefetching and close the figure."""
+        self.cache.close()
+        plt.close(self.fig)
@@ -0,0 +1,605 @@
+"""The variance time course (VTC) of gradCPT reaction times.
+
+The VTC (Esterman et al., 2013) measures how much each trial's reaction time
+deviates from the mean reaction time of its block:
+
+1. Only reaction times of correct responses to common (go) targets are used.
+   Missing reaction times (omission errors and rare targets) are linearly
+   interpolated from the closest surrounding trials.
+2. The absolute deviation of each reaction time from the block's mean is
+   divided by the block's standard deviation.
+3. The deviations are smoothed with a Gaussian kernel.
+4. Trials with a VTC at or below the block's median are "in the zone" (stable
+   performance), and trials above it are "out of the zone".
+
+`varianceTimeCourse` computes the VTC of any number of blocks at once, with a
+single convolution over all of them. `StreamingVTC` updates the VTC one trial
+at a time with constant work per trial, using a causal (half-Gaussian)
+kernel, running estimates of the mean and standard deviation (Welford's
+algorithm) and a running estimate of the median (the P² algorithm of Jain and
+Chlamtac, 1985). `VTCMonitor` feeds it from the live gradCPT marker streams.
+"""
+from collections import deque
+from functools import lru_cache
+import math
+import threading
+
+import numpy as np
+import polars as pl
+from pylsl import StreamInlet, resolve_byprop
+
+from .behaviour import UNAMBIGUOUS_END, assignResponses
+
+@lru_cache(maxsize=32)
+def gaussianKernel(fwhm, truncate=3.0, causal=False):
+    """Get a Gaussian smoothing kernel.
+
+    Parameters
+    ----------
+    fwhm : float
+        The full width at half maximum of the kernel, in trials.
+    truncate : float, default=3.0
+        The kernel is truncated at this many standard deviations.
+    causal : bool, default=False
+        If True, only return the half of the kernel for the current and
+        previous trials, starting with the current trial. Otherwise, the
+        kernel is symmetric around its centre.
+
+    Returns
+    -------
+    numpy.ndarray
+        The (unnormalized, read-only) kernel weights.
+    """
+    if fwhm <= 0:
+        raise ValueError(f"fwhm must be positive: {fwhm}")
+    sigma = fwhm / (2 * math.sqrt(2 * math.log(2)))
+    halfWidth = max(int(math.ceil(truncate * sigma)), 1)
+    lags = np.arange(0 if causal else -halfWidth, halfWidth + 1)
+    kernel = np.exp(-0.5 * (lags / sigma) ** 2)
+    kernel.flags.writeable = False
+    return kernel
+
+def interpolateMissing(values, blockStarts):
+    """Linearly interpolate missing (NaN) values within blocks.
+
+    Values before the first or after the last valid value of a block take
+    the value of that valid value. Blocks without any valid values stay NaN.
+
+    Parameters
+    ----------
+    values : numpy.ndarray
+        The values of every trial of every block, concatenated.
+    blockStarts : numpy.ndarray of int
+        The index of the first trial of each block, in increasing order.
+
+    Returns
+    -------
+    numpy.ndarray
+        The values, with missing values interpolated.
+    """
+    values = np.asarray(values, dtype=float)
+    n = len(values)
+    index = np.arange(n)
+    valid = ~np.isnan(values)
+    blockID = np.cumsum(np.isin(index, blockStarts)) - 1
+    starts = np.asarray(blockStarts)[blockID]
+    ends = np.append(np.asarray(blockStarts)[1:], n)[blockID]
+
+    # The previous and next valid value of each trial, within its block
+    prev = np.maximum.accumulate(np.where(valid, index, -1))
+    nxt = np.minimum.accumulate(np.where(valid, index, n)[::-1])[::-1]
+    hasPrev = prev >= starts
+    hasNext = nxt < ends
+    prevValue = values[np.clip(prev, 0, n - 1)]
+    nextValue = values[np.clip(nxt, 0, n - 1)]
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        frac = (index - prev) / (nxt - prev)
+        between = prevValue + frac * (nextValue - prevValue)
+    return np.where(
+        valid, values,
+        np.where(
+            hasPrev & hasNext, between,
+            np.where(hasPrev, prevValue, np.where(hasNext, nextValue, np.nan))
+            )
+        )
+
+def smoothBlocks(values, blockStarts, kernel):
+    """Smooth values within blocks with a symmetric kernel.
+
+    All blocks are smoothed with a single convolution, by separating them
+    with gaps as wide as the kernel. The kernel is renormalized at the edges
+    of each block and around missing (NaN) values.
+
+    Parameters
+    ----------
+    values : numpy.ndarray
+        The values of every trial of every block, concatenated.
+    blockStarts : numpy.ndarray of int
+        The index of the first trial of each block, in increasing order.
+    kernel : numpy.ndarray
+        The kernel weights, with an odd length (eg. from `gaussianKernel`).
+
+    Returns
+    -------
+    numpy.ndarray
+        The smoothed values.
+    """
+    values = np.asarray(values, dtype=float)
+    halfWidth = len(kernel) // 2
+    if len(values) == 0:
+        return values.copy()
+
+    # Position of each trial in the gapped signal
+    blockID = np.cumsum(np.isin(np.arange(len(values)), blockStarts)) - 1
+    position = np.arange(len(values)) + halfWidth * (blockID + 1)
+    gapped = np.zeros(len(values) + halfWidth * (blockID[-1] + 2))
+    weights = np.zeros_like(gapped)
+    valid = ~np.isnan(values)
+    gapped[position[valid]] = values[valid]
+    weights[position[valid]] = 1.0
+
+    total = np.convolve(gapped, kernel, mode="same")[position]
+    norm = np.convolve(weights, kernel, mode="same")[position]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(norm > 0, total / norm, np.nan)
+
+def blockMedians(values, blockStarts):
+    """Get the median of the valid (not NaN) values of each block."""
+    values = np.asarray(values, dtype=float)
+    blockStarts = np.asarray(blockStarts, dtype=np.intp)
+    sizes = np.diff(np.append(blockStarts, len(values)))
+    blockID = np.repeat(np.arange(len(blockStarts)), sizes)
+
+    # Sort by block, then value (NaNs last), and pick the middle values
+    order = np.lexsort((values, blockID))
+    ordered = values[order]
+    counts = np.bincount(
+        blockID, weights=~np.isnan(values), minlength=len(blockStarts)
+        ).astype(int)
+    lo = blockStarts + np.maximum(counts - 1, 0) // 2
+    hi = blockStarts + counts // 2
+    if len(ordered) == 0:
+        return np.full(len(blockStarts), np.nan)
+    lo = np.minimum(lo, len(ordered) - 1)
+    hi = np.minimum(hi, len(ordered) - 1)
+    return np.where(counts > 0, (ordered[lo] + ordered[hi]) / 2, np.nan)
+
+def varianceTimeCourse(
+        trials, fwhm=9.0, truncate=3.0, by=("session_name", "block_name")
+        ):
+    """Compute the VTC and in/out of the zone state of every trial.
+
+    Parameters
+    ----------
+    trials : polars.DataFrame
+        The trials, as returned by `behaviour.trialTable`. The trials of each
+        block must be contiguous and in order.
+    fwhm : float, default=9.0
+        The full width at half maximum of the Gaussian smoothing kernel, in
+        trials.
+    truncate : float, default=3.0
+        The kernel is truncated at this many standard deviations.
+    by : tuple of str, default=("session_name", "block_name")
+        The columns identifying each block. The VTC is computed separately
+        for each block.
+
+    Returns
+    -------
+    polars.DataFrame
+        `trials` with the additional columns "rt_interp_ms" (reaction times
+        with missing values interpolated), "vtc_raw" (the unsmoothed
+        deviations), "vtc" and "in_zone". Blocks without any reaction times
+        have null values in these columns.
+    """
+    numTrials = trials.height
+    if numTrials == 0:
+        return trials.with_columns(
+            pl.lit(None, dtype=pl.Float64).alias("rt_interp_ms"),
+            pl.lit(None, dtype=pl.Float64).alias("vtc_raw"),
+            pl.lit(None, dtype=pl.Float64).alias("vtc"),
+            pl.lit(None, dtype=pl.Boolean).alias("in_zone")
+            )
+    sizes = (
+        trials.groupby(list(by), maintain_order=True)
+        .agg(pl.count())["count"].to_numpy().astype(np.intp)
+        )
+    blockStarts = np.concatenate(([0], np.cumsum(sizes)[:-1]))
+    blockID = np.repeat(np.arange(len(sizes)), sizes)
+
+    # Reaction times of correct responses to common targets only
+    rt = (
+        trials.select(
+            pl.when(
+                (pl.col("target_type") == "common") & pl.col("responded")
+                )
+            .then(pl.col("rt_ms"))
+            .otherwise(None)
+            .fill_null(np.nan)
+            )
+        .to_series().to_numpy().astype(float)
+        )
+    valid = ~np.isnan(rt)
+    rtInterp = interpolateMissing(rt, blockStarts)
+
+    # Mean and (sample) standard deviation of each block's reaction times
+    counts = np.bincount(blockID, weights=valid, minlength=len(sizes))
+    sums = np.bincount(
+        blockID, weights=np.where(valid, rt, 0), minlength=len(sizes)
+        )
+    with np.errstate(invalid="ignore", divide="ignore"):
+        means = sums / counts
+        squares = np.bincount(
+            blockID,
+            weights=np.where(valid, (rt - means[blockID]) ** 2, 0),
+            minlength=len(sizes)
+            )
+        stds = np.sqrt(squares / (counts - 1))
+        stds = np.where(stds > 0, stds, np.nan)
+        vtcRaw = np.abs(rtInterp - means[blockID]) / stds[blockID]
+
+    vtc = smoothBlocks(vtcRaw, blockStarts, gaussianKernel(fwhm, truncate))
+    medians = blockMedians(vtc, blockStarts)
+
+    return trials.with_columns(
+        pl.Series("rt_interp_ms", rtInterp).fill_nan(None),
+        pl.Series("vtc_raw", vtcRaw).fill_nan(None),
+        pl.Series("vtc", vtc).fill_nan(None),
+        pl.Series("in_zone", vtc <= medians[blockID])
+        ).with_columns(
+            pl.when(pl.col("vtc").is_null())
+            .then(None)
+            .otherwise(pl.col("in_zone"))
+            .alias("in_zone")
+            )
+
+class _P2Median:
+    """Running estimate of the median with constant memory and work.
+
+    Implements the P² algorithm (Jain and Chlamtac, 1985). The median is
+    exact for the first five values.
+    """
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self._initial = []
+        self._heights = None
+        self._positions = None
+        self._desired = None
+
+    @property
+    def count(self):
+        if self._heights is None:
+            return len(self._initial)
+        return self._positions[4]
+
+    @property
+    def value(self):
+        if self._heights is None:
+            if len(self._initial) == 0:
+                return math.nan
+            return float(np.median(self._initial))
+        return self._heights[2]
+
+    def add(self, x):
+        if self._heights is None:
+            self._initial.append(x)
+            if len(self._initial) == 5:
+                self._heights = sorted(self._initial)
+                self._positions = [1, 2, 3, 4, 5]
+                self._desired = [1.0, 2.0, 3.0, 4.0, 5.0]
+            return
+
+        q, n = self._heights, self._positions
+        if x < q[0]:
+            q[0] = x
+            k = 0
+        elif x >= q[4]:
+            q[4] = x
+            k = 3
+        else:
+            k = 0
+            while x >= q[k + 1]:
+                k += 1
+        for i in range(k + 1, 5):
+            n[i] += 1
+        desired = self._desired
+        for i, step in enumerate((0.0, 0.25, 0.5, 0.75, 1.0)):
+            desired[i] += step
+
+        # Adjust the heights of the middle markers if they are off position
+        for i in (1, 2, 3):
+            d = desired[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (
+                    d <= -1 and n[i - 1] - n[i] < -1
+                    ):
+                d = 1 if d > 0 else -1
+                qp = q[i] + d / (n[i + 1] - n[i - 1]) * (
+                    (n[i] - n[i - 1] + d) * (q[i + 1] - q[i])
+                    / (n[i + 1] - n[i])
+                    + (n[i + 1] - n[i] - d) * (q[i] - q[i - 1])
+                    / (n[i] - n[i - 1])
+                    )
+                if not q[i - 1] < qp < q[i + 1]:
+                    qp = q[i] + d * (q[i + d] - q[i]) / (n[i + d] - n[i])
+                q[i] = qp
+                n[i] += d
+
+class StreamingVTC:
+    """Compute the VTC incrementally, one trial at a time.
+
+    Each call to `update` does a constant amount of work, independent of the
+    number of trials so far. Compared to `varianceTimeCourse`:
+
+    - The mean and standard deviation are those of the reaction times so far,
+      rather than of the whole block.
+    - Smoothing uses a causal kernel (the current and previous trials only).
+    - Missing reaction times are carried forward from the last reaction time
+      until the next one arrives. They are then linearly interpolated (for
+      at most the length of the kernel), which affects later VTC values.
+    - The median is estimated with the P² algorithm.
+
+    Parameters
+    ----------
+    fwhm : float, default=9.0
+        The full width at half maximum of the Gaussian smoothing kernel, in
+        trials (see `gaussianKernel`).
+    truncate : float, default=3.0
+        The kernel is truncated at this many standard deviations.
+    """
+    def __init__(self, fwhm=9.0, truncate=3.0):
+        self.kernel = gaussianKernel(fwhm, truncate, causal=True)
+        self._window = len(self.kernel)
+        self._median = _P2Median()
+        self.reset()
+
+    def reset(self):
+        """Forget all trials (eg. at the start of a new block)."""
+        self.numTrials = 0
+        self._count = 0
+        self._mean = 0.0
+        self._m2 = 0.0
+        self._rts = np.zeros(self._window)
+        self._lastRT = math.nan
+        self._pending = 0
+        self._median.reset()
+
+    @property
+    def mean(self):
+        """The mean of the reaction times so far."""
+        return self._mean if self._count > 0 else math.nan
+
+    @property
+    def std(self):
+        """The (sample) standard deviation of the reaction times so far."""
+        if self._count < 2:
+            return math.nan
+        return math.sqrt(self._m2 / (self._count - 1))
+
+    @property
+    def median(self):
+        """The estimated median of the VTC so far."""
+        return self._median.value
+
+    def update(self, rt):
+        """Add the next trial.
+
+        Parameters
+        ----------
+        rt : float or None
+            The reaction time of the trial, or None or NaN if it is missing
+            (eg. an omission error, or a rare target).
+
+        Returns
+        -------
+        vtc : float
+            The smoothed VTC of the trial. NaN until there are at least two
+            reaction times.
+        inZone : bool or None
+            Whether the trial is in the zone, or None if `vtc` is NaN.
+        """
+        pos = self.numTrials % self._window
+        self.numTrials += 1
+        if rt is None or math.isnan(rt):
+            # Carry the last reaction time forward until the next one arrives
+            self._rts[pos] = self._lastRT
+            self._pending += 1
+        else:
+            self._count += 1
+            delta = rt - self._mean
+            self._mean += delta / self._count
+            self._m2 += delta * (rt - self._mean)
+            self._rts[pos] = rt
+
+            # Interpolate the missing reaction times since the last one
+            numFill = min(self._pending, self._window - 1)
+            if numFill > 0 and not math.isnan(self._lastRT):
+                steps = np.arange(1, numFill + 1) / (self._pending + 1)
+                fillPos = (pos - np.arange(1, numFill + 1)) % self._window
+                self._rts[fillPos] = rt + steps * (self._lastRT - rt)
+            elif numFill > 0:
+                fillPos = (pos - np.arange(1, numFill + 1)) % self._window
+                self._rts[fillPos] = rt
+            self._lastRT = rt
+            self._pending = 0
+
+        std = self.std
+        if math.isnan(std) or std == 0:
+            return math.nan, None
+
+        # Smooth the deviations of the trials in the window, newest first
+        numUsed = min(self.numTrials, self._window)
+        lags = (pos - np.arange(numUsed)) % self._window
+        rts = self._rts[lags]
+        used = ~np.isnan(rts)
+        weights = self.kernel[:numUsed][used]
+        deviations = np.abs(rts[used] - self._mean) / std
+        vtc = float(weights @ deviations / weights.sum())
+
+        self._median.add(vtc)
+        return vtc, vtc <= self._median.value
+
+class VTCMonitor:
+    """Compute the VTC live from the gradCPT marker streams.
+
+    Reads the "transition_period_start", "block_start" and "block_stop"
+    markers of the stimuli marker stream and the "response" markers of the
+    response marker stream in a background thread. Responses are assigned
+    to trials with `behaviour.assignResponses` over a short window of recent
+    trials, which agrees with assigning them over the whole block except
+    for long chains of ambiguous responses. A trial is final once the
+    window in which responses could still be assigned to it has passed,
+    three trials after it starts, or at the end of its block.
+
+    The VTC is reset at the start of every block.
+
+    Parameters
+    ----------
+    targetTypes : list of list of str
+        The target type ("common" or "rare") of every trial of every block
+        that will be presented, in order.
+    transitionTimeMs, staticTimeMs : float
+        The length of the transition and static periods of each trial.
+    callback : Callable[[dict], None]
+        Called from the background thread for each trial once it is final,
+        with a dict containing the index of the block ("block") and trial
+        ("trial"), the trial's "target_type", reaction time ("rt_ms", or
+        None), "vtc" and "in_zone" (see `StreamingVTC.update`).
+    stimStreamName, responseStreamName : str
+        The names of the marker streams.
+    fwhm, truncate : float, default=9.0, 3.0
+        Smoothing parameters (see `StreamingVTC`).
+    """
+    # The number of trials a trial's responses depend on, after the trial,
+    # and the number of trials before it used to assign them
+    _LOOKAHEAD = 3
+    _LOOKBEHIND = 2
+
+    def __init__(
+            self, targetTypes, transitionTimeMs, staticTimeMs, callback,
+            stimStreamName="stimuli_marker_stream",
+            responseStreamName="response_marker_stream", fwhm=9.0,
+            truncate=3.0
+            ):
+        self.targetTypes = [list(t) for t in targetTypes]
+        self.transitionTime = transitionTimeMs / 1000
+        self.trialTime = (transitionTimeMs + staticTimeMs) / 1000
+        self.callback = callback
+        self.stimStreamName = stimStreamName
+        self.responseStreamName = responseStreamName
+        self.vtc = StreamingVTC(fwhm=fwhm, truncate=truncate)
+        self.__stopEvent = threading.Event()
+        self.__thread = None
+        self.__block = -1
+        self.__resetBlock()
+
+    def __enter__(self):
+        self.__thread = threading.Thread(
+            target=self.__watch, name="vtc-monitor", daemon=True
+            )
+        self.__thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_tb):
+        self.__stopEvent.set()
+        self.__thread.join()
+
+    def __resetBlock(self):
+        window = self._LOOKBEHIND + self._LOOKAHEAD + 1
+        self.__onsets = deque(maxlen=window)
+        self.__responses = deque()
+        self.__numOnsets = 0
+        self.__numFinal = 0
+        self.vtc.reset()
+
+    def __resolve(self, name):
+        streams = []
+        while len(streams) == 0:
+            if self.__stopEvent.is_set():
+                return None
+            streams = resolve_byprop("name", name, timeout=0.5)
+        return StreamInlet(streams[0])
+
+    def __watch(self):
+        stimInlet = self.__resolve(self.stimStreamName)
+        responseInlet = self.__resolve(self.responseStreamName)
+        if stimInlet is None or responseInlet is None:
+            return
+
+        while True:
+            stopping = self.__stopEvent.is_set()
+            markers, markerTimes = stimInlet.pull_chunk(timeout=0.05)
+            # Pull responses after stimuli, so that every response made
+            # before the latest stimulus marker has been received
+            responses, responseTimes = responseInlet.pull_chunk(timeout=0.0)
+            for sample, t in zip(responses, responseTimes):
+                if sample[0] == "response":
+                    self.__responses.append(t)
+            for sample, t in zip(markers, markerTimes):
+                self.__onMarker(sample[0], t)
+            if stopping and len(markers) == 0:
+                break
+
+    def __onMarker(self, marker, t):
+        if marker == "block_start":
+            self.__block += 1
+            self.__resetBlock()
+        elif marker == "transition_period_start":
+            self.__onsets.append(t)
+            self.__numOnsets += 1
+            while self.__numOnsets - self.__numFinal > self._LOOKAHEAD:
+                self.__finalize(self.__numFinal)
+        elif marker == "block_stop":
+            while self.__numFinal < self.__numOnsets:
+                self.__finalize(self.__numFinal)
+
+    def __finalize(self, trial):
+        # Assign responses over the recent trials and get the reaction time
+        # of `trial`
+        numWindow = len(self.__onsets)
+        first = self.__numOnsets - numWindow
+        onsets = np.array(self.__onsets)
+        while (
+                len(self.__responses) > 0
+                and self.__responses[0] < onsets[0]
+                ):
+            self.__responses.popleft()
+        windowEnd = (
+            onsets[-1] + self.trialTime + UNAMBIGUOUS_END * self.transitionTime
+            )
+        responses = np.array(
+            [r for r in self.__responses if r < windowEnd], dtype=float
+            )
+
+        blockTypes = (
+            self.targetTypes[self.__block]
+            if 0 <= self.__block < len(self.targetTypes) else []
+            )
+        types = [
+            blockTypes[k] if k < len(blockTypes) else "common"
+            for k in range(first, first + numWindow)
+            ]
+        isRare = np.array(types) == "rare"
+        isFirst = np.zeros(numWindow, dtype=bool)
+        isFirst[0] = True
+        assigned = assignResponses(
+            onsets, responses, isRare, self.transitionTime, self.trialTime,
+            isFirst=isFirst
+            )
+
+        k = trial - first
+        responded = not np.isnan(assigned[k])
+        rtMs = (assigned[k] - onsets[k]) * 1000 if responded else None
+        vtc, inZone = self.vtc.update(
+            rtMs if responded and not isRare[k] else None
+            )
+        self.__numFinal += 1
+        self.callback({
+            "block" : self.__block,
+            "trial" : trial,
+            "target_type" : types[k],
+            "rt_ms" : rtMs,
+            "vtc" : vtc,
+            "in_zone" : inZone
+            })
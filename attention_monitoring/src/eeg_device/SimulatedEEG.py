@@ -0,0 +1,154 @@
+import logging
+import threading
+
+import numpy as np
+from pylsl import StreamInfo, StreamOutlet, local_clock
+
+from .EEGDevice import EEGDevice
+
+_log = logging.getLogger(__name__)
+
+class SimulatedEEG(EEGDevice):
+    """Stand-in for a Muse device that streams synthetic signals to LSL.
+
+    Pushes the same streams as a Muse streaming through Bluemuse (EEG, PPG,
+    accelerometer and gyroscope, with the same types, channels and nominal
+    sample rates) from a background thread, so that gradCPT sessions can be
+    run, recorded and benchmarked without a headset. The EEG is white noise
+    with a 10 Hz (alpha) rhythm, the PPG a pulse at 70 beats per minute and
+    the motion signals are small noise around rest.
+
+    The device is connected iff it is streaming.
+
+    Parameters
+    ----------
+    signals : list of str
+        The signals to stream. Any combination of "eeg", "ppg",
+        "accelerometer", "gyroscope". If unspecified, streams all of these.
+    name : str, default="SimulatedMuse"
+        The name of every stream.
+    chunkDuration : float, default=0.02
+        The time in seconds between chunks pushed to LSL.
+    seed : int, optional
+        Seed for generating the signals.
+    """
+
+    # (type, channel labels, nominal sample rate) of each signal
+    _STREAMS = {
+        "eeg" : ("EEG", ["TP9", "AF7", "AF8", "TP10"], 256.0),
+        "ppg" : ("PPG", ["PPG1", "PPG2", "PPG3"], 64.0),
+        "accelerometer" : ("Accelerometer", ["X", "Y", "Z"], 52.0),
+        "gyroscope" : ("Gyroscope", ["X", "Y", "Z"], 52.0)
+        }
+
+    def __init__(
+            self,
+            *signals: str,
+            name: str = "SimulatedMuse",
+            chunkDuration: float = 0.02,
+            seed: [int | None] = None
+            ) -> None:
+        if len(signals) > 0:
+            if not all(s.lower() in self._STREAMS for s in signals):
+                raise ValueError(f"Invalid signal: {signals}")
+            self.__signals = tuple(s.lower() for s in signals)
+        else:
+            self.__signals = tuple(self._STREAMS.keys())
+        self.name = name
+        self.chunkDuration = chunkDuration
+        self._rng = np.random.default_rng(seed)
+
+        self.__outlets = {}
+        self.__stopEvent = threading.Event()
+        self.__thread = None
+
+    @property
+    def signals(self):
+        return self.__signals
+
+    def __enter__(self):
+        self.connect()
+        self.startStreaming()
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_tb):
+        self.stopStreaming()
+        self.disconnect()
+
+    def connect(self, timeout: [int | float] = -1):
+        # Nothing to connect to, the device is connected once streaming
+        pass
+
+    def isConnected(self) -> bool:
+        return self.isStreaming()
+
+    def disconnect(self):
+        self.stopStreaming()
+
+    def startStreaming(self, timeout: [int | float] = -1):
+        if self.isStreaming():
+            _log.debug("Simulated EEG device is already streaming")
+            return
+        _log.info("Streaming simulated %s signals to LSL", self.signals)
+        for signal in self.signals:
+            streamType, labels, srate = self._STREAMS[signal]
+            info = StreamInfo(
+                self.name, streamType, len(labels), srate, "float32",
+                f"{self.name}_{signal}"
+                )
+            channels = info.desc().append_child("channels")
+            for label in labels:
+                channels.append_child("channel").append_child_value(
+                    "label", label
+                    )
+            self.__outlets[signal] = StreamOutlet(info)
+        self.__stopEvent.clear()
+        self.__thread = threading.Thread(
+            target=self.__stream, name="simulated-eeg", daemon=True
+            )
+        self.__thread.start()
+
+    def isStreaming(self) -> bool:
+        return self.__thread is not None and self.__thread.is_alive()
+
+    def stopStreaming(self):
+        if self.__thread is None:
+            return
+        _log.debug("Stopping the simulated EEG streams")
+        self.__stopEvent.set()
+        self.__thread.join()
+        self.__thread = None
+        self.__outlets = {}
+
+    def _samples(self, signal: str, t: np.ndarray) -> np.ndarray:
+        # Synthetic samples of a signal at times `t`, with shape
+        # (samples, channels)
+        _, labels, _ = self._STREAMS[signal]
+        noise = self._rng.standard_normal((len(t), len(labels)))
+        if signal == "eeg":
+            alpha = 10 * np.sin(2 * np.pi * 10 * t)
+            return 800 + 10 * noise + alpha[:, np.newaxis]
+        if signal == "ppg":
+            pulse = np.sin(np.pi * 70 / 60 * t) ** 8
+            return 1e5 + 2e3 * pulse[:, np.newaxis] + 50 * noise
+        if signal == "accelerometer":
+            return np.array([0.0, 0.0, 1.0]) + 0.005 * noise
+        return 0.5 * noise
+
+    def __stream(self):
+        # Push samples on each stream's nominal schedule, in chunks
+        t0 = local_clock()
+        numSent = {signal : 0 for signal in self.__outlets}
+        while not self.__stopEvent.wait(self.chunkDuration):
+            elapsed = local_clock() - t0
+            for signal, outlet in self.__outlets.items():
+                srate = self._STREAMS[signal][2]
+                numDue = int(elapsed * srate)
+                if numDue <= numSent[signal]:
+                    continue
+                t = np.arange(numSent[signal], numDue) / srate
+                samples = self._samples(signal, t)
+                # Stamp the last sample, earlier samples are spaced at the
+                # nominal rate
+                outlet.push_chunk(samples.tolist(), t0 + t[-1])
+                numSent[signal] = numDue
@@ -1,2 +1,3 @@
 from .EEGDevice import EEGDevice
-from .Muse import Muse
\ No newline at end of file
+from .Muse import Muse
+from .SimulatedEEG import SimulatedEEG
\ No newline at end of file
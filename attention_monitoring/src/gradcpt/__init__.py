@@ -1,2 +1,4 @@
 from ._gradcpt_block import GradCPTBlock
-from ._gradcpt_session import GradCPTSession
\ No newline at end of file
+from ._gradcpt_session import GradCPTSession
+from ._gradcpt_simulator import GradCPTSimulator
+from ._gradcpt_batch import GradCPTBatchRunner
\ No newline at end of file
@@ -0,0 +1,211 @@
+from contextlib import ExitStack
+from datetime import datetime
+import logging
+import os
+from typing import Callable, Iterable
+
+from src.gradcpt.helpers import _GradCPTLogToFileCM, _GradCPTResources
+from ._gradcpt_session import GradCPTSession
+
+_log = logging.getLogger(__name__)
+
+class GradCPTBatchRunner:
+    """Run gradCPT sessions for a queue of participants back to back.
+
+    The expensive resources needed to run a session (the MATLAB engine, the
+    connection to the EEG device and LabRecorder) are opened once and shared
+    by every session in the batch, instead of being opened and closed for
+    each session. A new session is created for each participant, and each
+    session keeps its own directory, info file and logs ("run.log",
+    "matlab.log"). Output that cannot be attributed to a single session (the
+    log of the whole batch and LabRecorder's output) is written to a batch
+    directory, "batches/[yymmdd_HHMMSS]" in the study's data directory.
+
+    Between sessions, the health of the shared resources is checked and any
+    that have failed are restarted. If they cannot be recovered, all
+    resources are closed and opened again before continuing.
+
+    Parameters
+    ----------
+    makeSession : Callable[[int or None], GradCPTSession]
+        Called with the participant ID to create a new session for each
+        participant (eg. `lambda p: MuseGradCPTSession(participantID=p)`).
+        The EEG device of the first session created is the one that is
+        connected to and shared with all later sessions.
+    participantIDs : Iterable of int or None
+        The participant IDs to run sessions for, in order. May be a lazy
+        iterable (eg. a generator reading from a sign-up queue).
+    presentation : {"matlab", "simulated"}, default="matlab"
+        The presentation backend to use for every session (see
+        `GradCPTSession.run`).
+    timeScale : float, default=1.0
+        (Simulated presentation only) The factor by which to compress time.
+    writeLogToFile : bool, default=True
+        Whether to write each session's log to its "run.log" file.
+    stopOnError : bool, default=False
+        Whether to stop the batch if a session raises an exception. If False,
+        the exception is logged and the batch continues with the next
+        participant.
+    maxRecoveryAttempts : int, default=2
+        The number of times to try restarting unhealthy resources between
+        sessions before closing and reopening all of them.
+
+    Attributes
+    ----------
+    sessions : list of GradCPTSession
+        The sessions created by this runner, in order (read only).
+    failures : dict of str to Exception
+        Maps the name of each session that raised an exception to that
+        exception. Sessions that could not be created are keyed by
+        "participant [participant ID]" (read only).
+    batchDir : str or None
+        The batch directory, or None if the batch has not started.
+    """
+    def __init__(
+            self,
+            makeSession: Callable[[int | None], GradCPTSession],
+            participantIDs: Iterable[int | None],
+            /,
+            presentation: str = "matlab",
+            timeScale: float = 1.0,
+            writeLogToFile: bool = True,
+            stopOnError: bool = False,
+            maxRecoveryAttempts: int = 2
+            ) -> None:
+        if presentation not in ("matlab", "simulated"):
+            raise ValueError(f"Invalid presentation backend: {presentation}")
+
+        self._makeSession = makeSession
+        self._participantIDs = participantIDs
+        self.presentation = presentation
+        self.timeScale = timeScale
+        self.writeLogToFile = writeLogToFile
+        self.stopOnError = stopOnError
+        self.maxRecoveryAttempts = maxRecoveryAttempts
+
+        self.batchDir = None
+        self._sessions = []
+        self._failures = {}
+
+    @property
+    def sessions(self) -> list[GradCPTSession]:
+        return [s for s in self._sessions]
+
+    @property
+    def failures(self) -> dict[str, Exception]:
+        return {k : v for (k, v) in self._failures.items()}
+
+    def run(self) -> list[GradCPTSession]:
+        """Run a session for every participant in the queue.
+
+        Returns
+        -------
+        list of GradCPTSession
+            The sessions that were run, in order.
+        """
+        with ExitStack() as stack:
+            # Resources are kept on their own stack so that they can be
+            # closed and reopened without ending the batch
+            resStack = stack.enter_context(ExitStack())
+            resources = None
+
+            for participantID in self._participantIDs:
+                try:
+                    session = self._makeSession(participantID)
+                except Exception as E:
+                    self.__recordFailure(
+                        f"participant {participantID}",
+                        f"create the session of participant {participantID}",
+                        E
+                        )
+                    continue
+                self._sessions.append(session)
+                name = session.info["session_name"]
+
+                if resources is None:
+                    # Setup the batch directory and open the resources with
+                    # the first session's EEG device
+                    self.__setupBatchDir(session, stack)
+                    eeg = session.eeg
+                    resources = self.__openResources(resStack, eeg)
+                else:
+                    resources = self.__ensureHealthy(resources, resStack, eeg)
+
+                _log.info(
+                    "Running session %s of batch: %s",
+                    len(self._sessions), name
+                    )
+                session._info["batch_dir"] = self.batchDir
+                try:
+                    session.run(
+                        writeLogToFile=self.writeLogToFile,
+                        presentation=self.presentation,
+                        timeScale=self.timeScale,
+                        resources=resources
+                        )
+                except Exception as E:
+                    self.__recordFailure(name, f"run session {name}", E)
+
+            _log.info(
+                "Batch finished: %s sessions run, %s failed",
+                len(self._sessions), len(self._failures)
+                )
+        return self.sessions
+
+    def __recordFailure(self, key: str, what: str, error: Exception):
+        # Record the failure of a session. Must be called while handling
+        # `error`, which is raised again if the batch should stop.
+        self._failures[key] = error
+        if self.stopOnError:
+            raise
+        _log.error(
+            "Failed to %s, continuing with the next participant", what,
+            exc_info=error
+            )
+
+    def __setupBatchDir(self, session: GradCPTSession, stack: ExitStack):
+        self.batchDir = os.path.join(
+            session._DATA_DIR, "batches",
+            datetime.now().strftime("%y%m%d_%H%M%S")
+            )
+        _log.debug("Creating directory: %s", self.batchDir)
+        os.makedirs(self.batchDir, exist_ok=True)
+        if self.writeLogToFile:
+            stack.enter_context(_GradCPTLogToFileCM(
+                os.path.join(self.batchDir, "batch.log"), useBaseLogger=True
+                ))
+
+    def __openResources(self, resStack: ExitStack, eeg) -> _GradCPTResources:
+        lrLogFilePath = os.path.join(self.batchDir, "lab_recorder.log")
+        return resStack.enter_context(
+            _GradCPTResources(eeg, self.presentation, lrLogFilePath)
+            )
+
+    def __ensureHealthy(
+            self,
+            resources: _GradCPTResources,
+            resStack: ExitStack,
+            eeg
+            ) -> _GradCPTResources:
+        # Check the health of the resources, restarting them as needed.
+        # Returns the resources to use for the next session.
+        health = resources.check()
+        _log.debug("Resource health: %s", health)
+        for k in range(self.maxRecoveryAttempts):
+            if all(health.values()):
+                return resources
+            _log.warning("Recovering resources (attempt %s)", k + 1)
+            health = resources.recover()
+        if all(health.values()):
+            return resources
+
+        # Last resort: close everything and start again
+        _log.warning("Could not recover resources, reopening all resources")
+        resStack.close()
+        resources = self.__openResources(resStack, eeg)
+        health = resources.check()
+        if not all(health.values()):
+            raise RuntimeError(
+                f"Failed to recover resources for the batch: {health}"
+                )
+        return resources
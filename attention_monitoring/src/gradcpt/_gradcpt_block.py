@@ -23,6 +23,8 @@ class GradCPTBlock(StudyBlock):
             preBlockMsg: [str | None] = None,
             preBlockWaitingTime: int = 30,
             stimSequenceLength: int = 10,
+            stimSequenceFile: [str | None] = None,
+            dataFile: [str | None] = None,
             **kwargs
             ) -> None:
         
@@ -37,26 +39,28 @@ class GradCPTBlock(StudyBlock):
         self._COMMON_TARGET_DIR = os.path.join(
             self._STIMULI_DIR, "common_target"
             )
-        if not os.path.isdir(self._COMMON_TARGET_DIR):
-            _log.debug("Creating directory: %s", self._COMMON_TARGET_DIR)
-            os.makedirs(self._COMMON_TARGET_DIR)
         self._RARE_TARGET_DIR = os.path.join(
             self._STIMULI_DIR, "rare_target"
             )
-        if not os.path.isdir(self._RARE_TARGET_DIR):
-            _log.debug("Creating directory: %s", self._RARE_TARGET_DIR)
-            os.makedirs(self._RARE_TARGET_DIR)
+        self._makeDirs(self._COMMON_TARGET_DIR, self._RARE_TARGET_DIR)
         
         # Specify the paths to the stim sequence and data files
-        self._stimSequenceFile = os.path.join(
-            self._OUTPUT_DIR, self.name + "_stim_sequence.csv"
-            )
-        self._dataFile = os.path.join(
-            self._OUTPUT_DIR, self.name + "_data.xdf"
-            )
+        self._stimSequenceFile = stimSequenceFile
+        if stimSequenceFile is None:
+            self._stimSequenceFile = os.path.join(
+                self._OUTPUT_DIR, self.name + "_stim_sequence.csv"
+                )
+        self._dataFile = dataFile
+        if dataFile is None:
+            self._dataFile = os.path.join(
+                self._OUTPUT_DIR, self.name + "_data.xdf"
+                )
         
-        # Create the stim sequence file if it doesn't exist yet
-        if not os.path.isfile(self._stimSequenceFile):
+        # Create the stim sequence file if it doesn't exist yet. The stim
+        # sequence of a block loaded from its stored file is never generated.
+        if stimSequenceFile is not None:
+            _log.debug("Loading existing block: %s", self.name)
+        elif not os.path.isfile(self._stimSequenceFile):
             _log.debug(
                 "Creating stimulus sequence file: %s", self._stimSequenceFile
                 )
@@ -67,6 +71,40 @@ class GradCPTBlock(StudyBlock):
         # Initialize the data as None
         self._data = None
     
+    @classmethod
+    def fromBlocksRow(
+            cls,
+            row: dict[str, str],
+            outputDir: str,
+            /,
+            dataSubDir: [None | str] = None
+            ) -> Self:
+        """Load an existing block from its row in a session's blocks file.
+        
+        The block is created only from the stored row (the config is not
+        used), and no files are read or created.
+
+        Parameters
+        ----------
+        row : dict of str to str
+            The block's row in the blocks file, with the fields "block_name",
+            "pre_block_msg", "pre_block_wait_time", "stim_sequence_file" and
+            "data_file".
+        outputDir : str
+            The directory of the block's session.
+        dataSubDir : str, optional
+            The data subdirectory of the block's session (see `Study`).
+        """
+        return cls(
+            row["block_name"],
+            outputDir,
+            dataSubDir=dataSubDir,
+            preBlockMsg=row["pre_block_msg"],
+            preBlockWaitingTime=int(row["pre_block_wait_time"]),
+            stimSequenceFile=row["stim_sequence_file"],
+            dataFile=row["data_file"]
+            )
+    
     @classmethod
     def makePracticeBlock(cls, 
             name: str, 
@@ -191,6 +229,79 @@ class GradCPTBlock(StudyBlock):
 
         return dataStreams
     
+    @classmethod
+    def verifyDataFile(cls, dataFile: str) -> bool:
+        """Check whether an xdf file contains the data for a complete block.
+        
+        A data file is considered complete if it can be read and its stimuli 
+        marker stream contains the "block_stop" marker, which is sent at the
+        end of every block that was presented in full. Data files of blocks
+        that were interrupted (eg. by a crash) are either unreadable or do 
+        not contain this marker.
+
+        Parameters
+        ----------
+        dataFile : str
+            The file path to the data file to check.
+
+        Returns
+        -------
+        bool
+            Whether the data file is complete.
+        """
+        markers = cls.__readStimuliMarkers(dataFile)
+        return markers is not None and "block_stop" in markers[0]
+    
+    @classmethod
+    def dataFileDuration(cls, dataFile: str) -> [float | None]:
+        """Get the duration of the block recorded in an xdf file.
+
+        Parameters
+        ----------
+        dataFile : str
+            The file path to the data file.
+
+        Returns
+        -------
+        float or None
+            The time in seconds from the "block_start" marker to the
+            "block_stop" marker in the stimuli marker stream, or None if the
+            data file is not complete (see `verifyDataFile`).
+        """
+        markers = cls.__readStimuliMarkers(dataFile)
+        if markers is None:
+            return None
+        values, timestamps = markers
+        if "block_start" not in values or "block_stop" not in values:
+            return None
+        tStart = timestamps[values.index("block_start")]
+        tStop = timestamps[len(values) - 1 - values[::-1].index("block_stop")]
+        return float(tStop - tStart)
+    
+    @classmethod
+    def __readStimuliMarkers(
+            cls, 
+            dataFile: str
+            ) -> [tuple[list[str], list[float]] | None]:
+        # Read only the stimuli marker stream from a data file, returning its
+        # markers and their timestamps, or None if the file cannot be read
+        if not os.path.isfile(dataFile):
+            return None
+        try:
+            data, header = pyxdf.load_xdf(
+                dataFile, 
+                select_streams=[{"name" : "stimuli_marker_stream"}]
+                )
+        except Exception as E:
+            _log.debug("Could not read data file %s: %s", dataFile, E)
+            return None
+        values = []
+        timestamps = []
+        for stream in data:
+            values.extend(x[0] for x in stream["time_series"])
+            timestamps.extend(stream["time_stamps"])
+        return values, timestamps
+    
     # TODO: check this algorithm
     def __generateStimSequence(
             self,
@@ -3,32 +3,35 @@ import aiofiles
 import asyncio
 from contextlib import ExitStack, contextmanager
 import csv
-from io import StringIO
+from datetime import datetime
 import logging
 import os
 import shlex
-import shutil
 import subprocess
-from time import sleep
 from typing import Any, Callable
 
-import matlab.engine
 import polars as pl
 
 from src.config import CONFIG
 from src.eeg_device import EEGDevice
-from src.gradcpt.helpers import _GradCPTLogToFileCM
-from src.gradcpt.matlab.pyhelpers import _getMatlabCallback
+from src.gradcpt.helpers import (
+    _BlockRecorder, _BlockStopWatcher, _GradCPTLogToFileCM,
+    _GradCPTResources
+    )
+from src.gradcpt.matlab.pyhelpers import (
+    _getMatlabCallback, _MatlabOutputStream
+    )
+from src.helpers import _hashFile
+from src.lab_recorder import LabRecorderClient
 from src.study import StudySession, StudyBlock
-from src.study.helpers import _LaunchLabRecorder
 from ._gradcpt_block import GradCPTBlock
+from ._gradcpt_simulator import GradCPTSimulator
 
 _log = logging.getLogger(__name__)
 
 class GradCPTSession(StudySession):
     
     # TODO: add documentation
-    # TODO: add functionality for starting an existing session
     # TODO: integrate logger with MATLAB and labrecorder
     
     def __init__(
@@ -53,26 +56,30 @@ class GradCPTSession(StudySession):
         # `matlab.engine.FutureResult`.
         self.__matlabEng = None
         
-        # Create the blocks for this session
-        _log.debug("Creating session blocks")
-        self._blocks = {}
-        if CONFIG.do_practice_block:
-            name = f"{self._info['session_name']}_practice_block"
-            _log.debug("Creating block: %s", name)
-            block = GradCPTBlock.makePracticeBlock(
-                name, self._DIR, dataSubDir=dataSubDir
-                )
-            self._blocks[block.name] = block
-        for k in range(CONFIG.num_full_blocks):
-            name = f"{self._info['session_name']}_full_block_{k + 1}"
-            _log.debug("Creating block: %s", name)
-            block = GradCPTBlock.makeFullBlock(
-                name, self._DIR, dataSubDir=dataSubDir, n=(k + 1)
-                )
-            self._blocks[block.name] = block
+        # Blocks of existing sessions are only loaded (from the blocks file)
+        # when they are first accessed, see `blocks`
+        self._blocks = None
         
         # Create a new session if `sessionName` is unspecified.
         if sessionName is None:
+            # Create the blocks for this session
+            _log.debug("Creating session blocks")
+            self._blocks = {}
+            if CONFIG.do_practice_block:
+                name = f"{self._info['session_name']}_practice_block"
+                _log.debug("Creating block: %s", name)
+                block = GradCPTBlock.makePracticeBlock(
+                    name, self._DIR, dataSubDir=dataSubDir
+                    )
+                self._blocks[block.name] = block
+            for k in range(CONFIG.num_full_blocks):
+                name = f"{self._info['session_name']}_full_block_{k + 1}"
+                _log.debug("Creating block: %s", name)
+                block = GradCPTBlock.makeFullBlock(
+                    name, self._DIR, dataSubDir=dataSubDir, n=(k + 1)
+                    )
+                self._blocks[block.name] = block
+            
             # Create a "blocks file" that summarizes the blocks for this
             # session
             blocksFile = os.path.join(self._DIR, "blocks.csv")
@@ -105,6 +112,7 @@ class GradCPTSession(StudySession):
                 ]
             _log.debug("Updating info file with fields: %s", configVals)
             self._info.update(**{v : getattr(CONFIG, v) for v in configVals})
+            self._updateCatalog()
         
     @property
     @abstractmethod
@@ -113,10 +121,94 @@ class GradCPTSession(StudySession):
     
     @property
     def blocks(self) -> dict[str, StudyBlock]:
+        if self._blocks is None:
+            self._blocks = self.__loadBlocks()
         return {k : v for (k, v) in self._blocks.items()}
     
-    def run(self, writeLogToFile: bool = True) -> None:
+    def __loadBlocks(self) -> dict[str, GradCPTBlock]:
+        # Load the blocks of an existing session from its blocks file
+        _log.debug("Loading session blocks: %s", self._info["blocks_file"])
+        with open(self._info["blocks_file"], "r", newline="") as f:
+            rows = list(csv.DictReader(f))
+        blocks = {}
+        for row in rows:
+            block = GradCPTBlock.fromBlocksRow(
+                row, self._DIR, dataSubDir=self._dataSubDir
+                )
+            blocks[block.name] = block
+        return blocks
+    
+    def run(
+            self, 
+            writeLogToFile: bool = True, 
+            presentation: str = "matlab",
+            timeScale: float = 1.0,
+            resources: [_GradCPTResources | None] = None,
+            resume: bool = False
+            ) -> None:
+        """Run the gradCPT session.
+        
+        Parameters
+        ----------
+        writeLogToFile : bool, default=True
+            whether to write logging messages produced by this function to a
+            file named "run.log" in this session's directory.
+        presentation : {"matlab", "simulated"}, default="matlab"
+            The backend used to present the stimuli. "matlab" runs `gradCPT.m`
+            using the MATLAB engine. "simulated" runs a headless
+            `GradCPTSimulator` that emits the same marker streams with
+            synthetic responses, without needing MATLAB or a display.
+        timeScale : float, default=1.0
+            (Simulated presentation only) The factor by which to compress
+            time.
+        resources : _GradCPTResources, optional
+            Already open resources (MATLAB engine, EEG device, LabRecorder) to
+            run the session with, opened for the same `presentation` backend.
+            These are left open when the session ends so that they can be
+            reused by other sessions (see `GradCPTBatchRunner`). If
+            unspecified, resources are opened for this session only.
+        resume : bool, default=False
+            Whether to resume the session from its checkpoint (see
+            `completedBlocks`), skipping blocks that were already completed
+            and restarting at the first incomplete block. Data files of
+            completed blocks are verified first, and partially recorded data
+            files of incomplete blocks are moved aside. If every block is
+            already complete, returns without starting anything. If False,
+            every block is (re)run from the start.
+            
+        Notes
+        -----
+        A block is checkpointed as complete when its "block_stop" marker is
+        sent, so with MATLAB presentation checkpointing requires
+        `CONFIG.stream_markers_to_lsl`. The same marker is used to stop 
+        recording each block and start recording the next one through the
+        session's connection to LabRecorder (the first block is recorded from
+        the start of the presentation). Without it, MATLAB controls
+        LabRecorder with a connection of its own.
+        """
+        if presentation not in ("matlab", "simulated"):
+            raise ValueError(f"Invalid presentation backend: {presentation}")
         _log.debug("Running session: '%s'", self.info["session_name"])
+        
+        if resume:
+            startBlock = self.__prepareResume()
+            if startBlock is None:
+                _log.info(
+                    "All blocks of session '%s' are complete, nothing to "
+                    + "resume",
+                    self.info["session_name"]
+                    )
+                return
+        else:
+            if len(self.completedBlocks) > 0:
+                _log.warning(
+                    "Rerunning all blocks of session '%s', including "
+                    + "completed blocks: %s",
+                    self.info["session_name"], self.completedBlocks
+                    )
+            self._info["checkpoint"] = self.__emptyCheckpoint()
+            startBlock = 0
+            
         with ExitStack() as mainStack:
             # On `mainStack` place a new `ExitStack` object followed by a
             # callback function. This allows the new stack to be used as a
@@ -161,46 +253,108 @@ class GradCPTSession(StudySession):
                 self.getStudyType(), self.info["session_name"]
                 )
             
-            # Start MATLAB engine asynchronously (do this first as it may take
-            # some time) and add callback to cancel MATLAB startup
-            _log.debug("Starting the MATLAB engine")
-            future = matlab.engine.start_matlab(background=True)
-            stack.push(_getMatlabCallback(future, "MATLAB startup"))
+            # Add the data files of completed blocks to the checkpoint on exit,
+            # after any resources opened below are closed (so that LabRecorder
+            # is done writing them)
+            stack.callback(self.__sealCheckpoint)
             
-            # Connect to the EEG device
-            stack.enter_context(self.eeg)
-            
-            # Setup LabRecorder
-            lrPath = CONFIG.path_to_LabRecorder
-            if CONFIG.record_lsl and lrPath is not None:
+            if resources is None:
+                # Start MATLAB (if needed), connect to the EEG device and
+                # launch LabRecorder for this session only
                 lrLogFilePath = os.path.join(self._DIR, "lab_recorder.log")
-                stack.enter_context(_LaunchLabRecorder(lrLogFilePath, lrPath))
+                resources = stack.enter_context(
+                    _GradCPTResources(self.eeg, presentation, lrLogFilePath)
+                    )
+            elif resources.presentation != presentation:
+                raise ValueError(
+                    "The specified resources were opened for presentation "
+                    + f"backend '{resources.presentation}', not "
+                    + f"'{presentation}'"
+                    )
                 
-            # Wait for MATLAB to finish starting and get the MATLAB engine
-            _log.info("Running experiment in MATLAB")
-            _log.debug("Waiting for MATLAB to start ...")
-            while not future.done():
-                sleep(0.5)
-            _log.debug("MATLAB started")
-            eng = stack.enter_context(future.result())
+            _log.debug("Updating info file with fields: %s", ["presentation"])
+            self._info["presentation"] = presentation
+            if presentation == "matlab":
+                self.__presentWithMatlab(
+                    resources.engine, resources.labRecorder, startBlock
+                    )
+            else:
+                self.__presentWithSimulator(
+                    timeScale, resources.labRecorder, startBlock
+                    )
+            if resources.labRecorder is not None:
+                _log.debug(
+                    "LabRecorder command latencies: %s", 
+                    resources.labRecorder.latencyStats()
+                    )
+            
+            # Resources opened for this session (eg. the MATLAB engine, the EEG
+            # device, LabRecorder) are closed automatically when exiting the
+            # context manager
+            
+    def __presentWithMatlab(
+            self, 
+            eng: "matlab.engine.MatlabEngine", 
+            labRecorder: [LabRecorderClient | None],
+            startBlock: int
+            ) -> None:
+        _log.info("Running experiment in MATLAB")
+        with ExitStack() as stack:
+            # Record each block with the session's connection to LabRecorder
+            # and checkpoint it as it ends. Without the marker stream the
+            # ends of blocks are not known, so MATLAB controls LabRecorder
+            # itself, while the session's connection is closed.
+            recordInMatlab = False
+            if CONFIG.stream_markers_to_lsl:
+                if labRecorder is None:
+                    onBlockStop = self.__completeBlock
+                else:
+                    recorder = stack.enter_context(
+                        self.__blockRecorder(labRecorder, startBlock)
+                        )
+                    def onBlockStop(name: str) -> None:
+                        # Called from the watcher's thread, so errors are
+                        # logged rather than raised
+                        try:
+                            recorder.stopBlock(name)
+                        except ConnectionError as E:
+                            _log.error(
+                                "Failed to control LabRecorder after block "
+                                + "%s: %s", name, E
+                                )
+                        self.__completeBlock(name)
+                blockNames = self.__blockNames()[startBlock:]
+                stack.enter_context(
+                    _BlockStopWatcher(blockNames, onBlockStop)
+                    )
+            else:
+                _log.warning(
+                    "Markers are not streamed to LSL, completed blocks will "
+                    + "not be checkpointed"
+                    )
+                if labRecorder is not None:
+                    recordInMatlab = True
+                    labRecorder.close()
+                    @stack.callback
+                    def reconnect() -> None:
+                        try:
+                            labRecorder.connect()
+                        except ConnectionError as E:
+                            _log.warning(
+                                "Failed to reconnect to LabRecorder: %s", E
+                                )
             
             # Run experiment in MATLAB
             _log.debug("Displaying stimuli in MATLAB")
             
-            # Add project root directory to MATLAB path
-            p = eng.genpath(CONFIG.projectRoot)
-            eng.addpath(p, nargout=0)
-            
-            # Write MATLAB output from stimuli presentation to file on exit
-            matlabOut = stack.enter_context(StringIO())
-            @stack.push
-            def foo(exc_type, exc_value, exc_tb):
-                # TODO: should we do this while running the experiment?
-                matlabLogFile = os.path.join(self._DIR, "matlab.log")
-                _log.debug("Writing MATLAB output to file: %s", matlabLogFile)
-                with open(matlabLogFile, "a") as f:
-                    matlabOut.seek(0)
-                    shutil.copyfileobj(matlabOut, f)
+            # Stream MATLAB output from stimuli presentation to file while the
+            # experiment is running
+            matlabLogFile = os.path.join(self._DIR, "matlab.log")
+            matlabOut = stack.enter_context(
+                _MatlabOutputStream(
+                    matlabLogFile, forwardToLog=(CONFIG.verbose >= 3)
+                    )
+                )
                     
             # Display the stimuli, running in background, and add callback to
             # cancel stimuli presentation
@@ -208,9 +362,10 @@ class GradCPTSession(StudySession):
                 self._info["info_file"],
                 'verbose', CONFIG.verbose,
                 'streamMarkersToLSL', CONFIG.stream_markers_to_lsl,
-                'recordLSL', CONFIG.record_lsl,
+                'recordLSL', recordInMatlab,
                 'tcpAddress', CONFIG.tcp_address,
                 'tcpPort', CONFIG.tcp_port,
+                'startBlock', startBlock + 1,
                 stdout=matlabOut,
                 stderr=matlabOut,
                 background=True
@@ -221,20 +376,269 @@ class GradCPTSession(StudySession):
             _log.debug("Waiting for MATLAB to finish presenting stimuli...")
             future.result()
             _log.debug("Done presenting stimuli in MATLAB")
-            
-            # Close the MATLAB engine
-            _log.debug("Terminating the MATLAB engine")
-            eng.quit()   
-            
-            # Remaining resources (eg. the EEG device, LabRecorder) are closed
-            # automatically when exiting the context manager
+        
+    def __blockRecorder(
+            self, 
+            labRecorder: LabRecorderClient, 
+            startBlock: int
+            ) -> _BlockRecorder:
+        # Record the blocks from `startBlock` onwards, except for the
+        # practice block
+        blocks = self.__blocksTable()
+        return _BlockRecorder(
+            labRecorder,
+            [
+                {
+                    "block_name" : row["block_name"],
+                    "data_file" : row["data_file"],
+                    "record" : not (self._info["do_practice_block"] and k == 0)
+                    }
+                for k, row in enumerate(blocks.iter_rows(named=True))
+                if k >= startBlock
+                ],
+            self._info["participant_id"]
+            )
+        
+    def __presentWithSimulator(
+            self, 
+            timeScale: float, 
+            labRecorder: [LabRecorderClient | None],
+            startBlock: int
+            ) -> None:
+        _log.info("Running simulated experiment (time scale: %s)", timeScale)
+        simulator = GradCPTSimulator(
+            self._info["info_file"],
+            timeScale=timeScale,
+            streamMarkersToLSL=CONFIG.stream_markers_to_lsl,
+            labRecorder=labRecorder,
+            onBlockComplete=self.__completeBlock
+            )
+        stats = simulator.run(startBlock=startBlock)
+        _log.info(
+            "Simulated presentation schedule slip over %s events (ms): "
+            + "mean %.3f, median %.3f, p95 %.3f, p99 %.3f, max %.3f",
+            stats["num_events"], stats["mean_ms"], stats["median_ms"],
+            stats["p95_ms"], stats["p99_ms"], stats["max_ms"]
+            )
+        _log.debug(
+            "Updating info file with fields: %s", ["presentation_stats"]
+            )
+        self._info["presentation_stats"] = stats
+    
+    @property
+    def completedBlocks(self) -> list[str]:
+        """The names of the blocks that have been completed, in order."""
+        return [x for x in self.__checkpoint()["completed_blocks"]]
+    
+    @classmethod
+    def __emptyCheckpoint(cls) -> dict[str, Any]:
+        return {"completed_blocks" : [], "blocks" : {}}
+    
+    def __checkpoint(self) -> dict[str, Any]:
+        # The checkpoint stored in the info file. Has the fields 
+        # "completed_blocks" (the names of completed blocks, in order) and
+        # "blocks", which maps the name of each completed block to its
+        # "data_file" (or None if no data was recorded for the block), 
+        # "recorded" (whether data was being recorded for the block), "size"
+        # and "sha256" (the size and hash of the data file, or None if not yet
+        # known), "duration_s" (the duration of the block recorded in the data
+        # file, or None if not yet known) and "completed_at".
+        try:
+            return self._info["checkpoint"]
+        except KeyError:
+            return self.__emptyCheckpoint()
+        
+    def __blockNames(self) -> list[str]:
+        return self.__blocksTable()["block_name"].to_list()
+    
+    def __blocksTable(self) -> pl.DataFrame:
+        return pl.read_csv(self._info["blocks_file"])
+    
+    def __completeBlock(self, name: str) -> None:
+        # Add a block to the checkpoint. Called when the block ends (possibly
+        # from another thread).
+        _log.info("Checkpointing completed block: %s", name)
+        blocks = self.__blocksTable()
+        k = blocks["block_name"].to_list().index(name)
+        recorded = (
+            CONFIG.record_lsl 
+            and not (self._info["do_practice_block"] and k == 0)
+            )
+        checkpoint = self.__checkpoint()
+        if name in checkpoint["completed_blocks"]:
+            return
+        checkpoint["completed_blocks"].append(name)
+        checkpoint["blocks"][name] = {
+            "data_file" : blocks["data_file"][k] if recorded else None,
+            "recorded" : recorded,
+            "size" : None,
+            "sha256" : None,
+            "duration_s" : None,
+            "completed_at" : datetime.now().isoformat(timespec="seconds")
+            }
+        self._info["checkpoint"] = checkpoint
+        self._updateCatalog()
+        
+    def __sealCheckpoint(self) -> None:
+        # Record the size, hash and duration of the data files of completed
+        # blocks that do not have them yet, and update the catalog
+        checkpoint = self.__checkpoint()
+        changed = False
+        for name, entry in checkpoint["blocks"].items():
+            dataFile = entry["data_file"]
+            if entry["sha256"] is not None or dataFile is None:
+                continue
+            if os.path.isfile(dataFile):
+                _log.debug("Adding data file to checkpoint: %s", dataFile)
+                entry["size"] = os.path.getsize(dataFile)
+                entry["sha256"] = _hashFile(dataFile)
+                entry["duration_s"] = GradCPTBlock.dataFileDuration(dataFile)
+                changed = True
+            else:
+                _log.warning(
+                    "Data file of completed block %s not found: %s", 
+                    name, dataFile
+                    )
+        if changed:
+            self._info["checkpoint"] = checkpoint
+        self._updateCatalog()
+        
+    def __prepareResume(self) -> [int | None]:
+        # Verify the checkpoint and get the (0-based) index of the block to
+        # resume from, or None if all blocks are complete. Blocks are always
+        # presented in order, so the completed blocks are the first blocks
+        # of the session.
+        _log.info("Resuming session: %s", self.info["session_name"])
+        checkpoint = self.__checkpoint()
+        blocks = self.__blocksTable()
+        blockNames = blocks["block_name"].to_list()
+        
+        startBlock = None
+        for k, name in enumerate(blockNames):
+            entry = checkpoint["blocks"].get(name)
+            if entry is None or not self.__verifyCompletedBlock(name, entry):
+                startBlock = k
+                break
+        
+        # Drop any blocks from the checkpoint that will be run again
+        if startBlock is not None:
+            rerun = blockNames[startBlock:]
+            checkpoint["completed_blocks"] = [
+                x for x in checkpoint["completed_blocks"] if x not in rerun
+                ]
+            for name in rerun:
+                checkpoint["blocks"].pop(name, None)
+                self.__moveAsidePartialDataFile(blocks["data_file"][
+                    blockNames.index(name)
+                    ])
+            _log.info(
+                "Completed blocks: %s. Resuming at block: %s", 
+                checkpoint["completed_blocks"], blockNames[startBlock]
+                )
+        self._info["checkpoint"] = checkpoint
+        self._updateCatalog()
+        return startBlock
+    
+    def __verifyCompletedBlock(self, name: str, entry: dict) -> bool:
+        # Check that the data file of a block in the checkpoint is intact,
+        # adding its size and hash to the checkpoint if these are missing
+        dataFile = entry["data_file"]
+        if not entry["recorded"]:
+            return True
+        if dataFile is None or not os.path.isfile(dataFile):
+            _log.warning("Data file of block %s is missing", name)
+            return False
+        if entry["sha256"] is not None:
+            # Compare the size first as it is cheap
+            intact = (
+                os.path.getsize(dataFile) == entry["size"]
+                and _hashFile(dataFile) == entry["sha256"]
+                )
+            if not intact:
+                _log.warning("Data file of block %s has changed", name)
+            return intact
+        # The session ended before the data file could be checkpointed
+        if not GradCPTBlock.verifyDataFile(dataFile):
+            _log.warning("Data file of block %s is incomplete", name)
+            return False
+        entry["size"] = os.path.getsize(dataFile)
+        entry["sha256"] = _hashFile(dataFile)
+        entry["duration_s"] = GradCPTBlock.dataFileDuration(dataFile)
+        return True
+    
+    @classmethod
+    def __moveAsidePartialDataFile(cls, dataFile: str) -> None:
+        # Rename a partially recorded data file so that it is not overwritten
+        # when its block is run again
+        if not os.path.isfile(dataFile):
+            return
+        name, ext = os.path.splitext(dataFile)
+        n = 1
+        while os.path.exists(f"{name}.partial{n}{ext}"):
+            n += 1
+        newPath = f"{name}.partial{n}{ext}"
+        _log.info("Moving partial data file %s to %s", dataFile, newPath)
+        os.rename(dataFile, newPath)
+    
+    @classmethod
+    def _catalogBlocks(
+            cls, 
+            info: dict[str, Any], 
+            /,
+            scanDataFiles: bool = False
+            ) -> list[dict[str, Any]]:
+        # Get the entries of the session's blocks from its blocks file and
+        # checkpoint. Sizes are always read from the data files, and hashes 
+        # and durations are taken from the checkpoint if the size matches.
+        blocksFile = info.get("blocks_file")
+        if blocksFile is None or not os.path.isfile(blocksFile):
+            return []
+        with open(blocksFile, "r", newline="") as f:
+            blocks = list(csv.DictReader(f))
+        checkpoint = info.get("checkpoint", cls.__emptyCheckpoint())
+        
+        entries = []
+        for row in blocks:
+            name = row["block_name"]
+            dataFile = row["data_file"]
+            entry = checkpoint["blocks"].get(name, {})
+            exists = os.path.isfile(dataFile)
+            size = os.path.getsize(dataFile) if exists else None
+            sha256 = duration = None
+            if exists and entry.get("size") == size:
+                sha256 = entry.get("sha256")
+                duration = entry.get("duration_s")
+            if exists and scanDataFiles:
+                if sha256 is None:
+                    sha256 = _hashFile(dataFile)
+                if duration is None:
+                    duration = GradCPTBlock.dataFileDuration(dataFile)
+            completed = name in checkpoint["completed_blocks"] or (
+                # Sessions recorded before checkpointing (or whose checkpoint
+                # was lost) are complete if their data files are
+                "recorded" not in entry and duration is not None
+                )
+            entries.append({
+                "block_name" : name,
+                "stim_sequence_file" : row["stim_sequence_file"],
+                "data_file" : dataFile,
+                "completed" : completed,
+                "recorded" : entry.get("recorded", exists),
+                "data_file_exists" : exists,
+                "size" : size,
+                "sha256" : sha256,
+                "duration_s" : duration,
+                "completed_at" : entry.get("completed_at")
+                })
+        return entries
     
     def display(self) -> None:
         # TODO: finish this
-        if all(block.data is None for block in self._blocks.values()):
+        blocks = self.blocks
+        if all(block.data is None for block in blocks.values()):
             print("No data to display.")
         else:
-            for name, block in self._blocks.items():
+            for name, block in blocks.items():
                 if block.data is None:
                     print(f"No data to display for block {name}.")
                 else:
@@ -0,0 +1,301 @@
+import json
+import logging
+import os
+import random
+import time
+from typing import Any, Callable
+
+import numpy as np
+import polars as pl
+from pylsl import StreamInfo, StreamOutlet, local_clock
+
+from src.lab_recorder import LabRecorderClient
+
+_log = logging.getLogger(__name__)
+
+class GradCPTSimulator:
+    """Headless stand-in for the MATLAB gradCPT stimuli presentation.
+
+    Reads the same session info file and blocks file as `gradCPT.m` and emits
+    the same marker streams on the lab streaming layer, without requiring
+    MATLAB, Psychtoolbox or a display. For each block, a "block_start" marker
+    is followed by a "transition_period_start" and a "static_period_start"
+    marker for every stimulus in the block's stimulus sequence and finally a
+    "block_stop" marker, all on the "stimuli_marker_stream". Synthetic
+    participant responses are emitted on the "response_marker_stream". If a
+    `LabRecorderClient` is given, LabRecorder is controlled in the same way as
+    by `gradCPT.m`, recording each block except the practice block to the
+    block's data file.
+
+    Markers are emitted on a monotonic schedule derived from the session's
+    `stim_transition_time_ms` and `stim_static_time_ms`. The difference
+    between the time at which each marker is actually emitted and the time at
+    which it was scheduled (the "slip") is recorded, giving a measure of the
+    overhead of the Python side of the session pipeline.
+
+    Parameters
+    ----------
+    infoFile : str
+        The path to the info file of the session to simulate.
+    timeScale : float, default=1.0
+        The factor by which to compress time. For example, with `timeScale=10`
+        every period (including the pre-block waiting time) is 10 times
+        shorter than specified by the session.
+    streamMarkersToLSL : bool, default=True
+        Whether to push markers to LSL. If False, the schedule is still
+        followed and slip statistics are still recorded.
+    waitPreBlock : bool, default=True
+        Whether to wait the (scaled) pre-block waiting time before each block.
+    goResponseRate : float, default=0.9
+        The probability of a synthetic response to a common target.
+    commissionRate : float, default=0.3
+        The probability of a synthetic response to a rare target.
+    rtMeanMs, rtStdMs : float, optional
+        The mean and standard deviation of synthetic response times (measured
+        from the start of the transition period, before scaling). Default to
+        the transition period length and one eighth of it, respectively.
+    seed : int, optional
+        Seed for generating synthetic responses.
+    spinTimeMs : float, default=2.0
+        For waits shorter than this, busy-wait instead of sleeping to hit
+        deadlines accurately.
+    labRecorder : LabRecorderClient, optional
+        A client connected to LabRecorder, used to record each block.
+    onBlockComplete : Callable[[str], None], optional
+        Called with the name of each block after it has been completed.
+
+    Attributes
+    ----------
+    slips : dict of str to numpy.ndarray
+        The slip (in seconds) of every marker emitted, for each block that has
+        been simulated.
+    """
+
+    stimStreamName = "stimuli_marker_stream"
+    responseStreamName = "response_marker_stream"
+
+    def __init__(
+            self,
+            infoFile: str,
+            /,
+            timeScale: float = 1.0,
+            streamMarkersToLSL: bool = True,
+            waitPreBlock: bool = True,
+            goResponseRate: float = 0.9,
+            commissionRate: float = 0.3,
+            rtMeanMs: [float | None] = None,
+            rtStdMs: [float | None] = None,
+            seed: [int | None] = None,
+            spinTimeMs: float = 2.0,
+            labRecorder: [LabRecorderClient | None] = None,
+            onBlockComplete: [Callable[[str], None] | None] = None
+            ) -> None:
+        if timeScale <= 0:
+            raise ValueError(f"`timeScale` must be positive, got {timeScale}")
+
+        with open(infoFile, "r") as f:
+            self._info = json.load(f)
+        self._blocks = pl.read_csv(self._info["blocks_file"])
+
+        self.timeScale = timeScale
+        self.streamMarkersToLSL = streamMarkersToLSL
+        self.waitPreBlock = waitPreBlock
+        self.goResponseRate = goResponseRate
+        self.commissionRate = commissionRate
+
+        self._timeTP = self._info["stim_transition_time_ms"] / 1000
+        self._timeSP = self._info["stim_static_time_ms"] / 1000
+        self._rtMean = (
+            rtMeanMs / 1000 if rtMeanMs is not None else self._timeTP
+            )
+        self._rtStd = (
+            rtStdMs / 1000 if rtStdMs is not None else self._timeTP / 8
+            )
+        self._spinTime = spinTimeMs / 1000
+        self._rng = random.Random(seed)
+        self._labRecorder = labRecorder
+        self._onBlockComplete = onBlockComplete
+
+        self.slips = {}
+        self.__stimOutlet = None
+        self.__responseOutlet = None
+
+    def __enter__(self):
+        if self.streamMarkersToLSL:
+            _log.debug("Opening outlets for the gradCPT marker streams")
+            self.__stimOutlet = StreamOutlet(StreamInfo(
+                self.stimStreamName, "Markers", 1, 0, "string"
+                ))
+            self.__responseOutlet = StreamOutlet(StreamInfo(
+                self.responseStreamName, "Markers", 1, 0, "string"
+                ))
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_tb):
+        _log.debug("Closing outlets for the gradCPT marker streams")
+        self.__stimOutlet = None
+        self.__responseOutlet = None
+
+    @property
+    def blockNames(self) -> list[str]:
+        return self._blocks["block_name"].to_list()
+
+    def run(self, startBlock: int = 0) -> dict[str, Any]:
+        """Simulate the presentation of every block in the session.
+
+        Parameters
+        ----------
+        startBlock : int, default=0
+            The (0-based) index of the first block to present. Earlier blocks
+            are skipped.
+
+        Returns
+        -------
+        dict of str to Any
+            Slip statistics over all blocks (see `slipStats`), with an
+            additional item "blocks" mapping each block name to the slip
+            statistics of that block.
+        """
+        with self:
+            # Prepare LabRecorder to record data for this session
+            if self._labRecorder is not None:
+                self._labRecorder.update()
+                self._labRecorder.select("all")
+            for k in range(startBlock, self._blocks.height):
+                self.runBlock(k)
+        stats = self.slipStats()
+        stats["blocks"] = {
+            name : self.slipStats(name) for name in self.slips.keys()
+            }
+        return stats
+
+    def runBlock(self, k: int) -> None:
+        """Simulate the presentation of the block at (0-based) index `k`."""
+        block = self._blocks.row(k, named=True)
+        name = block["block_name"]
+        _log.info("Simulating block: %s", name)
+
+        targetTypes = pl.read_csv(block["stim_sequence_file"])["target_type"]
+        events = self.__schedule(targetTypes.to_list())
+
+        # Pre-block waiting period
+        if self.waitPreBlock:
+            self.__waitUntil(
+                local_clock() + block["pre_block_wait_time"] / self.timeScale
+                )
+
+        # Start recording data for this block on LabRecorder
+        record = (
+            self._labRecorder is not None
+            and not (self._info["do_practice_block"] and k == 0)
+            )
+        if record:
+            root, fileName = os.path.split(block["data_file"])
+            self._labRecorder.filename(
+                root, fileName,
+                participant=self._info["participant_id"], task=name
+                )
+            self._labRecorder.start()
+
+        # Emit the events, recording the slip of each one
+        slips = np.empty(len(events))
+        t0 = local_clock()
+        for n, (offset, isResponse, marker) in enumerate(events):
+            deadline = t0 + offset / self.timeScale
+            self.__waitUntil(deadline)
+            t = local_clock()
+            slips[n] = t - deadline
+            self.__push(isResponse, marker, t)
+        self.slips[name] = slips
+
+        # Stop recording data for this block on LabRecorder
+        if record:
+            self._labRecorder.stop()
+        if self._onBlockComplete is not None:
+            self._onBlockComplete(name)
+
+        stats = self.slipStats(name)
+        _log.debug(
+            "Block %s schedule slip (ms): mean %.3f, p99 %.3f, max %.3f",
+            name, stats["mean_ms"], stats["p99_ms"], stats["max_ms"]
+            )
+
+    def slipStats(self, blockName: [str | None] = None) -> dict[str, float]:
+        """Get summary statistics of the schedule slip.
+
+        Parameters
+        ----------
+        blockName : str, optional
+            The block to summarise. If unspecified, all blocks that have been
+            simulated are summarised together.
+
+        Returns
+        -------
+        dict of str to float
+            The number of events ("num_events") and the mean, median, 95th
+            percentile, 99th percentile and maximum slip in milliseconds
+            ("mean_ms", "median_ms", "p95_ms", "p99_ms", "max_ms").
+        """
+        if blockName is not None:
+            slips = self.slips[blockName]
+        elif len(self.slips) > 0:
+            slips = np.concatenate(list(self.slips.values()))
+        else:
+            slips = np.empty(0)
+
+        if len(slips) == 0:
+            return {
+                "num_events" : 0, "mean_ms" : np.nan, "median_ms" : np.nan,
+                "p95_ms" : np.nan, "p99_ms" : np.nan, "max_ms" : np.nan
+                }
+        slipsMs = slips * 1000
+        p50, p95, p99 = np.percentile(slipsMs, [50, 95, 99])
+        return {
+            "num_events" : len(slips),
+            "mean_ms" : float(slipsMs.mean()),
+            "median_ms" : float(p50),
+            "p95_ms" : float(p95),
+            "p99_ms" : float(p99),
+            "max_ms" : float(slipsMs.max())
+            }
+
+    def __schedule(self, targetTypes: list[str]) -> list[tuple]:
+        # Get the (unscaled) time of every event in a block relative to the
+        # start of the block, as tuples of (time, isResponse, marker) sorted
+        # by time
+        trialTime = self._timeTP + self._timeSP
+        events = [(0.0, False, "block_start")]
+        for k, targetType in enumerate(targetTypes):
+            tTP = k * trialTime
+            events.append((tTP, False, "transition_period_start"))
+            events.append((tTP + self._timeTP, False, "static_period_start"))
+
+            # Synthetic response to this trial
+            p = (
+                self.commissionRate if targetType == "rare"
+                else self.goResponseRate
+                )
+            if self._rng.random() < p:
+                rt = self._rng.gauss(self._rtMean, self._rtStd)
+                rt = min(max(rt, 0.1 * trialTime), 1.9 * trialTime)
+                events.append((tTP + rt, True, "response"))
+        blockEnd = len(targetTypes) * trialTime
+        events = [e for e in events if e[0] < blockEnd]
+        events.append((blockEnd, False, "block_stop"))
+
+        # Stable sort keeps markers with equal times in the order above
+        events.sort(key=lambda e: e[0])
+        return events
+
+    def __waitUntil(self, deadline: float) -> None:
+        # Sleep until shortly before the deadline, then busy-wait
+        remaining = deadline - local_clock()
+        if remaining > self._spinTime:
+            time.sleep(remaining - self._spinTime)
+        while local_clock() < deadline:
+            pass
+
+    def __push(self, isResponse: bool, marker: str, timestamp: float) -> None:
+        outlet = self.__responseOutlet if isResponse else self.__stimOutlet
+        if outlet is not None:
+            outlet.push_sample([marker], timestamp)
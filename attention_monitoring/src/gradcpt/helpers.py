@@ -1,12 +1,20 @@
+from contextlib import ExitStack
 import logging
+import os
+import threading
+from time import sleep
 from typing import Callable
 from typing_extensions import Self
 
-import matlab.engine
+from pylsl import StreamInlet, resolve_byprop
 
+from src.config import CONFIG
+from src.eeg_device import EEGDevice
 import src.gradcpt as gradcpt
+from src.gradcpt.matlab.pyhelpers import _getMatlabCallback
 from src.helpers import _LogToFileCM
-from src.study.helpers import getVerboseLogFormatter
+from src.lab_recorder import LabRecorderClient
+from src.study.helpers import _LaunchLabRecorder, getVerboseLogFormatter
 
 _log = logging.getLogger(__name__)
     
@@ -29,4 +37,349 @@ class _GradCPTLogToFileCM(_LogToFileCM):
             logging.getLogger(logName),
             filePath,
             getVerboseLogFormatter(gradcpt.GradCPTSession.getStudyType())
-        )
\ No newline at end of file
+        )
+
+class _GradCPTResources:
+    """Context manager for the expensive resources used to run gradCPT.
+    
+    Starts the MATLAB engine (in the background, if `presentation` is 
+    "matlab"), connects to the EEG device and launches LabRecorder (if
+    recording is enabled and `CONFIG.path_to_LabRecorder` is specified) and 
+    opens a persistent connection to LabRecorder's remote control interface 
+    (if recording is enabled) when entering the context, and closes them all
+    when exiting it. While in the
+    context, the resources may be shared by any number of consecutive gradCPT
+    sessions. Their health can be checked between sessions with `check` and
+    any that have failed can be restarted with `recover`.
+    
+    Parameters
+    ----------
+    eeg : EEGDevice
+        The EEG device to connect to.
+    presentation : {"matlab", "simulated"}
+        The presentation backend that the resources will be used with. The
+        MATLAB engine is only started for "matlab".
+    lrLogFilePath : str
+        The file to write LabRecorder's output to.
+    """
+    def __init__(
+            self, 
+            eeg: EEGDevice, 
+            presentation: str, 
+            lrLogFilePath: str
+            ) -> None:
+        self.eeg = eeg
+        self.presentation = presentation
+        self.lrLogFilePath = lrLogFilePath
+        
+        self.__stack = None
+        self.__matlabFuture = None
+        self.__eng = None
+        self.__lr = None
+        self.__lrClient = None
+        
+    def __enter__(self):
+        with ExitStack() as stack:
+            if self.presentation == "matlab":
+                # Start MATLAB engine asynchronously (do this first as it may
+                # take some time) and add callback to cancel MATLAB startup
+                self.__startMatlab(stack)
+            
+            # Connect to the EEG device
+            stack.enter_context(self.eeg)
+            
+            # Setup LabRecorder
+            lrPath = CONFIG.path_to_LabRecorder
+            if CONFIG.record_lsl and lrPath is not None:
+                self.__lr = stack.enter_context(
+                    _LaunchLabRecorder(self.lrLogFilePath, lrPath)
+                    )
+            
+            # Connect to LabRecorder's remote control interface, waiting for
+            # it to start listening if it was just launched
+            if CONFIG.record_lsl:
+                self.__lrClient = stack.enter_context(
+                    LabRecorderClient(CONFIG.tcp_address, CONFIG.tcp_port)
+                    )
+                self.__lrClient.update()
+                self.__lrClient.select("all")
+            
+            # Only keep the resources open if all of them were opened
+            # successfully
+            self.__stack = stack.pop_all()
+        return self
+    
+    def __exit__(self, exc_type, exc_value, exc_tb):
+        stack, self.__stack = self.__stack, None
+        self.__eng = None
+        self.__matlabFuture = None
+        self.__lr = None
+        self.__lrClient = None
+        return stack.__exit__(exc_type, exc_value, exc_tb)
+        
+    @property
+    def engine(self) -> "matlab.engine.MatlabEngine":
+        """The MATLAB engine, waiting for it to finish starting if needed."""
+        if self.__eng is None:
+            if self.__matlabFuture is None:
+                raise RuntimeError(
+                    "The MATLAB engine is not used for presentation: "
+                    + f"'{self.presentation}'"
+                    )
+            _log.debug("Waiting for MATLAB to start ...")
+            while not self.__matlabFuture.done():
+                sleep(0.5)
+            _log.debug("MATLAB started")
+            self.__eng = self.__stack.enter_context(
+                self.__matlabFuture.result()
+                )
+            
+            # Add project root directory to MATLAB path
+            p = self.__eng.genpath(CONFIG.projectRoot)
+            self.__eng.addpath(p, nargout=0)
+        return self.__eng
+    
+    @property
+    def labRecorder(self) -> [LabRecorderClient | None]:
+        """The client connected to LabRecorder, if recording is enabled."""
+        return self.__lrClient
+    
+    def check(self) -> dict[str, bool]:
+        """Check whether each of the resources is still usable.
+        
+        Returns
+        -------
+        dict of str to bool
+            Maps the name of each open resource ("matlab", "eeg", 
+            "lab_recorder", "lab_recorder_connection") to whether it is
+            healthy.
+        """
+        health = {}
+        if self.__matlabFuture is not None:
+            health["matlab"] = self.__matlabIsHealthy()
+        health["eeg"] = self.eeg.isStreaming()
+        if self.__lr is not None:
+            health["lab_recorder"] = self.__lr.isRunning()
+        if self.__lrClient is not None:
+            health["lab_recorder_connection"] = self.__lrClientIsHealthy()
+        return health
+    
+    def recover(self) -> dict[str, bool]:
+        """Restart any resources that are no longer usable.
+        
+        Returns
+        -------
+        dict of str to bool
+            The health of each resource after attempting recovery (see 
+            `check`).
+        """
+        health = self.check()
+        if all(health.values()):
+            return health
+        _log.warning(
+            "Restarting unhealthy resources: %s", 
+            [k for (k, v) in health.items() if not v]
+            )
+        
+        if not health.get("matlab", True):
+            # The old engine is abandoned, it is closed (if possible) when 
+            # exiting this context
+            self.__eng = None
+            self.__startMatlab(self.__stack)
+        if not health["eeg"]:
+            self.eeg.__exit__(None, None, None)
+            self.eeg.__enter__()
+        if not health.get("lab_recorder", True):
+            self.__lr.__exit__(None, None, None)
+            self.__lr.__enter__()
+        if not health.get("lab_recorder_connection", True):
+            self.__lrClient.close()
+            try:
+                self.__lrClient.connect()
+                self.__lrClient.select("all")
+            except ConnectionError as E:
+                _log.warning("Failed to reconnect to LabRecorder: %s", E)
+        
+        health = self.check()
+        _log.info("Resource health after recovery: %s", health)
+        return health
+    
+    def __startMatlab(self, stack: ExitStack) -> None:
+        # Imported here so that sessions can be run with a simulated
+        # presentation without MATLAB installed
+        import matlab.engine
+        
+        _log.debug("Starting the MATLAB engine")
+        self.__matlabFuture = matlab.engine.start_matlab(background=True)
+        stack.push(_getMatlabCallback(self.__matlabFuture, "MATLAB startup"))
+        
+    def __matlabIsHealthy(self) -> bool:
+        if self.__eng is None:
+            # Still starting, or failed to start
+            return not self.__matlabFuture.cancelled()
+        try:
+            self.__eng.eval("1;", nargout=0)
+        except Exception as E:
+            _log.debug("MATLAB engine health check failed: %s", E)
+            return False
+        return True
+        
+    def __lrClientIsHealthy(self) -> bool:
+        try:
+            self.__lrClient.update()
+        except ConnectionError as E:
+            _log.debug("LabRecorder connection health check failed: %s", E)
+            return False
+        return True
+
+
+class _BlockStopWatcher:
+    """Context manager for watching the stimuli marker stream for the end of
+    each block.
+    
+    While in this context, a background thread reads the gradCPT stimuli 
+    marker stream from LSL (as soon as it becomes available) and calls 
+    `callback` with the name of the block that has just ended every time a
+    "block_stop" marker is received. Blocks are assumed to be presented in the
+    order given by `blockNames`.
+    
+    Parameters
+    ----------
+    blockNames : list of str
+        The names of the blocks that will be presented, in order.
+    callback : Callable[[str], None]
+        Called with the name of each block when it ends.
+    streamName : str, default="stimuli_marker_stream"
+        The name of the marker stream to watch.
+    """
+    def __init__(
+            self, 
+            blockNames: list[str], 
+            callback: Callable[[str], None],
+            streamName: str = "stimuli_marker_stream"
+            ) -> None:
+        self.blockNames = blockNames
+        self.callback = callback
+        self.streamName = streamName
+        self.__stopEvent = threading.Event()
+        self.__thread = None
+        
+    def __enter__(self):
+        _log.debug("Watching stream for the end of blocks: %s", self.streamName)
+        self.__thread = threading.Thread(
+            target=self.__watch, name="block-stop-watcher", daemon=True
+            )
+        self.__thread.start()
+        return self
+    
+    def __exit__(self, exc_type, exc_value, exc_tb):
+        self.__stopEvent.set()
+        self.__thread.join()
+        _log.debug("Stopped watching stream: %s", self.streamName)
+        
+    def __watch(self) -> None:
+        # Wait for the stream to become available
+        streams = []
+        while len(streams) == 0:
+            if self.__stopEvent.is_set():
+                return
+            streams = resolve_byprop("name", self.streamName, timeout=0.5)
+        inlet = StreamInlet(streams[0])
+        
+        # Keep reading until stopped, then read any markers that are still
+        # buffered
+        pending = list(self.blockNames)
+        while len(pending) > 0:
+            samples, _ = inlet.pull_chunk(timeout=0.2)
+            if self.__stopEvent.is_set() and len(samples) == 0:
+                break
+            for sample in samples:
+                if sample[0] == "block_stop" and len(pending) > 0:
+                    self.callback(pending.pop(0))
+
+
+class _BlockRecorder:
+    """Context manager for recording each block of a gradCPT session with 
+    LabRecorder.
+    
+    Records the blocks through an already connected `LabRecorderClient`, so
+    that the presentation backend does not need its own connection to
+    LabRecorder. Recording of the first block is started when entering the
+    context, and `stopBlock` must be called when each block ends (eg. by a
+    `_BlockStopWatcher`), which stops recording it and starts recording the
+    next block, ahead of its pre-block period. Any recording still in
+    progress is stopped when exiting the context.
+    
+    Parameters
+    ----------
+    labRecorder : LabRecorderClient
+        The client connected to LabRecorder.
+    blocks : list of dict
+        The blocks that will be presented, in order. Each has the keys
+        "block_name", "data_file" (the file to record the block to) and
+        "record" (whether to record the block).
+    participant : int or str
+        The participant ID given to LabRecorder with each file name.
+    """
+    def __init__(
+            self,
+            labRecorder: LabRecorderClient,
+            blocks: list[dict],
+            participant: [int | str]
+            ) -> None:
+        self.labRecorder = labRecorder
+        self.blocks = blocks
+        self.participant = participant
+        self.__next = 0
+        self.__recording = None
+        
+    def __enter__(self):
+        self.labRecorder.update()
+        self.labRecorder.select("all")
+        self.__startNext()
+        return self
+    
+    def __exit__(self, exc_type, exc_value, exc_tb):
+        if self.__recording is None:
+            return
+        _log.info(
+            "Stopping recording of unfinished block: %s", self.__recording
+            )
+        try:
+            self.labRecorder.stop()
+        except ConnectionError as E:
+            if exc_type is None:
+                raise
+            _log.warning("Failed to stop recording: %s", E)
+        self.__recording = None
+        
+    def stopBlock(self, name: str) -> None:
+        """Stop recording the block that has just ended (`name`) and start
+        recording the next block.
+        """
+        expected = self.blocks[self.__next - 1]["block_name"]
+        if name != expected:
+            raise ValueError(
+                f"Block '{name}' ended, expected block '{expected}'"
+                )
+        if self.__recording is not None:
+            _log.debug("Stopping recording of block: %s", name)
+            self.labRecorder.stop()
+            self.__recording = None
+        self.__startNext()
+        
+    def __startNext(self) -> None:
+        if self.__next >= len(self.blocks):
+            return
+        block = self.blocks[self.__next]
+        self.__next += 1
+        if not block["record"]:
+            return
+        _log.debug("Starting recording of block: %s", block["block_name"])
+        root, fileName = os.path.split(block["data_file"])
+        self.labRecorder.filename(
+            root, fileName, 
+            participant=self.participant, task=block["block_name"]
+            )
+        self.labRecorder.start()
+        self.__recording = block["block_name"]
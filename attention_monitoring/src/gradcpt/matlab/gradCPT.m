@@ -36,6 +36,7 @@ function data = gradCPT(infoFile, nvargs, lslargs)
 arguments
     infoFile (1,:) {mustBeFile}
     nvargs.verbose (1,1) {mustBeInteger} = 0
+    nvargs.startBlock (1,1) {mustBeInteger, mustBePositive} = 1
     lslargs.streamMarkersToLSL (1,1) logical = false
     lslargs.recordLSL (1,1) logical = false
     lslargs.tcpAddress = 'localhost'
@@ -277,8 +278,9 @@ try
 %     % Hide the cursor
 %     HideCursor(screenNumber);
     
-    % Run each block of trials
-    for k1 = 1:height(blocks)
+    % Run each block of trials, skipping any blocks before `startBlock`
+    % (eg. when resuming a session)
+    for k1 = nvargs.startBlock:height(blocks)
         if verbose >= 2
             msg = "== " + blocks.block_name{k1} + " ==";
             fprintf('\n%s\n', msg);
@@ -1,12 +1,16 @@
+import asyncio
 import logging
+import queue
+import threading
+import time
 from typing import Callable
 
-import matlab.engine
+import aiofiles
 
 _log = logging.getLogger(__name__)      
         
 def _getMatlabCallback(
-        future: matlab.engine.FutureResult, 
+        future: "matlab.engine.FutureResult", 
         desc: str
         ) -> Callable[[], None]:
     """Get a function that, when called, cancels the specified asynchronous
@@ -36,6 +40,9 @@ def _getMatlabCallback(
     Callable[[], None]
         The function to call to cancel the specified MATLAB call.
     """
+    # Imported here so that this module can be used without MATLAB installed
+    import matlab.engine
+    
     # TODO: use weakref?
     def f(exc_type, exc_value, exc_tb) -> None:
         if exc_type is not None:
@@ -76,4 +83,202 @@ def _getMatlabCallback(
                     desc
                     )
         
-    return f  
\ No newline at end of file
+    return f
+
+class _MatlabOutputStream:
+    """Line-oriented writer for streaming MATLAB output to a log file.
+    
+    Instances can be passed as the `stdout` and/or `stderr` of a call to the
+    MATLAB engine. Text written by MATLAB is split into lines, which are
+    queued and appended to the file specified by `filePath` incrementally by
+    a background thread, so that output is not lost if the Python process
+    ends unexpectedly. Memory use is bounded: at most `maxQueuedLines` lines
+    are held in memory at any time, and partial lines longer than
+    `maxLineLength` characters are split. If the queue remains full for 
+    longer than `putTimeout` seconds, lines are dropped and a note indicating
+    how many lines were dropped is written to the file instead.
+    
+    Optionally, each line can also be forwarded to the logger of this module
+    (a child of the `src` logger), with the time of the log record set to the
+    time at which the line was received from MATLAB.
+    
+    Must be used as a context manager: the background thread is started when
+    entering the context and all remaining output is written to the file
+    before exiting the context.
+    
+    Parameters
+    ----------
+    filePath : str
+        The path to the file that MATLAB output is appended to.
+    forwardToLog : bool, default=False
+        Whether to forward each line of MATLAB output to the logger.
+    logLevel : int, default=logging.DEBUG
+        The level to use when forwarding lines to the logger.
+    maxQueuedLines : int, default=10000
+        The maximum number of lines that may be waiting to be written.
+    maxLineLength : int, default=4096
+        The maximum length of a line before it is split.
+    flushInterval : float, default=0.5
+        The maximum time in seconds that a line may wait before being written
+        to the file.
+    putTimeout : float, default=1.0
+        The time in seconds to wait for space in the queue before dropping a
+        line.
+    """
+    
+    # Sentinel placed on the queue to stop the background thread
+    __STOP = object()
+    
+    def __init__(
+            self,
+            filePath: str,
+            /,
+            forwardToLog: bool = False,
+            logLevel: int = logging.DEBUG,
+            maxQueuedLines: int = 10000,
+            maxLineLength: int = 4096,
+            flushInterval: float = 0.5,
+            putTimeout: float = 1.0
+            ) -> None:
+        self.filePath = filePath
+        self.forwardToLog = forwardToLog
+        self.logLevel = logLevel
+        self._maxLineLength = maxLineLength
+        self._flushInterval = flushInterval
+        self._putTimeout = putTimeout
+        
+        self.__queue = queue.Queue(maxsize=maxQueuedLines)
+        self.__partial = ""
+        self.__partialTime = None
+        self.__lock = threading.Lock()
+        self.__numDropped = 0
+        self.__numDroppedTotal = 0
+        self.__thread = None
+        
+    @property
+    def numDroppedLines(self) -> int:
+        """The total number of lines of output that have been dropped."""
+        return self.__numDroppedTotal
+    
+    def __enter__(self):
+        _log.debug("Streaming MATLAB output to file: %s", self.filePath)
+        self.__thread = threading.Thread(
+            target=lambda: asyncio.run(self.__drain()),
+            name="matlab-output-writer",
+            daemon=True
+            )
+        self.__thread.start()
+        return self
+        
+    def __exit__(self, exc_type, exc_value, exc_tb):
+        self.close()
+        
+    def write(self, s: str) -> int:
+        """Write text produced by MATLAB.
+        
+        Only complete lines are queued for writing; any trailing partial line
+        is held until it is completed by a later call or the stream is 
+        closed.
+        """
+        now = time.time()
+        with self.__lock:
+            if self.__partial == "":
+                self.__partialTime = now
+            text = self.__partial + s
+            lines = text.splitlines(keepends=True)
+            if len(lines) > 0 and not lines[-1].endswith(("\n", "\r")):
+                self.__partial = lines.pop()
+            else:
+                self.__partial = ""
+            while len(self.__partial) > self._maxLineLength:
+                lines.append(self.__partial[:self._maxLineLength] + "\n")
+                self.__partial = self.__partial[self._maxLineLength:]
+            for line in lines:
+                self.__put((self.__partialTime, line))
+                self.__partialTime = now
+        return len(s)
+    
+    def flush(self) -> None:
+        # Lines are flushed to the file by the background thread
+        pass
+    
+    def close(self) -> None:
+        """Write any remaining output to the file and stop the background
+        thread."""
+        if self.__thread is None:
+            return
+        with self.__lock:
+            if self.__partial != "":
+                self.__put((self.__partialTime, self.__partial + "\n"))
+                self.__partial = ""
+        # Always deliver the sentinel, even if the queue is full
+        self.__queue.put(self.__STOP)
+        self.__thread.join()
+        self.__thread = None
+        if self.__numDroppedTotal > 0:
+            _log.warning(
+                "Dropped %s lines of MATLAB output", self.__numDroppedTotal
+                )
+        _log.debug("Stopped streaming MATLAB output to file")
+        
+    def __put(self, item) -> None:
+        # Queue a line for writing, dropping it if the queue stays full. Must
+        # be called while holding `self.__lock`.
+        if self.__numDropped > 0:
+            note = f"[{self.__numDropped} lines of MATLAB output dropped]\n"
+            try:
+                self.__queue.put_nowait((item[0], note))
+            except queue.Full:
+                pass
+            else:
+                self.__numDropped = 0
+        try:
+            self.__queue.put(item, timeout=self._putTimeout)
+        except queue.Full:
+            self.__numDropped += 1
+            self.__numDroppedTotal += 1
+        
+    def __nextBatch(self) -> list:
+        # Block until at least one item is available (or the flush interval
+        # elapses), then take everything else that is already queued
+        batch = []
+        try:
+            batch.append(self.__queue.get(timeout=self._flushInterval))
+        except queue.Empty:
+            return batch
+        while batch[-1] is not self.__STOP:
+            try:
+                batch.append(self.__queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+        
+    async def __drain(self) -> None:
+        async with aiofiles.open(self.filePath, "a") as f:
+            done = False
+            while not done:
+                batch = await asyncio.to_thread(self.__nextBatch)
+                if len(batch) > 0 and batch[-1] is self.__STOP:
+                    done = True
+                    batch.pop()
+                if len(batch) == 0:
+                    continue
+                await f.write("".join(line for (_, line) in batch))
+                await f.flush()
+                if self.forwardToLog:
+                    for t, line in batch:
+                        self.__forward(t, line.rstrip("\r\n"))
+                    
+    def __forward(self, t: float, line: str) -> None:
+        # Log a line of output with the time it was received from MATLAB
+        if not _matlabLog.isEnabledFor(self.logLevel):
+            return
+        record = _matlabLog.makeRecord(
+            _matlabLog.name, self.logLevel, __file__, 0, "%s", (line,), None
+            )
+        record.created = t
+        record.msecs = (t - int(t)) * 1000
+        _matlabLog.handle(record)
+
+# Logger that MATLAB output is forwarded to
+_matlabLog = _log.getChild("output")
@@ -1,27 +1,59 @@
 import logging
 
 from src.config import CONFIG
-from src.eeg_device import Muse
+from src.eeg_device import EEGDevice, Muse, SimulatedEEG
 from src.gradcpt import GradCPTSession
 
 _log = logging.getLogger(__name__)
 
 class MuseGradCPTSession(GradCPTSession):
+    """GradCPT session recording EEG from a Muse headset.
+
+    Parameters
+    ----------
+    museTimeout : int or float, default=-1
+        Time in seconds to wait for the Muse to connect and to start
+        streaming. Wait indefinitely if negative.
+    simulateEEG : bool, default=False
+        Stream synthetic signals from a `SimulatedEEG` device instead of
+        connecting to a Muse headset, eg. when testing the session with
+        simulated presentation.
+    **kwargs
+        Passed to `GradCPTSession`.
+    """
     
-    def __init__(self, /, museTimeout: [int | float] = -1, **kwargs) -> None:
+    def __init__(
+            self, 
+            /, 
+            museTimeout: [int | float] = -1, 
+            simulateEEG: bool = False,
+            **kwargs
+            ) -> None:
         
         super().__init__(**kwargs)
         
-        self.__eeg = Muse(
-            *CONFIG.muse_signals, 
-            connectTimeout=museTimeout, 
-            startStreamingTimeout=museTimeout
-            )
+        # Existing sessions use the signals they were recorded with
+        signals = self._info.safeView().get("muse_signals")
+        if signals is None:
+            signals = CONFIG.muse_signals
+            if kwargs.get("sessionName") is None:
+                # Update the info file with the signals that will be streamed
+                # from Muse
+                _log.debug(
+                    "Updating info file with fields: %s", ["muse_signals"]
+                    )
+                self._info["muse_signals"] = signals
         
-        # Update the info file with the signals that will be streamed from Muse
-        _log.debug("Updating info file with fields: %s", ["muse_signals"])
-        self._info["muse_signals"] = CONFIG.muse_signals
+        if simulateEEG:
+            _log.info("Using a simulated EEG device instead of a Muse")
+            self.__eeg = SimulatedEEG(*signals)
+        else:
+            self.__eeg = Muse(
+                *signals, 
+                connectTimeout=museTimeout, 
+                startStreamingTimeout=museTimeout
+                )
         
     @property
-    def eeg(self) -> Muse:
+    def eeg(self) -> EEGDevice:
         return self.__eeg
\ No newline at end of file
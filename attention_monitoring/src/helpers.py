@@ -1,9 +1,137 @@
 import errno
+import hashlib
 import json
 import logging
 import os
+import threading
+import time
 from typing import Any
 
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+try:
+    import msvcrt
+except ImportError:
+    msvcrt = None
+
+def _hashFile(filePath: str, chunkSize: int = 1 << 20) -> str:
+    """Get the SHA-256 hash of a file's contents as a hex string."""
+    h = hashlib.sha256()
+    with open(filePath, "rb") as f:
+        while chunk := f.read(chunkSize):
+            h.update(chunk)
+    return h.hexdigest()
+
+class _FileLock:
+    """Context manager for holding an exclusive lock on a file.
+    
+    The lock is taken on a separate lock file, "[filePath].lock", which is
+    created if needed and left in place afterwards. The file specified by
+    `filePath` itself is not opened. The lock is exclusive between processes
+    (including processes on other machines, if the file system supports
+    it) and between threads. It is not reentrant.
+    
+    On POSIX systems, `fcntl.flock` is used. On Windows, `msvcrt.locking` is
+    used. Otherwise, the lock file is created exclusively to take the lock and
+    deleted to release it.
+    
+    Parameters
+    ----------
+    filePath : str
+        The path to the file to lock.
+    timeout : float, optional
+        The time in seconds to wait for the lock before raising a
+        `TimeoutError`. If unspecified, wait indefinitely.
+    pollInterval : float, default=0.001
+        The time in seconds to wait between attempts to take the lock, when
+        it cannot be waited for directly.
+    """
+    def __init__(
+            self,
+            filePath: str,
+            timeout: [float | None] = None,
+            pollInterval: float = 0.001
+            ) -> None:
+        self.path = filePath + ".lock"
+        self.timeout = timeout
+        self.pollInterval = pollInterval
+        self.__fd = None
+        self.__threadLock = threading.Lock()
+    
+    def __enter__(self):
+        self.acquire()
+        return self
+    
+    def __exit__(self, exc_type, exc_value, exc_tb):
+        self.release()
+    
+    def acquire(self) -> None:
+        """Take the lock, waiting for it if it is held elsewhere.
+        
+        Raises
+        ------
+        TimeoutError
+            If the lock could not be taken within `timeout` seconds.
+        """
+        timeout = -1 if self.timeout is None else self.timeout
+        if not self.__threadLock.acquire(timeout=timeout):
+            raise TimeoutError(f"Timed out waiting for lock: {self.path}")
+        try:
+            deadline = (
+                None if self.timeout is None
+                else time.monotonic() + self.timeout
+                )
+            while not self.__tryAcquire(block=(deadline is None)):
+                if deadline is not None and time.monotonic() > deadline:
+                    raise TimeoutError(
+                        f"Timed out waiting for lock: {self.path}"
+                        )
+                time.sleep(self.pollInterval)
+        except BaseException:
+            self.__threadLock.release()
+            raise
+    
+    def release(self) -> None:
+        """Release the lock."""
+        fd, self.__fd = self.__fd, None
+        try:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            elif msvcrt is not None:
+                os.lseek(fd, 0, os.SEEK_SET)
+                msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+            os.close(fd)
+            if fcntl is None and msvcrt is None:
+                os.remove(self.path)
+        finally:
+            self.__threadLock.release()
+    
+    def __tryAcquire(self, block: bool) -> bool:
+        # Try to take the lock, returning whether it was taken
+        if fcntl is None and msvcrt is None:
+            try:
+                self.__fd = os.open(
+                    self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY
+                    )
+            except FileExistsError:
+                return False
+            return True
+        
+        fd = os.open(self.path, os.O_CREAT | os.O_RDWR)
+        try:
+            if fcntl is not None:
+                flags = fcntl.LOCK_EX if block else fcntl.LOCK_EX | fcntl.LOCK_NB
+                fcntl.flock(fd, flags)
+            else:
+                msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+        except OSError:
+            os.close(fd)
+            return False
+        self.__fd = fd
+        return True
+
 class _LogToFileCM:
     """Context manager for temporarily writing log output to a file.
     
@@ -51,12 +179,16 @@ class JsonBackedDict:
     `JsonBackedDict` object. Changes to the jdict made through this object
     using the provided methods are reflected in the json file. Once 
     initialised, key value pairs in the jdict can be specified and accessed 
-    like a normal dict object (ie. `myJsonBackedDict[x] = y`). Note that the 
-    data returned by instances of `JsonBackedDict` are undefined and may result 
-    in unexpected behaviour if:
-     - The content of the json file is changed externally.
-     - Multiple instances of `JsonBackedDict` exist concurrently and are backed
-       by the same file.
+    like a normal dict object (ie. `myJsonBackedDict[x] = y`).
+    
+    Multiple instances of `JsonBackedDict` (including in other processes) can
+    be backed by the same file. The file is only read and written while
+    holding a lock on it (see `_FileLock`). When items are changed, the
+    current content of the file is read and only the changed items are
+    replaced, so that changes made through other instances are kept. The file
+    is replaced atomically, so it is never seen partially written. Changes
+    made through other instances are only seen by this instance after it
+    changes an item or `reload` is called.
     
     Parameters
     ----------
@@ -86,29 +218,48 @@ class JsonBackedDict:
                 )
         self.__path = name + ".json"
         
+        self.__lock = _FileLock(self.__path)
+        
         # Load the info file if it exists, otherwise create it or raise an 
         # exception if `forceReadFile` is True
-        if os.path.isfile(self.__path):
-            with open(self.__path, "r") as f:
-                self.__data = json.load(f)
-        elif not forceReadFile:
-            with open(self.__path, "w") as f:
+        with self.__lock:
+            if os.path.isfile(self.__path):
+                self.__data = self.__readFile()
+            elif not forceReadFile:
                 self.__data = {}
-                json.dump(self.__data, f)
-        else:
-            raise FileNotFoundError(
-                errno.ENOENT, os.strerror(errno.ENOENT), filePath
-                )
-                
-    def __updateFile(self):
-        # Update the saved file to store the contents of self.__data
-        with open(self.__path, "w") as f:
-            json.dump(self.__data, f, sort_keys=True, indent=0)
+                self.__writeFile(self.__data)
+            else:
+                raise FileNotFoundError(
+                    errno.ENOENT, os.strerror(errno.ENOENT), filePath
+                    )
+    
+    def __readFile(self) -> dict:
+        with open(self.__path, "r") as f:
+            return json.load(f)
+    
+    def __writeFile(self, data: dict) -> None:
+        # Write to a temporary file and move it into place, so that the file
+        # is never seen partially written. Must be called with the lock held.
+        tmpPath = self.__path + ".tmp"
+        try:
+            with open(tmpPath, "w") as f:
+                json.dump(data, f, sort_keys=True, indent=0)
+            os.replace(tmpPath, self.__path)
+        except BaseException:
+            os.remove(tmpPath)
+            raise
                 
+    def __updateFile(self, items: dict):
+        # Update the saved file with the specified items, keeping any changes
+        # made to other items by other instances
+        with self.__lock:
+            data = self.__readFile() if os.path.isfile(self.__path) else {}
+            data.update(items)
+            self.__writeFile(data)
+        self.__data = data
         
     def __setitem__(self, key, value):
-        self.__data[key] = value
-        self.__updateFile()
+        self.__updateFile({key : value})
             
             
     def __getitem__(self, key):
@@ -126,8 +277,14 @@ class JsonBackedDict:
         """
         if len(items) == 0:
             return
-        self.__data.update(items)
-        self.__updateFile()
+        self.__updateFile(items)
+    
+    def reload(self) -> None:
+        """Read the jdict from the json file, including any changes made
+        through other instances.
+        """
+        with self.__lock:
+            self.__data = self.__readFile()
         
     # TODO: ensure this is implemented correctly, maybe make a proper subclass
     # of dict instead?
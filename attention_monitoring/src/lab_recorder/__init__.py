@@ -0,0 +1,2 @@
+from ._lab_recorder_client import LabRecorderClient
+from ._lab_recorder_stand_in import LabRecorderStandIn
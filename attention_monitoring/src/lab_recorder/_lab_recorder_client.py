@@ -0,0 +1,258 @@
+import logging
+import socket
+import time
+
+import numpy as np
+
+_log = logging.getLogger(__name__)
+
+class LabRecorderClient:
+    """Client for LabRecorder's remote control interface.
+
+    Holds a single TCP connection to LabRecorder's remote control socket for
+    as long as it is open, and sends commands over it. After each command, an
+    acknowledgement ("OK") is awaited for at most `ackTimeout` seconds. If a
+    command cannot be sent, the client reconnects and sends it again, up to
+    `maxRetries` times. A command that was sent but not acknowledged is not
+    sent again, since LabRecorder may have received and executed it (and
+    commands such as "start" and "stop" are not idempotent); the connection
+    is closed and an error is raised instead. The latency of every command
+    (the time from sending it to receiving its acknowledgement, including any
+    retries) is recorded.
+
+    Can be used as a context manager, connecting when entering the context and
+    closing the connection when exiting it.
+
+    Parameters
+    ----------
+    address : str
+        The remote host name or IP address of LabRecorder (eg.
+        `CONFIG.tcp_address`).
+    port : int
+        The port of LabRecorder's remote control socket (eg.
+        `CONFIG.tcp_port`).
+    ackTimeout : float, default=2.0
+        The time in seconds to wait for a command to be acknowledged.
+    connectTimeout : float, default=10.0
+        The time in seconds to keep trying to connect before giving up. This
+        allows connecting to a LabRecorder instance that has just been
+        launched and is not yet listening.
+    maxRetries : int, default=2
+        The number of times to reconnect and resend a command that could not
+        be sent.
+
+    Attributes
+    ----------
+    latencies : dict of str to list of float
+        Maps the name of each command sent (eg. "start", "filename") to the
+        latency in seconds of every time it was sent (read only).
+    isConnected : bool
+        Whether the client is currently connected (read only).
+    """
+    __ack = b"OK"
+
+    def __init__(
+            self,
+            address: str,
+            port: int,
+            /,
+            ackTimeout: float = 2.0,
+            connectTimeout: float = 10.0,
+            maxRetries: int = 2
+            ) -> None:
+        self.address = address
+        self.port = port
+        self.ackTimeout = ackTimeout
+        self.connectTimeout = connectTimeout
+        self.maxRetries = maxRetries
+
+        self.__sock = None
+        self.__latencies = {}
+
+    def __enter__(self):
+        self.connect()
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_tb):
+        self.close()
+
+    @property
+    def latencies(self) -> dict[str, list[float]]:
+        return {k : [x for x in v] for (k, v) in self.__latencies.items()}
+
+    @property
+    def isConnected(self) -> bool:
+        return self.__sock is not None
+
+    def connect(self) -> None:
+        """Connect to LabRecorder, retrying until `connectTimeout` elapses.
+
+        Raises
+        ------
+        ConnectionError
+            If a connection could not be made.
+        """
+        if self.isConnected:
+            return
+        _log.debug(
+            "Connecting to LabRecorder at %s:%s", self.address, self.port
+            )
+        tStart = time.monotonic()
+        while True:
+            try:
+                sock = socket.create_connection(
+                    (self.address, self.port), timeout=self.ackTimeout
+                    )
+            except OSError as E:
+                if time.monotonic() - tStart > self.connectTimeout:
+                    raise ConnectionError(
+                        "Could not connect to LabRecorder at "
+                        + f"{self.address}:{self.port}"
+                        ) from E
+                time.sleep(0.25)
+            else:
+                break
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.__sock = sock
+        _log.debug("Connected to LabRecorder")
+
+    def close(self) -> None:
+        """Close the connection to LabRecorder, if open."""
+        if self.__sock is not None:
+            _log.debug("Closing connection to LabRecorder")
+            try:
+                self.__sock.close()
+            finally:
+                self.__sock = None
+
+    def update(self) -> float:
+        """Refresh LabRecorder's list of available streams."""
+        return self.send("update")
+
+    def select(self, streams: str = "all") -> float:
+        """Select the streams to record: "all" or "none"."""
+        return self.send(f"select {streams}")
+
+    def filename(self, root: str, template: str, **options: str) -> float:
+        """Set the file that the next recording is saved to.
+
+        Parameters
+        ----------
+        root : str
+            The directory to save the recording to.
+        template : str
+            The name of the recording file, which may contain placeholders
+            (eg. "%p" for the participant) that LabRecorder fills in from
+            `options`.
+        **options : str
+            Additional filename options (eg. `participant`, `task`).
+        """
+        items = {"root" : root, "template" : template, **options}
+        opts = " ".join(f"{{{k}:{v}}}" for (k, v) in items.items())
+        return self.send(f"filename {opts}")
+
+    def start(self) -> float:
+        """Start recording."""
+        return self.send("start")
+
+    def stop(self) -> float:
+        """Stop recording."""
+        return self.send("stop")
+
+    def send(self, command: str) -> float:
+        """Send a command to LabRecorder and wait for it to be acknowledged.
+
+        Parameters
+        ----------
+        command : str
+            The command to send, without a trailing newline.
+
+        Raises
+        ------
+        ConnectionError
+            If the command could not be sent after `maxRetries` retries, or
+            was sent but not acknowledged.
+
+        Returns
+        -------
+        float
+            The latency of the command in seconds.
+        """
+        data = (command + "\n").encode()
+        tStart = time.perf_counter()
+        for attempt in range(self.maxRetries + 1):
+            try:
+                self.connect()
+                self.__sock.sendall(data)
+            except OSError as E:
+                _log.warning(
+                    "Failed to send LabRecorder command '%s' (attempt %s of "
+                    + "%s): %s",
+                    command, attempt + 1, self.maxRetries + 1, E
+                    )
+                self.close()
+                lastError = E
+            else:
+                break
+        else:
+            raise ConnectionError(
+                f"Could not send command '{command}' to LabRecorder"
+                ) from lastError
+        try:
+            self.__awaitAck()
+        except OSError as E:
+            # LabRecorder may have executed the command, so it is not resent.
+            # Close the connection so that a late acknowledgement is not
+            # mistaken for that of the next command.
+            self.close()
+            raise ConnectionError(
+                f"LabRecorder did not acknowledge command '{command}'"
+                ) from E
+        latency = time.perf_counter() - tStart
+
+        name = command.split(" ", 1)[0]
+        self.__latencies.setdefault(name, []).append(latency)
+        _log.debug(
+            "LabRecorder command '%s' acknowledged in %.3f ms",
+            command, latency * 1000
+            )
+        return latency
+
+    def latencyStats(self) -> dict[str, dict[str, float]]:
+        """Get summary statistics of command latencies.
+
+        Returns
+        -------
+        dict of str to dict of str to float
+            Maps the name of each command sent to the number of times it was
+            sent ("count") and the mean, median, 99th percentile and maximum
+            latency in milliseconds ("mean_ms", "median_ms", "p99_ms",
+            "max_ms").
+        """
+        stats = {}
+        for name, latencies in self.__latencies.items():
+            x = np.array(latencies) * 1000
+            stats[name] = {
+                "count" : len(x),
+                "mean_ms" : float(x.mean()),
+                "median_ms" : float(np.median(x)),
+                "p99_ms" : float(np.percentile(x, 99)),
+                "max_ms" : float(x.max())
+                }
+        return stats
+
+    def __awaitAck(self) -> None:
+        # Read from the socket until an acknowledgement is received. Raises
+        # `TimeoutError` (a subclass of `OSError`) if none is received in
+        # time.
+        deadline = time.monotonic() + self.ackTimeout
+        received = b""
+        while self.__ack not in received:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError("Timed out waiting for acknowledgement")
+            self.__sock.settimeout(remaining)
+            chunk = self.__sock.recv(64)
+            if chunk == b"":
+                raise ConnectionResetError("LabRecorder closed the connection")
+            received += chunk
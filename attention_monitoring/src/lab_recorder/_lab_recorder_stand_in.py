@@ -0,0 +1,158 @@
+import logging
+import os
+import re
+import socketserver
+import threading
+import time
+
+_log = logging.getLogger(__name__)
+
+class LabRecorderStandIn:
+    """Local stand-in for LabRecorder's remote control interface.
+
+    Listens on a TCP socket and implements the same line-based protocol as
+    LabRecorder's remote control socket ("update", "select all",
+    "select none", "filename ...", "start", "stop"), acknowledging every
+    command with "OK". Instead of recording streams, it keeps track of the
+    state that LabRecorder would be in, so that code controlling LabRecorder
+    can be tested and benchmarked without it.
+
+    Use as a context manager: the server is started when entering the context
+    and stopped when exiting it.
+
+    Parameters
+    ----------
+    address : str, default="localhost"
+        The address to listen on.
+    port : int, default=0
+        The port to listen on. If 0, a free port is chosen (see `port`).
+    ackDelay : float, default=0.0
+        Artificial delay in seconds before acknowledging each command.
+    createFiles : bool, default=False
+        Whether to create an empty file at the recording path when a
+        recording is started, mimicking the file LabRecorder would create.
+
+    Attributes
+    ----------
+    port : int
+        The port that the server is listening on (read only).
+    commands : list of tuple of (float, str)
+        Every command received, with the time it was received (read only).
+    selected : str
+        The selected streams: "all" or "none".
+    filenameOptions : dict of str to str
+        The options given by the last "filename" command.
+    isRecording : bool
+        Whether a recording is in progress.
+    recordings : list of dict
+        One item per recording, with the keys "path", "start" and "stop".
+    """
+    __filenameOption = re.compile(r"\{(\w+):([^}]*)\}")
+
+    def __init__(
+            self,
+            address: str = "localhost",
+            port: int = 0,
+            /,
+            ackDelay: float = 0.0,
+            createFiles: bool = False
+            ) -> None:
+        self.address = address
+        self.ackDelay = ackDelay
+        self.createFiles = createFiles
+
+        self.selected = "none"
+        self.filenameOptions = {}
+        self.isRecording = False
+        self.recordings = []
+        self.__commands = []
+        self.__lock = threading.Lock()
+
+        standIn = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                for line in self.rfile:
+                    command = line.decode().strip()
+                    if command == "":
+                        continue
+                    standIn._handle(command)
+                    if standIn.ackDelay > 0:
+                        time.sleep(standIn.ackDelay)
+                    self.wfile.write(b"OK")
+                    self.wfile.flush()
+
+        class Server(socketserver.ThreadingTCPServer):
+            allow_reuse_address = True
+            daemon_threads = True
+
+        self.__server = Server((address, port), Handler)
+        self.__thread = None
+
+    def __enter__(self):
+        _log.debug(
+            "Starting LabRecorder stand-in on %s:%s", self.address, self.port
+            )
+        self.__thread = threading.Thread(
+            target=self.__server.serve_forever,
+            name="lab-recorder-stand-in",
+            daemon=True
+            )
+        self.__thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_tb):
+        _log.debug("Stopping LabRecorder stand-in")
+        self.__server.shutdown()
+        self.__server.server_close()
+        self.__thread.join()
+
+    @property
+    def port(self) -> int:
+        return self.__server.server_address[1]
+
+    @property
+    def commands(self) -> list[tuple[float, str]]:
+        with self.__lock:
+            return [c for c in self.__commands]
+
+    def _handle(self, command: str) -> None:
+        # Update the state according to the command, as LabRecorder would
+        with self.__lock:
+            self.__commands.append((time.time(), command))
+            if command == "start":
+                self.__start()
+            elif command == "stop":
+                self.__stop()
+            elif command == "update":
+                pass
+            elif command.startswith("filename"):
+                self.filenameOptions = dict(
+                    self.__filenameOption.findall(command)
+                    )
+            elif command.startswith("select"):
+                if "all" in command:
+                    self.selected = "all"
+                elif "none" in command:
+                    self.selected = "none"
+            else:
+                _log.warning("Unknown LabRecorder command: %s", command)
+
+    def __start(self) -> None:
+        if self.isRecording:
+            return
+        root = self.filenameOptions.get("root", "")
+        template = self.filenameOptions.get("template", "untitled.xdf")
+        path = os.path.join(root, template)
+        if self.createFiles:
+            open(path, "a").close()
+        self.isRecording = True
+        self.recordings.append(
+            {"path" : path, "start" : time.time(), "stop" : None}
+            )
+
+    def __stop(self) -> None:
+        if not self.isRecording:
+            return
+        self.isRecording = False
+        self.recordings[-1]["stop"] = time.time()
@@ -1,2 +1,3 @@
 from ._study_session import StudySession
-from ._study_block import StudyBlock
\ No newline at end of file
+from ._study_block import StudyBlock
+from ._catalog import SessionCatalog, CatalogSession, CatalogBlock
\ No newline at end of file
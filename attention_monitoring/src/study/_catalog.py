@@ -0,0 +1,480 @@
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing, contextmanager
+from datetime import datetime
+import json
+import logging
+import os
+import sqlite3
+from typing import Any, Iterable, Iterator
+
+from src.config import CONFIG
+
+_log = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS studies (
+    study_type TEXT PRIMARY KEY,
+    data_dir TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS sessions (
+    study_type TEXT NOT NULL,
+    session_name TEXT NOT NULL,
+    session_id INTEGER,
+    date TEXT,
+    participant_id INTEGER,
+    session_dir TEXT NOT NULL,
+    info_file TEXT NOT NULL,
+    presentation TEXT,
+    num_blocks INTEGER NOT NULL,
+    num_completed_blocks INTEGER NOT NULL,
+    num_data_files INTEGER NOT NULL,
+    total_size INTEGER NOT NULL,
+    complete INTEGER NOT NULL,
+    indexed_at TEXT NOT NULL,
+    PRIMARY KEY (study_type, session_name)
+);
+CREATE INDEX IF NOT EXISTS sessions_participant
+    ON sessions (participant_id);
+CREATE TABLE IF NOT EXISTS blocks (
+    study_type TEXT NOT NULL,
+    session_name TEXT NOT NULL,
+    block_index INTEGER NOT NULL,
+    block_name TEXT NOT NULL,
+    stim_sequence_file TEXT,
+    data_file TEXT,
+    completed INTEGER NOT NULL,
+    recorded INTEGER,
+    data_file_exists INTEGER NOT NULL,
+    size INTEGER,
+    sha256 TEXT,
+    duration_s REAL,
+    completed_at TEXT,
+    PRIMARY KEY (study_type, session_name, block_name)
+);
+"""
+
+_BLOCK_FIELDS = [
+    "block_index", "block_name", "stim_sequence_file", "data_file",
+    "completed", "recorded", "data_file_exists", "size", "sha256",
+    "duration_s", "completed_at"
+    ]
+
+class CatalogBlock:
+    """A block of a session, as recorded in a `SessionCatalog`.
+
+    Each field of the "blocks" table of the catalog is available as an
+    attribute (eg. `block_name`, `data_file`, `size`, `sha256`,
+    `duration_s`). Creating a `CatalogBlock` does not touch the session's
+    directory.
+    """
+    def __init__(self, session: "CatalogSession", row: dict[str, Any]) -> None:
+        self.session = session
+        for field in _BLOCK_FIELDS:
+            setattr(self, field, row[field])
+        self.completed = bool(self.completed)
+        self.data_file_exists = bool(self.data_file_exists)
+        if self.recorded is not None:
+            self.recorded = bool(self.recorded)
+
+    def __repr__(self) -> str:
+        return (
+            f"CatalogBlock({self.session.session_name!r}, "
+            + f"{self.block_name!r})"
+            )
+
+    def open(self, sessionCls: type, **kwargs):
+        """Open the block.
+
+        Parameters
+        ----------
+        sessionCls : type of StudySession
+            The class to open the block's session with (see
+            `CatalogSession.open`).
+        **kwargs
+            Additional arguments used to open the session.
+
+        Returns
+        -------
+        StudyBlock
+            The block, from the opened session's `blocks`.
+        """
+        return self.session.open(sessionCls, **kwargs).blocks[self.block_name]
+
+class CatalogSession:
+    """A session, as recorded in a `SessionCatalog`.
+
+    Each field of the "sessions" table of the catalog is available as an
+    attribute (eg. `session_name`, `participant_id`, `complete`), along with
+    the session's blocks (`blocks`, a list of `CatalogBlock`) and the
+    `dataSubDir` that the session was created with. Creating a
+    `CatalogSession` does not touch the session's directory.
+    """
+    def __init__(
+            self,
+            row: dict[str, Any],
+            blockRows: list[dict[str, Any]],
+            dataSubDir: [str | None]
+            ) -> None:
+        for field, value in row.items():
+            setattr(self, field, value)
+        self.complete = bool(self.complete)
+        self.dataSubDir = dataSubDir
+        self.blocks = [CatalogBlock(self, r) for r in blockRows]
+
+    def __repr__(self) -> str:
+        return f"CatalogSession({self.study_type!r}, {self.session_name!r})"
+
+    def open(self, sessionCls: type, **kwargs):
+        """Open the session.
+
+        Parameters
+        ----------
+        sessionCls : type of StudySession
+            The class to open the session with (eg. `MuseGradCPTSession`). Its
+            study type must match the session's.
+        **kwargs
+            Additional arguments passed to `sessionCls`.
+
+        Raises
+        ------
+        ValueError
+            If the study type of `sessionCls` does not match the session's.
+
+        Returns
+        -------
+        StudySession
+            The opened session.
+        """
+        if sessionCls.getStudyType() != self.study_type:
+            raise ValueError(
+                f"Cannot open a {self.study_type} session as a "
+                + f"{sessionCls.getStudyType()} session"
+                )
+        return sessionCls(
+            dataSubDir=self.dataSubDir, sessionName=self.session_name, **kwargs
+            )
+
+class SessionCatalog:
+    """An index of all studies, sessions and blocks in a data directory.
+
+    The catalog is an SQLite database, "catalog.sqlite", in the data
+    directory ("src/data", or its subdirectory `dataSubDir`). It has three
+    tables: "studies", "sessions" and "blocks". Sessions add themselves to the
+    catalog when they are created, and update it when their blocks are
+    completed (see `StudySession._updateCatalog`). Sessions created before the
+    catalog existed, or by other means, can be added with `rebuild`.
+
+    Queries (`findSessions`, `findBlocks`) only read the catalog, not the
+    session directories, and return handles (`CatalogSession`,
+    `CatalogBlock`) that can be used to open the corresponding sessions and
+    blocks.
+
+    Parameters
+    ----------
+    dataSubDir : str, optional
+        The subdirectory of "src/data" containing the studies to catalog (see
+        `Study`).
+    timeout : float, default=30.0
+        The time in seconds to wait for the database if it is locked by
+        another connection (eg. another station writing to it).
+
+    Attributes
+    ----------
+    path : str
+        The path to the database file.
+    dataDir : str
+        The directory containing the studies in the catalog.
+    """
+    def __init__(
+            self,
+            dataSubDir: [str | None] = None,
+            timeout: float = 30.0
+            ) -> None:
+        self.dataSubDir = dataSubDir
+        self.dataDir = os.path.join(CONFIG.projectRoot, "src", "data")
+        if dataSubDir is not None:
+            self.dataDir = os.path.join(self.dataDir, dataSubDir)
+        self.path = os.path.join(self.dataDir, "catalog.sqlite")
+        self.timeout = timeout
+
+        os.makedirs(self.dataDir, exist_ok=True)
+        with self.__connect() as con:
+            con.executescript(_SCHEMA)
+
+    @contextmanager
+    def __connect(self) -> Iterator[sqlite3.Connection]:
+        # Open a connection for a single transaction, committing it if no
+        # exception is raised. Connections are not shared, so the catalog
+        # can be used from any thread.
+        with closing(sqlite3.connect(self.path, timeout=self.timeout)) as con:
+            con.row_factory = sqlite3.Row
+            with con:
+                yield con
+
+    def indexSession(
+            self,
+            studyType: str,
+            info: dict[str, Any],
+            blocks: list[dict[str, Any]]
+            ) -> None:
+        """Add a session to the catalog, replacing any existing entry.
+
+        Parameters
+        ----------
+        studyType : str
+            The study type of the session (eg. "GradCPT").
+        info : dict of str to Any
+            The contents of the session's info file.
+        blocks : list of dict of str to Any
+            One item per block of the session, in order, with the keys
+            "block_name", "stim_sequence_file", "data_file", "completed",
+            "recorded", "data_file_exists", "size", "sha256", "duration_s" and
+            "completed_at" (see `StudySession._catalogBlocks`).
+        """
+        with self.__connect() as con:
+            self.__insert(con, studyType, [(info, blocks)])
+
+    def findSessions(
+            self,
+            studyType: [str | None] = None,
+            /,
+            participantID: [int | None] = None,
+            sessionName: [str | None] = None,
+            date: [str | None] = None,
+            complete: [bool | None] = None
+            ) -> list[CatalogSession]:
+        """Find sessions in the catalog.
+
+        Only sessions that match all specified criteria are returned. For
+        example, `findSessions(participantID=12, complete=True)` finds all
+        sessions of participant 12 that have all of their data.
+
+        Parameters
+        ----------
+        studyType : str, optional
+            The study type of the sessions.
+        participantID : int, optional
+            The ID of the participant in the sessions.
+        sessionName : str, optional
+            The name of the session.
+        date : str, optional
+            The date of the sessions, in the format `ddmmyy`.
+        complete : bool, optional
+            Whether every block of the sessions is complete and every recorded
+            block has its data file.
+
+        Returns
+        -------
+        list of CatalogSession
+            The matching sessions, ordered by study type and session ID.
+        """
+        where, params = self.__where(
+            study_type=studyType, participant_id=participantID,
+            session_name=sessionName, date=date,
+            complete=None if complete is None else int(complete)
+            )
+        with self.__connect() as con:
+            rows = con.execute(
+                f"SELECT * FROM sessions {where} "
+                + "ORDER BY study_type, session_id",
+                params
+                ).fetchall()
+            blockRows = con.execute(
+                "SELECT blocks.* FROM blocks JOIN sessions USING "
+                + f"(study_type, session_name) {where} "
+                + "ORDER BY block_index",
+                params
+                ).fetchall()
+
+        blocks = {}
+        for row in blockRows:
+            key = (row["study_type"], row["session_name"])
+            blocks.setdefault(key, []).append(dict(row))
+        return [
+            CatalogSession(
+                dict(row),
+                blocks.get((row["study_type"], row["session_name"]), []),
+                self.dataSubDir
+                )
+            for row in rows
+            ]
+
+    def findBlocks(
+            self,
+            studyType: [str | None] = None,
+            /,
+            participantID: [int | None] = None,
+            sessionName: [str | None] = None,
+            completed: [bool | None] = None,
+            hasDataFile: [bool | None] = None
+            ) -> list[CatalogBlock]:
+        """Find blocks in the catalog.
+
+        Parameters
+        ----------
+        studyType : str, optional
+            The study type of the blocks' sessions.
+        participantID : int, optional
+            The ID of the participant in the blocks' sessions.
+        sessionName : str, optional
+            The name of the blocks' session.
+        completed : bool, optional
+            Whether the blocks were completed.
+        hasDataFile : bool, optional
+            Whether the blocks' data files exist.
+
+        Returns
+        -------
+        list of CatalogBlock
+            The matching blocks, in order.
+        """
+        sessions = self.findSessions(
+            studyType, participantID=participantID, sessionName=sessionName
+            )
+        return [
+            block for session in sessions for block in session.blocks
+            if (completed is None or bool(block.completed) == completed)
+            and (
+                hasDataFile is None
+                or bool(block.data_file_exists) == hasDataFile
+                )
+            ]
+
+    def rebuild(
+            self,
+            sessionClasses: Iterable[type],
+            /,
+            numWorkers: [int | None] = None,
+            scanDataFiles: bool = True
+            ) -> int:
+        """Rebuild the catalog from the session directories.
+
+        Every session directory of the given study types is scanned in
+        parallel, and the entries for those study types are replaced with
+        the results in a single transaction.
+
+        Parameters
+        ----------
+        sessionClasses : Iterable of type of StudySession
+            The session classes of the studies to catalog (eg.
+            `GradCPTSession`). Each class's `_catalogBlocks` is used to index
+            the blocks of its sessions.
+        numWorkers : int, optional
+            The number of threads used to scan session directories. Defaults
+            to the default of `concurrent.futures.ThreadPoolExecutor`.
+        scanDataFiles : bool, default=True
+            Whether to read data files to get any hashes and durations that
+            are not recorded in the sessions' info files. This is the slowest
+            part of the scan.
+
+        Returns
+        -------
+        int
+            The number of sessions in the rebuilt catalog.
+        """
+        numSessions = 0
+        for sessionCls in sessionClasses:
+            studyType = sessionCls.getStudyType()
+            sessionsDir = os.path.join(self.dataDir, studyType, "sessions")
+            if not os.path.isdir(sessionsDir):
+                _log.info("No sessions found for study type: %s", studyType)
+                continue
+            infoFiles = [
+                os.path.join(entry.path, "info.json")
+                for entry in os.scandir(sessionsDir) if entry.is_dir()
+                ]
+            _log.info(
+                "Scanning %s %s session directories", len(infoFiles), studyType
+                )
+
+            def scan(infoFile):
+                try:
+                    with open(infoFile, "r") as f:
+                        info = json.load(f)
+                    return info, sessionCls._catalogBlocks(
+                        info, scanDataFiles=scanDataFiles
+                        )
+                except (OSError, ValueError) as E:
+                    _log.warning("Skipping session %s: %s", infoFile, E)
+                    return None
+
+            with ThreadPoolExecutor(numWorkers) as pool:
+                sessions = [x for x in pool.map(scan, infoFiles) if x]
+
+            with self.__connect() as con:
+                con.execute(
+                    "DELETE FROM blocks WHERE study_type = ?", (studyType,)
+                    )
+                con.execute(
+                    "DELETE FROM sessions WHERE study_type = ?", (studyType,)
+                    )
+                self.__insert(con, studyType, sessions)
+            _log.info("Cataloged %s %s sessions", len(sessions), studyType)
+            numSessions += len(sessions)
+        return numSessions
+
+    def __insert(
+            self,
+            con: sqlite3.Connection,
+            studyType: str,
+            sessions: list[tuple[dict[str, Any], list[dict[str, Any]]]]
+            ) -> None:
+        # Insert or replace sessions (given as their info and blocks)
+        con.execute(
+            "INSERT OR REPLACE INTO studies VALUES (?, ?)",
+            (studyType, os.path.join(self.dataDir, studyType))
+            )
+        now = datetime.now().isoformat(timespec="seconds")
+        sessionRows = []
+        blockRows = []
+        for info, blocks in sessions:
+            name = info["session_name"]
+            numCompleted = sum(bool(b["completed"]) for b in blocks)
+            complete = (
+                len(blocks) > 0
+                and numCompleted == len(blocks)
+                and all(
+                    b["data_file_exists"] or not b["recorded"] for b in blocks
+                    )
+                )
+            sessionRows.append((
+                studyType, name,
+                self.__toInt(info.get("session_id")), info.get("date"),
+                self.__toInt(info.get("participant_id")),
+                info["session_dir"], info["info_file"],
+                info.get("presentation"), len(blocks), numCompleted,
+                sum(bool(b["data_file_exists"]) for b in blocks),
+                sum(b["size"] or 0 for b in blocks), int(complete), now
+                ))
+            con.execute(
+                "DELETE FROM blocks WHERE study_type = ? AND session_name = ?",
+                (studyType, name)
+                )
+            blockRows.extend(
+                (studyType, name, k, *[b[f] for f in _BLOCK_FIELDS[1:]])
+                for (k, b) in enumerate(blocks)
+                )
+        con.executemany(
+            "INSERT OR REPLACE INTO sessions VALUES "
+            + f"({', '.join('?' * 14)})",
+            sessionRows
+            )
+        con.executemany(
+            f"INSERT INTO blocks VALUES ({', '.join('?' * 13)})", blockRows
+            )
+
+    @classmethod
+    def __where(cls, **criteria: Any) -> tuple[str, list[Any]]:
+        # Get a WHERE clause (on the sessions table) matching every criterion
+        # that is not None
+        criteria = {k : v for (k, v) in criteria.items() if v is not None}
+        if len(criteria) == 0:
+            return "", []
+        clause = " AND ".join(f"sessions.{k} = ?" for k in criteria.keys())
+        return "WHERE " + clause, list(criteria.values())
+
+    @classmethod
+    def __toInt(cls, value: Any) -> [int | None]:
+        if value is None or value == "":
+            return None
+        return int(value)
@@ -16,6 +16,8 @@ class Study(ABC):
         # Define some useful directories, creating them if they don't already 
         # exist 
         
+        self._dataSubDir = dataSubDir
+        
         # Directory to store all data for studies of this type
         studyDir = self.getStudyType()
         if dataSubDir is not None:
@@ -23,22 +25,34 @@ class Study(ABC):
         self._DATA_DIR = os.path.join(
             CONFIG.projectRoot, "src", "data", studyDir
             )
-        if not os.path.isdir(self._DATA_DIR):
-            _log.debug("Creating directory: %s", self._DATA_DIR)
-            os.makedirs(self._DATA_DIR)
         
         # Directory to store stimuli used in this study
         self._STIMULI_DIR = os.path.join(self._DATA_DIR, "stimuli")
-        if not os.path.isdir(self._STIMULI_DIR):
-            _log.debug("Creating directory: %s", self._STIMULI_DIR)
-            os.makedirs(self._STIMULI_DIR)
         
         # Parent directory to contain the individual directories of every
         # session of this study.
         self._SESSIONS_DIR = os.path.join(self._DATA_DIR, "sessions")
-        if not os.path.isdir(self._SESSIONS_DIR):
-            _log.debug("Creating directory: %s", self._SESSIONS_DIR)
-            os.makedirs(self._SESSIONS_DIR)
+        
+        self._makeDirs(self._DATA_DIR, self._STIMULI_DIR, self._SESSIONS_DIR)
+    
+    # Directories that are known to exist, shared by all studies so that each
+    # directory is only checked once per process
+    __existingDirs = set()
+    
+    @classmethod
+    def _makeDirs(cls, *dirs: str) -> None:
+        """Create the specified directories if they don't already exist.
+        
+        Directories that have already been checked or created by any study 
+        in this process are not checked again.
+        """
+        for d in dirs:
+            if d in Study.__existingDirs:
+                continue
+            if not os.path.isdir(d):
+                _log.debug("Creating directory: %s", d)
+                os.makedirs(d, exist_ok=True)
+            Study.__existingDirs.add(d)
     
     @classmethod
     @abstractmethod
@@ -2,6 +2,7 @@ from abc import abstractmethod
 import csv
 from datetime import datetime
 import errno
+import io
 import logging
 import os
 from typing import Any
@@ -9,7 +10,8 @@ from typing import Any
 import polars as pl
 
 from src.config import CONFIG
-from src.helpers import JsonBackedDict
+from src.helpers import JsonBackedDict, _FileLock
+from ._catalog import SessionCatalog
 from ._study import Study
 from ._study_block import StudyBlock
 
@@ -96,29 +98,26 @@ class StudySession(Study):
         # self._SESSIONS_DIR = os.path.join(self._DATA_DIR, "sessions")
         # os.makedirs(self.__SESSION_DIR, exist_ok=True)
         
-        # Get the log for sessions of this study type
-        sessionsLogPath = os.path.join(self._SESSIONS_DIR, "log.csv")
-        _log.debug("Getting the sessions log: %s", sessionsLogPath)
-        sessionsLog = SessionLogger(sessionsLogPath)
-        
         if sessionName is None:
             # Create a new session if `sessionName` is unspecified.
             _log.info("Creating a new session")
             
+            # Get the log for sessions of this study type
+            sessionsLogPath = os.path.join(self._SESSIONS_DIR, "log.csv")
+            _log.debug("Getting the sessions log: %s", sessionsLogPath)
+            sessionsLog = SessionLogger(sessionsLogPath)
+            
             # Update the session log with the info for this study. This
             # includes the fields "session_name", "session_id", "date", and
             # "participant_id", all of which are automatically formatted by the
             # `SessionLogger` object.
-            if sessionsLog.numLines > 0:
-                session_id = int(sessionsLog.read(-1)["session_id"][0]) + 1
-            else:
-                session_id = 1
-            sessionsLog.addLine(
-                session_id=session_id,
+            # The session ID is allocated by the log, so that sessions
+            # created at the same time (eg. on other stations) get different
+            # IDs.
+            SessionLogEntry = sessionsLog.addSession(
                 date=datetime.now().strftime("%d%m%y"),
                 participant_id=participantID
                 )
-            SessionLogEntry = sessionsLog.read(-1)
             SessionLogEntry = {
                 k : v[0] for (k, v) in SessionLogEntry.items() 
                 if k in SessionLogger.logFields
@@ -142,6 +141,7 @@ class StudySession(Study):
                 session_dir=self._DIR,
                 info_file=infoPath
                 )
+            self._updateCatalog()
         else:
             # If a session name was provided, get its directory and info file
             _log.info("Loading existing session: %s", sessionName)
@@ -194,6 +194,52 @@ class StudySession(Study):
         """
         pass
     
+    @classmethod
+    def _catalogBlocks(
+            cls, 
+            info: dict[str, Any], 
+            /,
+            scanDataFiles: bool = False
+            ) -> list[dict[str, Any]]:
+        """Get the entries of a session's blocks for the `SessionCatalog`.
+        
+        Subclasses with blocks should override this. Must only use the
+        session's info (not the current config), as it is also used to 
+        catalog existing sessions.
+        
+        Parameters
+        ----------
+        info : dict of str to Any
+            The contents of the session's info file.
+        scanDataFiles : bool, default=False
+            Whether to read data files to get any hashes and durations that are
+            not recorded in `info`.
+        
+        Returns
+        -------
+        list of dict of str to Any
+            One item per block, in order, in the format expected by 
+            `SessionCatalog.indexSession`.
+        """
+        return []
+    
+    def _updateCatalog(self) -> None:
+        """Update this session's entry in the `SessionCatalog`.
+        
+        Errors are logged instead of raised, so that a problem with the 
+        catalog never interrupts a session. The catalog can be rebuilt from
+        the session directories later (see `SessionCatalog.rebuild`).
+        """
+        try:
+            info = self._info.safeView()
+            SessionCatalog(self._dataSubDir).indexSession(
+                self.getStudyType(), info, self._catalogBlocks(info)
+                )
+        except Exception as E:
+            _log.warning(
+                "Could not update the session catalog: %s", E, exc_info=True
+                )
+    
     
 class SessionLogger:
     """A log to keep track of study sessions.
@@ -202,10 +248,20 @@ class SessionLogger:
     new `SessionLogger` object. Changes to the log made through this object
     using the provided methods are reflected in the log file. Note that the 
     data returned by instances of `SessionLogger` are undefined and may result 
-    in unexpected behaviour if:
-     - The content of the log file is changed externally
-     - Multiple instances of `SessionLogger` exist concurrently and are backed 
-       by the same file.
+    in unexpected behaviour if the content of the log file is changed
+    externally, other than by appending lines.
+    
+    Multiple instances of `SessionLogger` (including in other processes, eg.
+    on several stations sharing a data directory) can be backed by the same
+    file. Lines are only added while holding a lock on the log file (see
+    `_FileLock`), and `addSession` allocates the next session ID and adds the
+    line for it in one step, so that sessions created at the same time get
+    different IDs. The lock is only held briefly and the log is never read in
+    full while holding it.
+    
+    The number of lines in the log is kept in a metadata file next to the log
+    file ("[name]_meta.json"), so that it does not need to be counted and new
+    lines can be appended without reading the log.
      
     Parameters
     ----------
@@ -232,6 +288,12 @@ class SessionLogger:
 
     __rowCountCol = "row_count"
     
+    # Bytes read at a time when reading the end of the log file, and the
+    # maximum number of lines to read from the end of the file instead of
+    # loading the full log
+    __tailChunkSize = 1 << 12
+    __maxTailLines = 1000
+    
     def __init__(self, filePath: str) -> None:
         
         name, ext = os.path.splitext(filePath)
@@ -241,26 +303,24 @@ class SessionLogger:
                 + "unspecified or '.csv'"
                 )
         self.__path = name + ".csv"
+        self.__lock = _FileLock(self.__path)
         
-        dtypes = {field : pl.Utf8 for field in self.logFields}
+        # The full log is only loaded when it is needed (see `__load`), and
+        # kept along with the size of the log file when it was loaded
+        self.__log = None
+        self.__logSize = None
 
-        if self.__exists():
-            self.__log = pl.read_csv(
-                self.path, 
-                dtypes=dtypes, 
-                row_count_name=self.__rowCountCol
-                )
-            # Row count column doesn't get added if the log is empty
-            if not self.__rowCountCol in self.__log.columns:
-                self.__log = self.__log.with_row_count(name=self.__rowCountCol)
-        else:
-            self.__log = pl.DataFrame(schema=dtypes).with_row_count(
-                name=self.__rowCountCol,
-                offset=1
-                )
-            with open(self.__path, 'w', newline="") as f:
-                dictWriter = csv.DictWriter(f, fieldnames=self.logFields)
-                dictWriter.writeheader()
+        with self.__lock:
+            if not self.__exists():
+                with open(self.__path, 'w', newline="") as f:
+                    dictWriter = csv.DictWriter(f, fieldnames=self.logFields)
+                    dictWriter.writeheader()
+            
+            # The number of lines in the log is stored in a small metadata
+            # file next to the log, along with the size of the log file when
+            # it was last counted (see `__snapshot`)
+            self.__meta = JsonBackedDict(name + "_meta.json")
+            self.__snapshot()
                 
     @classmethod
     @property
@@ -273,14 +333,81 @@ class SessionLogger:
     
     @property
     def numLines(self) -> int:
-        return self.__log.height
+        with self.__lock:
+            return self.__snapshot()[0]
 
     def __exists(self):
         return os.path.isfile(self.path)
     
+    def __snapshot(self) -> tuple[int, int]:
+        # Get the number of lines in the log and the size of the log file. If
+        # the size has changed since the lines were last counted (eg. if the
+        # log was edited externally), the lines are counted again. Must be
+        # called with the lock held.
+        self.__meta.reload()
+        size = os.path.getsize(self.path)
+        if self.__meta.safeView().get("file_size") != size:
+            _log.debug("Counting lines in the sessions log: %s", self.path)
+            self.__meta.update(num_lines=self.__countLines(), file_size=size)
+        return self.__meta["num_lines"], size
+    
+    def __countLines(self) -> int:
+        # Count the lines in the log file, not including the header
+        numNewlines = 0
+        lastChunk = b"\n"
+        with open(self.path, "rb") as f:
+            while chunk := f.read(1 << 20):
+                numNewlines += chunk.count(b"\n")
+                lastChunk = chunk
+        if not lastChunk.endswith(b"\n"):
+            # Last line has no trailing newline
+            numNewlines += 1
+        return max(numNewlines - 1, 0)
+    
+    def __load(self, size: int) -> pl.DataFrame:
+        # Get the full log as it was when the log file was `size` bytes long,
+        # reading it from the file if it is not loaded. Lines appended since
+        # are not read.
+        if self.__log is None or self.__logSize != size:
+            _log.debug("Loading the sessions log: %s", self.path)
+            with open(self.path, "rb") as f:
+                data = f.read(size)
+            dtypes = {field : pl.Utf8 for field in self.logFields}
+            log = pl.read_csv(io.BytesIO(data), dtypes=dtypes)
+            self.__log = log.with_row_count(name=self.__rowCountCol, offset=1)
+            self.__logSize = size
+        return self.__log
+    
+    def __tail(self, n: int, size: int) -> list[dict[str, str]]:
+        # Read the last `n` lines of the log file (as it was when it was
+        # `size` bytes long) by reading backwards from the end of the file,
+        # without reading the rest of the file
+        with open(self.path, "rb") as f:
+            pos = size
+            data = b""
+            # Read one extra line so that the first line read is complete
+            while pos > 0 and data.count(b"\n") <= n + 1:
+                step = min(self.__tailChunkSize, pos)
+                pos -= step
+                f.seek(pos)
+                data = f.read(step) + data
+        # Drop the header, or the first line if it was only partly read.
+        # Lines are only decoded once split, as the data read may start in
+        # the middle of a multi-byte character.
+        lines = data.split(b"\n")[1:]
+        lines = [
+            line.rstrip(b"\r").decode() for line in lines
+            if line.strip(b"\r") != b""
+            ][-n:]
+        return list(csv.DictReader(lines, fieldnames=self.logFields))
+    
     def read(self, *lines: int) -> dict[str, list[Any]]:
         """Read the specified line(s) from the log
         
+        Reading only lines near the end of the log using negative indices
+        (eg. `read(-1)`) only reads the end of the log file. Otherwise, the
+        full log is loaded (and kept until the log is next changed).
+        
         Parameters
         ----------
         *lines : tuple of int
@@ -305,26 +432,52 @@ class SessionLogger:
             raise FileNotFoundError(
                 errno.ENOENT, "The log file does not exist.", self.path
                 )
+        
+        with self.__lock:
+            numLines, size = self.__snapshot()
             
-        if len(lines) == 0:
-            data = self.__log
-        else:
-            lastLineNum = self.__log.max()[self.__rowCountCol][0]
-            _lines = [n if n >= 0 else lastLineNum + 1 + n for n in lines]
-
-            # Assume row numbers are unique
-            data = self.__log.filter(pl.col(self.__rowCountCol).is_in(_lines))
+        _lines = [n if n >= 0 else numLines + 1 + n for n in lines]
+        invalidLines = [
+            x for (x, n) in zip(_lines, lines) if not 1 <= x <= numLines
+            ]
+        if len(invalidLines) > 0:
+            # TODO: improve error message
+            raise IndexError(
+                "The following specified lines were not found:"
+                + f"{invalidLines}"
+                )
             
-            selectedLines = data[self.__rowCountCol].to_list()
-            unSelectedLines = [x for x in _lines if x not in selectedLines]
-            if len(unSelectedLines) > 0:
-                # TODO: improve error message
-                raise IndexError(
-                    "The following specified lines were not found:"
-                    + f"{unSelectedLines}"
-                    )
-
-        data = data.to_dict(as_series=False)
+        if len(lines) == 0:
+            return self.__load(size).to_dict(as_series=False)
+        
+        if all(n < 0 for n in lines) and -min(lines) <= self.__maxTailLines:
+            # Read only the end of the file
+            return self.__readTail(-min(lines), numLines, size, _lines)
+        
+        # Assume row numbers are unique
+        data = self.__load(size).filter(
+            pl.col(self.__rowCountCol).is_in(_lines)
+            )
+        return data.to_dict(as_series=False)
+    
+    def __readTail(
+            self,
+            n: int,
+            numLines: int,
+            size: int,
+            lines: list[int]
+            ) -> dict[str, list[Any]]:
+        # Read the specified lines (all of which must be in the last `n`
+        # lines), in the same format as `read`
+        tail = self.__tail(n, size)
+        firstLineNum = numLines - len(tail) + 1
+        rows = [
+            (firstLineNum + k, row) for (k, row) in enumerate(tail)
+            if firstLineNum + k in lines
+            ]
+        data = {self.__rowCountCol : [n for (n, _) in rows]}
+        for field in self.logFields:
+            data[field] = [row[field] or None for (_, row) in rows]
         return data
 
     def addLine(self, **items) -> None:
@@ -335,6 +488,10 @@ class SessionLogger:
         corresponding log field. For any unspecified fields, an attempt is made
         to extrapolate values from the specified fields. If this cannot be 
         done, the value of the field is left empty in the log.
+        
+        The line is appended to the log file without reading the log. To add
+        a line for a new session, use `addSession` instead, which also
+        allocates the session ID.
 
         Parameters
         ----------
@@ -358,6 +515,63 @@ class SessionLogger:
             If any of the specified items do not correspond to an existing 
             field in the log.
         """
+        self.__checkItems(items)
+        line = self.__formatLogInfo(**items)
+        with self.__lock:
+            numLines, size = self.__snapshot()
+            self.__append(line, numLines, size)
+    
+    def addSession(self, **items) -> dict[str, list[Any]]:
+        """Allocate the next session ID and add a line for it to the log.
+        
+        The session ID is one more than the session ID in the last line of
+        the log (or 1 if the log is empty). Allocating the ID and adding the
+        line are done while holding a lock on the log, so that no other
+        session can be given the same ID.
+        
+        Parameters
+        ----------
+        date : str, optional
+            The date of this session, in the format `ddmmyy`.
+        participant_id : int or str, optional
+            The numerical ID assigned to the participant in this session.
+            
+        Raises
+        ------
+        FileNotFoundError
+            If log file cannot be found.
+        ValueError
+            If any of the specified items do not correspond to an existing 
+            field in the log, or specify the session ID or name.
+            
+        Returns
+        -------
+        dict of str to list of Any
+            The line that was added, in the same format as returned by `read`.
+        """
+        self.__checkItems(items)
+        if any(k in items for k in ("session_id", "session_name")):
+            raise ValueError(
+                "The session ID and name are allocated by the log and cannot "
+                + "be specified."
+                )
+        
+        with self.__lock:
+            numLines, size = self.__snapshot()
+            if numLines > 0:
+                last = self.__tail(1, size)[0]
+                session_id = int(last["session_id"]) + 1
+            else:
+                session_id = 1
+            line = self.__formatLogInfo(session_id=session_id, **items)
+            self.__append(line, numLines, size)
+            
+        data = {self.__rowCountCol : [numLines + 1]}
+        for field in self.logFields:
+            data[field] = [line[field] or None]
+        return data
+    
+    def __checkItems(self, items: dict[str, Any]) -> None:
         if not self.__exists():
             raise FileNotFoundError(
                 errno.ENOENT, "The log file does not exist.", self.path
@@ -369,27 +583,23 @@ class SessionLogger:
                 f"The specified key(s) '{invalidKeys}' are not valid fields. "
                 + f"Valid fields are: {self.logFields}"
                 )
-            
-        line = self.__formatLogInfo(**items)
-        
-        # The file (self.path) and the copy of the log stored in self.__log 
-        # must always contain the same data.
-        
-        # Update the file
-        with open(self.path, "a", newline="") as f:
-            dictWriter = csv.DictWriter(f, fieldnames=self.logFields)
+    
+    def __append(self, line: dict[str, str], numLines: int, size: int) -> None:
+        # Append a line to the log file and update the line count. Must be
+        # called with the lock held, with the current number of lines and
+        # size of the log file.
+        with open(self.path, "ab+") as f:
+            if size > 0:
+                # Make sure the line is not appended to an unterminated line
+                f.seek(size - 1)
+                if f.read(1) != b"\n":
+                    f.write(b"\r\n")
+            buffer = io.StringIO(newline="")
+            dictWriter = csv.DictWriter(buffer, fieldnames=self.logFields)
             dictWriter.writerow(line)
-            
-        # Update the stored copy of the log
-        if self.numLines > 0:
-            lastLineNum = self.__log.max()[self.__rowCountCol][0]
-        else:
-            lastLineNum = 0
-        thisLine = pl.DataFrame(line).with_row_count(
-            name=self.__rowCountCol,
-            offset=lastLineNum+1
-            )
-        self.__log = self.__log.vstack(thisLine)
+            f.write(buffer.getvalue().encode())
+            newSize = f.tell()
+        self.__meta.update(num_lines=numLines + 1, file_size=newSize)
 
     @classmethod
     def __formatLogInfo(cls, session_name=None, session_id=None, date=None,
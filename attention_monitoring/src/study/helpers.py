@@ -33,6 +33,11 @@ class _LaunchLabRecorder:
             stderr=subprocess.STDOUT,
             text=True
             ) 
+        return self
+    
+    def isRunning(self) -> bool:
+        """Check whether the LabRecorder process is still running."""
+        return self._proc_LR.poll() is None
                 
     def __exit__(self, exc_type, exc_value, exc_tb):
         if exc_type is not None:
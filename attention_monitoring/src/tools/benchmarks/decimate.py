@@ -0,0 +1,92 @@
+"""Benchmark redrawing a long signal while zooming and panning.
+
+Plots a long simulated multi-channel block with `DecimatedLine` and with
+plain `ax.plot`, then changes the x limits to several zoom levels and
+reports the time taken to update the decimated lines and to redraw the
+figure. The time to draw an empty figure is reported as a baseline.
+
+Run from the `attention_monitoring` directory:
+
+    python -m src.tools.benchmarks.decimate [--minutes 30] [--channels 4]
+"""
+import argparse
+import time
+
+import matplotlib
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+import numpy as np
+
+from src.data_analysis.decimate import DecimatedLine
+
+# Views as (start, width) in seconds, from the whole block to a few samples
+_VIEWS = [(0, None), (600, 60), (900, 1), (30, 0.05), (1200, 300), (0, None)]
+
+def _makeFigure(numChannels):
+    fig, axs = plt.subplots(numChannels, 1, sharex=True, figsize=(12, 8))
+    return fig, np.atleast_1d(axs)
+
+def _timeViews(fig, axs, duration):
+    times = []
+    for start, width in _VIEWS:
+        width = duration if width is None else width
+        t0 = time.perf_counter()
+        axs[0].set_xlim(start, start + width)
+        fig.canvas.draw()
+        times.append(time.perf_counter() - t0)
+    return times
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--minutes", type=float, default=30)
+    parser.add_argument("--channels", type=int, default=4)
+    parser.add_argument("--srate", type=float, default=256.0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    numSamples = int(args.minutes * 60 * args.srate)
+    x = np.arange(numSamples) / args.srate
+    y = np.cumsum(rng.standard_normal((numSamples, args.channels)), axis=0)
+    duration = x[-1]
+
+    fig, axs = _makeFigure(args.channels)
+    for ax in axs:
+        ax.set_xlim(0, duration)
+    fig.canvas.draw()
+    t0 = time.perf_counter()
+    fig.canvas.draw()
+    emptyTime = time.perf_counter() - t0
+
+    for name in ("decimated", "raw"):
+        fig, axs = _makeFigure(args.channels)
+        t0 = time.perf_counter()
+        lines = []
+        for k, ax in enumerate(axs):
+            if name == "decimated":
+                lines.append(DecimatedLine(ax, x, y[:, k], linewidth=1))
+            else:
+                ax.plot(x, y[:, k], linewidth=1)
+        fig.canvas.draw()
+        initialTime = time.perf_counter() - t0
+        times = _timeViews(fig, axs, duration)
+        print(
+            f"{name:>9}: initial plot {initialTime * 1000:.1f} ms, redraw "
+            + ", ".join(f"{t * 1000:.1f}" for t in times) + " ms"
+            )
+        if name == "decimated":
+            t0 = time.perf_counter()
+            for line in lines:
+                line.update()
+            print(
+                f"{'':>9}  updating {args.channels} lines: "
+                + f"{(time.perf_counter() - t0) * 1000:.2f} ms"
+                )
+        plt.close(fig)
+
+    print(f"{'empty':>9}: redraw {emptyTime * 1000:.1f} ms")
+    print(f"{numSamples} samples per channel; views (start s, width s): "
+        + ", ".join(f"({s}, {w if w is not None else 'all'})" for s, w in _VIEWS)
+        )
+
+if __name__ == "__main__":
+    main()
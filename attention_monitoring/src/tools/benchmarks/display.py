@@ -0,0 +1,141 @@
+"""Benchmark plotting a long block with `GradCPTBlock.display`.
+
+Plots a long simulated block with `GradCPTBlock.display`, and with the
+previous implementation (which converted and masked the signal for every
+channel, compared the marker strings for every channel and marker type and
+called `ax.vlines` per axis and marker type), and reports the time taken to
+build and draw each figure.
+
+Run from the `attention_monitoring` directory:
+
+    python -m src.tools.benchmarks.display [--minutes 30]
+"""
+import argparse
+import time
+
+import matplotlib
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+import numpy as np
+
+from src.data_analysis.block import (
+    BlockPlotter, GradCPTBlock
+    )
+
+_CHANNEL_NAMES = ["TP9", "AF7", "AF8", "TP10"]
+
+def _makeData(rng, minutes, srate):
+    # The streams of a block, as loaded from its data file, with a stimulus
+    # every 0.8 s and a response to most of them
+    duration = minutes * 60
+    timestamps = 1000 + np.arange(int(duration * srate)) / srate
+    channels = [
+        {'label' : [name], 'type' : ["EEG"], 'unit' : ["microvolts"]}
+        for name in _CHANNEL_NAMES
+        ]
+    stimTimes = 1000 + np.arange(1, duration, 0.8)
+    stimMarkers = np.repeat(
+        [["transition_period_start"], ["transition_period_end"]],
+        len(stimTimes) // 2 + 1, axis=0
+        )[:len(stimTimes)]
+    stimMarkers[0], stimMarkers[-1] = "block_start", "block_stop"
+    responseTimes = stimTimes[rng.random(len(stimTimes)) < 0.9] + 0.4
+    return {
+        'eeg' : {
+            'time_series' : rng.standard_normal(
+                (len(timestamps), len(_CHANNEL_NAMES))
+                ),
+            'time_stamps' : timestamps,
+            'info' : {
+                'effective_srate' : srate,
+                'desc' : [{'channels' : [{'channel' : channels}]}]
+                }
+            },
+        'stimuli_marker_stream' : {
+            'time_series' : stimMarkers.tolist(),
+            'time_stamps' : stimTimes
+            },
+        'response_marker_stream' : {
+            'time_series' : [["response"]] * len(responseTimes),
+            'time_stamps' : responseTimes
+            }
+        }
+
+def _legacyDisplay(block, domain=[-np.inf, np.inf]):
+    # `GradCPTBlock.display` before the markers were encoded once and the
+    # signal was converted once for all channels
+    numChannels = len(_CHANNEL_NAMES)
+    startTime = min(np.min(x['time_stamps']) for x in block.data.values())
+    plotter = BlockPlotter(block)
+    fig = plt.figure(layout="constrained")
+    axs = fig.add_gridspec(numChannels, hspace=0).subplots(
+        sharex=True, sharey=True
+        )
+
+    def baseCB(x, y):
+        x_ = x - startTime
+        mask = np.logical_and(x_ >= domain[0], x_ <= domain[1])
+        return x_[mask], y[mask]
+
+    def sigCB(x, y):
+        return baseCB(x, y - y.mean())
+
+    def stimOnsetCB(x, y):
+        mask = (y == "transition_period_start")
+        return baseCB(x[mask], y[mask])
+
+    def blockTimeCB(x, y):
+        mask = np.logical_or(y == "block_start", y == "block_stop")
+        return baseCB(x[mask], y[mask])
+
+    for k in range(numChannels):
+        plotter.plotMuseSig(axs[k], 'eeg', k, "b", callback=sigCB, linewidth=1)
+    for k in range(numChannels):
+        plotter.plotStimMarkers(axs[k], callback=stimOnsetCB, color='r')
+    for k in range(numChannels):
+        plotter.plotStimMarkers(axs[k], callback=blockTimeCB, color='y')
+    for k in range(numChannels):
+        plotter.plotResponseMarkers(axs[k], callback=baseCB, color='g')
+    return fig
+
+def _timeDisplay(display, repeats):
+    buildTimes, drawTimes = [], []
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        fig = display()
+        t1 = time.perf_counter()
+        fig.canvas.draw()
+        t2 = time.perf_counter()
+        plt.close(fig)
+        buildTimes.append(t1 - t0)
+        drawTimes.append(t2 - t1)
+    return np.median(buildTimes), np.median(drawTimes)
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--minutes", type=float, default=30)
+    parser.add_argument("--srate", type=float, default=256.0)
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    block = GradCPTBlock("benchmark", "", 0, "", "")
+    block.data = _makeData(np.random.default_rng(0), args.minutes, args.srate)
+    numMarkers = len(block.data['stimuli_marker_stream']['time_stamps'])
+    print(
+        f"{len(block.data['eeg']['time_stamps'])} samples x "
+        + f"{len(_CHANNEL_NAMES)} channels, {numMarkers} stimulus markers"
+        )
+
+    for name, display in [
+            ("previous", lambda: _legacyDisplay(block)),
+            ("current", lambda: block.display())
+            ]:
+        buildTime, drawTime = _timeDisplay(display, args.repeats)
+        print(
+            f"{name:>8}: build {buildTime * 1000:.1f} ms, draw "
+            + f"{drawTime * 1000:.1f} ms, total "
+            + f"{(buildTime + drawTime) * 1000:.1f} ms"
+            )
+
+if __name__ == "__main__":
+    main()
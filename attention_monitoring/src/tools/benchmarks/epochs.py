@@ -0,0 +1,66 @@
+"""Benchmark epoching around stimulus markers.
+
+Cuts epochs around tens of thousands of simulated stimulus onsets spread over
+several simulated sessions, then baseline corrects them and marks epochs for
+rejection.
+
+Run from the `attention_monitoring` directory:
+
+    python -m src.tools.benchmarks.epochs [--sessions 10] [--trials 4000]
+"""
+import argparse
+import time
+
+import numpy as np
+
+from src.data_analysis.epochs import Epochs
+
+def _makeSession(rng, numTrials, srate, numChannels):
+    # A continuous signal with a stimulus onset every ~0.8 s
+    duration = numTrials * 0.8 + 10
+    timestamps = 1000 + np.arange(int(duration * srate)) / srate
+    data = rng.standard_normal(
+        (len(timestamps), numChannels)
+        ).astype(np.float32)
+    onsets = 1005 + np.arange(numTrials) * 0.8 + rng.normal(0, 0.002, numTrials)
+    return data, timestamps, onsets
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--sessions", type=int, default=10)
+    parser.add_argument("--trials", type=int, default=4000)
+    parser.add_argument("--srate", type=float, default=256.0)
+    parser.add_argument("--channels", type=int, default=4)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    sessions = [
+        _makeSession(rng, args.trials, args.srate, args.channels)
+        for _ in range(args.sessions)
+        ]
+
+    t0 = time.perf_counter()
+    epochs = Epochs.concatenate([
+        Epochs.fromSignal(data, timestamps, onsets, -0.2, 0.8)
+        for (data, timestamps, onsets) in sessions
+        ])
+    t1 = time.perf_counter()
+    epochs.applyBaseline((None, 0))
+    t2 = time.perf_counter()
+    reject = epochs.markReject(maxPeakToPeak=8.0, minPeakToPeak=0.1)
+    t3 = time.perf_counter()
+
+    print(
+        f"{epochs.numTrials} epochs of shape {epochs.data.shape[1:]} from "
+        + f"{args.sessions} sessions"
+        )
+    print(f"epoching:  {(t1 - t0) * 1000:8.1f} ms")
+    print(f"baseline:  {(t2 - t1) * 1000:8.1f} ms")
+    print(
+        f"rejection: {(t3 - t2) * 1000:8.1f} ms "
+        + f"({reject.sum()} epochs rejected)"
+        )
+    print(f"total:     {(t3 - t0) * 1000:8.1f} ms")
+
+if __name__ == "__main__":
+    main()
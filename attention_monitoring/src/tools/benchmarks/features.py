@@ -0,0 +1,68 @@
+"""Benchmark computing spectral features of many trials.
+
+Computes the band powers of simulated epochs with `spectralFeatures` (Welch
+and multitaper spectra, in single and double precision), and with the
+previous implementation of the "features" pipeline action (which called
+`scipy.signal.welch` on every trial at once, then summed each band with a
+boolean mask), and reports the time taken and the trials per second.
+
+Run from the `attention_monitoring` directory:
+
+    python -m src.tools.benchmarks.features [--trials 100000]
+"""
+import argparse
+import time
+
+import numpy as np
+from scipy import signal as spsignal
+
+from src.data_analysis.features import DEFAULT_BANDS, spectralFeatures
+
+def _legacyFeatures(epochs, srate):
+    # The "features" action before spectra were computed in chunks
+    freqs, psd = spsignal.welch(
+        epochs, fs=srate, nperseg=min(256, epochs.shape[-1]), axis=-1
+        )
+    powers = []
+    for _, low, high in DEFAULT_BANDS:
+        mask = (freqs >= low) & (freqs < high)
+        powers.append(psd[..., mask].sum(axis=-1))
+    return np.stack(powers, axis=-1)
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--trials", type=int, default=100_000)
+    parser.add_argument("--channels", type=int, default=4)
+    parser.add_argument("--duration", type=float, default=0.8)
+    parser.add_argument("--srate", type=float, default=256.0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    numSamples = int(args.duration * args.srate)
+    epochs = rng.standard_normal((args.trials, args.channels, numSamples))
+    print(
+        f"{args.trials} trials x {args.channels} channels x {numSamples} "
+        + f"samples ({epochs.nbytes / 2**20:.0f} MiB)"
+        )
+
+    runs = [
+        ("previous", lambda: _legacyFeatures(epochs, args.srate)),
+        ("welch float32", lambda: spectralFeatures(epochs, args.srate)),
+        ("welch float64", lambda: spectralFeatures(
+            epochs, args.srate, dtype=np.float64
+            )),
+        ("multitaper float32", lambda: spectralFeatures(
+            epochs, args.srate, method="multitaper"
+            ))
+        ]
+    for name, run in runs:
+        t0 = time.perf_counter()
+        run()
+        elapsed = time.perf_counter() - t0
+        print(
+            f"{name:>18}: {elapsed:.2f} s, "
+            + f"{args.trials / elapsed:,.0f} trials/s"
+            )
+
+if __name__ == "__main__":
+    main()
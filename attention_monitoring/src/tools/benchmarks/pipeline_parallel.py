@@ -0,0 +1,89 @@
+"""Benchmark applying a `DataPipe` to many sessions in parallel.
+
+Applies a filter, epoch and band power pipeline to the blocks of synthetic
+sessions with an increasing number of worker processes, and reports the
+throughput and the speedup over processing the blocks one after the other.
+
+Run from the `attention_monitoring` directory:
+
+    python -m src.tools.benchmarks.pipeline_parallel [--sessions 8] [--blocks 4]
+"""
+import argparse
+import os
+import time
+
+import numpy as np
+
+from src.data_analysis.pipeline import DataPipe
+
+def _makeBlock(rng, numTrials, srate, numChannels):
+    # The streams of a block, as loaded from its data file, with a stimulus
+    # onset every 0.8 s
+    duration = numTrials * 0.8 + 10
+    timestamps = 1000 + np.arange(int(duration * srate)) / srate
+    channels = [{'label' : [f"ch{k}"]} for k in range(numChannels)]
+    return {
+        'eeg' : {
+            'time_series' : rng.standard_normal(
+                (len(timestamps), numChannels)
+                ),
+            'time_stamps' : timestamps,
+            'info' : {
+                'effective_srate' : srate,
+                'desc' : [{'channels' : [{'channel' : channels}]}]
+                }
+            },
+        'stimuli_marker_stream' : {
+            'time_series' : [["transition_period_start"]] * numTrials,
+            'time_stamps' : 1005 + np.arange(numTrials) * 0.8
+            },
+        'response_marker_stream' : {
+            'time_series' : [], 'time_stamps' : np.empty(0)
+            }
+        }
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--sessions", type=int, default=8)
+    parser.add_argument("--blocks", type=int, default=4)
+    parser.add_argument("--trials", type=int, default=500)
+    parser.add_argument("--srate", type=float, default=256.0)
+    parser.add_argument("--channels", type=int, default=4)
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    blocks = [
+        _makeBlock(rng, args.trials, args.srate, args.channels)
+        for _ in range(args.sessions * args.blocks)
+        ]
+    pipe = (
+        DataPipe(cache=False)
+        .add("filter", lowFreq=1, highFreq=40)
+        .add("rereference")
+        .add("epoch", tmin=-0.2, tmax=0.8, baseline=(None, 0))
+        .add("features", log=True)
+        )
+
+    workerCounts = [0] + [
+        n for n in (1, 2, 4, 8, 16, 32, 64) if n <= args.max_workers
+        ]
+    if args.max_workers not in workerCounts:
+        workerCounts.append(args.max_workers)
+
+    baseline = None
+    for numWorkers in workerCounts:
+        t0 = time.perf_counter()
+        results = pipe.execute(blocks, numWorkers=numWorkers)
+        elapsed = time.perf_counter() - t0
+        assert len(results) == len(blocks)
+        baseline = elapsed if baseline is None else baseline
+        label = "serial" if numWorkers == 0 else f"{numWorkers} workers"
+        print(
+            f"{label:>11}: {len(blocks)} blocks in {elapsed:.2f} s, "
+            + f"{len(blocks) / elapsed:.1f} blocks/s, speedup "
+            + f"{baseline / elapsed:.2f}x"
+            )
+
+if __name__ == "__main__":
+    main()
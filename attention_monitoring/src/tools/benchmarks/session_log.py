@@ -0,0 +1,83 @@
+"""Benchmark creating a session entry in a large sessions log.
+
+Compares the time taken to open a sessions log, look up the last entry and
+append a new one using `SessionLogger` against the previous approach of
+loading the whole log into polars on every open and append.
+
+Run from the `attention_monitoring` directory:
+
+    python -m src.tools.benchmarks.session_log [--rows 100000] [--repeats 20]
+"""
+import argparse
+import csv
+import os
+import statistics
+import tempfile
+import time
+
+import polars as pl
+
+from src.study._study_session import SessionLogger
+
+def _makeLog(filePath: str, numRows: int) -> None:
+    with open(filePath, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(SessionLogger.logFields)
+        for k in range(1, numRows + 1):
+            writer.writerow([f"S{k}_191026_P{k}", k, "191026", k])
+
+def _legacyNewSession(filePath: str) -> None:
+    # Open the log, read the last line and append a new line, as done by the
+    # previous implementation of `SessionLogger`
+    dtypes = {field : pl.Utf8 for field in SessionLogger.logFields}
+    log = pl.read_csv(filePath, dtypes=dtypes, row_count_name="row_count")
+    last = log.filter(pl.col("row_count") == log["row_count"].max())
+    sessionID = int(last["session_id"][0]) + 1
+    line = pl.DataFrame(
+        {
+            "row_count" : [log["row_count"].max() + 1],
+            "session_name" : [f"S{sessionID}_191026"],
+            "session_id" : [str(sessionID)],
+            "date" : ["191026"],
+            "participant_id" : [None]
+            },
+        schema=log.schema
+        )
+    log = log.vstack(line)
+    with open(filePath, "a", newline="") as f:
+        csv.writer(f).writerow(line.drop("row_count").row(0))
+
+def _newSession(filePath: str) -> None:
+    SessionLogger(filePath).addSession(date="191026")
+
+def _time(func, filePath: str, repeats: int) -> list[float]:
+    times = []
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        func(filePath)
+        times.append(time.perf_counter() - t0)
+    return times
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--repeats", type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpDir:
+        for name, func in (("legacy", _legacyNewSession), ("new", _newSession)):
+            filePath = os.path.join(tmpDir, f"{name}.csv")
+            _makeLog(filePath, args.rows)
+            if func is _newSession:
+                # Count the lines of the existing log once, as happens the
+                # first time an existing log is opened
+                SessionLogger(filePath)
+            times = [t * 1000 for t in _time(func, filePath, args.repeats)]
+            print(
+                f"{name:>6}: {args.rows} rows, median "
+                + f"{statistics.median(times):.3f} ms, max {max(times):.3f} ms"
+                + f" per new session ({args.repeats} repeats)"
+                )
+
+if __name__ == "__main__":
+    main()
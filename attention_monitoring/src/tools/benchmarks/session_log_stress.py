@@ -0,0 +1,108 @@
+"""Stress test creating sessions from many processes at once.
+
+Starts several processes that each add sessions to the same sessions log as
+fast as they can, simulating several stations sharing a data directory. Each
+process also records the sessions it created in a shared `JsonBackedDict`.
+Afterwards, checks that every session was given a different ID, that the IDs
+are consecutive, that the log can be read and that no update to the shared
+json file was lost.
+
+Run from the `attention_monitoring` directory:
+
+    python -m src.tools.benchmarks.session_log_stress [--processes 16]
+        [--sessions 50] [--dir DIR]
+
+Use `--dir` to run against a directory on a shared (eg. network) file system.
+"""
+import argparse
+import multiprocessing
+import os
+import statistics
+import tempfile
+import time
+
+from src.helpers import JsonBackedDict
+from src.study._study_session import SessionLogger
+
+def _worker(
+        logPath: str,
+        jsonPath: str,
+        worker: int,
+        numSessions: int,
+        start
+        ) -> list[float]:
+    # Add sessions to the log, returning the time taken to add each one
+    start.wait()
+    times = []
+    for k in range(numSessions):
+        t0 = time.perf_counter()
+        entry = SessionLogger(logPath).addSession(
+            date="191026", participant_id=worker
+            )
+        times.append(time.perf_counter() - t0)
+        JsonBackedDict(jsonPath)[f"w{worker}_{k}"] = entry["session_id"][0]
+    return times
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--processes", type=int, default=16)
+    parser.add_argument("--sessions", type=int, default=50)
+    parser.add_argument("--dir", default=None)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmpDir:
+        logPath = os.path.join(tmpDir, "log.csv")
+        jsonPath = os.path.join(tmpDir, "created.json")
+        SessionLogger(logPath)
+        JsonBackedDict(jsonPath)
+
+        manager = multiprocessing.Manager()
+        start = manager.Event()
+        with multiprocessing.Pool(args.processes) as pool:
+            results = [
+                pool.apply_async(
+                    _worker,
+                    (logPath, jsonPath, w, args.sessions, start)
+                    )
+                for w in range(args.processes)
+                ]
+            t0 = time.perf_counter()
+            start.set()
+            times = [t for r in results for t in r.get()]
+            elapsed = time.perf_counter() - t0
+
+        total = args.processes * args.sessions
+        log = SessionLogger(logPath)
+        entries = log.read()
+        ids = sorted(int(x) for x in entries["session_id"])
+        created = JsonBackedDict(jsonPath).safeView()
+
+        problems = []
+        if log.numLines != total:
+            problems.append(f"log has {log.numLines} lines, expected {total}")
+        if ids != list(range(1, total + 1)):
+            problems.append("session IDs are not unique and consecutive")
+        if len(created) != total:
+            problems.append(
+                f"shared json has {len(created)} items, expected {total}"
+                )
+        if sorted(int(x) for x in created.values()) != ids:
+            problems.append("shared json does not match the log")
+
+        timesMs = [t * 1000 for t in times]
+        print(
+            f"{args.processes} processes x {args.sessions} sessions in "
+            + f"{elapsed:.2f} s ({total / elapsed:.0f} sessions/s)"
+            )
+        print(
+            f"addSession latency: median {statistics.median(timesMs):.3f} ms,"
+            + f" max {max(timesMs):.3f} ms"
+            )
+        if len(problems) > 0:
+            for problem in problems:
+                print(f"FAILED: {problem}")
+            raise SystemExit(1)
+        print("OK")
+
+if __name__ == "__main__":
+    main()
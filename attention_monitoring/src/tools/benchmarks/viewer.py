@@ -0,0 +1,94 @@
+"""Benchmark scrolling through a long recording with a `ScrollViewer`.
+
+Writes a long simulated recording to a memory-mapped store, then scrolls
+through it by a quarter of the view and by whole views, and reports the time
+taken to update the view (without drawing it) and to draw the figure, and
+the memory held by the window cache. Drawing is not interleaved with
+scrolling, so that the background thread has time to prefetch windows.
+
+Run from the `attention_monitoring` directory:
+
+    python -m src.tools.benchmarks.viewer [--hours 2] [--width 10]
+"""
+import argparse
+import tempfile
+import time
+
+import matplotlib
+matplotlib.use("Agg")
+import numpy as np
+
+from src.data_analysis.viewer import ScrollViewer, SignalStore
+
+def _timeScrolls(viewer, amount, numScrolls, pause):
+    times = []
+    for _ in range(numScrolls):
+        t0 = time.perf_counter()
+        viewer.scroll(amount)
+        times.append(time.perf_counter() - t0)
+        time.sleep(pause)
+    return np.array(times)
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--hours", type=float, default=2)
+    parser.add_argument("--width", type=float, default=10)
+    parser.add_argument("--channels", type=int, default=4)
+    parser.add_argument("--srate", type=float, default=256.0)
+    parser.add_argument("--scrolls", type=int, default=200)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    numSamples = int(args.hours * 3600 * args.srate)
+    with tempfile.TemporaryDirectory() as storeDir:
+        t0 = time.perf_counter()
+        store = SignalStore.create(
+            storeDir, np.arange(numSamples) / args.srate, args.channels
+            )
+        chunkSize = 2**20
+        for start in range(0, numSamples, chunkSize):
+            stop = min(start + chunkSize, numSamples)
+            store.timeSeries[start:stop] = np.cumsum(
+                rng.standard_normal((stop - start, args.channels)), axis=0
+                )
+        store.close()
+        print(
+            f"wrote {numSamples} samples x {args.channels} channels in "
+            + f"{time.perf_counter() - t0:.2f} s"
+            )
+
+        markers = [(np.arange(0, args.hours * 3600, 0.8), {'color' : 'r'})]
+        viewer = ScrollViewer(
+            SignalStore(storeDir), markers=markers, width=args.width
+            )
+        draw = viewer.fig.canvas.draw
+        draw()
+
+        # Only time updating the view while scrolling, as `draw_idle` draws
+        # immediately with the Agg backend
+        viewer.fig.canvas.draw_idle = lambda: None
+        for label, amount in [("quarter view", 0.25), ("whole view", 1)]:
+            times = _timeScrolls(viewer, amount, args.scrolls, 0.005)
+            print(
+                f"{label:>12}: update median {np.median(times) * 1000:.2f} "
+                + f"ms, p99 {np.percentile(times, 99) * 1000:.2f} ms, max "
+                + f"{times.max() * 1000:.2f} ms"
+                )
+
+        drawTimes = []
+        for _ in range(10):
+            t0 = time.perf_counter()
+            draw()
+            drawTimes.append(time.perf_counter() - t0)
+        cacheBytes = (
+            len(viewer.cache) * args.width * args.srate
+            * (args.channels + 1) * 8
+            )
+        print(
+            f"draw median {np.median(drawTimes) * 1000:.1f} ms; window cache "
+            + f"{len(viewer.cache)} windows, ~{cacheBytes / 2**20:.1f} MiB"
+            )
+        viewer.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+import numpy as np
+import pytest
+
+from src.data_analysis.alignment import (
+    alignStreams, dejitter, detectGaps, segmentBoundaries
+    )
+
+# (nominal rate, frequency of the test signal, number of channels) of each
+# stream
+STREAMS = {"eeg" : (256, 3.0, 4), "ppg" : (64, 1.0, 3), "acc" : (52, 0.5, 3)}
+
+def makeStream(rng, rate, freq, numChannels, duration=120, gap=None):
+    # Sinusoids sampled at a nominal rate, with jittered time stamps (some
+    # of them late) and optionally a gap (in seconds from the start)
+    times = 100 + np.arange(int(duration * rate)) / rate
+    if gap is not None:
+        times = times[(times <= 100 + gap[0]) | (times >= 100 + gap[1])]
+    stamps = times + rng.normal(0, 0.002, len(times))
+    stamps[rng.random(len(times)) < 0.02] += 0.05
+    values = np.column_stack([
+        np.sin(2 * np.pi * freq * (times - 100) + k)
+        for k in range(numChannels)
+        ])
+    channels = [{'label' : [f"c{k}"]} for k in range(numChannels)]
+    stream = {
+        'time_series' : values,
+        'time_stamps' : stamps,
+        'info' : {
+            'nominal_srate' : [str(rate)],
+            'desc' : [{'channels' : [{'channel' : channels}]}]
+            }
+        }
+    return stream, times
+
+@pytest.fixture(scope="module")
+def data():
+    rng = np.random.default_rng(0)
+    return {
+        name : makeStream(
+            rng, rate, freq, numChannels,
+            gap=(60, 62) if name == "eeg" else None
+            )[0]
+        for name, (rate, freq, numChannels) in STREAMS.items()
+        }
+
+def expectedValues(times):
+    return np.column_stack([
+        np.sin(2 * np.pi * freq * (times - 100) + k)
+        for _, freq, numChannels in STREAMS.values()
+        for k in range(numChannels)
+        ])
+
+def test_dejitterRecoversNominalTimes():
+    rng = np.random.default_rng(1)
+    stream, times = makeStream(rng, 256, 3.0, 1, gap=(60, 62))
+
+    dejittered, segments = dejitter(stream['time_stamps'], srate=256)
+
+    assert len(segments) == 2
+    np.testing.assert_allclose(dejittered, times, atol=2e-3)
+    np.testing.assert_array_equal(
+        segmentBoundaries(dejittered), [0, segments[1, 0], len(times)]
+        )
+    gaps = detectGaps(dejittered)
+    assert len(gaps) == 1
+    assert gaps[0][0] == pytest.approx(160, abs=0.01)
+    assert gaps[0][1] == pytest.approx(162, abs=0.01)
+
+def test_alignStreamsMatchesSignals(data):
+    times, values, names = alignStreams(data)
+
+    assert names == [
+        f"{name}_c{k}" for name, (_, _, n) in STREAMS.items()
+        for k in range(n)
+        ]
+    # The lowest nominal rate
+    np.testing.assert_allclose(np.diff(times), 1 / 52)
+    # EEG channels are missing in its gap only
+    missing = np.isnan(values[:, 0])
+    assert missing.any()
+    assert np.all((times[missing] > 159.9) & (times[missing] < 162.1))
+    assert not np.isnan(values[:, 4:]).any()
+    valid = ~np.isnan(values)
+    error = np.abs(values - expectedValues(times))[valid]
+    assert np.percentile(error, 99) < 0.05
+
+@pytest.mark.parametrize("chunkDuration", [7.3, 60.0])
+def test_chunkedAlignStreamsMatchesUnchunked(data, chunkDuration):
+    times, values, _ = alignStreams(data)
+    chunkedTimes, chunked, _ = alignStreams(data, chunkDuration=chunkDuration)
+    np.testing.assert_array_equal(chunkedTimes, times)
+    np.testing.assert_allclose(chunked, values, atol=1e-10)
+
+def test_alignStreamsIntoMemmap(data, tmp_path):
+    times, values, _ = alignStreams(data)
+    out = np.lib.format.open_memmap(
+        tmp_path / "aligned.npy", mode="w+", shape=values.shape
+        )
+    alignStreams(data, chunkDuration=30.0, out=out)
+    np.testing.assert_allclose(out, values, atol=1e-10)
@@ -0,0 +1,120 @@
+import numpy as np
+import pytest
+
+from src.data_analysis.artifacts import (
+    detectArtifacts, dilateMask, eventsMask, maskEvents, rollingMean,
+    rollingStd, rollingSum
+    )
+
+SRATE = 256
+CHANNELS = ["TP9", "AF7", "AF8", "TP10"]
+
+@pytest.fixture(scope="module")
+def data():
+    # Clean EEG with blinks at 50 s and 100 s, a flat TP9 from 150 to 155 s,
+    # TP10 railing at 200 s and head motion from 250 to 252 s
+    rng = np.random.default_rng(0)
+    duration = 300
+    n = SRATE * duration
+    x = rng.normal(0, 10, (n, 4))
+    blink = 150 * np.exp(-0.5 * (np.arange(-64, 65) / 20) ** 2)
+    for t in (50, 100):
+        x[t * SRATE - 64:t * SRATE + 65, 1:3] += blink[:, np.newaxis]
+    x[150 * SRATE:155 * SRATE, 0] = 3.0
+    x[200 * SRATE:200 * SRATE + 50, 3] = 900
+
+    imuTimes = 1000 + np.arange(52 * duration) / 52
+    acc = np.tile([0.0, 0.0, 1.0], (len(imuTimes), 1))
+    acc += rng.normal(0, 0.005, acc.shape)
+    acc[52 * 250:52 * 252] += rng.normal(0, 0.3, (104, 3))
+    channels = [{'label' : [c]} for c in CHANNELS]
+    return {
+        'eeg' : {
+            'time_series' : x,
+            'time_stamps' : 1000 + np.arange(n) / SRATE,
+            'info' : {
+                'effective_srate' : SRATE,
+                'desc' : [{'channels' : [{'channel' : channels}]}]
+                }
+            },
+        'acc' : {'time_series' : acc, 'time_stamps' : imuTimes, 'info' : {}}
+        }
+
+@pytest.mark.parametrize("window", [1, 50, 51])
+def test_rollingStatisticsMatchNaiveWindows(window):
+    x = np.random.default_rng(1).normal(5, 2, (1000, 2))
+
+    sums, counts = rollingSum(x, window)
+    means, stds = rollingMean(x, window), rollingStd(x, window)
+
+    for k in range(len(x)):
+        lo = k - window // 2
+        segment = x[max(lo, 0):min(lo + window, len(x))]
+        assert counts[k] == len(segment)
+        np.testing.assert_allclose(sums[k], segment.sum(axis=0))
+        np.testing.assert_allclose(means[k], segment.mean(axis=0))
+        np.testing.assert_allclose(
+            stds[k], segment.std(axis=0), atol=1e-6
+            )
+
+def test_dilateMask():
+    mask = np.random.default_rng(2).random(500) < 0.02
+    dilated = dilateMask(mask, 3, 5)
+    # Every flagged sample extends 3 samples before and 5 after it
+    expected = np.zeros_like(mask)
+    for k in np.flatnonzero(mask):
+        expected[max(k - 3, 0):k + 6] = True
+    np.testing.assert_array_equal(dilated, expected)
+
+def test_maskEventsRoundTrip():
+    mask = np.random.default_rng(3).random(1000) < 0.3
+    events = maskEvents(mask)
+    assert np.all(mask[events[:, 0]])
+    assert np.all(mask[events[:, 1] - 1])
+    np.testing.assert_array_equal(eventsMask(events, len(mask)), mask)
+    assert maskEvents(np.zeros(10, dtype=bool)).shape == (0, 2)
+
+def flaggedSeconds(mask):
+    # The start and end (in seconds) of each run of flagged samples
+    mask = mask.any(axis=1) if mask.ndim == 2 else mask
+    return maskEvents(mask) / SRATE
+
+def test_detectArtifactsFindsInjectedArtifacts(data):
+    artifacts = detectArtifacts(data, rails=(-900, 900))
+
+    blinks = artifacts.blinks / SRATE
+    assert len(blinks) == 2
+    np.testing.assert_allclose(blinks.mean(axis=1), [50, 100], atol=0.05)
+
+    flat = flaggedSeconds(artifacts.masks["flatline"][:, 0])
+    np.testing.assert_allclose(flat, [[150, 155]], atol=0.01)
+    assert not artifacts.masks["flatline"][:, 1:].any()
+
+    railing = flaggedSeconds(artifacts.masks["railing"][:, 3])
+    assert len(railing) == 1
+    assert railing[0, 0] < 200 < 200.2 < railing[0, 1] < 200.5
+
+    motion = flaggedSeconds(artifacts.masks["motion"])
+    assert len(motion) == 1
+    assert 249 < motion[0, 0] < 250 and 252 < motion[0, 1] < 253
+
+    amplitude = flaggedSeconds(artifacts.masks["amplitude"])
+    assert len(amplitude) == 1
+    assert amplitude[0, 0] < 200 < railing[0, 1] <= amplitude[0, 1] + 0.01
+
+def test_trialMaskAndBadChannels(data):
+    artifacts = detectArtifacts(data, rails=(-900, 900))
+    starts = np.arange(0, artifacts.numSamples - SRATE, SRATE)
+
+    trialMask = artifacts.trialMask(starts, SRATE)
+
+    sampleMask = artifacts.sampleMask()
+    expected = [sampleMask[s:s + SRATE].any() for s in starts]
+    np.testing.assert_array_equal(trialMask, expected)
+    assert artifacts.badChannels() == []
+    assert artifacts.badChannels(maxFraction=0.01) == ["TP9"]
+    # Ignoring TP9 drops its flat segment
+    withoutTP9 = artifacts.sampleMask(
+        kinds=["flatline"], excludeChannels=["TP9"]
+        )
+    assert not withoutTP9.any()
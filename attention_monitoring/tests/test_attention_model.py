@@ -0,0 +1,133 @@
+import numpy as np
+import pytest
+
+from src.data_analysis.attention_model import (
+    AttentionModel, AttentionPredictor
+    )
+from src.data_analysis.feature_store import trialFeatures
+from src.data_analysis.summary import defaultPipeline
+
+EEG_SRATE = 256.0
+PPG_SRATE = 64.0
+CHANNELS = ["TP9", "AF7", "AF8", "TP10"]
+START = 1000.0
+
+def makeBlock(rng, seconds=60, numTrials=70):
+    # A recording with alpha and delta rhythms in the EEG and a pulse with
+    # variable intervals in the PPG
+    eegTimes = START + np.arange(int(seconds * EEG_SRATE)) / EEG_SRATE
+    rhythms = (
+        10 * np.sin(2 * np.pi * 10 * eegTimes)
+        + 20 * np.sin(2 * np.pi * 2 * eegTimes)
+        )
+    eeg = (
+        800 + 10 * rng.standard_normal((len(eegTimes), len(CHANNELS)))
+        + rhythms[:, np.newaxis]
+        )
+    ppgTimes = START + np.arange(int(seconds * PPG_SRATE)) / PPG_SRATE
+    beats = np.cumsum(0.85 + 0.05 * rng.standard_normal(2 * seconds))
+    phase = np.interp(ppgTimes - START, beats, np.arange(len(beats)))
+    pulse = (
+        1e5 + 2e3 * np.cos(np.pi * phase) ** 8
+        + 20 * rng.standard_normal(len(ppgTimes))
+        )
+    onsets = START + 2 + np.arange(numTrials) * 0.8
+    return {
+        'eeg' : {
+            'time_series' : eeg, 'time_stamps' : eegTimes,
+            # The effective rate of a recording differs from the nominal
+            # rate that is known live
+            'info' : {
+                'nominal_srate' : [str(EEG_SRATE)],
+                'effective_srate' : EEG_SRATE - 0.01,
+                'desc' : [{'channels' : [{'channel' : [
+                    {'label' : [name]} for name in CHANNELS
+                    ]}]}]
+                }
+            },
+        'ppg' : {
+            'time_series' : np.column_stack((
+                np.zeros(len(ppgTimes)), pulse, np.zeros(len(ppgTimes))
+                )),
+            'time_stamps' : ppgTimes,
+            'info' : {
+                'nominal_srate' : [str(PPG_SRATE)],
+                'effective_srate' : PPG_SRATE + 0.01
+                }
+            },
+        'stimuli_marker_stream' : {
+            'time_series' : [["transition_period_start"]] * numTrials,
+            'time_stamps' : onsets
+            }
+        }
+
+def replayLive(predictor, data, rng, lookahead):
+    # Feed the recording to a predictor in chunks of irregular size, as
+    # they arrive during a run, and compute the features of each trial as
+    # soon as its EEG has been received
+    eeg, ppg = data['eeg'], data['ppg']
+    onsets = data['stimuli_marker_stream']['time_stamps']
+    features, rejects = [], []
+    i = j = 0
+    for stop in np.arange(START, eeg['time_stamps'][-1] + 0.1, 0.05):
+        end = np.searchsorted(eeg['time_stamps'], stop)
+        predictor.addEEG(
+            eeg['time_series'][i:end], eeg['time_stamps'][i:end]
+            )
+        i = end
+        end = np.searchsorted(ppg['time_stamps'], stop)
+        while j < end:
+            n = min(int(rng.integers(1, 7)), end - j)
+            predictor.addPPG(
+                ppg['time_series'][j:j + n], ppg['time_stamps'][j:j + n]
+                )
+            j += n
+        while (
+                len(features) < len(onsets) and i > 0
+                and onsets[len(features)] + 0.8 + lookahead
+                <= eeg['time_stamps'][i - 1]
+                ):
+            x, reject = predictor.features(onsets[len(features)])
+            features.append(x)
+            rejects.append(reject)
+    return np.array(features), np.array(rejects)
+
+@pytest.fixture(scope="module")
+def block():
+    return makeBlock(np.random.default_rng(0))
+
+@pytest.mark.parametrize("lookahead", [0.25, 1.0])
+def test_liveFeaturesMatchStore(block, lookahead):
+    stored = trialFeatures(block, lookahead=lookahead)
+    features = [
+        c for c in stored.columns
+        if c.startswith(("eeg_", "ppg_"))
+        and c not in ("eeg_reject", "ppg_num_beats")
+        ]
+    rng = np.random.default_rng(1)
+    model = AttentionModel(features).fit(
+        rng.standard_normal((20, len(features))), np.arange(20) % 2 == 0
+        )
+    model.metadata = {
+        "pipeline" : [[a, p] for a, p in defaultPipeline().actions],
+        "ppg_window" : [-10.0, 0.0],
+        "padding" : 1.0,
+        "lookahead" : lookahead
+        }
+    predictor = AttentionPredictor(
+        model, EEG_SRATE, CHANNELS, ppgSrate=PPG_SRATE
+        )
+
+    live, rejects = replayLive(predictor, block, rng, lookahead)
+
+    assert len(live) > 60
+    expected = stored.select(features).to_numpy()[:len(live)]
+    # Including the delta band and every PPG metric
+    assert any(f.endswith("_delta") for f in features)
+    assert {"ppg_hr_bpm", "ppg_sdnn_ms", "ppg_rmssd_ms"} <= set(features)
+    assert not np.isnan(expected[10:]).any()
+    np.testing.assert_allclose(live, expected, rtol=1e-9, atol=1e-9)
+    np.testing.assert_array_equal(
+        rejects,
+        stored["eeg_reject"].to_numpy().astype(bool)[:len(live)]
+        )
@@ -0,0 +1,126 @@
+from statistics import NormalDist
+
+import numpy as np
+import polars as pl
+import pytest
+
+from src.data_analysis.behaviour import blockSummary, trialTable
+
+TRANSITION_TIME = 0.8
+
+def makeBlock(types, responses, name="b", static=0.0):
+    return {
+        "session_name" : "s",
+        "block_name" : name,
+        "onsets" : 10 + np.arange(len(types)) * (TRANSITION_TIME + static),
+        "responses" : 10 + np.asarray(responses, dtype=float),
+        "target_types" : np.asarray(types),
+        "transition_time" : TRANSITION_TIME,
+        "static_time" : static
+        }
+
+def reactionTimes(types, responses):
+    rt = trialTable([makeBlock(types, responses)])["rt_ms"].to_numpy()
+    return np.round(rt.astype(float), 6)
+
+def test_unambiguousResponsesAreAssignedToTheirTrial():
+    # Responses after an image is 70% coherent and before the next is 40%
+    # coherent belong to that image's trial
+    rng = np.random.default_rng(0)
+    blocks, expected = [], []
+    for b in range(20):
+        numTrials, static = 300, 0.2
+        trialTime = TRANSITION_TIME + static
+        types = np.where(rng.random(numTrials) < 0.1, "rare", "common")
+        responded = rng.random(numTrials) < 0.8
+        rt = rng.uniform(
+            0.7 * TRANSITION_TIME + 1e-3,
+            trialTime + 0.4 * TRANSITION_TIME - 1e-3,
+            numTrials
+            )
+        onsets = 10 + np.arange(numTrials) * trialTime
+        blocks.append(makeBlock(
+            types, (onsets + rt - 10)[responded], f"b{b}", static
+            ))
+        expected.append(np.where(responded, rt * 1000, np.nan))
+
+    trials = trialTable(blocks)
+
+    expected = np.concatenate(expected)
+    rt = trials["rt_ms"].to_numpy().astype(float)
+    np.testing.assert_array_equal(np.isnan(rt), np.isnan(expected))
+    np.testing.assert_allclose(rt, expected, atol=1e-6)
+    isRare = trials["target_type"].to_numpy() == "rare"
+    responded = ~np.isnan(expected)
+    np.testing.assert_array_equal(
+        trials["commission_error"].to_numpy().astype(bool),
+        isRare & responded
+        )
+    np.testing.assert_array_equal(
+        trials["omission_error"].to_numpy().astype(bool),
+        ~isRare & ~responded
+        )
+
+@pytest.mark.parametrize("types, responses, expected", [
+    # Ambiguous response, the later trial has an unambiguous response
+    (["common"] * 3, [1.2, 1.4], [1200, 600, np.nan]),
+    # Ambiguous response, the earlier trial has an unambiguous response
+    (["common"] * 3, [0.6, 1.2], [600, 400, np.nan]),
+    # Neither does: the most coherent image
+    (["common"] * 3, [1.15], [1150, np.nan, np.nan]),
+    (["common"] * 3, [1.35], [np.nan, 550, np.nan]),
+    # ... unless one is a rare target
+    (["common", "rare", "common"], [1.35], [1350, np.nan, np.nan]),
+    (["rare", "common", "common"], [1.15], [np.nan, 350, np.nan]),
+    # Only the first response to a trial is kept
+    (["common"] * 3, [0.6, 0.65], [600, np.nan, np.nan]),
+    ])
+def test_responseAssignmentRules(types, responses, expected):
+    np.testing.assert_allclose(
+        reactionTimes(types, responses), expected, atol=1e-6
+        )
+
+def test_blockSummaryMatchesCounts():
+    rng = np.random.default_rng(1)
+    blocks = []
+    for b in range(5):
+        types = np.where(rng.random(200) < 0.1, "rare", "common")
+        onsets = np.arange(200) * TRANSITION_TIME
+        responded = rng.random(200) < np.where(types == "rare", 0.3, 0.9)
+        blocks.append(makeBlock(
+            types, (onsets + 0.6)[responded], name=f"b{b}"
+            ))
+    trials = trialTable(blocks)
+
+    summary = blockSummary(trials).sort("block_name")
+
+    for row, (name, block) in zip(
+            summary.iter_rows(named=True),
+            trials.groupby("block_name", maintain_order=True)
+            ):
+        assert row["block_name"] == name
+        isRare = (block["target_type"] == "rare").to_numpy().astype(bool)
+        responded = block["responded"].to_numpy().astype(bool)
+        numRare, numCommon = isRare.sum(), (~isRare).sum()
+        hits = (responded & ~isRare).sum()
+        falseAlarms = (responded & isRare).sum()
+        assert row["num_hits"] == hits
+        assert row["num_false_alarms"] == falseAlarms
+        assert row["commission_rate"] == pytest.approx(falseAlarms / numRare)
+        assert row["omission_rate"] == pytest.approx(1 - hits / numCommon)
+
+        # Log-linear correction
+        z = NormalDist().inv_cdf
+        zHit = z((hits + 0.5) / (numCommon + 1))
+        zFA = z((falseAlarms + 0.5) / (numRare + 1))
+        assert row["d_prime"] == pytest.approx(zHit - zFA)
+        assert row["criterion"] == pytest.approx(-(zHit + zFA) / 2)
+
+        rt = block.filter(
+            (pl.col("target_type") == "common") & pl.col("responded")
+            )["rt_ms"].to_numpy()
+        assert row["mean_rt_ms"] == pytest.approx(rt.mean())
+
+def test_emptyBlocks():
+    assert trialTable([]).height == 0
+    assert trialTable([None, makeBlock([], [])]).height == 0
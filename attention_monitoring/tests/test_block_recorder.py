@@ -0,0 +1,70 @@
+import os
+
+import pytest
+
+from src.gradcpt.helpers import _BlockRecorder
+from src.lab_recorder import LabRecorderClient, LabRecorderStandIn
+
+@pytest.fixture
+def standIn():
+    with LabRecorderStandIn() as standIn:
+        yield standIn
+
+def makeBlocks(tmp_path, names, practice=False):
+    return [
+        {
+            "block_name" : name,
+            "data_file" : os.path.join(tmp_path, f"{name}.xdf"),
+            "record" : not (practice and k == 0)
+            }
+        for k, name in enumerate(names)
+        ]
+
+def recordedCommands(standIn):
+    return [
+        command.split(" ", 1)[0] for (_, command) in standIn.commands
+        ]
+
+@pytest.mark.parametrize("practice", [False, True])
+def test_recordsEachBlockThroughOneConnection(standIn, tmp_path, practice):
+    blocks = makeBlocks(tmp_path, ["block_0", "block_1", "block_2"], practice)
+    recorded = blocks[1:] if practice else blocks
+
+    with LabRecorderClient("localhost", standIn.port) as client:
+        with _BlockRecorder(client, blocks, 101) as recorder:
+            # The first block is recorded from the start
+            assert standIn.isRecording != practice
+            for block in blocks:
+                recorder.stopBlock(block["block_name"])
+        assert not standIn.isRecording
+        assert client.latencyStats()["start"]["count"] == len(recorded)
+
+    assert [r["path"] for r in standIn.recordings] == [
+        block["data_file"] for block in recorded
+        ]
+    assert all(r["stop"] is not None for r in standIn.recordings)
+    assert standIn.selected == "all"
+    assert standIn.filenameOptions["participant"] == "101"
+    assert standIn.filenameOptions["task"] == "block_2"
+    assert recordedCommands(standIn) == (
+        ["update", "select"] + ["filename", "start", "stop"] * len(recorded)
+        )
+
+def test_unfinishedBlockIsStopped(standIn, tmp_path):
+    blocks = makeBlocks(tmp_path, ["block_0", "block_1"])
+
+    with LabRecorderClient("localhost", standIn.port) as client:
+        with pytest.raises(RuntimeError):
+            with _BlockRecorder(client, blocks, 101) as recorder:
+                recorder.stopBlock("block_0")
+                raise RuntimeError("presentation failed")
+
+        # Blocks must end in order
+        with _BlockRecorder(client, blocks, 101) as recorder:
+            with pytest.raises(ValueError):
+                recorder.stopBlock("block_1")
+
+    assert not standIn.isRecording
+    assert [r["path"] for r in standIn.recordings] == [
+        blocks[0]["data_file"], blocks[1]["data_file"], blocks[0]["data_file"]
+        ]
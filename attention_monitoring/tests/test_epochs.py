@@ -0,0 +1,112 @@
+import numpy as np
+
+from src.data_analysis.epochs import (
+    Epochs, baselineCorrect, epochStarts, markerTimes, peakToPeakMask,
+    sampleMaskToTrialMask
+    )
+
+SRATE = 256.0
+
+def makeSignal(rng, seconds=60, numChannels=4):
+    timestamps = 100 + np.arange(int(seconds * SRATE)) / SRATE
+    data = rng.standard_normal((len(timestamps), numChannels))
+    return data, timestamps
+
+def naiveEpochs(data, timestamps, eventTimes, tmin, tmax):
+    # One epoch at a time: the samples from the first at or after
+    # `event + tmin`, dropping epochs that leave the signal
+    firstSample = int(np.round(tmin * SRATE))
+    numSamples = int(np.round(tmax * SRATE)) - firstSample
+    epochs, kept = [], []
+    for t in eventTimes:
+        start = t + firstSample / SRATE
+        later = np.flatnonzero(timestamps >= start)
+        if start < timestamps[0] or len(later) == 0:
+            continue
+        k = later[0]
+        if k + numSamples > len(timestamps):
+            continue
+        epochs.append(data[k:k + numSamples].T)
+        kept.append(t)
+    return np.array(epochs), np.array(kept)
+
+def test_fromSignalMatchesNaiveEpochs():
+    rng = np.random.default_rng(0)
+    data, timestamps = makeSignal(rng)
+    # Including events whose epochs leave the signal
+    eventTimes = np.sort(
+        rng.uniform(timestamps[0] - 1, timestamps[-1] + 1, 200)
+        )
+
+    epochs = Epochs.fromSignal(data, timestamps, eventTimes, -0.2, 0.8)
+    expected, kept = naiveEpochs(data, timestamps, eventTimes, -0.2, 0.8)
+
+    np.testing.assert_array_equal(epochs.data, expected)
+    np.testing.assert_array_equal(epochs.eventTimes, kept)
+    np.testing.assert_array_equal(eventTimes[epochs.events], kept)
+    np.testing.assert_allclose(epochs.times, np.arange(-51, 205) / SRATE)
+
+def test_viewOfEvenlySpacedEpochsEqualsCopy():
+    rng = np.random.default_rng(1)
+    data, timestamps = makeSignal(rng)
+    eventTimes = timestamps[1000] + np.arange(50) * 0.5 + 1e-6
+
+    view = Epochs.fromSignal(data, timestamps, eventTimes, asView=True)
+    copy = Epochs.fromSignal(data, timestamps, eventTimes)
+
+    assert np.shares_memory(view.data, data)
+    np.testing.assert_array_equal(view.data, copy.data)
+    np.testing.assert_allclose(
+        view.applyBaseline().data, copy.applyBaseline().data
+        )
+
+def test_baselineCorrect():
+    rng = np.random.default_rng(2)
+    epochs = rng.standard_normal((10, 3, 256))
+    times = (np.arange(256) - 51) / SRATE
+
+    corrected = baselineCorrect(epochs, times, (None, 0))
+
+    for trial in range(10):
+        for channel in range(3):
+            baseline = epochs[trial, channel, times <= 0].mean()
+            np.testing.assert_allclose(
+                corrected[trial, channel], epochs[trial, channel] - baseline
+                )
+
+def test_rejection():
+    rng = np.random.default_rng(3)
+    epochs = rng.standard_normal((20, 2, 100))
+    epochs[4, 1, 50] = 100
+    epochs[9, 0] = 0
+
+    reject = peakToPeakMask(epochs, maxPeakToPeak=50, minPeakToPeak=1)
+
+    expected = np.array([
+        np.ptp(e, axis=-1).max() > 50 or np.ptp(e, axis=-1).min() < 1
+        for e in epochs
+        ])
+    np.testing.assert_array_equal(reject, expected)
+    assert reject[4] and reject[9] and reject.sum() == 2
+
+def test_sampleMaskToTrialMask():
+    rng = np.random.default_rng(4)
+    sampleMask = rng.random(10000) < 0.001
+    starts = np.sort(rng.integers(0, 10000 - 50, 300))
+
+    trialMask = sampleMaskToTrialMask(sampleMask, starts, 50)
+
+    expected = [sampleMask[s:s + 50].any() for s in starts]
+    np.testing.assert_array_equal(trialMask, expected)
+
+def test_epochStartsAndMarkerTimes():
+    timestamps = np.arange(10.0)
+    starts, valid = epochStarts(timestamps, [-1.0, 0.5, 7.0, 8.0], 0.0, 3)
+    np.testing.assert_array_equal(starts[valid], [1, 7])
+    np.testing.assert_array_equal(valid, [False, True, True, False])
+
+    stream = {
+        'time_series' : [["a"], ["b"], ["a"]],
+        'time_stamps' : np.array([1.0, 2.0, 3.0])
+        }
+    np.testing.assert_array_equal(markerTimes(stream, "a"), [1.0, 3.0])
@@ -0,0 +1,162 @@
+import os
+import shutil
+
+import polars as pl
+from polars.testing import assert_frame_equal
+import pytest
+
+from src.data_analysis.block import GradCPTBlock
+from src.data_analysis.feature_store import FeatureStore
+from .test_summary import NUM_TRIALS, loadData, writeSeed, writeSession
+
+@pytest.fixture
+def studyDir(tmp_path, monkeypatch):
+    # A study of synthetic blocks (see `test_summary`), processed in this
+    # process
+    monkeypatch.setattr(GradCPTBlock, "loadData", classmethod(loadData))
+    studyDir = os.path.join(tmp_path, "study")
+    writeSession(studyDir, "S1_191026", [1, 2])
+    writeSession(studyDir, "S2_191026", [3])
+    writeSession(studyDir, "S3_191026", [4, 5])
+    return studyDir
+
+@pytest.fixture
+def store(tmp_path):
+    return FeatureStore(os.path.join(tmp_path, "store"))
+
+def counts(stats):
+    return {k : v for k, v in stats.items() if k != "errors"}
+
+def blockTrials(store, sessionName, blockName):
+    return store.query(sessions=[sessionName], blocks=[blockName])
+
+def dataFile(studyDir, sessionName, blockName):
+    return os.path.join(studyDir, "sessions", sessionName, f"{blockName}.xdf")
+
+def test_updateOnlyComputesChangedBlocks(studyDir, store):
+    stats = store.update(studyDir, numWorkers=0)
+    assert counts(stats) == {
+        "computed" : 5, "unchanged" : 0, "removed" : 0, "failed" : 0
+        }
+    assert len(store.query()) == 5 * NUM_TRIALS
+    assert counts(store.update(studyDir, numWorkers=0))["unchanged"] == 5
+
+    # A data file is touched but not changed: it is only hashed
+    path = store.partitions(sessions=["S1_191026"], blocks=["block_0"])[0]
+    before = {
+        r["block_name"] : r for r in store.provenance()
+        if r["session_name"] == "S1_191026"
+        }
+    trialsFile = os.path.join(path["path"], "trials.parquet")
+    written = os.stat(trialsFile).st_mtime_ns
+    os.utime(dataFile(studyDir, "S1_191026", "block_0"), ns=(1, 1))
+    stats = store.update(studyDir, numWorkers=0)
+    assert counts(stats) == {
+        "computed" : 0, "unchanged" : 5, "removed" : 0, "failed" : 0
+        }
+    assert os.stat(trialsFile).st_mtime_ns == written
+    after = {
+        r["block_name"] : r for r in store.provenance()
+        if r["session_name"] == "S1_191026"
+        }
+    assert after["block_0"]["inputs_stat"] != before["block_0"]["inputs_stat"]
+    assert after["block_0"]["computed_at"] == before["block_0"]["computed_at"]
+    assert after["block_1"] == before["block_1"]
+    assert counts(store.update(studyDir, numWorkers=0))["unchanged"] == 5
+
+    # A data file is changed: its block is computed again
+    old = blockTrials(store, "S1_191026", "block_1")
+    writeSeed(dataFile(studyDir, "S1_191026", "block_1"), 6)
+    stats = store.update(studyDir, numWorkers=0)
+    assert counts(stats) == {
+        "computed" : 1, "unchanged" : 4, "removed" : 0, "failed" : 0
+        }
+    new = blockTrials(store, "S1_191026", "block_1")
+    assert new["trial"].to_list() == old["trial"].to_list()
+    assert not new["eeg_TP9_alpha"].series_equal(old["eeg_TP9_alpha"])
+
+def test_failedBlocksKeepTheirPartition(studyDir, store):
+    store.update(studyDir, numWorkers=0)
+    old = blockTrials(store, "S3_191026", "block_1")
+    path = dataFile(studyDir, "S3_191026", "block_1")
+    with open(path, "w") as f:
+        f.write("corrupt")
+
+    # Computed again at every update until it succeeds
+    for _ in range(2):
+        stats = store.update(studyDir, numWorkers=0)
+        assert counts(stats) == {
+            "computed" : 0, "unchanged" : 4, "removed" : 0, "failed" : 1
+            }
+        assert list(stats["errors"]) == [("S3_191026", "block_1")]
+        assert_frame_equal(blockTrials(store, "S3_191026", "block_1"), old)
+
+    # The file is restored to the contents the partition was computed
+    # from, so it is only hashed
+    writeSeed(path, 5)
+    stats = store.update(studyDir, numWorkers=0)
+    assert counts(stats) == {
+        "computed" : 0, "unchanged" : 5, "removed" : 0, "failed" : 0
+        }
+    assert_frame_equal(blockTrials(store, "S3_191026", "block_1"), old)
+
+def test_removedBlocksLoseTheirPartition(studyDir, store):
+    store.update(studyDir, numWorkers=0)
+
+    # A deleted session, and a session that no longer lists a block
+    shutil.rmtree(os.path.join(studyDir, "sessions", "S2_191026"))
+    writeSession(studyDir, "S1_191026", [1])
+    stats = store.update(studyDir, numWorkers=0)
+    assert counts(stats) == {
+        "computed" : 0, "unchanged" : 3, "removed" : 2, "failed" : 0
+        }
+    partitions = [
+        (p["session_name"], p["block_name"]) for p in store.partitions()
+        ]
+    assert partitions == [
+        ("S1_191026", "block_0"), ("S3_191026", "block_0"),
+        ("S3_191026", "block_1")
+        ]
+
+def test_unreadableSessionsKeepTheirPartitions(studyDir, store):
+    store.update(studyDir, numWorkers=0)
+    old = store.query(sessions=["S3_191026"])
+
+    # The blocks file of a session can no longer be read
+    blocksFile = os.path.join(studyDir, "sessions", "S3_191026", "blocks.csv")
+    os.remove(blocksFile)
+    stats = store.update(studyDir, numWorkers=0)
+    assert counts(stats) == {
+        "computed" : 0, "unchanged" : 3, "removed" : 0, "failed" : 0
+        }
+    assert list(stats["errors"]) == [
+        os.path.join(studyDir, "sessions", "S3_191026")
+        ]
+    assert_frame_equal(store.query(sessions=["S3_191026"]), old)
+
+    # Neither do sessions whose info file is missing (eg. being copied)
+    os.remove(os.path.join(studyDir, "sessions", "S2_191026", "info.json"))
+    stats = store.update(studyDir, numWorkers=0)
+    assert counts(stats)["removed"] == 0
+    assert len(store.partitions()) == 5
+
+def test_scanPushesDownPredicates(studyDir, store):
+    store.update(studyDir, numWorkers=0)
+    predicate = (pl.col("trial") < 3) & (pl.col("session_name") != "S2_191026")
+    columns = ["session_name", "block_name", "trial", "vtc", "ppg_hr_bpm"]
+
+    trials = store.query(predicate, columns=columns)
+
+    assert_frame_equal(
+        trials, store.query().filter(predicate).select(columns)
+        )
+    assert len(trials) == 4 * 3
+    # The filter and projection are applied while reading each partition
+    plan = store.scan().filter(predicate).select(columns).explain()
+    assert plan.count("Parquet SCAN") == 5
+    assert plan.count("SELECTION") == 5
+    assert plan.count(f"PROJECT {len(columns)}/") == 5
+    # Partitions that are not selected are not read
+    plan = store.scan(sessions=["S2_191026"]).explain()
+    assert plan.count("Parquet SCAN") == 1
+    assert len(store.query(sessions=["S2_191026"])) == NUM_TRIALS
@@ -0,0 +1,106 @@
+import numpy as np
+import pytest
+from scipy import signal as spsignal
+
+from src.data_analysis.epochs import Epochs
+from src.data_analysis.features import (
+    DEFAULT_BANDS, bandPowers, featureTable, multitaperPSD, spectralFeatures,
+    welchPSD
+    )
+
+SRATE = 256.0
+
+@pytest.fixture(scope="module")
+def epochs():
+    return np.random.default_rng(0).standard_normal((30, 4, 300))
+
+@pytest.mark.parametrize("length, kwargs", [
+    (300, {}),
+    (205, {}),
+    (300, {"nperseg" : 128, "noverlap" : 96}),
+    (300, {"nperseg" : 100, "window" : "hamming"})
+    ])
+def test_welchPSDMatchesScipy(epochs, length, kwargs):
+    freqs, psd = welchPSD(epochs[..., :length], SRATE, **kwargs)
+    kwargs.setdefault("nperseg", min(256, length))
+    expectedFreqs, expected = spsignal.welch(
+        epochs[..., :length], fs=SRATE, axis=-1, **kwargs
+        )
+    np.testing.assert_allclose(freqs, expectedFreqs)
+    np.testing.assert_allclose(psd, expected, rtol=1e-10, atol=1e-14)
+
+def test_multitaperPSDMatchesTaperedPeriodograms(epochs):
+    n = epochs.shape[-1]
+    freqs, psd = multitaperPSD(epochs, SRATE, bandwidth=4.0)
+
+    # The mean of the one-sided periodograms with each (unit energy) taper
+    halfBandwidth = 4.0 * n / (2 * SRATE)
+    tapers = spsignal.windows.dpss(
+        n, halfBandwidth, int(2 * halfBandwidth) - 1
+        )
+    x = epochs - epochs.mean(axis=-1, keepdims=True)
+    expected = np.mean([
+        np.abs(np.fft.rfft(x * taper, axis=-1)) ** 2 / SRATE
+        for taper in tapers
+        ], axis=0)
+    expected[..., 1:-1 if n % 2 == 0 else None] *= 2
+    np.testing.assert_allclose(freqs, np.fft.rfftfreq(n, 1 / SRATE))
+    np.testing.assert_allclose(psd, expected, rtol=1e-8)
+
+def test_bandPowers():
+    freqs = np.arange(129) * 0.5
+    psd = np.random.default_rng(1).random((5, 129))
+
+    power = bandPowers(freqs, psd)
+
+    for k, (_, low, high) in enumerate(DEFAULT_BANDS):
+        inBand = (freqs >= low) & (freqs < high)
+        np.testing.assert_allclose(power[:, k], psd[:, inBand].sum(-1) * 0.5)
+
+def test_spectralFeaturesOfSinusoid():
+    # A 10 Hz sinusoid of amplitude 1 has all of its power (0.5) in alpha
+    t = np.arange(512) / SRATE
+    epochs = np.sin(2 * np.pi * 10 * t) * np.ones((2, 3, 1))
+
+    features, names = spectralFeatures(epochs, SRATE, dtype=np.float64)
+
+    alpha = features[..., names.index("alpha")]
+    np.testing.assert_allclose(alpha, 0.5, rtol=0.05)
+    others = [n for n, _, _ in DEFAULT_BANDS if n != "alpha"]
+    for name in others:
+        assert np.all(features[..., names.index(name)] < 1e-3)
+
+def test_spectralFeaturesChunksAndRatios(epochs):
+    features, names = spectralFeatures(epochs, SRATE, dtype=np.float64)
+    chunked, _ = spectralFeatures(
+        epochs, SRATE, dtype=np.float64, chunkSize=7
+        )
+    np.testing.assert_allclose(chunked, features)
+
+    freqs, psd = spsignal.welch(epochs, fs=SRATE, nperseg=256, axis=-1)
+    power = bandPowers(freqs, psd)
+    numBands = len(DEFAULT_BANDS)
+    np.testing.assert_allclose(features[..., :numBands], power)
+    for k, name in enumerate(names[numBands:]):
+        a, b = name.split("_")
+        bands = [n for n, _, _ in DEFAULT_BANDS]
+        np.testing.assert_allclose(
+            features[..., numBands + k],
+            power[..., bands.index(a)] / power[..., bands.index(b)]
+            )
+
+    logged, _ = spectralFeatures(epochs, SRATE, dtype=np.float64, log=True)
+    np.testing.assert_allclose(logged, np.log10(features))
+
+def test_featureTable(epochs):
+    e = Epochs(epochs, np.arange(300) / SRATE, np.arange(30.0), SRATE)
+    e.reject[3] = True
+
+    table = featureTable(e, dtype=np.float64)
+
+    features, names = spectralFeatures(epochs, SRATE, dtype=np.float64)
+    assert table.height == 30
+    assert table["reject"].to_list() == [k == 3 for k in range(30)]
+    np.testing.assert_allclose(
+        table[f"1_{names[0]}"].to_numpy(), features[:, 1, 0]
+        )
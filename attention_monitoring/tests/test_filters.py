@@ -0,0 +1,84 @@
+import numpy as np
+import pytest
+from scipy import signal as spsignal
+
+from src.data_analysis.filters import (
+    StreamingFilter, defaultFilters, designFilter, designFilters, filterSignal,
+    zeroPhaseFilter
+    )
+
+SRATE = 256.0
+
+@pytest.fixture(scope="module")
+def signal():
+    rng = np.random.default_rng(0)
+    return rng.standard_normal((int(SRATE * 120), 4)) + 5
+
+@pytest.fixture(scope="module")
+def sos():
+    return designFilters(defaultFilters("eeg"), SRATE)
+
+def test_zeroPhaseFilterMatchesSosfiltfilt(signal, sos):
+    expected = spsignal.sosfiltfilt(sos, signal, axis=0)
+    np.testing.assert_allclose(
+        zeroPhaseFilter(signal, sos), expected, atol=1e-10
+        )
+
+@pytest.mark.parametrize("chunkSize", [777, 4096, 10000])
+def test_chunkedZeroPhaseFilterMatchesSosfiltfilt(signal, sos, chunkSize):
+    expected = spsignal.sosfiltfilt(sos, signal, axis=0)
+    np.testing.assert_allclose(
+        zeroPhaseFilter(signal, sos, chunkSize=chunkSize), expected,
+        atol=1e-10
+        )
+    # One channel, and channels along the first axis
+    np.testing.assert_allclose(
+        zeroPhaseFilter(signal[:, 0], sos, chunkSize=chunkSize),
+        expected[:, 0], atol=1e-10
+        )
+    np.testing.assert_allclose(
+        zeroPhaseFilter(signal.T, sos, axis=1, chunkSize=chunkSize),
+        expected.T, atol=1e-10
+        )
+
+def test_chunkedZeroPhaseFilterIntoMemmap(signal, sos, tmp_path):
+    out = np.lib.format.open_memmap(
+        tmp_path / "filtered.npy", mode="w+", dtype=float, shape=signal.shape
+        )
+    zeroPhaseFilter(signal, sos, chunkSize=4096, out=out)
+    np.testing.assert_allclose(
+        out, spsignal.sosfiltfilt(sos, signal, axis=0), atol=1e-10
+        )
+
+def test_streamingFilterMatchesSosfilt(signal, sos):
+    streaming = StreamingFilter(sos)
+    filtered = np.concatenate([
+        streaming.process(signal[k:k + 333])
+        for k in range(0, len(signal), 333)
+        ])
+
+    zi = spsignal.sosfilt_zi(sos)[:, :, np.newaxis] * signal[0]
+    expected, _ = spsignal.sosfilt(sos, signal, axis=0, zi=zi)
+    np.testing.assert_allclose(filtered, expected, atol=1e-10)
+
+def test_filterSignalCausal(signal):
+    # Designs are read-only, which `sosfilt` does not accept
+    sos = designFilter("highpass", 1.0, SRATE).copy()
+    filtered = filterSignal(
+        signal, SRATE, [("highpass", 1.0)], zeroPhase=False, chunkSize=1000
+        )
+    zi = spsignal.sosfilt_zi(sos)[:, :, np.newaxis] * signal[0]
+    expected, _ = spsignal.sosfilt(sos, signal, axis=0, zi=zi)
+    np.testing.assert_allclose(filtered, expected, atol=1e-10)
+
+def test_designFilter():
+    # Designs are cached
+    assert designFilter("bandpass", [1, 40], SRATE) is designFilter(
+        "bandpass", (1.0, 40.0), SRATE
+        )
+    np.testing.assert_allclose(
+        designFilter("bandpass", [1, 40], SRATE),
+        spsignal.butter(4, [1, 40], "bandpass", fs=SRATE, output="sos")
+        )
+    with pytest.raises(ValueError):
+        designFilter("lowpass", 200, SRATE)
@@ -0,0 +1,210 @@
+from collections import Counter
+import os
+import time
+
+import numpy as np
+import pytest
+
+from src.data_analysis.pipeline import (
+    DataPipe, PipeError, PipelineCache, registerAction
+    )
+
+SRATE = 256.0
+CHANNELS = ["TP9", "AF7", "AF8", "TP10"]
+START = 1000.0
+
+# The number of times each "test_count" step has run in this process
+CALLS = Counter()
+
+@registerAction("test_count")
+def _count(data, label=""):
+    """Count the executions of a step (see `CALLS`)."""
+    CALLS[label] += 1
+    return data
+
+@registerAction("test_sleep")
+def _sleep(data):
+    """Wait for the number of seconds in the data's "sleep" item."""
+    time.sleep(data.get('sleep', 0))
+    return data
+
+def makeData(rng, seconds=30, gaps=(), numTrials=30):
+    # A block whose EEG is a sum of rhythms of the time of each sample, so
+    # that the signal at any time is known, without the samples in `gaps`
+    times = START + np.arange(int(seconds * SRATE)) / SRATE
+    for start, stop in gaps:
+        times = times[(times < start) | (times >= stop)]
+    phases = rng.uniform(0, 2 * np.pi, len(CHANNELS))
+    eeg = signal(times, phases)
+    onsets = np.sort(rng.uniform(START + 1, START + seconds - 2, numTrials))
+    return {
+        'eeg' : {
+            'time_series' : eeg, 'time_stamps' : times,
+            'info' : {
+                'nominal_srate' : [str(SRATE)], 'effective_srate' : SRATE,
+                'desc' : [{'channels' : [{'channel' : [
+                    {'label' : [name]} for name in CHANNELS
+                    ]}]}]
+                }
+            },
+        'stimuli_marker_stream' : {
+            'time_series' : [["transition_period_start"]] * numTrials,
+            'time_stamps' : onsets
+            }
+        }, phases
+
+def signal(times, phases):
+    return (
+        np.sin(2 * np.pi * 3 * times[:, np.newaxis] + phases)
+        + 0.5 * np.sin(2 * np.pi * 7 * times[:, np.newaxis] + 2 * phases)
+        )
+
+def test_resampleKeepsGaps():
+    gaps = [(START + 10, START + 12.5), (START + 20, START + 20.75)]
+    data, phases = makeData(np.random.default_rng(0), gaps=gaps)
+    pipe = DataPipe(cache=False).add("resample", srate=128)
+
+    resampled = pipe.execute(data)['eeg']
+    epochs = pipe.add("epoch", tmin=0.0, tmax=0.5).execute(data)
+
+    # Samples are only dropped around the gaps, and keep their time
+    times = resampled['time_stamps']
+    assert np.all(np.diff(times) > 0)
+    for start, stop in gaps:
+        assert not np.any((times >= start) & (times < stop))
+        assert np.min(np.abs(times - stop)) < 1e-9
+    # Away from the edges of each segment, where the resampling filter rings
+    edges = np.array([START] + [t for gap in gaps for t in gap] + [times[-1]])
+    settled = np.min(np.abs(times[:, np.newaxis] - edges), axis=1) > 0.25
+    np.testing.assert_allclose(
+        resampled['time_series'][settled], signal(times, phases)[settled],
+        atol=0.05
+        )
+
+    # Every epoch holds the signal that followed its event, even after a
+    # gap, except for those overlapping a gap (which are cut from the
+    # samples after it) or near one (where the resampling filter rings)
+    onsets = data['stimuli_marker_stream']['time_stamps']
+    assert epochs.numTrials == len(onsets)
+    clear = np.ones(len(onsets), dtype=bool)
+    for start, stop in gaps:
+        clear &= (onsets + 0.5 < start - 0.25) | (onsets > stop + 0.25)
+    assert np.sum(clear & (onsets > gaps[0][1])) >= 10
+    for k in np.flatnonzero(clear):
+        # Cut from the first sample at or after the event
+        sampleTimes = times[epochs.starts[k]:][:len(epochs.times)]
+        assert 0 <= sampleTimes[0] - onsets[k] < 1 / 128
+        np.testing.assert_allclose(
+            epochs.data[k], signal(sampleTimes, phases).T, atol=0.05,
+            err_msg=f"trial {k}"
+            )
+
+@pytest.mark.parametrize("srate", [64, 128, 200])
+def test_resampleWithoutGapsKeepsTimebase(srate):
+    data, phases = makeData(np.random.default_rng(1))
+    pipe = DataPipe(cache=False).add("resample", srate=srate)
+
+    stream = pipe.execute(data)['eeg']
+
+    times = stream['time_stamps']
+    np.testing.assert_allclose(np.diff(times), 1 / srate)
+    assert times[0] == START
+    edge = int(srate)
+    np.testing.assert_allclose(
+        stream['time_series'][edge:-edge], signal(times, phases)[edge:-edge],
+        atol=0.01
+        )
+
+def epochPipe(cache=False, highFreq=40):
+    return (
+        DataPipe(cache=cache)
+        .add("test_count", label="first")
+        .add("filter", lowFreq=1, highFreq=highFreq)
+        .add("rereference")
+        .add("epoch", tmin=0.0, tmax=0.5)
+        .add("test_count", label="last")
+        )
+
+def assertSameEpochs(actual, expected):
+    for a, e in zip(actual, expected):
+        np.testing.assert_array_equal(a.data, e.data)
+        np.testing.assert_array_equal(a.events, e.events)
+        np.testing.assert_array_equal(a.eventTimes, e.eventTimes)
+        np.testing.assert_array_equal(a.reject, e.reject)
+
+@pytest.fixture(scope="module")
+def items():
+    rng = np.random.default_rng(2)
+    return [
+        makeData(rng, gaps=[(START + 5, START + 6)] * (k % 2))[0]
+        for k in range(4)
+        ]
+
+@pytest.mark.parametrize("numWorkers", [0, 2])
+def test_executeManyMatchesExecute(items, numWorkers):
+    pipe = epochPipe()
+    calls = []
+
+    results = pipe.executeMany(
+        items, numWorkers=numWorkers,
+        progress=lambda n, total: calls.append((n, total))
+        )
+
+    assertSameEpochs(results, [pipe.execute(data) for data in items])
+    assert calls == [(n, len(items)) for n in range(1, len(items) + 1)]
+
+def test_cacheIsReusedAndInvalidated(items, tmp_path):
+    cacheDir = os.path.join(tmp_path, "cache")
+    cache = PipelineCache(cacheDir=cacheDir)
+    expected = [epochPipe().execute(data) for data in items]
+
+    results = epochPipe(cache).executeMany(items, numWorkers=2)
+    assertSameEpochs(results, expected)
+    assert cache.hits == 0 and cache.misses == len(items)
+
+    # Served from the cache, in memory and on disk
+    hits = cache.hits
+    results = epochPipe(cache).executeMany(items, numWorkers=2)
+    assertSameEpochs(results, expected)
+    assert cache.hits == hits + len(items)
+    CALLS.clear()
+    results = epochPipe(PipelineCache(cacheDir=cacheDir)).executeMany(
+        items, numWorkers=0
+        )
+    assertSameEpochs(results, expected)
+    assert CALLS == {}
+
+    # Changing a step recomputes it and the steps after it only
+    expectedChanged = [
+        epochPipe(highFreq=30).execute(data) for data in items
+        ]
+    CALLS.clear()
+    changed = epochPipe(PipelineCache(cacheDir=cacheDir), highFreq=30)
+    results = changed.executeMany(items, numWorkers=0)
+    assertSameEpochs(results, expectedChanged)
+    assert not np.allclose(results[0].data, expected[0].data)
+    assert CALLS == {"last" : len(items)}
+
+def test_failuresDoNotLoseOtherResults(items):
+    pipe = epochPipe().add("test_sleep", position=0)
+    inputs = [
+        items[0],
+        # Fails, without EEG
+        {'stimuli_marker_stream' : items[1]['stimuli_marker_stream']},
+        items[2],
+        # Times out
+        {**items[3], 'sleep' : 60}
+        ]
+
+    t0 = time.monotonic()
+    results = pipe.executeMany(inputs, numWorkers=2, timeout=2)
+
+    assert time.monotonic() - t0 < 30
+    assertSameEpochs(
+        [results[0], results[2]],
+        [pipe.execute(items[0]), pipe.execute(items[2])]
+        )
+    for k, message in ((1, "KeyError"), (3, "Timed out")):
+        assert isinstance(results[k], PipeError)
+        assert results[k].index == k
+        assert message in str(results[k])
@@ -0,0 +1,125 @@
+import numpy as np
+import pytest
+
+from src.data_analysis.ppg import (
+    StreamingHRV, analyzePPG, beatIntervals, detectBeats, filterPPG,
+    hrvMetrics, replayPPG, windowMetrics
+    )
+
+SRATE = 64.0
+START = 100.0
+
+def makePulse(rng, seconds=120, meanIBI=0.8, sdIBI=0.04):
+    # A PPG stream with a pulse peaking at each of a known series of beats
+    beats = 1 + np.cumsum(
+        meanIBI + sdIBI * rng.standard_normal(int(seconds / meanIBI))
+        )
+    beats = beats[beats < seconds - 1]
+    times = np.arange(int(seconds * SRATE)) / SRATE
+    pulse = np.exp(
+        -0.5 * ((times[:, np.newaxis] - beats) / 0.08) ** 2
+        ).sum(axis=1)
+    x = 1e5 + 2e3 * pulse + 5 * rng.standard_normal(len(times))
+    stream = {
+        'time_series' : np.column_stack((
+            np.zeros(len(times)), x, np.zeros(len(times))
+            )),
+        'time_stamps' : START + times,
+        'info' : {'nominal_srate' : [str(SRATE)], 'effective_srate' : SRATE}
+        }
+    return stream, START + beats
+
+@pytest.fixture(scope="module")
+def pulse():
+    return makePulse(np.random.default_rng(0))
+
+def test_detectBeatsRecoversKnownBeats(pulse):
+    stream, beats = pulse
+    x = stream['time_series'][:, 1]
+
+    indices, times = detectBeats(
+        filterPPG(x, SRATE), SRATE, timestamps=stream['time_stamps']
+        )
+
+    assert len(times) == len(beats)
+    np.testing.assert_allclose(times, beats, atol=0.005)
+    # The sample nearest to each beat, or its neighbour
+    assert np.all(np.abs(indices - (beats - START) * SRATE) < 1)
+
+def test_analyzePPGRecoversHRV(pulse):
+    stream, beats = pulse
+
+    result = analyzePPG(stream)
+
+    np.testing.assert_allclose(result["beat_times"], beats, atol=0.005)
+    assert result["valid"].all()
+    metrics = result["metrics"]
+    expected = hrvMetrics(np.diff(beats))
+    assert metrics["num_beats"] == len(beats) - 1
+    assert metrics["hr_bpm"] == pytest.approx(expected["hr_bpm"], rel=1e-3)
+    for key in ("sdnn_ms", "rmssd_ms"):
+        assert metrics[key] == pytest.approx(expected[key], rel=0.03)
+
+def test_windowMetricsMatchesHrvMetrics():
+    rng = np.random.default_rng(1)
+    beatTimes = np.cumsum(0.8 + 0.05 * rng.standard_normal(500))
+    # Missed and spurious beats
+    beatTimes = np.sort(np.concatenate((
+        np.delete(beatTimes, rng.choice(500, 10, replace=False)),
+        rng.uniform(beatTimes[0], beatTimes[-1], 10)
+        )))
+    ibi, valid = beatIntervals(beatTimes)
+    assert not valid.all()
+    starts = rng.uniform(beatTimes[0] - 5, beatTimes[-1], 200)
+    stops = starts + rng.uniform(0, 30, 200)
+    # Windows that are empty or hold a single interval
+    starts[:3] = stops[:2] = beatTimes[10]
+    stops[2] = np.nextafter(beatTimes[10], np.inf)
+
+    windows = windowMetrics(beatTimes, ibi, valid, starts, stops)
+
+    ends = beatTimes[1:]
+    for k, (start, stop) in enumerate(zip(starts, stops)):
+        inWindow = (ends >= start) & (ends < stop)
+        expected = hrvMetrics(ibi[inWindow], valid[inWindow])
+        row = windows.row(k, named=True)
+        assert row["num_beats"] == expected.pop("num_beats")
+        for key, value in expected.items():
+            np.testing.assert_allclose(row[key], value, rtol=1e-9)
+
+def test_streamingBeatsDoNotDependOnChunking(pulse):
+    stream, beats = pulse
+    x = stream['time_series'][:, 1]
+    timestamps = stream['time_stamps']
+    rng = np.random.default_rng(2)
+
+    def streamBeats(sizes):
+        hrv = StreamingHRV(SRATE)
+        found, start = [], 0
+        for size in sizes:
+            found.extend(
+                b["time"] for b in hrv.process(
+                    x[start:start + size], timestamps[start:start + size]
+                    )
+                )
+            start += size
+        assert start >= len(x)
+        return np.array(found)
+
+    expected = streamBeats([len(x)])
+    for sizes in (
+            [1] * len(x), [7] * (len(x) // 7 + 1), [64] * (len(x) // 64 + 1),
+            rng.integers(0, 20, len(x))
+            ):
+        np.testing.assert_allclose(streamBeats(sizes), expected, rtol=1e-12)
+    for chunkDuration in (0.01, 0.05, 0.3):
+        np.testing.assert_allclose(
+            replayPPG(stream, chunkDuration=chunkDuration)["beat_times"],
+            expected, rtol=1e-12
+            )
+
+    # Once the filter has settled, the beats are those of the pulse
+    settled = expected[expected > START + 5]
+    nearest = beats[np.argmin(np.abs(settled[:, np.newaxis] - beats), axis=1)]
+    assert len(settled) == np.sum(beats > START + 5)
+    np.testing.assert_allclose(settled, nearest, atol=0.02)
@@ -0,0 +1,118 @@
+import csv
+import multiprocessing
+import os
+import re
+import time
+
+import pytest
+
+from src.helpers import _FileLock
+from src.study._study_session import SessionLogger
+
+NUM_PROCESSES = 4
+NUM_SESSIONS = 15
+
+@pytest.fixture
+def logPath(tmp_path):
+    return os.path.join(tmp_path, "sessions_log.csv")
+
+def test_tailMatchesFullRead(logPath):
+    log = SessionLogger(logPath)
+    for k in range(1, 51):
+        log.addLine(session_id=k, date="191026", participant_id=k % 7)
+
+    full = SessionLogger(logPath).read()
+    tail = SessionLogger(logPath).read(-3, -1, -20)
+
+    rows = [full["row_count"].index(n) for n in (31, 48, 50)]
+    for field, values in tail.items():
+        assert values == [full[field][k] for k in rows]
+
+@pytest.mark.parametrize("chunkSize", [5, 6, 7, 8, 64])
+def test_tailSplitsMultiByteCharacters(logPath, chunkSize):
+    # Lines with multi-byte characters, read in chunks that start in the
+    # middle of them
+    log = SessionLogger(logPath)
+    names = [f"S{k}_191026_éè中" for k in range(1, 21)]
+    for k, name in enumerate(names, start=1):
+        log.addLine(session_name=name, session_id=k, date="191026")
+
+    log = SessionLogger(logPath)
+    log._SessionLogger__tailChunkSize = chunkSize
+    for n in range(1, 11):
+        assert log.read(-n)["session_name"] == [names[-n]]
+    assert log.read(-5, -1)["session_name"] == [names[-5], names[-1]]
+
+    with open(logPath, newline="", encoding="utf-8") as f:
+        assert [row["session_name"] for row in csv.DictReader(f)] == names
+
+def addSessions(logPath, worker, start):
+    # Add sessions to the log from another process, returning their IDs
+    start.wait()
+    return [
+        int(SessionLogger(logPath).addSession(
+            date="191026", participant_id=worker
+            )["session_id"][0])
+        for _ in range(NUM_SESSIONS)
+        ]
+
+def incrementCounter(filePath, worker, start):
+    # Increment a counter in a file while holding a lock on it, slowly
+    # enough that unlocked increments from other processes would be lost
+    start.wait()
+    for _ in range(NUM_SESSIONS):
+        with _FileLock(filePath):
+            with open(filePath) as f:
+                count = int(f.read())
+            time.sleep(0.001)
+            with open(filePath, "w") as f:
+                f.write(str(count + 1))
+
+def runWorkers(function, filePath):
+    # Run a function in several processes at once, as
+    # `function(filePath, worker, start)`
+    context = multiprocessing.get_context("spawn")
+    with context.Manager() as manager, context.Pool(NUM_PROCESSES) as pool:
+        start = manager.Event()
+        results = [
+            pool.apply_async(function, (filePath, w, start))
+            for w in range(NUM_PROCESSES)
+            ]
+        start.set()
+        return [r.get(timeout=60) for r in results]
+
+def test_concurrentSessionsGetContiguousIDs(logPath):
+    SessionLogger(logPath)
+
+    created = runWorkers(addSessions, logPath)
+
+    total = NUM_PROCESSES * NUM_SESSIONS
+    ids = sorted(i for ids in created for i in ids)
+    assert ids == list(range(1, total + 1))
+    # Each process got increasing IDs
+    assert all(ids == sorted(ids) for ids in created)
+
+    with open(logPath, newline="") as f:
+        rows = list(csv.reader(f))
+    assert rows[0] == SessionLogger.logFields
+    assert all(len(row) == len(SessionLogger.logFields) for row in rows[1:])
+    assert [int(row[1]) for row in rows[1:]] == list(range(1, total + 1))
+    for name, sessionID, date, participant in rows[1:]:
+        assert re.fullmatch(
+            f"S{sessionID}_{date}_P{participant}", name
+            ) is not None
+
+    log = SessionLogger(logPath)
+    assert log.numLines == total
+    assert log.read(-1)["session_id"] == [str(total)]
+    assert log.addSession(date="191026")["session_id"] == [str(total + 1)]
+
+def test_fileLockIsExclusiveBetweenProcesses(tmp_path):
+    filePath = os.path.join(tmp_path, "counter.txt")
+    with open(filePath, "w") as f:
+        f.write("0")
+
+    runWorkers(incrementCounter, filePath)
+
+    with open(filePath) as f:
+        assert int(f.read()) == NUM_PROCESSES * NUM_SESSIONS
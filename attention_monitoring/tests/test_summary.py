@@ -0,0 +1,158 @@
+import csv
+import json
+import os
+
+import numpy as np
+import polars as pl
+from polars.testing import assert_frame_equal
+import pytest
+
+from src.data_analysis.block import GradCPTBlock
+from src.data_analysis.summary import summarizeStudy
+
+EEG_SRATE = 256.0
+PPG_SRATE = 64.0
+CHANNELS = ["TP9", "AF7", "AF8", "TP10"]
+NUM_TRIALS = 30
+START = 1000.0
+
+def makeData(seed):
+    # The streams of a block, generated from a seed
+    rng = np.random.default_rng(seed)
+    seconds = 2 + NUM_TRIALS * 0.8 + 3
+    eegTimes = START + np.arange(int(seconds * EEG_SRATE)) / EEG_SRATE
+    eeg = (
+        800 + 10 * rng.standard_normal((len(eegTimes), len(CHANNELS)))
+        + 10 * np.sin(2 * np.pi * 10 * eegTimes)[:, np.newaxis]
+        )
+    ppgTimes = START + np.arange(int(seconds * PPG_SRATE)) / PPG_SRATE
+    beats = np.cumsum(0.85 + 0.05 * rng.standard_normal(int(seconds)))
+    phase = np.interp(ppgTimes - START, beats, np.arange(len(beats)))
+    pulse = 1e5 + 2e3 * np.cos(np.pi * phase) ** 8
+    onsets = START + 2 + np.arange(NUM_TRIALS) * 0.8
+    responses = onsets[np.arange(NUM_TRIALS) % 10 != 0] + 0.5
+    return {
+        'eeg' : {
+            'time_series' : eeg, 'time_stamps' : eegTimes,
+            'info' : {
+                'nominal_srate' : [str(EEG_SRATE)],
+                'effective_srate' : EEG_SRATE,
+                'desc' : [{'channels' : [{'channel' : [
+                    {'label' : [name]} for name in CHANNELS
+                    ]}]}]
+                }
+            },
+        'ppg' : {
+            'time_series' : np.column_stack((
+                np.zeros(len(ppgTimes)), pulse, np.zeros(len(ppgTimes))
+                )),
+            'time_stamps' : ppgTimes,
+            'info' : {
+                'nominal_srate' : [str(PPG_SRATE)],
+                'effective_srate' : PPG_SRATE
+                }
+            },
+        'stimuli_marker_stream' : {
+            'time_series' : [["transition_period_start"]] * NUM_TRIALS,
+            'time_stamps' : onsets
+            },
+        'response_marker_stream' : {
+            'time_series' : [["response"]] * len(responses),
+            'time_stamps' : responses
+            }
+        }
+
+def loadData(cls, dataFile, dejitter=True):
+    # Stands in for `GradCPTBlock.loadData`. Data files only contain the
+    # seed of their data.
+    with open(dataFile) as f:
+        return makeData(int(f.read()))
+
+def writeSession(studyDir, sessionName, seeds):
+    # Write the files of a session with a block for each seed
+    sessionDir = os.path.join(studyDir, "sessions", sessionName)
+    os.makedirs(sessionDir, exist_ok=True)
+    rows = []
+    for k, seed in enumerate(seeds):
+        dataFile = os.path.join(sessionDir, f"block_{k}.xdf")
+        writeSeed(dataFile, seed)
+        sequenceFile = os.path.join(sessionDir, f"block_{k}_sequence.csv")
+        pl.DataFrame({
+            "stimulus_path" : ["stimulus.jpg"] * NUM_TRIALS,
+            "target_type" : [
+                "rare" if n % 10 == 0 else "common" for n in range(NUM_TRIALS)
+                ]
+            }).write_csv(sequenceFile)
+        rows.append({
+            "block_name" : f"block_{k}", "pre_block_msg" : "",
+            "pre_block_wait_time" : 0, "stim_sequence_file" : sequenceFile,
+            "data_file" : dataFile
+            })
+    blocksFile = os.path.join(sessionDir, "blocks.csv")
+    with open(blocksFile, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+    with open(os.path.join(sessionDir, "info.json"), "w") as f:
+        json.dump({
+            "session_name" : sessionName,
+            "session_id" : int(sessionName[1:].split("_")[0]),
+            "participant_id" : 100 + len(seeds),
+            "date" : "191026",
+            "blocks_file" : blocksFile,
+            "stim_transition_time_ms" : 800,
+            "stim_static_time_ms" : 0
+            }, f)
+    return sessionDir
+
+def writeSeed(dataFile, seed):
+    with open(dataFile, "w") as f:
+        f.write(str(seed))
+
+@pytest.fixture
+def studyDir(tmp_path, monkeypatch):
+    # A study of synthetic blocks, analyzed in this process
+    monkeypatch.setattr(GradCPTBlock, "loadData", classmethod(loadData))
+    studyDir = os.path.join(tmp_path, "study")
+    writeSession(studyDir, "S1_191026", [1, 2])
+    writeSession(studyDir, "S2_191026", [3])
+    writeSession(studyDir, "S3_191026", [4, 5])
+    return studyDir
+
+def test_unreadableSessionsKeepTheirSummary(studyDir):
+    table, stats = summarizeStudy(studyDir, numWorkers=0)
+    assert stats["analyzed"] == 5 and stats["failed"] == 0
+    assert table["session_name"].to_list() == [
+        "S1_191026", "S1_191026", "S2_191026", "S3_191026", "S3_191026"
+        ]
+
+    # The info file of a session can no longer be read
+    sessionDir = os.path.join(studyDir, "sessions", "S2_191026")
+    with open(os.path.join(sessionDir, "info.json"), "w") as f:
+        f.write("{")
+    for force in (False, True):
+        kept, stats = summarizeStudy(studyDir, numWorkers=0, force=force)
+        assert list(stats["errors"]) == [sessionDir]
+        assert stats["analyzed" if force else "unchanged"] == 4
+        # Other blocks are analyzed again if forced, with the same results
+        assert_frame_equal(
+            kept.drop("analyzed_at"), table.drop("analyzed_at")
+            )
+
+def test_failedBlocksKeepTheirSummary(studyDir):
+    table, _ = summarizeStudy(studyDir, numWorkers=0)
+    dataFile = os.path.join(studyDir, "sessions", "S3_191026", "block_1.xdf")
+    with open(dataFile, "w") as f:
+        f.write("corrupt")
+
+    for force in (False, True):
+        kept, stats = summarizeStudy(studyDir, numWorkers=0, force=force)
+        assert stats["failed"] == 1
+        assert list(stats["errors"]) == [("S3_191026", "block_1")]
+        assert kept.row(4, named=True) == table.row(4, named=True)
+
+    # Analyzed again once it can be read
+    writeSeed(dataFile, 6)
+    table, stats = summarizeStudy(studyDir, numWorkers=0)
+    assert stats["analyzed"] == 1 and stats["unchanged"] == 4
+    assert table["block_name"].to_list()[-1] == "block_1"
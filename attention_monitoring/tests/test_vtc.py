@@ -0,0 +1,111 @@
+import math
+
+import numpy as np
+import polars as pl
+import pytest
+
+from src.data_analysis.vtc import (
+    StreamingVTC, gaussianKernel, varianceTimeCourse
+    )
+
+def makeTrials(rng, numBlocks=5, numTrials=300):
+    blocks = []
+    for b in range(numBlocks):
+        isRare = rng.random(numTrials) < 0.1
+        responded = rng.random(numTrials) < np.where(isRare, 0.2, 0.95)
+        rt = (
+            600 + 100 * np.sin(np.arange(numTrials) / 30)
+            + rng.normal(0, 80, numTrials)
+            )
+        blocks.append(pl.DataFrame({
+            "session_name" : ["s"] * numTrials,
+            "block_name" : [f"b{b}"] * numTrials,
+            "trial" : np.arange(numTrials),
+            "target_type" : np.where(isRare, "rare", "common"),
+            "responded" : responded,
+            "rt_ms" : np.where(responded, rt, np.nan)
+            }).with_columns(pl.col("rt_ms").fill_nan(None)))
+    return pl.concat(blocks)
+
+def naiveVTC(trials, fwhm=9.0):
+    # The VTC of one block, following each step of its definition
+    isCommon = (trials["target_type"] == "common").to_numpy().astype(bool)
+    rt = trials["rt_ms"].fill_null(np.nan).to_numpy().astype(float)
+    rt = np.where(isCommon, rt, np.nan)
+    valid = ~np.isnan(rt)
+    index = np.arange(len(rt))
+    rtInterp = np.interp(index, index[valid], rt[valid])
+    raw = np.abs(rtInterp - rt[valid].mean()) / rt[valid].std(ddof=1)
+
+    # Gaussian smoothing, normalized by the weights inside the block
+    sigma = fwhm / (2 * math.sqrt(2 * math.log(2)))
+    halfWidth = math.ceil(3 * sigma)
+    vtc = np.empty(len(raw))
+    for k in range(len(raw)):
+        lags = np.arange(
+            max(k - halfWidth, 0), min(k + halfWidth + 1, len(raw))
+            )
+        weights = np.exp(-0.5 * ((lags - k) / sigma) ** 2)
+        vtc[k] = (weights * raw[lags]).sum() / weights.sum()
+    return rtInterp, vtc, vtc <= np.median(vtc)
+
+def test_varianceTimeCourseMatchesNaiveFormula():
+    trials = makeTrials(np.random.default_rng(0))
+
+    result = varianceTimeCourse(trials)
+
+    for name, block in result.groupby("block_name", maintain_order=True):
+        rtInterp, vtc, inZone = naiveVTC(block)
+        np.testing.assert_allclose(block["rt_interp_ms"].to_numpy(), rtInterp)
+        np.testing.assert_allclose(block["vtc"].to_numpy(), vtc)
+        np.testing.assert_array_equal(
+            block["in_zone"].to_numpy().astype(bool), inZone
+            )
+
+def test_blockWithoutReactionTimes():
+    trials = makeTrials(np.random.default_rng(1), numBlocks=2)
+    trials = trials.with_columns(
+        pl.when(pl.col("block_name") == "b0")
+        .then(False)
+        .otherwise(pl.col("responded"))
+        .alias("responded")
+        )
+
+    result = varianceTimeCourse(trials)
+
+    empty = result.filter(pl.col("block_name") == "b0")
+    assert empty["vtc"].null_count() == empty.height
+    assert empty["in_zone"].null_count() == empty.height
+    other = result.filter(pl.col("block_name") == "b1")
+    _, vtc, _ = naiveVTC(other)
+    np.testing.assert_allclose(other["vtc"].to_numpy(), vtc)
+
+def test_gaussianKernel():
+    kernel = gaussianKernel(9.0)
+    sigma = 9.0 / (2 * math.sqrt(2 * math.log(2)))
+    assert len(kernel) == 2 * math.ceil(3 * sigma) + 1
+    # Half the maximum at half the FWHM from the centre
+    halfWidth = len(kernel) // 2
+    halfMaximum = np.interp(
+        4.5, np.arange(halfWidth + 1), kernel[halfWidth:]
+        )
+    assert halfMaximum == pytest.approx(0.5, abs=0.01)
+    np.testing.assert_array_equal(
+        gaussianKernel(9.0, causal=True), kernel[halfWidth:]
+        )
+
+def test_streamingVTCRunningStatistics():
+    rng = np.random.default_rng(2)
+    rts = rng.normal(600, 80, 2000)
+    vtc = StreamingVTC()
+
+    values = np.array([vtc.update(rt)[0] for rt in rts])
+
+    assert vtc.mean == pytest.approx(rts.mean())
+    assert vtc.std == pytest.approx(rts.std(ddof=1))
+    assert math.isnan(values[0])
+    # The causal VTC of the last trial, with the final mean and deviation
+    kernel = gaussianKernel(9.0, causal=True)
+    raw = np.abs(rts[::-1][:len(kernel)] - rts.mean()) / rts.std(ddof=1)
+    assert values[-1] == pytest.approx((kernel * raw).sum() / kernel.sum())
+    assert vtc.median == pytest.approx(np.median(values[1:]), rel=0.05)